@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context, send_file, abort
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
+import asyncio
+import hashlib
+import inspect
+import hmac
 from datetime import datetime, timedelta
 from functools import wraps
 from dotenv import load_dotenv
@@ -9,14 +13,29 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from models.database import init_db, get_db_connection
-from utils.easyocr_processor import extract_receipt_data
-from utils.ai_categorizer import categorize_expense, predict_category
+from models.database import init_db, get_db_connection, get_data_version
+from utils.ai_categorizer import CATEGORY_KEYWORDS, predict_category
+from utils.ml_categorizer import learn_transactions, correct_transaction, forget_transaction
 from utils.alerts import check_budget_alerts, detect_anomalies
-from utils.analytics import generate_spending_report, get_category_breakdown
-from utils.email_service import get_notification_preferences, send_daily_summary_email
+from utils.analytics import generate_spending_report, get_category_breakdown, get_monthly_summary, get_merchant_breakdown
+from utils.email_service import get_notification_preferences, send_daily_summary_email, get_user_email
 from utils.enhanced_email_service import EmailService
 from utils.currency_formatter import format_inr, currency_symbol, currency_name
+from utils.columnar_store import record_insert
+from utils.forecasting import project_budgets
+from utils.subscriptions import get_subscriptions
+from utils.merchants import resolve_merchant, record_category
+from utils.importer import import_statement as import_statement_file, StatementError
+from utils.exporter import stream_export, export_filename, EXPORT_FORMATS
+from utils.transaction_service import create_transactions, ValidationError
+from utils.duplicates import find_duplicate
+from utils.partitions import source, restore_transaction
+from utils.recurring import create_rule, get_rules, set_rule_active, delete_rule, start_materializer, FREQUENCIES
+from utils.receipt_store import ingest_upload, open_upload, UploadError, thumbnail_path, start_collector
+from utils.receipt_jobs import process_receipt, create_job, get_job
+from utils import query_profiler, metrics, executors
+from utils.tracing import traced, span
+from cli import register_commands
 # Initialize enhanced email service
 email_service = EmailService()
 
@@ -24,9 +43,43 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
+app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf'}
+
+# Slow-query log thresholds and per-route statement budgets, see utils/query_profiler.py.
+# A route over its budget fails under app.testing and is logged otherwise.
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['QUERY_PROFILER_HEADERS'] = bool(os.environ.get('QUERY_PROFILER_HEADERS'))
+# Each budget is the route's measured count plus QUERY_BUDGET_MARGIN (test_query_profiler checks both ways).
+QUERY_BUDGET_MARGIN = 2
+app.config['QUERY_BUDGETS'] = {
+    # The first view of the day also records and emails the day's alerts (27 statements, then 18)
+    'dashboard': 27 + QUERY_BUDGET_MARGIN,
+    'api_dashboard': 11 + QUERY_BUDGET_MARGIN,
+    'transactions': 3 + QUERY_BUDGET_MARGIN,
+    'analytics': 4 + QUERY_BUDGET_MARGIN,
+    'api_analytics': 5 + QUERY_BUDGET_MARGIN,
+    'budgets': 1 + QUERY_BUDGET_MARGIN,
+    'recurring': 1 + QUERY_BUDGET_MARGIN,
+    'notifications': 1 + QUERY_BUDGET_MARGIN,
+    'add_transaction': 0 + QUERY_BUDGET_MARGIN,
+    'api_receipt_status': 1 + QUERY_BUDGET_MARGIN,
+}
 
 init_db()
+register_commands(app)
+query_profiler.init_app(app)
+metrics.init_app(app)
+
+# Generate scheduled recurring transactions in the background; otherwise run
+# 'flask --app app materialize-recurring' from cron
+if os.environ.get('RECURRING_MATERIALIZER_INTERVAL'):
+    start_materializer(int(os.environ['RECURRING_MATERIALIZER_INTERVAL']))
+
+# Delete receipts no transaction refers to any more; otherwise run
+# 'flask --app app collect-receipts' from cron
+if os.environ.get('RECEIPT_GC_INTERVAL'):
+    start_collector(int(os.environ['RECEIPT_GC_INTERVAL']))
 
 # Make currency formatter available to all templates
 @app.context_processor
@@ -38,6 +91,16 @@ def inject_currency():
     }
 
 def login_required(f):
+    if inspect.iscoroutinefunction(f):
+        # Async views stay coroutine functions, so asgi.py can await them
+        @wraps(f)
+        async def decorated_coroutine(*args, **kwargs):
+            if 'user_id' not in session:
+                flash('Please log in to access this page.', 'warning')
+                return redirect(url_for('login'))
+            return await f(*args, **kwargs)
+        return decorated_coroutine
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
@@ -46,9 +109,58 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@app.errorhandler(executors.Busy)
+def executor_busy(e):
+    """A thread pool behind an async view is full: ask the client to retry"""
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'The server is busy, please retry shortly'}), 503, {'Retry-After': '5'}
+    return 'The server is busy, please retry shortly.', 503, {'Retry-After': '5'}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def period_start_date(period):
+    if period == 'week':
+        return (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+    elif period == 'year':
+        return (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
+    return datetime.now().replace(day=1).strftime('%Y-%m-%d')
+
+def resolve_date_range(args):
+    """Map ?period= or ?start=&end= query args to (period, start_date, end_date).
+
+    Preset periods have no end date; custom ranges are inclusive and raise
+    ValueError when a date is malformed.
+    """
+    start = args.get('start')
+    if not start:
+        period = args.get('period', 'month')
+        return period, period_start_date(period), None
+
+    start_date = datetime.strptime(start, '%Y-%m-%d').date()
+    end = args.get('end')
+    end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else datetime.now().date()
+    if end_date < start_date:
+        start_date, end_date = end_date, start_date
+    return 'custom', start_date.isoformat(), end_date.isoformat()
+
+def conditional_json(user_id, key_parts, build_payload):
+    """Serve build_payload() as JSON with an ETag tied to the user's data version.
+
+    The ETag is checked before the payload is built, so an unchanged poll only
+    costs one primary-key lookup and an empty 304 response.
+    """
+    raw = ':'.join(str(part) for part in (user_id, get_data_version(user_id)) + tuple(key_parts))
+    etag = hashlib.sha1(raw.encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -121,21 +233,24 @@ def dashboard():
 
     cursor.execute('SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC LIMIT 10', (user_id,))
     recent_transactions = cursor.fetchall()
+    # Only archived months from the tenth hot row's date on could hold more recent ones
+    table = source(cursor, recent_transactions[-1]['date'] if len(recent_transactions) == 10 else None)
+    if table != 'transactions':
+        cursor.execute(f'SELECT * FROM {table} WHERE user_id = ? ORDER BY date DESC LIMIT 10', (user_id,))
+        recent_transactions = cursor.fetchall()
 
     current_month = datetime.now().strftime('%Y-%m')
-    cursor.execute('''SELECT 
-        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense
-        FROM transactions WHERE user_id = ? AND strftime('%Y-%m', date) = ?''', (user_id, current_month))
-    summary = cursor.fetchone()
+    summary = get_monthly_summary(user_id, current_month)
 
     category_data = get_category_breakdown(user_id, current_month)
-    alerts = check_budget_alerts(user_id)
+    budget_outlook = project_budgets(user_id)
+    alerts = check_budget_alerts(user_id, budget_outlook)
     anomalies = detect_anomalies(user_id)
+    subscriptions = get_subscriptions(user_id)
 
     conn.close()
 
-    return render_template('dashboard.html', transactions=recent_transactions, summary=summary, categories=category_data, alerts=alerts, anomalies=anomalies)
+    return render_template('dashboard.html', transactions=recent_transactions, summary=summary, categories=category_data, alerts=alerts, anomalies=anomalies, budget_outlook=budget_outlook, subscriptions=subscriptions)
 
 @app.route('/add_transaction', methods=['GET', 'POST'])
 @login_required
@@ -148,73 +263,268 @@ def add_transaction():
         description = request.form.get('description', '')
         date = request.form.get('date', datetime.now().strftime('%Y-%m-%d'))
 
+        merchant_id, _, category_hint = resolve_merchant(description, user_id)
         if not category or category == 'auto':
-            category = predict_category(description, amount)
+            category = predict_category(description, amount, user_id=user_id, hint=category_hint)
+        else:
+            record_category(user_id, merchant_id, category)
 
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO transactions (user_id, type, amount, category, description, date) VALUES (?, ?, ?, ?, ?, ?)', (user_id, transaction_type, amount, category, description, date))
+        duplicate_of = find_duplicate(cursor, user_id, date, amount, merchant_id, transaction_type)
+        cursor.execute('INSERT INTO transactions (user_id, type, amount, category, description, date, merchant_id, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (user_id, transaction_type, amount, category, description, date, merchant_id, duplicate_of))
         conn.commit()
         conn.close()
+        record_insert(user_id, cursor.lastrowid, date, amount, category, transaction_type)
+        learn_transactions(user_id)
 
-        flash('Transaction added successfully!', 'success')
+        if duplicate_of:
+            flash('Transaction added, but it looks like one you already have on that date. Review it on the Transactions page.', 'warning')
+        else:
+            flash('Transaction added successfully!', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('add_transaction.html')
 
 @app.route('/upload_receipt', methods=['GET', 'POST'])
 @login_required
+@traced('upload_receipt')
 def upload_receipt():
     if request.method == 'POST':
-        if 'receipt' not in request.files:
+        try:
+            file = open_upload(request.stream, request.content_type, 'receipt')
+        except UploadError as e:
+            flash(str(e), 'error')
+            return redirect(request.url)
+        if file is None:
             flash('No file uploaded!', 'error')
             return redirect(request.url)
 
-        file = request.files['receipt']
         if file.filename == '':
             flash('No file selected!', 'error')
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-
-            extracted_data = extract_receipt_data(filepath)
-
-            if extracted_data:
-                category = categorize_expense(extracted_data.get('description', ''))
-                user_id = session['user_id']
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('INSERT INTO transactions (user_id, type, amount, category, description, date, receipt_path) VALUES (?, ?, ?, ?, ?, ?, ?)', (user_id, 'expense', extracted_data.get('amount', 0), category, extracted_data.get('description', ''), extracted_data.get('date', datetime.now().strftime('%Y-%m-%d')), filepath))
-                conn.commit()
-                conn.close()
-
-                flash('Receipt processed successfully!', 'success')
+            try:
+                with span('store', filename=filename, user_id=session['user_id']) as stage:
+                    stored = ingest_upload(file, app.config['MAX_CONTENT_LENGTH'])
+                    stage.set(kind=stored['kind'], sha256=stored['sha256'], bytes=stored['bytes'],
+                              stored_bytes=stored['stored_bytes'], deduplicated=stored['deduplicated'])
+            except UploadError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+            result = process_receipt(session['user_id'], stored['path'])
+
+            if result:
+                if result['duplicate_of']:
+                    flash('Receipt processed, but it looks like a transaction you already have. Review it on the Transactions page.', 'warning')
+                else:
+                    flash('Receipt processed successfully!', 'success')
                 return redirect(url_for('dashboard'))
             else:
                 flash('Could not extract data from receipt.', 'error')
 
     return render_template('upload_receipt.html')
 
+@app.route('/receipt/<int:transaction_id>')
+@login_required
+def receipt(transaction_id):
+    """A transaction's receipt, or its thumbnail with ?size=thumbnail"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT receipt_path FROM {source(cursor)} WHERE id = ? AND user_id = ?', (transaction_id, session['user_id']))
+    row = cursor.fetchone()
+    conn.close()
+    path = row['receipt_path'] if row else None
+    if path and request.args.get('size') == 'thumbnail':
+        path = thumbnail_path(path) or path
+    if not path or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), max_age=86400)
+
+@app.route('/import_statement', methods=['GET', 'POST'])
+@login_required
+def import_statement():
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('statement')
+        if not file or file.filename == '':
+            flash('No file selected!', 'error')
+            return redirect(request.url)
+
+        try:
+            result = import_statement_file(session['user_id'], file.stream, file.filename,
+                                           date_format=request.form.get('date_format') or None)
+        except StatementError as e:
+            flash(f'Could not read statement: {e}', 'error')
+            return redirect(request.url)
+
+        flash(f"Imported {result['inserted']} transactions ({result['duplicates']} duplicates skipped).", 'success')
+
+    return render_template('import_statement.html', result=result)
+
 @app.route('/analytics')
 @login_required
 def analytics():
     user_id = session['user_id']
-    period = request.args.get('period', 'month')
+    bucket = request.args.get('bucket', 'auto')
+    try:
+        period, start_date, end_date = resolve_date_range(request.args)
+    except ValueError:
+        flash('Invalid date range, showing this month instead.', 'error')
+        period, start_date, end_date = 'month', period_start_date('month'), None
+
+    report = generate_spending_report(user_id, start_date, end_date, bucket)
+    merchants = get_merchant_breakdown(user_id, start_date, end_date)
+    return render_template('analytics.html', report=report, merchants=merchants, period=period,
+                           start_date=start_date, end_date=end_date or datetime.now().strftime('%Y-%m-%d'),
+                           bucket=bucket)
+
+@app.route('/api/analytics')
+@login_required
+async def api_analytics():
+    """Compact chart data for the analytics page, revalidated with ETags"""
+    user_id = session['user_id']
+    bucket = request.args.get('bucket', 'auto')
+    try:
+        period, start_date, end_date = resolve_date_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'Dates must be formatted as YYYY-MM-DD'}), 400
+
+    def build_payload():
+        report = generate_spending_report(user_id, start_date, end_date, bucket)
+        series = report['series']
+        return {
+            'period': period,
+            'start_date': start_date,
+            'end_date': end_date,
+            'summary': report['summary'],
+            'categories': {
+                'labels': [row['category'] for row in report['category_breakdown']],
+                'values': [row['amount'] for row in report['category_breakdown']]
+            },
+            'series': {
+                'bucket': series['bucket'],
+                'labels': [point['date'] for point in series['points']],
+                'expense': [point['amount'] for point in series['points']],
+                'income': [point['income'] for point in series['points']]
+            },
+            'top_expenses': [{'id': t['id'], 'date': t['date'], 'category': t['category'],
+                              'description': t['description'], 'amount': t['amount']}
+                             for t in report['top_expenses']],
+            'merchants': get_merchant_breakdown(user_id, start_date, end_date)
+        }
 
-    if period == 'week':
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    elif period == 'year':
-        start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-    else:
-        start_date = datetime.now().replace(day=1).strftime('%Y-%m-%d')
+    return await executors.run('default', conditional_json, user_id, ('analytics', start_date, end_date, bucket), build_payload)
 
-    report = generate_spending_report(user_id, start_date)
-    return render_template('analytics.html', report=report, period=period)
+@app.route('/api/dashboard')
+@login_required
+async def api_dashboard():
+    """Compact current-month dashboard data, revalidated with ETags"""
+    user_id = session['user_id']
+    current_month = datetime.now().strftime('%Y-%m')
+
+    def build_payload():
+        summary = get_monthly_summary(user_id, current_month)
+        categories = get_category_breakdown(user_id, current_month)
+        return {
+            'month': current_month,
+            'summary': {
+                'total_income': summary['total_income'],
+                'total_expense': summary['total_expense'],
+                'net_savings': summary['total_income'] - summary['total_expense']
+            },
+            'categories': {
+                'labels': [row['category'] for row in categories],
+                'values': [row['amount'] for row in categories]
+            },
+            'budget_outlook': project_budgets(user_id),
+            'subscriptions': get_subscriptions(user_id)
+        }
+
+    # Keyed on today's date too, since projections and subscription status move with the calendar
+    return await executors.run('default', conditional_json, user_id, ('dashboard', datetime.now().strftime('%Y-%m-%d')), build_payload)
+
+@app.route('/api/transactions/bulk', methods=['POST'])
+@login_required
+async def api_bulk_transactions():
+    """Insert many transactions in one write; safe to retry with an Idempotency-Key header or per-item keys"""
+    # Read on a pool thread: under asgi.py the body arrives as it is read
+    payload = await executors.run('default', request.get_json, silent=True)
+    items = payload.get('transactions') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a JSON list of transactions or {"transactions": [...]}'}), 400
+
+    try:
+        result = await executors.run('default', create_transactions, session['user_id'], items,
+                                     request.headers.get('Idempotency-Key'))
+    except ValidationError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+    return jsonify(result), 201 if result['inserted'] else 200
+
+@app.route('/api/receipts', methods=['POST'])
+@login_required
+async def api_upload_receipt():
+    """Store a receipt (multipart field 'receipt') and queue it for OCR; poll status_url for the transaction"""
+    user_id = session['user_id']
+
+    def queue_receipt():
+        file = open_upload(request.stream, request.content_type, 'receipt')
+        if not file or file.filename == '':
+            raise UploadError('Send the receipt as a multipart field named receipt.')
+        stored = ingest_upload(file, app.config['MAX_CONTENT_LENGTH'])
+        return create_job(user_id, stored['path'])
+
+    try:
+        job_id = await executors.run('default', queue_receipt)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    status_url = url_for('api_receipt_status', job_id=job_id)
+    return jsonify({'id': job_id, 'status': 'queued', 'status_url': status_url}), 202, {'Location': status_url}
+
+@app.route('/api/receipts/<int:job_id>')
+@login_required
+async def api_receipt_status(job_id):
+    """OCR status of a receipt sent to /api/receipts: queued, processing, done or failed"""
+    job = await executors.run('default', get_job, session['user_id'], job_id)
+    if job is None:
+        return jsonify({'error': 'Receipt not found'}), 404
+    if job['transaction_id']:
+        job['receipt_url'] = url_for('receipt', transaction_id=job['transaction_id'])
+    return jsonify(job)
+
+@app.route('/recurring', methods=['GET', 'POST'])
+@login_required
+def recurring():
+    user_id = session['user_id']
+    if request.method == 'POST':
+        try:
+            create_rule(user_id, request.form.to_dict())
+        except ValueError as e:
+            flash(f'Could not save the recurring transaction: {e}', 'error')
+        else:
+            flash('Recurring transaction saved. Due occurrences are added by the scheduled job.', 'success')
+        return redirect(url_for('recurring'))
+
+    return render_template('recurring.html', rules=get_rules(user_id), frequencies=FREQUENCIES,
+                           today=datetime.now().strftime('%Y-%m-%d'))
+
+@app.route('/recurring/<int:rule_id>/toggle', methods=['POST'])
+@login_required
+def toggle_recurring(rule_id):
+    if not set_rule_active(session['user_id'], rule_id, request.form.get('active') == '1'):
+        flash('Recurring transaction not found.', 'error')
+    return redirect(url_for('recurring'))
+
+@app.route('/recurring/<int:rule_id>/delete', methods=['POST'])
+@login_required
+def delete_recurring(rule_id):
+    if delete_rule(session['user_id'], rule_id):
+        flash('Recurring transaction deleted. Transactions it already added are kept.', 'success')
+    else:
+        flash('Recurring transaction not found.', 'error')
+    return redirect(url_for('recurring'))
 
 @app.route('/budgets', methods=['GET', 'POST'])
 @login_required
@@ -228,7 +538,9 @@ def budgets():
 
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)', (user_id, category, amount, period))
+        cursor.execute('''INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, category, period) DO UPDATE SET amount = excluded.amount''',
+                       (user_id, category, amount, period))
         conn.commit()
         conn.close()
 
@@ -253,7 +565,8 @@ def transactions():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    query = 'SELECT * FROM transactions WHERE user_id = ?'
+    table = source(cursor)
+    query = f'SELECT * FROM {table} WHERE user_id = ?'
     params = [user_id]
 
     if transaction_type != 'all':
@@ -269,12 +582,100 @@ def transactions():
     cursor.execute(query, params)
     all_transactions = cursor.fetchall()
 
-    cursor.execute('SELECT DISTINCT category FROM transactions WHERE user_id = ?', (user_id,))
+    cursor.execute(f'SELECT DISTINCT category FROM {table} WHERE user_id = ?', (user_id,))
     categories = [row['category'] for row in cursor.fetchall()]
 
     conn.close()
 
-    return render_template('transactions.html', transactions=all_transactions, categories=categories, selected_type=transaction_type, selected_category=category)
+    all_categories = list(CATEGORY_KEYWORDS) + [c for c in categories if c not in CATEGORY_KEYWORDS]
+    return render_template('transactions.html', transactions=all_transactions, categories=categories, all_categories=all_categories, selected_type=transaction_type, selected_category=category)
+
+@app.route('/export_transactions')
+@login_required
+def export_transactions():
+    """Download the filtered transaction list, streamed as it is read"""
+    file_format = request.args.get('format', 'csv')
+    try:
+        start_date = end_date = None
+        if request.args.get('start'):
+            _, start_date, end_date = resolve_date_range(request.args)
+        chunks = stream_export(session['user_id'], file_format,
+                               transaction_type=request.args.get('type', 'all'),
+                               category=request.args.get('category', 'all'),
+                               start_date=start_date, end_date=end_date)
+    except ValueError as e:
+        flash(f'Could not export: {e}', 'error')
+        return redirect(url_for('transactions'))
+
+    response = app.response_class(stream_with_context(chunks), mimetype=EXPORT_FORMATS[file_format][0])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(file_format, datetime.now().date())}"'
+    return response
+
+@app.route('/update_category/<int:transaction_id>', methods=['POST'])
+@login_required
+def update_category(transaction_id):
+    user_id = session['user_id']
+    new_category = request.form.get('category', '').strip()
+    if not new_category:
+        flash('Please choose a category.', 'error')
+        return redirect(url_for('transactions'))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    query = 'SELECT description, amount, category, merchant_id FROM transactions WHERE id = ? AND user_id = ?'
+    cursor.execute(query, (transaction_id, user_id))
+    transaction = cursor.fetchone()
+    if transaction is None and restore_transaction(cursor, user_id, transaction_id):
+        cursor.execute(query, (transaction_id, user_id))
+        transaction = cursor.fetchone()
+    if transaction:
+        cursor.execute('UPDATE transactions SET category = ? WHERE id = ? AND user_id = ?', (new_category, transaction_id, user_id))
+        conn.commit()
+    conn.close()
+
+    if transaction:
+        correct_transaction(user_id, transaction_id, transaction['description'], transaction['amount'], transaction['category'], new_category)
+        record_category(user_id, transaction['merchant_id'], new_category)
+        flash('Category updated!', 'success')
+    else:
+        flash('Transaction not found.', 'error')
+    return redirect(url_for('transactions'))
+
+@app.route('/resolve_duplicate/<int:transaction_id>', methods=['POST'])
+@login_required
+def resolve_duplicate(transaction_id):
+    """Merge a flagged duplicate into its original (keeping any receipt) or keep it as a separate transaction"""
+    user_id = session['user_id']
+    action = request.form.get('action')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    def flagged_copy():
+        cursor.execute(f'''SELECT t.description, t.amount, t.category, t.receipt_path, t.duplicate_of FROM transactions t
+            JOIN {source(cursor, alias='original')} ON original.id = t.duplicate_of AND original.user_id = t.user_id
+            WHERE t.id = ? AND t.user_id = ?''', (transaction_id, user_id))
+        return cursor.fetchone()
+
+    transaction = flagged_copy()
+    if transaction is None and restore_transaction(cursor, user_id, transaction_id):
+        transaction = flagged_copy()
+    if transaction and action == 'merge':
+        if transaction['receipt_path']:
+            # The receipt moves to the original, which may be archived
+            restore_transaction(cursor, user_id, transaction['duplicate_of'])
+            cursor.execute('UPDATE transactions SET receipt_path = ? WHERE id = ? AND user_id = ? AND receipt_path IS NULL', (transaction['receipt_path'], transaction['duplicate_of'], user_id))
+        cursor.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', (transaction_id, user_id))
+    elif transaction and action == 'keep':
+        cursor.execute('UPDATE transactions SET duplicate_of = 0 WHERE id = ? AND user_id = ?', (transaction_id, user_id))
+    conn.commit()
+    conn.close()
+
+    if transaction and action == 'merge':
+        forget_transaction(user_id, transaction_id, transaction['description'], transaction['amount'], transaction['category'])
+        flash('Duplicate merged.', 'success')
+    elif transaction and action == 'keep':
+        flash('Kept as a separate transaction.', 'success')
+    return redirect(url_for('transactions'))
 
 @app.route('/delete_transaction/<int:transaction_id>')
 @login_required
@@ -282,10 +683,22 @@ def delete_transaction(transaction_id):
     user_id = session['user_id']
     conn = get_db_connection()
     cursor = conn.cursor()
+    query = 'SELECT description, amount, category FROM transactions WHERE id = ? AND user_id = ?'
+    cursor.execute(query, (transaction_id, user_id))
+    transaction = cursor.fetchone()
+    if transaction is None and restore_transaction(cursor, user_id, transaction_id):
+        cursor.execute(query, (transaction_id, user_id))
+        transaction = cursor.fetchone()
     cursor.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', (transaction_id, user_id))
+    # Copies flagged against it are no longer duplicates of anything
+    cursor.execute('UPDATE transactions SET duplicate_of = NULL WHERE user_id = ? AND duplicate_of = ?', (user_id, transaction_id))
     conn.commit()
     conn.close()
-    flash('Transaction deleted!', 'success')
+    if transaction:
+        forget_transaction(user_id, transaction_id, transaction['description'], transaction['amount'], transaction['category'])
+        flash('Transaction deleted!', 'success')
+    else:
+        flash('Transaction not found.', 'error')
     return redirect(url_for('transactions'))
 
 @app.route('/notifications', methods=['GET', 'POST'])
@@ -301,9 +714,12 @@ def notifications():
         
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''INSERT OR REPLACE INTO notification_preferences 
+        cursor.execute('''INSERT INTO notification_preferences 
             (user_id, budget_alerts_email, anomaly_alerts_email, daily_summary_email, weekly_summary_email) 
-            VALUES (?, ?, ?, ?, ?)''', 
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET budget_alerts_email = excluded.budget_alerts_email,
+                anomaly_alerts_email = excluded.anomaly_alerts_email, daily_summary_email = excluded.daily_summary_email,
+                weekly_summary_email = excluded.weekly_summary_email''', 
             (user_id, budget_alerts_email, anomaly_alerts_email, daily_summary_email, weekly_summary_email))
         conn.commit()
         conn.close()
@@ -316,10 +732,10 @@ def notifications():
 
 @app.route('/send_test_email')
 @login_required
-def send_test_email():
+async def send_test_email():
     user_id = session['user_id']
     try:
-        success = send_daily_summary_email(user_id)
+        success = await executors.run('email', send_daily_summary_email, user_id)
         if success:
             flash('Test email sent successfully!', 'success')
         else:
@@ -329,36 +745,39 @@ def send_test_email():
     
     return redirect(url_for('notifications'))
 
+@app.route('/metrics')
+def prometheus_metrics():
+    # Scrapers authenticate with 'Authorization: Bearer <METRICS_TOKEN>' when it is set
+    token = os.environ.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return 'Unauthorized', 401
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
 @app.route('/api/email-status')
 @login_required
-def email_status():
+async def email_status():
     """API endpoint to check if email is configured"""
-    import os
     configured = bool(os.environ.get('SMTP_USERNAME') and os.environ.get('SMTP_PASSWORD'))
     return jsonify({'configured': configured})
 
 @app.route('/send_enhanced_test_email')
 @login_required
-def send_enhanced_test_email():
+async def send_enhanced_test_email():
     """Send test email using enhanced email service"""
     user_id = session['user_id']
     
     # Get user email
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT email FROM users WHERE id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    user_email = await executors.run('default', get_user_email, user_id)
     
-    if not result:
+    if not user_email:
         flash('User email not found', 'error')
         return redirect(url_for('notifications'))
     
-    user_email = result['email']
-    
     try:
         # Send test email using enhanced service
-        result = email_service.send_template(
+        result = await executors.run(
+            'email',
+            email_service.send_template,
             'test',
             [user_email],
             '🧪 Enhanced Email Service Test - Expense Tracker',
@@ -377,23 +796,17 @@ def send_enhanced_test_email():
 
 @app.route('/test_all_email_templates')
 @login_required
-def test_all_email_templates():
+async def test_all_email_templates():
     """Test all professional email templates"""
     user_id = session['user_id']
     
     # Get user email
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT email FROM users WHERE id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    user_email = await executors.run('default', get_user_email, user_id)
     
-    if not result:
+    if not user_email:
         flash('User email not found', 'error')
         return redirect(url_for('notifications'))
     
-    user_email = result['email']
-    
     try:
         # Import enhanced email service
         from utils.enhanced_email_service import EmailService
@@ -476,22 +889,25 @@ def test_all_email_templates():
             }
         ]
         
-        results = []
-        for template in templates_to_test:
+        def send_template(template):
             try:
                 result = professional_email_service.send_mail(template['options'])
-                results.append({
+                return {
                     'name': template['name'],
                     'success': result['success'],
                     'message_id': result.get('message_id', ''),
                     'error': result.get('error', '')
-                })
+                }
             except Exception as e:
-                results.append({
+                return {
                     'name': template['name'],
                     'success': False,
                     'error': str(e)
-                })
+                }
+
+        # Sent side by side on the email pool
+        results = await asyncio.gather(*(executors.run('email', send_template, template)
+                                         for template in templates_to_test))
         
         # Count successes
         successful = sum(1 for r in results if r['success'])
@@ -0,0 +1,237 @@
+"""
+ASGI entry point: 'uvicorn asgi:application'
+
+Under gunicorn every open connection holds a worker thread, so a few slow
+SMTP sends or OCR polls can take up all of them. Here connections are held
+by the event loop instead:
+
+- Views written as 'async def' (the JSON API, receipt status and email
+  views) are awaited on the loop, inside Flask's request handling through
+  its public methods. Their blocking calls, reading the request body
+  included, go to the bounded pools in utils/executors.py, so a slow SMTP
+  send holds an email thread but no request thread.
+- Every other view runs as plain WSGI on a thread of the 'wsgi' pool. It
+  works exactly as it does under gunicorn.
+- Response bodies are iterated on a thread, never on the loop.
+- The request body is handed to the app as a stream that receives each
+  chunk from the server as the app reads it. A body that is too large or
+  not a valid upload is refused before the rest of it is sent.
+
+A full pool answers 503 with Retry-After.
+"""
+
+import asyncio
+import inspect
+import io
+import sys
+
+from werkzeug.exceptions import ClientDisconnected, HTTPException, RequestEntityTooLarge
+from werkzeug.routing import RequestRedirect
+
+from flask import request, request_started
+from app import app
+from utils import executors
+
+# Bytes read from the server per wsgi.input buffer fill, at most
+_READ_BYTES = 64 * 1024
+
+
+class Application:
+    """ASGI wrapper around a Flask app"""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.to_thread(executors.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        limit = self.app.config['MAX_CONTENT_LENGTH']
+        environ = _environ(scope, RequestBody(receive, loop, limit))
+        length = environ.get('CONTENT_LENGTH', '')
+        if limit is not None and length.isdigit() and int(length) > limit:
+            # Refused without taking a thread; a body sent without a length is checked as it is read
+            await _send_plain(send, 413, b'Request Entity Too Large')
+            return
+        if self._is_async(environ):
+            await self._call_async(environ, send, loop)
+            return
+        try:
+            future = executors.submit('wsgi', self._call, environ, send, loop)
+        except executors.Busy:
+            await _send_plain(send, 503, b'Service Unavailable', [(b'retry-after', b'5')])
+            return
+        await asyncio.wrap_future(future)
+
+    def _is_async(self, environ):
+        if environ['REQUEST_METHOD'] == 'OPTIONS':
+            return False
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except (HTTPException, RequestRedirect):
+            return False
+        return inspect.iscoroutinefunction(self.app.view_functions.get(endpoint))
+
+    def _call(self, environ, send, loop):
+        """Run the WSGI app on a pool thread, passing its output to the loop"""
+        started = {}
+        _send_response(self.app.wsgi_app(environ, _start_response(started)), started, send, loop)
+
+    async def _call_async(self, environ, send, loop):
+        """Flask.wsgi_app for an async view, awaiting the view on the loop"""
+        ctx = self.app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                response = await self._full_dispatch_request()
+            except Exception as e:
+                error = e
+                response = self.app.handle_exception(e)
+            except:  # noqa: E722
+                error = sys.exc_info()[1]
+                raise
+            started = {}
+            chunks = response(environ, _start_response(started))
+            # Streamed bodies may block, so they are iterated on a thread like a sync view's
+            await asyncio.to_thread(_send_response, chunks, started, send, loop)
+        finally:
+            ctx.pop(error)
+
+    async def _full_dispatch_request(self):
+        """Flask.full_dispatch_request, awaiting the view"""
+        flask_app = self.app
+        try:
+            request_started.send(flask_app)
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await flask_app.view_functions[request.endpoint](**request.view_args)
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        return flask_app.finalize_request(rv)
+
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input for a pool thread: each read that runs out of data waits
+    for the next http.request message from the loop. A body longer than
+    limit raises RequestEntityTooLarge; Werkzeug would only cut it short."""
+
+    def __init__(self, receive, loop, limit=None):
+        self._receive = receive
+        self._loop = loop
+        self._limit = limit
+        self._received = 0
+        self._chunk = memoryview(b'')
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            raise RuntimeError('The request body must be read on a pool thread, not on the event loop')
+        # At the limit, the next message tells a body that ends there from one that goes on
+        while self._more and (not self._chunk or self._received == self._limit):
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            body = message.get('body', b'')
+            self._received += len(body)
+            if self._limit is not None and self._received > self._limit:
+                raise RequestEntityTooLarge()
+            if body:
+                self._chunk = memoryview(body)
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def _send_response(chunks, started, send, loop):
+    """Pass a WSGI response to the loop from a thread, one chunk at a time"""
+    def call(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    try:
+        call(_start_message(started))
+        for chunk in chunks:
+            if chunk:
+                call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        call({'type': 'http.response.body'})
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _environ(scope, body):
+    """A WSGI environ for an ASGI http scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(body, _READ_BYTES),
+        # Without a Content-Length the body runs to the last message, not to zero bytes
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name in ('content-length', 'content-type'):
+            environ[name.upper().replace('-', '_')] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _start_response(started):
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    return start_response
+
+
+def _start_message(started):
+    return {'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']}
+
+
+async def _send_plain(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain'), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+application = Application(app)
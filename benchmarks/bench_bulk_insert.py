@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Benchmark: create_transactions batches vs one connection and commit per row
+
+Generates N transaction payloads (as the bulk API receives them) and writes
+them through create_transactions in batches, with and without idempotency
+keys, then replays the keyed batches (every row a duplicate). The
+row-at-a-time baseline is what add_transaction does per row: connect, INSERT,
+commit; it is timed on a sample.
+
+Usage:
+    python -m benchmarks.bench_bulk_insert --rows 200000 --batch-size 5000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+import utils.ml_categorizer as ml_categorizer
+from models.database import init_db, get_db_connection
+from utils import merchants
+from utils.ai_categorizer import CATEGORY_KEYWORDS
+from utils.transaction_service import create_transactions
+from benchmarks.bench_categorizer import generate_descriptions
+
+BASELINE_SAMPLE = 2000
+
+
+def make_items(rng, count):
+    descriptions = generate_descriptions(2000, CATEGORY_KEYWORDS, rng)
+    categories = list(CATEGORY_KEYWORDS)
+    return [{'type': 'expense', 'amount': round(rng.uniform(1, 500), 2),
+             'date': f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+             'description': rng.choice(descriptions),
+             # Half the rows leave the category to the categorizer
+             'category': rng.choice(categories) if rng.random() < 0.5 else 'auto'}
+            for _ in range(count)]
+
+
+def row_at_a_time(user_id, items):
+    for item in items:
+        conn = get_db_connection()
+        conn.execute('INSERT INTO transactions (user_id, type, amount, category, description, date) VALUES (?, ?, ?, ?, ?, ?)',
+                     (user_id, item['type'], item['amount'], item['category'], item['description'], item['date']))
+        conn.commit()
+        conn.close()
+
+
+def bulk(user_id, items, batch_size, key=None):
+    totals = {'inserted': 0, 'duplicates': 0}
+    for offset in range(0, len(items), batch_size):
+        result = create_transactions(user_id, items[offset:offset + batch_size],
+                                     f'{key}-{offset}' if key else None)
+        totals['inserted'] += result['inserted']
+        totals['duplicates'] += result['duplicates']
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    workdir = tempfile.mkdtemp()
+    database.DATABASE = os.path.join(workdir, 'bench.db')
+    ml_categorizer.MODEL_DIR = os.path.join(workdir, 'models')
+    ml_categorizer.reset_models()
+    merchants.reset_cache()
+    try:
+        init_db()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+        user_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        items = make_items(rng, args.rows)
+        # Warm the merchant index so the runs below measure steady-state writes
+        create_transactions(user_id, items[:args.batch_size])
+
+        started = time.perf_counter()
+        row_at_a_time(user_id, items[:BASELINE_SAMPLE])
+        per_row = (time.perf_counter() - started) / BASELINE_SAMPLE
+        print(f'row at a time          {1 / per_row:>9,.0f} rows/s  (sampled {BASELINE_SAMPLE:,} rows)')
+
+        for label, key in (('bulk, no keys', None), ('bulk, request keys', 'run'), ('bulk, replayed keys', 'run')):
+            started = time.perf_counter()
+            totals = bulk(user_id, items, args.batch_size, key)
+            elapsed = time.perf_counter() - started
+            print(f'{label:<22} {args.rows / elapsed:>9,.0f} rows/s  {elapsed:6.2f} s  '
+                  f'added {totals["inserted"]:,}, duplicates {totals["duplicates"]:,}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Benchmark: compiled keyword matcher vs the original per-keyword substring loop
+
+Generates deterministic merchant-style descriptions and times categorize_expense
+and predict_category against the original nested-loop implementation, with the
+default keyword set and with a larger user-defined one.
+
+Usage:
+    python -m benchmarks.bench_categorizer --count 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ai_categorizer import CATEGORY_KEYWORDS, categorize_expense, predict_category
+
+FILLER = ['payment', 'pos', 'purchase', 'card', 'debit', 'ref', 'store', 'inc', 'ltd', 'online',
+          'india', 'pvt', 'txn', 'upi', 'order', 'the', 'and', 'co', 'services', 'retail']
+
+
+def loop_categorize(description, category_keywords):
+    """The original categorize_expense"""
+    if not description:
+        return 'Other'
+    description_lower = description.lower()
+    for category, keywords in category_keywords.items():
+        for keyword in keywords:
+            if keyword in description_lower:
+                return category
+    return 'Other'
+
+
+def loop_predict(description, category_keywords):
+    """The original predict_category"""
+    if not description:
+        return 'Other'
+    description_lower = description.lower()
+    scores = {}
+    for category, keywords in category_keywords.items():
+        score = sum(1 for keyword in keywords if keyword in description_lower)
+        if score > 0:
+            scores[category] = score
+    if not scores:
+        return 'Other'
+    return max(scores, key=scores.get)
+
+
+def user_keyword_set(rng, extra_per_category):
+    """The default keywords plus synthetic merchant names, as a user might add"""
+    keywords = {}
+    for category, words in CATEGORY_KEYWORDS.items():
+        extra = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(5, 10)))
+                 for _ in range(extra_per_category)]
+        keywords[category] = list(words) + extra
+    return keywords
+
+
+def generate_descriptions(count, category_keywords, rng):
+    vocabulary = [word for words in category_keywords.values() for word in words]
+    descriptions = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(2, 5))]
+        if vocabulary and rng.random() < 0.8:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(vocabulary).upper())
+        words.append(str(rng.randint(1000, 9999)))
+        descriptions.append(' '.join(words))
+    return descriptions
+
+
+def timed(label, func, descriptions, count):
+    started = time.perf_counter()
+    for description in descriptions:
+        func(description)
+    elapsed = time.perf_counter() - started
+    print(f'  {label:<28} {elapsed:>8.2f} s  {count / elapsed:>12,.0f} desc/s')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--extra-keywords', type=int, default=200,
+                        help='synthetic keywords added per category for the user-defined run')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    runs = [('default keywords', CATEGORY_KEYWORDS),
+            (f'user keywords (+{args.extra_keywords}/category)', user_keyword_set(rng, args.extra_keywords))]
+
+    for name, keywords in runs:
+        descriptions = generate_descriptions(args.count, keywords, rng)
+        total = sum(len(k) for k in keywords.values())
+        print(f'{name}: {total} keywords, {args.count:,} descriptions')
+        timed('loop categorize', lambda d: loop_categorize(d, keywords), descriptions, args.count)
+        timed('compiled categorize', lambda d: categorize_expense(d, category_keywords=keywords), descriptions, args.count)
+        timed('loop predict', lambda d: loop_predict(d, keywords), descriptions, args.count)
+        timed('compiled predict', lambda d: predict_category(d, category_keywords=keywords), descriptions, args.count)
+
+        sample = descriptions[:20000]
+        agree = sum(loop_predict(d, keywords) == predict_category(d, category_keywords=keywords) for d in sample)
+        print(f'  agreement with loop predict: {agree / len(sample):.2%} (word-start matching differs by design)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Benchmark: duplicate checks on write and the sweep over existing rows
+
+Fills a throwaway database with N transactions spread over 100 users, with
+merchant ids already assigned and about 2% exact copies, then times:
+find_duplicate lookups (the per-write check), sweep_duplicates over the whole
+table, and, on a sample, the pairwise comparison the sweep replaces.
+
+Usage:
+    python -m benchmarks.bench_duplicates --sizes 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+from models.database import init_db, get_db_connection
+from utils.duplicates import find_duplicate, sweep_duplicates
+
+USERS = 100
+LOOKUPS = 20000
+PAIRWISE_SAMPLE = 3000
+
+
+def populate(rng, size):
+    conn = get_db_connection()
+    conn.executemany("INSERT INTO users (username, email, password) VALUES (?, ?, 'x')",
+                     [(f'u{i}', f'u{i}@example.com') for i in range(USERS)])
+    rows = []
+    for _ in range(size):
+        row = (rng.randint(1, USERS), 'expense', round(rng.uniform(1, 500), 2), 'Other', 'x',
+               f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', rng.randint(1, 3000))
+        rows.append(row)
+        if rng.random() < 0.02:
+            rows.append(row)
+    for offset in range(0, len(rows), 100000):
+        conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date, merchant_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows[offset:offset + 100000])
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def pairwise(rows):
+    """The naive alternative: compare every pair"""
+    found = 0
+    for i, a in enumerate(rows):
+        for b in rows[i + 1:]:
+            if a[0] == b[0] and a[5] == b[5] and a[6] == b[6] and round(a[2]) == round(b[2]):
+                found += 1
+                break
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    rng = random.Random(9)
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        try:
+            init_db()
+            rows = populate(rng, size)
+
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            probes = [rng.choice(rows) for _ in range(LOOKUPS)]
+            started = time.perf_counter()
+            hits = sum(find_duplicate(cursor, row[0], row[5], row[2], row[6]) is not None for row in probes)
+            per_lookup = (time.perf_counter() - started) / LOOKUPS
+            conn.close()
+            print(f'{len(rows):>9,} rows  find_duplicate {per_lookup * 1e6:7.1f} µs per write check ({hits:,}/{LOOKUPS:,} hits)')
+
+            started = time.perf_counter()
+            flagged = sweep_duplicates()
+            elapsed = time.perf_counter() - started
+            print(f'{len(rows):>9,} rows  sweep          {elapsed:7.2f} s  {len(rows) / elapsed:>9,.0f} rows/s  flagged {flagged:,}')
+
+            started = time.perf_counter()
+            pairwise(rows[:PAIRWISE_SAMPLE])
+            sample = time.perf_counter() - started
+            estimate = sample * (len(rows) / PAIRWISE_SAMPLE) ** 2
+            print(f'{len(rows):>9,} rows  pairwise       ~{estimate:,.0f} s  (extrapolated from {PAIRWISE_SAMPLE:,} rows)')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: streaming export vs building the whole file in memory
+
+Fills a throwaway database with N transactions for one user and exports them
+as CSV and NDJSON through stream_export, discarding the chunks, then through a
+fetchall-and-join baseline (what scraping the transactions page amounts to).
+Reports wall time and, from a second run, peak Python memory (tracemalloc).
+
+Usage:
+    python -m benchmarks.bench_export --sizes 100000 1000000
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+from models.database import init_db, get_db_connection
+from utils.ai_categorizer import CATEGORY_KEYWORDS
+from utils.exporter import stream_export, export_query, EXPORT_COLUMNS
+from benchmarks.bench_categorizer import generate_descriptions
+
+
+def populate(rng, size):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+    user_id = cursor.lastrowid
+    descriptions = generate_descriptions(5000, CATEGORY_KEYWORDS, rng)
+    categories = list(CATEGORY_KEYWORDS)
+    for offset in range(0, size, 100000):
+        cursor.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)''',
+            [(user_id, 'expense', round(rng.uniform(1, 500), 2), rng.choice(categories), rng.choice(descriptions),
+              f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}') for _ in range(min(100000, size - offset))])
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+def buffered_csv(user_id):
+    """Baseline: fetch every row, then render the whole file"""
+    query, params = export_query(user_id)
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(tuple(row) for row in rows)
+    return buffer.getvalue()
+
+
+def measure(run):
+    """(bytes written, seconds, peak traced bytes); timed without tracemalloc, which slows Python code"""
+    started = time.perf_counter()
+    written = run()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return written, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        try:
+            init_db()
+            user_id = populate(rng, size)
+            runs = [
+                ('stream csv', lambda: sum(len(chunk) for chunk in stream_export(user_id, 'csv'))),
+                ('stream ndjson', lambda: sum(len(chunk) for chunk in stream_export(user_id, 'ndjson'))),
+                ('buffered csv', lambda: len(buffered_csv(user_id))),
+            ]
+            for label, run in runs:
+                written, elapsed, peak = measure(run)
+                print(f'{size:>9,} rows  {label:<14} {elapsed:6.2f} s  {size / elapsed:>9,.0f} rows/s  '
+                      f'{written / 1e6:6.1f} MB out  peak {peak / 1e6:7.1f} MB')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark: streaming statement import
+
+Writes a synthetic bank CSV of N rows to a temporary file, imports it into a
+throwaway database, then imports it again (every row a duplicate). Reports
+wall time and peak Python memory (tracemalloc) for each pass.
+
+Usage:
+    python -m benchmarks.bench_import --sizes 20000 200000
+"""
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+import utils.ml_categorizer as ml_categorizer
+from utils import merchants
+from models.database import init_db, get_db_connection
+from utils.ai_categorizer import CATEGORY_KEYWORDS
+from utils.importer import import_statement
+from benchmarks.bench_categorizer import generate_descriptions
+
+
+def write_statement(path, rows, rng):
+    merchants = generate_descriptions(2000, CATEGORY_KEYWORDS, rng)
+    start = date(2024, 1, 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Txn Date', 'Narration', 'Withdrawal Amt.', 'Deposit Amt.'])
+        for i in range(rows):
+            day = (start + timedelta(days=i * 730 // rows)).strftime('%d/%m/%Y')
+            if rng.random() < 0.05:
+                writer.writerow([day, 'SALARY CREDIT', '', f'{rng.uniform(20000, 90000):,.2f}'])
+            else:
+                writer.writerow([day, rng.choice(merchants), f'{rng.uniform(10, 5000):,.2f}', ''])
+
+
+def timed_import(user_id, path):
+    tracemalloc.start()
+    started = time.perf_counter()
+    with open(path, 'rb') as statement:
+        totals = import_statement(user_id, statement, path)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return totals, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20000, 200000])
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        ml_categorizer.MODEL_DIR = os.path.join(workdir, 'models')
+        ml_categorizer.reset_models()
+        merchants.reset_cache()
+        try:
+            init_db()
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+            user_id = cursor.lastrowid
+            conn.commit()
+            conn.close()
+
+            path = os.path.join(workdir, 'statement.csv')
+            write_statement(path, size, rng)
+            megabytes = os.path.getsize(path) / 1e6
+
+            for label in ('first import', 're-import'):
+                totals, elapsed, peak = timed_import(user_id, path)
+                print(f'{size:>8,} rows ({megabytes:5.1f} MB) {label:<13} {elapsed:6.2f} s  '
+                      f'{size / elapsed:>9,.0f} rows/s  peak {peak / 1e6:6.1f} MB  '
+                      f'added {totals["inserted"]:,}, duplicates {totals["duplicates"]:,}')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+"""
+Benchmark: OCR throughput, per-stage latency and field accuracy
+
+Renders a corpus of synthetic receipts with known merchant, date and total,
+varying font, font size, noise, rotation and resolution, and writes it with a
+manifest.json of the ground truth (kept with --corpus DIR and reused on later
+runs). Every receipt then goes through each OCR backend and preprocessing
+profile:
+
+  backends  easyocr (utils.easyocr_processor), tesseract (pytesseract and
+            utils.ocr_processor), text (the exact printed text, no OCR: an
+            upper bound for the parsers)
+  profiles  none (grayscale), contrast (the tesseract path's enhancement),
+            denoise_threshold (the easyocr path's preprocess_array)
+
+and reports images/s, mean and p95 latency of the load, preprocess, detect,
+recognize and parse stages (tesseract detects and recognizes in one call,
+timed as recognize), peak RSS and the share of receipts whose amount, date
+and merchant were read correctly. Each combination runs in a fresh process so
+its peak RSS is its own. Backends or profiles whose packages are missing are
+skipped. Results are also written as JSON, as bench_routes does.
+
+Usage:
+    python -m benchmarks.bench_ocr --count 200 --corpus /tmp/receipts
+    python -m benchmarks.bench_ocr --backends easyocr --profiles none denoise_threshold
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from utils.merchants import normalize_merchant
+from benchmarks.bench_routes import current_commit, RESULTS_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('load', 'preprocess', 'detect', 'recognize', 'parse')
+
+BACKENDS = ('easyocr', 'tesseract', 'text')
+
+PROFILES = ('none', 'contrast', 'denoise_threshold')
+
+# Tried in order by name (found through the system font directories), plus Pillow's own
+FONTS = ('DejaVuSans.ttf', 'DejaVuSansMono.ttf', 'LiberationSans-Regular.ttf', 'LiberationMono-Regular.ttf',
+         'Arial.ttf', 'arial.ttf', 'cour.ttf')
+
+MERCHANTS = ('Reliance Fresh', 'Big Bazaar', 'Cafe Coffee Day', 'Apollo Pharmacy', 'Dominos Pizza',
+             'Shoppers Stop', 'More Supermarket', 'Starbucks Coffee', 'Spencers Retail', 'Croma Electronics',
+             'Haldirams', 'Lifestyle Stores', 'Decathlon Sports', 'Barbeque Nation', 'Nature Basket')
+
+ITEMS = ('Milk 1L', 'Bread', 'Paneer 200g', 'Cappuccino', 'Veg Sandwich', 'Paracetamol', 'Shampoo',
+         'T-Shirt', 'Rice 5kg', 'Cookies', 'Orange Juice', 'Notebook', 'Batteries', 'Coffee Beans')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d %b %Y', '%b %d, %Y')
+
+TOTAL_LABELS = ('TOTAL: Rs. {:.2f}', 'TOTAL AMOUNT: {:,.2f}', 'GRAND TOTAL: {:.2f}', 'Total {:.2f}')
+
+# Values each variation is drawn from
+VARIATIONS = {
+    'font_size': (16, 20, 26),
+    'noise': (0, 10, 25),
+    'rotation': (0, 0, 1.5, -3),
+    'scale': (0.5, 0.75, 1.0, 1.5),
+}
+
+
+def available_fonts(extra=()):
+    fonts = []
+    for name in tuple(extra) + FONTS:
+        try:
+            ImageFont.truetype(name, 12)
+            fonts.append(name)
+        except OSError:
+            continue
+    return fonts + ['default']
+
+
+def load_font(name, size):
+    return ImageFont.load_default(size=size) if name == 'default' else ImageFont.truetype(name, size)
+
+
+def receipt_lines(rng):
+    """(printed lines, ground truth, date format) for one receipt"""
+    merchant = rng.choice(MERCHANTS)
+    day = date(2024, 1, 1) + timedelta(days=rng.randrange(730))
+    items = [(rng.choice(ITEMS), rng.randint(1, 3), round(rng.uniform(20, 900), 2)) for _ in range(rng.randint(2, 6))]
+    subtotal = round(sum(quantity * price for _, quantity, price in items), 2)
+    tax = round(subtotal * 0.05, 2)
+    total = round(subtotal + tax, 2)
+    date_format = rng.choice(DATE_FORMATS)
+    lines = [merchant.upper() if rng.random() < 0.5 else merchant,
+             f'{rng.randint(1, 200)} MG Road, Bengaluru',
+             f'GSTIN 29ABCDE{rng.randint(1000, 9999)}F1Z5',
+             f'Date: {day.strftime(date_format)}  Time: {rng.randint(8, 22)}:{rng.randint(0, 59):02d}',
+             f'Bill No: {rng.randint(10000, 99999)}',
+             '-' * 28]
+    lines += [f'{name}  {quantity} x {price:.2f}' for name, quantity, price in items]
+    lines += ['-' * 28, f'SUBTOTAL: {subtotal:.2f}', f'GST 5%: {tax:.2f}', rng.choice(TOTAL_LABELS).format(total),
+              'Thank you, visit again']
+    return lines, {'merchant': merchant, 'date': day.isoformat(), 'amount': total}, date_format
+
+
+def render(lines, font, variation, noise_rng):
+    """Grayscale receipt image with the variation's scale, rotation and noise applied"""
+    size = variation['font_size']
+    line_height = int(size * 1.4)
+    width = int(max(font.getlength(line) for line in lines)) + 2 * size
+    image = Image.new('L', (width, line_height * len(lines) + 2 * size), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((size, size + i * line_height), line, fill=0, font=font)
+
+    if variation['scale'] != 1:
+        image = image.resize((int(image.width * variation['scale']), int(image.height * variation['scale'])),
+                             Image.LANCZOS)
+    if variation['rotation']:
+        image = image.rotate(variation['rotation'], resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if variation['noise']:
+        pixels = np.asarray(image, dtype=np.float32) + noise_rng.normal(0, variation['noise'], (image.height, image.width))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    return image
+
+
+def generate_corpus(directory, count, seed, fonts):
+    """Write count receipt PNGs and manifest.json to directory; returns the manifest"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    receipts = []
+    for i in range(count):
+        lines, truth, date_format = receipt_lines(rng)
+        variation = {name: rng.choice(values) for name, values in VARIATIONS.items()}
+        variation.update(font=rng.choice(fonts), date_format=date_format)
+        image = render(lines, load_font(variation['font'], variation['font_size']), variation,
+                       np.random.default_rng(seed * 1000003 + i))
+        filename = f'receipt_{i:05d}.png'
+        image.save(os.path.join(directory, filename))
+        receipts.append({'file': filename, 'truth': truth, 'variation': variation, 'text': '\n'.join(lines)})
+    manifest = {'seed': seed, 'count': count, 'fonts': fonts, 'receipts': receipts}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_backend(name):
+    """(detect or None, recognize, (extract_amount, extract_date, extract_merchant)); raises ImportError"""
+    if name == 'easyocr':
+        from utils import easyocr_processor as processor
+        reader = processor.get_ocr_reader()
+
+        def detect(image, receipt):
+            horizontal, free = reader.detect(image)
+            return horizontal[0], free[0]
+
+        def recognize(image, receipt, boxes):
+            results = reader.recognize(image, horizontal_list=boxes[0], free_list=boxes[1], detail=1)
+            return '\n'.join(text for _, text, confidence in results if confidence > 0.1)
+        return detect, recognize, (processor.extract_amount, processor.extract_date, processor.extract_merchant)
+
+    if name == 'tesseract':
+        import pytesseract
+        from utils import ocr_processor as processor
+        processor.configure_tesseract()
+        pytesseract.get_tesseract_version()
+        return None, lambda image, receipt, boxes: pytesseract.image_to_string(image), (
+            processor.extract_amount, processor.extract_date, processor.extract_merchant)
+
+    try:
+        from utils import easyocr_processor as processor
+    except ImportError:
+        from utils import ocr_processor as processor
+    return None, lambda image, receipt, boxes: receipt['text'], (
+        processor.extract_amount, processor.extract_date, processor.extract_merchant)
+
+
+def load_profile(name):
+    if name == 'none':
+        return lambda image: image
+    if name == 'contrast':
+        return lambda image: np.asarray(ImageEnhance.Contrast(Image.fromarray(image)).enhance(1.5))
+    from utils.easyocr_processor import preprocess_array
+    return preprocess_array
+
+
+def field_matches(extracted, truth):
+    amount, day, merchant = extracted
+    return {'amount': abs(amount - truth['amount']) < 0.005,
+            'date': day == truth['date'],
+            'merchant': bool(merchant) and normalize_merchant(merchant) == normalize_merchant(truth['merchant'])}
+
+
+def run_combination(job):
+    """Run one backend and profile over the corpus; meant for a fresh process"""
+    corpus, manifest, backend, profile = job
+    started = time.perf_counter()
+    try:
+        detect, recognize, parsers = load_backend(backend)
+        preprocess = load_profile(profile)
+    except Exception as e:  # a missing package or tesseract binary
+        return {'backend': backend, 'profile': profile, 'skipped': f'{type(e).__name__}: {e}'}
+    init_seconds = time.perf_counter() - started
+
+    timings = {stage: [] for stage in STAGES}
+    matches = []
+    started = time.perf_counter()
+    for receipt in manifest['receipts']:
+        marks = [time.perf_counter()]
+        image = np.asarray(Image.open(os.path.join(corpus, receipt['file'])).convert('L'))
+        marks.append(time.perf_counter())
+        image = preprocess(image)
+        marks.append(time.perf_counter())
+        boxes = detect(image, receipt) if detect else None
+        marks.append(time.perf_counter())
+        text = recognize(image, receipt, boxes)
+        marks.append(time.perf_counter())
+        extracted = (parsers[0](text), parsers[1](text), parsers[2](text))
+        marks.append(time.perf_counter())
+        for stage, before, after in zip(STAGES, marks, marks[1:]):
+            timings[stage].append(after - before)
+        matches.append(field_matches(extracted, receipt['truth']))
+    elapsed = time.perf_counter() - started
+
+    accuracy = {field: round(sum(match[field] for match in matches) / len(matches), 3) for field in ('amount', 'date', 'merchant')}
+    by_variation = {}
+    for name in list(VARIATIONS) + ['font', 'date_format']:
+        for value in sorted({receipt['variation'][name] for receipt in manifest['receipts']}):
+            group = [match for match, receipt in zip(matches, manifest['receipts']) if receipt['variation'][name] == value]
+            by_variation[f'{name}={value}'] = {field: round(sum(match[field] for match in group) / len(group), 3)
+                                               for field in accuracy}
+    return {
+        'backend': backend, 'profile': profile, 'images': len(matches),
+        'init_s': round(init_seconds, 2),
+        'images_per_s': round(len(matches) / elapsed, 2),
+        'stages_ms': {stage: {'mean': round(float(np.mean(values)) * 1000, 2),
+                              'p95': round(float(np.percentile(values, 95)) * 1000, 2)}
+                      for stage, values in timings.items()},
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+        'accuracy': accuracy,
+        'accuracy_by_variation': by_variation,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=200, help='receipts to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus', help='directory to keep the corpus in; reused when its manifest matches')
+    parser.add_argument('--fonts', nargs='*', default=[], help='extra font files or names to draw with')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/ocr-<commit>.json)')
+    args = parser.parse_args()
+
+    corpus = args.corpus or os.path.join(RESULTS_DIR, 'ocr-corpus')
+    manifest_path = os.path.join(corpus, 'manifest.json')
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (manifest['seed'], manifest['count']) != (args.seed, args.count):
+            manifest = None
+    if manifest is None:
+        started = time.perf_counter()
+        manifest = generate_corpus(corpus, args.count, args.seed, available_fonts(args.fonts))
+        print(f'Generated {args.count:,} receipts in {corpus} ({time.perf_counter() - started:.1f}s), '
+              f"fonts: {', '.join(manifest['fonts'])}")
+
+    jobs = [(corpus, manifest, backend, profile) for backend in args.backends
+            for profile in (args.profiles if backend != 'text' else ['none'])]
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for job in jobs:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_combination, (job,)))
+
+    print(f"{'backend':<10} {'profile':<18} {'img/s':>7} " + ' '.join(f'{stage:>10}' for stage in STAGES)
+          + f" {'RSS MB':>7} {'amount':>7} {'date':>7} {'merchant':>8}")
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['backend']:<10} {result['profile']:<18} skipped ({result['skipped']})")
+            continue
+        stages = ' '.join(f"{result['stages_ms'][stage]['mean']:>8.1f}ms" for stage in STAGES)
+        rss = f"{result['peak_rss_mb']:>7.0f}" if result['peak_rss_mb'] is not None else f"{'-':>7}"
+        accuracy = result['accuracy']
+        print(f"{result['backend']:<10} {result['profile']:<18} {result['images_per_s']:>7.1f} {stages} {rss} "
+              f"{accuracy['amount']:>7.1%} {accuracy['date']:>7.1%} {accuracy['merchant']:>8.1%}")
+
+    commit = current_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f'ocr-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'benchmark': 'ocr', 'commit': commit, 'created': datetime.now().isoformat(timespec='seconds'),
+                   'corpus': {'seed': manifest['seed'], 'count': manifest['count'], 'fonts': manifest['fonts']},
+                   'results': results}, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: batched recategorize_transactions vs one predict_category call and UPDATE per row
+
+Builds a throwaway database with a labelled history for one user and a backlog
+of N transactions left in 'Other', then re-categorizes the backlog. The
+row-at-a-time baseline is timed on a sample and extrapolated.
+
+Usage:
+    python -m benchmarks.bench_recategorize --sizes 10000 100000 500000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+import utils.ml_categorizer as ml_categorizer
+from models.database import init_db, get_db_connection
+from utils.ai_categorizer import CATEGORY_KEYWORDS, predict_category, recategorize_transactions
+from benchmarks.bench_categorizer import generate_descriptions
+
+HISTORY_ROWS = 5000
+BASELINE_SAMPLE = 2000
+
+
+def populate(rng, backlog):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, email, password) VALUES ('bench', 'bench@example.com', 'x')")
+    user_id = cursor.lastrowid
+
+    history = generate_descriptions(HISTORY_ROWS, CATEGORY_KEYWORDS, rng)
+    rows = [(user_id, 'expense', round(rng.uniform(1, 500), 2), predict_category(d), d, '2025-01-01') for d in history]
+    # Merchant-style backlog: the same descriptions recur, with and without keywords
+    merchants = generate_descriptions(max(backlog // 20, 100), CATEGORY_KEYWORDS, rng)
+    rows += [(user_id, 'expense', round(rng.uniform(1, 500), 2), 'Other', rng.choice(merchants), '2025-02-01')
+             for _ in range(backlog)]
+    cursor.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+        VALUES (?, ?, ?, ?, ?, ?)''', rows)
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+def row_at_a_time(user_id, limit):
+    """The pre-batch approach: categorize and save each row on its own"""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT id, description, amount FROM transactions WHERE user_id = ? AND category = 'Other' LIMIT ?",
+                        (user_id, limit)).fetchall()
+    for row in rows:
+        category = predict_category(row['description'], row['amount'], user_id=user_id)
+        conn.execute('UPDATE transactions SET category = ? WHERE id = ?', (category, row['id']))
+        conn.commit()
+    conn.close()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        ml_categorizer.MODEL_DIR = os.path.join(workdir, 'models')
+        ml_categorizer.reset_models()
+        try:
+            init_db()
+            user_id = populate(rng, size)
+            ml_categorizer.get_model(user_id)
+            ml_categorizer.get_model()
+
+            started = time.perf_counter()
+            totals = recategorize_transactions(user_id)
+            batched = time.perf_counter() - started
+
+            # Reset the backlog and time the baseline on a sample
+            conn = get_db_connection()
+            conn.execute("UPDATE transactions SET category = 'Other' WHERE date = '2025-02-01'")
+            conn.commit()
+            conn.close()
+            started = time.perf_counter()
+            sampled = row_at_a_time(user_id, BASELINE_SAMPLE)
+            per_row = (time.perf_counter() - started) / sampled
+
+            print(f'{size:>9,} rows: batched {batched:7.2f} s ({totals["updated"]:,} re-categorized), '
+                  f'row at a time ~{per_row * size:8.1f} s (from {sampled:,} rows)')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""
+Load test: latency and throughput of the main pages
+
+Uses --db or builds a synthetic database (benchmarks/synthetic.py), then
+drives GET /dashboard, /transactions, /analytics, /budgets and POST
+/add_transaction as logged-in users and reports p50/p95/p99 latency and
+requests per second for each route. --routes picks others from ROUTES, such
+as the JSON API and email views.
+
+Two modes:
+  client  Flask's test client in this process: no server or network, so it
+          measures the app's own cost, one request at a time (default)
+  http    --workers processes, each logged in as a different user, sending
+          real HTTP requests for --duration seconds to --url, or to a server
+          started on the database when no URL is given. Each process keeps
+          --connections requests in flight, so the server sees workers x
+          connections open connections.
+
+--server picks the server started in http mode: Werkzeug's threaded
+development server, gunicorn (app:app) or uvicorn (asgi:application), with
+--server-workers processes. --smtp-delay starts a local SMTP server that
+waits that many seconds before answering and points the app at it. It
+offers no STARTTLS, so sends fail after the delay; what is measured is a
+slow send holding its connection.
+
+Results are saved as JSON (--output, by default under benchmarks/results/,
+named after the commit). --compare with an earlier file prints the change
+per route and exits with status 1 when p95 latency or throughput is worse by
+more than --threshold.
+
+Usage:
+    python -m benchmarks.bench_routes --users 50 --transactions 2000 --requests 200
+    python -m benchmarks.bench_routes --mode http --workers 4 --duration 20 --compare before.json
+    python -m benchmarks.bench_routes --mode http --server uvicorn --connections 50 \
+        --routes api_dashboard,send_email --smtp-delay 2
+"""
+
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import models.database as database
+from benchmarks.synthetic import generate, user_email, PASSWORD
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+
+# name -> (method, path)
+ROUTES = {
+    'dashboard': ('GET', '/dashboard'),
+    'transactions': ('GET', '/transactions'),
+    'analytics': ('GET', '/analytics'),
+    'budgets': ('GET', '/budgets'),
+    'add_transaction': ('POST', '/add_transaction'),
+    'api_dashboard': ('GET', '/api/dashboard'),
+    'email_status': ('GET', '/api/email-status'),
+    'send_email': ('GET', '/send_enhanced_test_email'),
+}
+
+DEFAULT_ROUTES = ['dashboard', 'transactions', 'analytics', 'budgets', 'add_transaction']
+
+DESCRIPTIONS = ['Swiggy order', 'Uber trip', 'BigBasket groceries', 'Netflix', 'Apollo pharmacy', 'Electricity bill']
+
+
+def transaction_form(rng):
+    return {'type': 'expense', 'amount': f'{rng.uniform(50, 5000):.2f}', 'category': 'auto',
+            'description': rng.choice(DESCRIPTIONS), 'date': date.today().isoformat()}
+
+
+def summarize(samples, elapsed):
+    """Latency percentiles (ms) and throughput for [(seconds, ok)] over elapsed seconds"""
+    latencies = np.array([seconds for seconds, _ in samples]) * 1000
+    errors = sum(not ok for _, ok in samples)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {'requests': len(samples), 'errors': errors,
+            'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2),
+            'mean_ms': round(float(latencies.mean()), 2) if len(latencies) else 0,
+            'rps': round(len(samples) / elapsed, 1) if elapsed else 0}
+
+
+def run_client(user_ids, routes, requests_per_route, seed):
+    """Each route in turn through the test client, cycling through users' sessions"""
+    from app import app
+
+    rng = random.Random(seed)
+    clients = []
+    for user_id in user_ids:
+        client = app.test_client()
+        client.post('/login', data={'email': user_email(user_id), 'password': PASSWORD})
+        clients.append(client)
+
+    results = {}
+    for name in routes:
+        method, path = ROUTES[name]
+        # One untimed pass per session warms caches the way a returning user would find them
+        for client in clients:
+            client.open(path, method=method, data=transaction_form(rng) if method == 'POST' else None).close()
+        samples = []
+        started = time.perf_counter()
+        for i in range(requests_per_route):
+            client = clients[i % len(clients)]
+            data = transaction_form(rng) if method == 'POST' else None
+            sent = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            samples.append((time.perf_counter() - sent, response.status_code < 400))
+            response.close()
+        results[name] = summarize(samples, time.perf_counter() - started)
+    return results
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects instead of following them, so a POST is timed on its own"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _request(opener, url, data=None):
+    try:
+        with opener.open(url, data=urllib.parse.urlencode(data).encode() if data else None, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def http_worker(job):
+    """One logged-in user requesting the routes round-robin on each of its
+    connections for duration seconds, timed from when all have logged in"""
+    base_url, email, routes, connections, duration, seed = job
+    samples = {name: [] for name in routes}
+    window = {}
+    logged_in = threading.Barrier(connections, action=lambda: window.update(deadline=time.time() + duration))
+
+    def connection(index):
+        rng = random.Random(seed * 1000 + index)
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                             _NoRedirect)
+        _request(opener, base_url + '/login', {'email': email, 'password': PASSWORD})
+        logged_in.wait()
+        i = index
+        while time.time() < window['deadline']:
+            name = routes[i % len(routes)]
+            method, path = ROUTES[name]
+            sent = time.perf_counter()
+            status = _request(opener, base_url + path, transaction_form(rng) if method == 'POST' else None)
+            samples[name].append((time.perf_counter() - sent, status < 400))
+            i += 1
+
+    threads = [threading.Thread(target=connection, args=(i,)) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def serve(db_path, port):
+    """Run the app on a threaded development server (the --mode http default target)"""
+    from werkzeug.serving import make_server
+    database.DATABASE = db_path
+    from app import app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start_server(server, db_path, port, workers, threads, smtp_port):
+    """Start --server on port; returns something with terminate() and join()"""
+    env = dict(os.environ, DATABASE_PATH=db_path)
+    if smtp_port:
+        env.update(SMTP_SERVER='127.0.0.1', SMTP_PORT=str(smtp_port), SMTP_USERNAME='bench', SMTP_PASSWORD='bench')
+    if server == 'threaded':
+        os.environ.update(env)  # inherited by the forked server
+        process = multiprocessing.Process(target=serve, args=(db_path, port), daemon=True)
+        process.start()
+        return process
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                   '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+                   '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env)
+    process.join = process.wait
+    return process
+
+
+def slow_smtp(delay):
+    """A local SMTP server that greets each connection after delay seconds; returns its port"""
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def session(conn):
+        with conn, conn.makefile('rb') as lines:
+            time.sleep(delay)
+            conn.sendall(b'220 bench ESMTP\r\n')
+            for line in lines:
+                command = line[:4].upper()
+                if command in (b'EHLO', b'HELO'):
+                    conn.sendall(b'250 bench\r\n')
+                elif command == b'QUIT':
+                    conn.sendall(b'221 bye\r\n')
+                    return
+                else:
+                    conn.sendall(b'502 not implemented\r\n')
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=session, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/login', timeout=5).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def run_http(user_ids, routes, url, db_path, workers, connections, duration, seed, server_options):
+    server = None
+    if not url:
+        port = 5000 + os.getpid() % 1000
+        url = f'http://127.0.0.1:{port}'
+        server = start_server(db_path=db_path, port=port, **server_options)
+    try:
+        wait_for(url)
+        jobs = [(url, user_email(user_ids[i % len(user_ids)]), routes, connections, duration, seed + i)
+                for i in range(workers)]
+        with multiprocessing.Pool(workers) as pool:
+            per_worker = pool.map(http_worker, jobs)
+    finally:
+        if server:
+            server.terminate()
+            server.join()
+
+    return {name: summarize([sample for samples in per_worker for sample in samples[name]], duration)
+            for name in routes}
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous, current, threshold):
+    """Print per-route changes; True when any route regressed by more than threshold"""
+    regressed = False
+    print(f"\nvs {previous.get('commit', '?')} ({previous.get('mode', '?')} mode):")
+    if previous.get('mode') != current['mode'] or previous.get('config') != current['config']:
+        print('  note: mode or configuration differs, so the numbers are not directly comparable')
+    for name, now in current['routes'].items():
+        before = previous['routes'].get(name)
+        if not before:
+            continue
+        p95_change = now['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+        rps_change = now['rps'] / before['rps'] - 1 if before['rps'] else 0
+        worse = p95_change > threshold or rps_change < -threshold
+        regressed |= worse
+        print(f"  {name:<16} p95 {before['p95_ms']:8.1f} -> {now['p95_ms']:8.1f} ms ({p95_change:+6.1%})  "
+              f"rps {before['rps']:8.1f} -> {now['rps']:8.1f} ({rps_change:+6.1%}){'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--db', help='existing database to use (it is written to); default: a synthetic one')
+    parser.add_argument('--users', type=int, default=50, help='synthetic users (and sessions used)')
+    parser.add_argument('--transactions', type=int, default=2000, help='synthetic transactions per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='client mode: requests per route')
+    parser.add_argument('--routes', default=','.join(DEFAULT_ROUTES),
+                        help=f"comma-separated routes to request, from: {', '.join(ROUTES)}")
+    parser.add_argument('--workers', type=int, default=4, help='http mode: client processes')
+    parser.add_argument('--connections', type=int, default=1, help='http mode: requests in flight per client process')
+    parser.add_argument('--server', choices=['threaded', 'gunicorn', 'uvicorn'], default='threaded',
+                        help='http mode: server started when no --url is given')
+    parser.add_argument('--server-workers', type=int, default=1, help='gunicorn and uvicorn: worker processes')
+    parser.add_argument('--server-threads', type=int, default=1, help='gunicorn: threads per worker')
+    parser.add_argument('--smtp-delay', type=float, help='http mode: seconds a local SMTP server waits before answering')
+    parser.add_argument('--duration', type=float, default=20, help='http mode: seconds to run')
+    parser.add_argument('--url', help='http mode: running server to test (its database must hold the synthetic users)')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/routes-<mode>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+    routes = args.routes.split(',')
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    workdir = None
+    if args.db:
+        database.DATABASE = args.db
+        user_ids = list(range(1, args.users + 1))
+    else:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        started = time.perf_counter()
+        user_ids = generate(args.users, args.transactions, args.seed)
+        print(f'Generated {args.users:,} users x {args.transactions:,} transactions '
+              f'in {time.perf_counter() - started:.1f}s')
+
+    try:
+        if args.mode == 'client':
+            results = run_client(user_ids, routes, args.requests, args.seed)
+        else:
+            server_options = {'server': args.server, 'workers': args.server_workers, 'threads': args.server_threads,
+                              'smtp_port': slow_smtp(args.smtp_delay) if args.smtp_delay else None}
+            results = run_http(user_ids, routes, args.url, database.DATABASE, args.workers, args.connections,
+                               args.duration, args.seed, server_options)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = current_commit()
+    result = {
+        'benchmark': 'routes', 'mode': args.mode, 'commit': commit,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {'users': args.users, 'transactions_per_user': args.transactions, 'seed': args.seed,
+                   'requests_per_route': args.requests if args.mode == 'client' else None,
+                   'workers': args.workers if args.mode == 'http' else None,
+                   'duration': args.duration if args.mode == 'http' else None,
+                   'url': args.url, 'db': args.db},
+        'routes': results,
+    }
+    if args.mode == 'http':
+        result['config'].update(connections=args.connections, server=None if args.url else args.server,
+                                server_workers=args.server_workers, server_threads=args.server_threads,
+                                smtp_delay=args.smtp_delay)
+
+    print(f"{'route':<16} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for name, stats in results.items():
+        print(f"{name:<16} {stats['requests']:>8,} {stats['errors']:>6,} {stats['p50_ms']:>8.1f} "
+              f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['rps']:>8.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f'routes-{args.mode}-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'Results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), result, args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Benchmark: single-scan generate_spending_report vs the original four-query version
+
+Builds a throwaway database with N expense/income rows for one user spread over
+a year, then reports the number of SQL statements and the median latency of
+each implementation for a whole-year report.
+
+Usage:
+    python -m benchmarks.bench_spending_report --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+import utils.analytics as analytics
+from models.database import init_db, get_db_connection
+
+CATEGORIES = ['Food & Dining', 'Transportation', 'Shopping', 'Entertainment',
+              'Healthcare', 'Utilities', 'Education', 'Housing', 'Other']
+
+
+def multi_query_report(user_id, start_date, end_date=None):
+    """The original report: one query per output, each scanning the window"""
+    conn = analytics.get_db_connection()
+    cursor = conn.cursor()
+    range_end = end_date or '9999-12-31'
+
+    cursor.execute('''SELECT
+        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
+        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
+        COUNT(*) as transaction_count
+        FROM transactions WHERE user_id = ? AND date >= ? AND date <= ?''', (user_id, start_date, range_end))
+    summary = cursor.fetchone()
+
+    cursor.execute('''SELECT category, SUM(amount) as total FROM transactions
+        WHERE user_id = ? AND type = 'expense' AND date >= ? AND date <= ?
+        GROUP BY category ORDER BY total DESC''', (user_id, start_date, range_end))
+    category_breakdown = cursor.fetchall()
+
+    cursor.execute('''SELECT date, SUM(amount) as daily_total FROM transactions
+        WHERE user_id = ? AND type = 'expense' AND date >= ? AND date <= ?
+        GROUP BY date ORDER BY date''', (user_id, start_date, range_end))
+    daily_spending = cursor.fetchall()
+
+    cursor.execute('''SELECT * FROM transactions WHERE user_id = ?
+        AND type = 'expense' AND date >= ? AND date <= ? ORDER BY amount DESC LIMIT 5''', (user_id, start_date, range_end))
+    top_expenses = cursor.fetchall()
+    conn.close()
+
+    series = analytics.get_spending_series(user_id, start_date, end_date)
+    return summary, category_breakdown, daily_spending, top_expenses, series
+
+
+class QueryCounter:
+    """Wraps analytics.get_db_connection to count executed SQL statements"""
+
+    def __init__(self):
+        self.count = 0
+        self._original = analytics.get_db_connection
+
+    def __enter__(self):
+        def counting_connection():
+            conn = self._original()
+            conn.set_trace_callback(self._trace)
+            return conn
+        analytics.get_db_connection = counting_connection
+        return self
+
+    def __exit__(self, *exc):
+        analytics.get_db_connection = self._original
+
+    def _trace(self, statement):
+        self.count += 1
+
+
+def populate(user_id, rows, seed=42):
+    rng = random.Random(seed)
+    first_day = date.today() - timedelta(days=364)
+    conn = get_db_connection()
+    batch = []
+    for i in range(rows):
+        is_income = rng.random() < 0.05
+        batch.append((
+            user_id,
+            'income' if is_income else 'expense',
+            round(rng.uniform(1000, 5000) if is_income else rng.lognormvariate(3.5, 1.0), 2),
+            'Salary' if is_income else rng.choice(CATEGORIES),
+            f'synthetic transaction {i}',
+            (first_day + timedelta(days=rng.randrange(365))).isoformat()
+        ))
+        if len(batch) == 50000:
+            conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+                VALUES (?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)''', batch)
+    conn.commit()
+    conn.close()
+
+
+def measure(func, user_id, start_date, repeats):
+    with QueryCounter() as counter:
+        func(user_id, start_date)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func(user_id, start_date)
+        timings.append(time.perf_counter() - started)
+    return counter.count, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    original_database = database.DATABASE
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'rows':>10} {'impl':<14} {'queries':>8} {'median ms':>10}")
+        for size in args.sizes:
+            database.DATABASE = os.path.join(work_dir, f'bench_{size}.db')
+            init_db()
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                           ('bench', 'bench@example.com', 'x'))
+            user_id = cursor.lastrowid
+            conn.commit()
+            conn.close()
+            populate(user_id, size)
+
+            start_date = (date.today() - timedelta(days=365)).isoformat()
+            for name, func in (('multi-query', multi_query_report),
+                               ('single-scan', analytics.generate_spending_report)):
+                queries, median = measure(func, user_id, start_date, args.repeats)
+                print(f'{size:>10} {name:<14} {queries:>8} {median * 1000:>10.1f}')
+    finally:
+        database.DATABASE = original_database
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmark: subscription detection, full scan and incremental update
+
+Fills a throwaway database with one user's N expenses over 500 merchants:
+random purchases plus weekly, monthly and annual series. Times
+detect_recurring on the arrays alone, a full update_subscriptions, and an
+incremental update after one more day of expenses.
+
+Usage:
+    python -m benchmarks.bench_subscriptions --sizes 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.database as database
+from models.database import init_db, get_db_connection
+from utils.subscriptions import detect_recurring, update_subscriptions, _load_expenses
+
+MERCHANTS = 500
+START = date(2020, 1, 1)
+SPAN_DAYS = 5 * 365
+
+
+def populate(rng, size):
+    conn = get_db_connection()
+    conn.execute("INSERT INTO users (username, email, password) VALUES ('u', 'u@example.com', 'x')")
+    conn.executemany("INSERT INTO merchants (id, normalized, name) VALUES (?, ?, ?)",
+                     [(i, f'm{i}', f'M{i}') for i in range(1, MERCHANTS + 1)])
+    rows = []
+    for merchant_id, step in ((1, 7), (2, 30), (3, 365)):
+        for day in range(0, SPAN_DAYS, step):
+            rows.append((merchant_id, 499.0, (START + timedelta(days=day)).isoformat()))
+    while len(rows) < size:
+        rows.append((rng.randint(4, MERCHANTS), round(rng.uniform(20, 5000), 2),
+                     (START + timedelta(days=rng.randrange(SPAN_DAYS))).isoformat()))
+    rows.sort(key=lambda row: row[2])
+    conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date, merchant_id)
+        VALUES (1, 'expense', ?, 'Other', 'x', ?, ?)''', [(amount, day, merchant) for merchant, amount, day in rows])
+    conn.commit()
+    conn.close()
+
+
+def add_day(rng):
+    day = (START + timedelta(days=SPAN_DAYS)).isoformat()
+    conn = get_db_connection()
+    conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date, merchant_id)
+        VALUES (1, 'expense', ?, 'Other', 'x', ?, ?)''',
+                     [(round(rng.uniform(20, 5000), 2), day, rng.randint(1, MERCHANTS)) for _ in range(20)])
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    rng = random.Random(39)
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        database.DATABASE = os.path.join(workdir, 'bench.db')
+        try:
+            init_db()
+            populate(rng, size)
+
+            conn = get_db_connection()
+            merchant_ids, amounts, days = _load_expenses(conn.cursor(), 1)
+            conn.close()
+            started = time.perf_counter()
+            found = detect_recurring(merchant_ids, amounts, days)
+            elapsed = time.perf_counter() - started
+            periods = sorted(series['period'] for series in found if series['merchant_id'] <= 3)
+            print(f'{size:>9,} rows  detect_recurring     {elapsed * 1e3:8.1f} ms  {size / elapsed:>12,.0f} rows/s  '
+                  f'{len(found)} series, planted: {periods}')
+
+            started = time.perf_counter()
+            update_subscriptions(1)
+            print(f'{size:>9,} rows  full update          {(time.perf_counter() - started) * 1e3:8.1f} ms')
+
+            add_day(rng)
+            started = time.perf_counter()
+            analyzed = update_subscriptions(1)
+            print(f'{size:>9,} rows  incremental update   {(time.perf_counter() - started) * 1e3:8.1f} ms  '
+                  f'({analyzed} merchants re-analyzed)')
+
+            started = time.perf_counter()
+            update_subscriptions(1)
+            print(f'{size:>9,} rows  no-op update         {(time.perf_counter() - started) * 1e3:8.1f} ms')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Deterministic synthetic data for benchmarks and load tests
+
+Fills the database at models.database.DATABASE with N users, each with M
+transactions spread over the year before end_date, a few monthly budgets and
+notification preferences. The same seed, sizes and end date always produce
+the same rows. Every user is 'user<i>@bench.example' with password
+'bench'; email alerts are switched off so load tests send no mail.
+
+Usage:
+    python -m benchmarks.synthetic --db /tmp/bench.db --users 100 --transactions 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+import models.database as database
+from models.database import init_db, get_db_connection
+from utils.ai_categorizer import CATEGORY_KEYWORDS
+from utils.merchants import assign_merchants
+from benchmarks.bench_categorizer import generate_descriptions
+
+PASSWORD = 'bench'
+
+INCOME_CATEGORIES = ('Salary', 'Freelance', 'Refund')
+
+# Rows per executemany
+INSERT_CHUNK = 50000
+
+
+def user_email(index):
+    return f'user{index}@bench.example'
+
+
+def generate(users, transactions_per_user, seed=0, end_date=None, history_days=365):
+    """Create users, transactions, budgets and preferences; returns the new user ids"""
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    init_db()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # One hash for everyone: hashing is deliberately slow
+    password = generate_password_hash(PASSWORD)
+    first = (cursor.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0) + 1
+    cursor.executemany('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                       [(f'bench{first + i}', user_email(first + i), password) for i in range(users)])
+    user_ids = list(range(first, first + users))
+
+    categories = list(CATEGORY_KEYWORDS)
+    descriptions = generate_descriptions(2000, CATEGORY_KEYWORDS, rng)
+    rows = []
+    for user_id in user_ids:
+        for _ in range(transactions_per_user):
+            day = (end_date - timedelta(days=rng.randrange(history_days))).isoformat()
+            if rng.random() < 0.05:
+                rows.append((user_id, 'income', round(rng.uniform(5000, 90000), 2), rng.choice(INCOME_CATEGORIES),
+                             'salary credit', day))
+            else:
+                rows.append((user_id, 'expense', round(rng.lognormvariate(6, 1.2), 2), rng.choice(categories),
+                             rng.choice(descriptions), day))
+            if len(rows) >= INSERT_CHUNK:
+                cursor.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+                    VALUES (?, ?, ?, ?, ?, ?)''', rows)
+                rows = []
+    cursor.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+        VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+    cursor.executemany('INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)',
+                       [(user_id, category, rng.choice([2000, 5000, 10000, 20000]), 'monthly')
+                        for user_id in user_ids for category in rng.sample(categories, 4)])
+    cursor.executemany('''INSERT INTO notification_preferences
+        (user_id, budget_alerts_email, anomaly_alerts_email, daily_summary_email, weekly_summary_email)
+        VALUES (?, 0, 0, 0, 0)''', [(user_id,) for user_id in user_ids])
+    conn.commit()
+    conn.close()
+
+    assign_merchants()
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--db', required=True, help='SQLite file to create or add to')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=2000, help='per user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end-date', type=date.fromisoformat, help='last transaction date (default: today)')
+    args = parser.parse_args()
+
+    database.DATABASE = args.db
+    started = time.perf_counter()
+    user_ids = generate(args.users, args.transactions, args.seed, args.end_date)
+    print(f'{len(user_ids):,} users x {args.transactions:,} transactions written to {args.db} '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
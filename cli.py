@@ -0,0 +1,213 @@
+"""
+Maintenance commands, available through the flask CLI:
+
+    flask --app app recategorize --user someone@example.com
+    flask --app app recategorize --all --dry-run
+    flask --app app assign-merchants
+    flask --app app import-statement statement.csv --user someone@example.com
+    flask --app app export-transactions --user someone@example.com -o transactions.csv
+    flask --app app find-duplicates --dry-run
+    flask --app app detect-subscriptions --rebuild
+    flask --app app materialize-recurring
+    flask --app app archive-transactions --vacuum
+    flask --app app collect-receipts --dry-run
+"""
+
+import time
+
+import click
+
+from models.database import get_db_connection
+from utils.ai_categorizer import recategorize_transactions, RECATEGORIZE_CHUNK_SIZE
+from utils.merchants import assign_merchants
+from utils.importer import import_statement, StatementError, IMPORT_CHUNK_SIZE
+from utils.exporter import stream_export, EXPORT_FORMATS, EXPORT_BATCH_SIZE
+from utils.duplicates import sweep_duplicates
+from utils.subscriptions import update_subscriptions
+from utils.recurring import materialize_due, MATERIALIZE_BATCH_SIZE
+from utils.partitions import archive_transactions, HOT_MONTHS
+from utils.receipt_store import collect_garbage, GC_GRACE_SECONDS
+
+
+def find_user_ids(user=None, category=None):
+    """User ids matching an id or email, or every user with transactions in category"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if user is not None:
+        cursor.execute('SELECT id FROM users WHERE email = ? OR CAST(id AS TEXT) = ?', (user, user))
+    else:
+        cursor.execute('SELECT DISTINCT user_id AS id FROM transactions WHERE category = ?', (category,))
+    user_ids = [row['id'] for row in cursor.fetchall()]
+    conn.close()
+    return user_ids
+
+
+def register_commands(app):
+
+    @app.cli.command('recategorize')
+    @click.option('--user', help='User id or email')
+    @click.option('--all', 'all_users', is_flag=True, help='Every user with transactions in the category')
+    @click.option('--category', default='Other', show_default=True, help='Category to re-run')
+    @click.option('--chunk-size', default=RECATEGORIZE_CHUNK_SIZE, show_default=True, help='Rows per commit')
+    @click.option('--dry-run', is_flag=True, help='Report what would change without saving')
+    def recategorize(user, all_users, category, chunk_size, dry_run):
+        """Re-categorize transactions left in a category (by default 'Other')."""
+        if not user and not all_users:
+            raise click.UsageError('Pass --user or --all')
+
+        user_ids = find_user_ids(None if all_users else user, category)
+        if not user_ids:
+            raise click.ClickException('No matching users')
+
+        for user_id in user_ids:
+            started = time.perf_counter()
+            totals = recategorize_transactions(
+                user_id, category, chunk_size, dry_run,
+                progress=lambda t: click.echo(f"  user {user_id}: {t['scanned']:,} scanned, {t['updated']:,} re-categorized", err=True))
+            elapsed = time.perf_counter() - started
+            verb = 'would change' if dry_run else 'changed'
+            click.echo(f"User {user_id}: {totals['updated']:,} of {totals['scanned']:,} {verb} in {elapsed:.1f}s")
+            for name, count in sorted(totals['categories'].items(), key=lambda item: -item[1]):
+                click.echo(f'  {name}: {count:,}')
+
+    @app.cli.command('assign-merchants')
+    @click.option('--user', help='User id or email (default: everyone)')
+    @click.option('--chunk-size', default=5000, show_default=True, help='Rows per commit')
+    def assign_merchants_command(user, chunk_size):
+        """Link transactions saved before merchant tracking to canonical merchants."""
+        user_id = None
+        if user:
+            user_ids = find_user_ids(user)
+            if not user_ids:
+                raise click.ClickException('No matching users')
+            user_id = user_ids[0]
+
+        started = time.perf_counter()
+        assigned = assign_merchants(user_id, chunk_size,
+                                    progress=lambda last_id, total: click.echo(f'  through id {last_id}: {total:,} linked', err=True))
+        click.echo(f'Linked {assigned:,} transactions to merchants in {time.perf_counter() - started:.1f}s')
+
+    @app.cli.command('import-statement')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--user', required=True, help='User id or email')
+    @click.option('--date-format', help="strptime format for the date column, e.g. '%d/%m/%Y' (default: detect)")
+    @click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True, help='Rows per commit')
+    def import_statement_command(path, user, date_format, chunk_size):
+        """Import a CSV or OFX/QFX bank statement."""
+        user_ids = find_user_ids(user)
+        if not user_ids:
+            raise click.ClickException('No matching users')
+
+        started = time.perf_counter()
+        with open(path, 'rb') as statement:
+            try:
+                totals = import_statement(
+                    user_ids[0], statement, path, date_format, chunk_size,
+                    progress=lambda t: click.echo(f"  {t['rows']:,} rows read, {t['inserted']:,} added", err=True))
+            except StatementError as e:
+                raise click.ClickException(str(e))
+        click.echo(f"{totals['rows']:,} rows in {time.perf_counter() - started:.1f}s: {totals['inserted']:,} added, "
+                   f"{totals['duplicates']:,} already imported, {totals['flagged']:,} flagged as possible duplicates, "
+                   f"{totals['errors']:,} unreadable")
+        for message in totals['error_messages']:
+            click.echo(f'  {message}')
+
+    @app.cli.command('export-transactions')
+    @click.option('--user', required=True, help='User id or email')
+    @click.option('--format', 'file_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+    @click.option('-o', '--output', default='-', show_default=True, help="File to write, '-' for stdout")
+    @click.option('--type', 'transaction_type', type=click.Choice(['all', 'expense', 'income']), default='all', show_default=True)
+    @click.option('--category', default='all', show_default=True)
+    @click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='First date, inclusive')
+    @click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Last date, inclusive')
+    @click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Rows per fetch')
+    def export_transactions_command(user, file_format, output, transaction_type, category, start, end, batch_size):
+        """Export a user's transactions as CSV or NDJSON."""
+        user_ids = find_user_ids(user)
+        if not user_ids:
+            raise click.ClickException('No matching users')
+
+        started = time.perf_counter()
+        with click.open_file(output, 'wb') as f:
+            for chunk in stream_export(user_ids[0], file_format, batch_size,
+                                       transaction_type=transaction_type, category=category,
+                                       start_date=start.date().isoformat() if start else None,
+                                       end_date=end.date().isoformat() if end else None):
+                f.write(chunk.encode('utf-8'))
+        click.echo(f'Exported in {time.perf_counter() - started:.1f}s', err=True)
+
+    @app.cli.command('find-duplicates')
+    @click.option('--user', help='User id or email (default: everyone)')
+    @click.option('--dry-run', is_flag=True, help='Count possible duplicates without flagging them')
+    def find_duplicates_command(user, dry_run):
+        """Flag existing transactions that look like duplicates (same date, whole amount and merchant)."""
+        user_id = None
+        if user:
+            user_ids = find_user_ids(user)
+            if not user_ids:
+                raise click.ClickException('No matching users')
+            user_id = user_ids[0]
+
+        started = time.perf_counter()
+        # Duplicates are matched by merchant, so link any rows saved without one first
+        assign_merchants(user_id)
+        flagged = sweep_duplicates(user_id, dry_run,
+                                   progress=lambda scanned, total: click.echo(f'  {scanned:,} scanned, {total:,} flagged', err=True))
+        verb = 'would be flagged' if dry_run else 'flagged'
+        click.echo(f'{flagged:,} possible duplicates {verb} in {time.perf_counter() - started:.1f}s')
+
+    @app.cli.command('detect-subscriptions')
+    @click.option('--user', help='User id or email (default: everyone)')
+    @click.option('--rebuild', is_flag=True, help='Rescan full history instead of only new transactions')
+    def detect_subscriptions_command(user, rebuild):
+        """Detect recurring payments among new transactions (or all of them with --rebuild)."""
+        if user:
+            user_ids = find_user_ids(user)
+            if not user_ids:
+                raise click.ClickException('No matching users')
+        else:
+            conn = get_db_connection()
+            user_ids = [row['id'] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+            conn.close()
+
+        started = time.perf_counter()
+        # Series are grouped by merchant, so link any rows saved without one first
+        assign_merchants(user_ids[0] if user else None)
+        for user_id in user_ids:
+            analyzed = update_subscriptions(user_id, rebuild)
+            click.echo(f'User {user_id}: {analyzed:,} merchants analyzed', err=True)
+        click.echo(f'Updated subscriptions for {len(user_ids):,} users in {time.perf_counter() - started:.1f}s')
+
+    @app.cli.command('materialize-recurring')
+    @click.option('--date', 'through', type=click.DateTime(['%Y-%m-%d']), help='Generate through this date (default: today)')
+    @click.option('--batch-size', default=MATERIALIZE_BATCH_SIZE, show_default=True, help='Rules per commit')
+    def materialize_recurring_command(through, batch_size):
+        """Add the transactions that recurring rules have due, for every user."""
+        started = time.perf_counter()
+        totals = materialize_due(through.date() if through else None, batch_size,
+                                 progress=lambda t: click.echo(f"  {t['rules']:,} rules, {t['inserted']:,} added", err=True))
+        click.echo(f"{totals['inserted']:,} transactions added from {totals['rules']:,} due rules "
+                   f"in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command('archive-transactions')
+    @click.option('--hot-months', default=HOT_MONTHS, show_default=True,
+                  help='Months, counting the current one, kept in the transactions table')
+    @click.option('--vacuum', is_flag=True, help='Compact the SQLite file afterwards')
+    def archive_transactions_command(hot_months, vacuum):
+        """Move older months of transactions into read-only monthly partitions."""
+        started = time.perf_counter()
+        totals = archive_transactions(hot_months, vacuum=vacuum,
+                                      progress=lambda t: click.echo(f"  {t['months']:,} months, {t['archived']:,} rows", err=True))
+        click.echo(f"{totals['archived']:,} transactions archived into {totals['months']:,} monthly partitions, "
+                   f"{totals['restored']:,} moved back, in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command('collect-receipts')
+    @click.option('--grace', default=GC_GRACE_SECONDS, show_default=True,
+                  help='Seconds an unreferenced file is kept, so uploads in progress survive')
+    @click.option('--dry-run', is_flag=True, help='Report what would be deleted without deleting it')
+    def collect_receipts_command(grace, dry_run):
+        """Delete stored receipt images that no transaction refers to any more."""
+        started = time.perf_counter()
+        totals = collect_garbage(grace, dry_run)
+        click.echo(f"{'Would delete' if dry_run else 'Deleted'} {totals['files']:,} files, "
+                   f"{totals['bytes'] / 1e6:,.1f} MB, in {time.perf_counter() - started:.1f}s")
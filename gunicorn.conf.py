@@ -0,0 +1,25 @@
+"""
+gunicorn settings, read from the working directory by 'gunicorn app:app'
+
+Workers share their Prometheus metrics through files in
+PROMETHEUS_MULTIPROC_DIR (see utils/metrics.py). The directory is emptied
+when the server starts, and a worker's live gauges are dropped when it exits.
+"""
+
+import os
+import shutil
+import tempfile
+
+# Set before the workers import the app, so prometheus_client uses the shared files
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'expense-tracker-metrics'))
+
+
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,82 +1,358 @@
+import os
 import sqlite3
-from pathlib import Path
 
-DATABASE = 'data/expense_tracker.db'
+from utils.query_profiler import ProfiledConnection
+
+DATABASE = os.environ.get('DATABASE_PATH', 'data/expense_tracker.db')
+
+
+class StorageBackend:
+    """A database engine behind get_db_connection() and init_db().
+
+    Connections follow sqlite3's DB-API dialect whatever the engine: '?'
+    placeholders, rows readable by column name or index (or plain tuples
+    with row_factory = None), cursor.lastrowid after an INSERT, and
+    close() to give the connection back. The SQL in app.py and utils/
+    keeps to what every backend runs: ON CONFLICT upserts rather than
+    INSERT OR IGNORE/REPLACE, date ranges rather than strftime(), and
+    begin_write() and week_start() where the dialects differ.
+    """
+
+    name = None
+
+    def connect(self):
+        raise NotImplementedError
+
+    def init_schema(self):
+        """Create or upgrade the tables, indexes and triggers"""
+        raise NotImplementedError
+
+    def begin_write(self, cursor, lock):
+        """Start a transaction that holds the named write lock until commit"""
+        raise NotImplementedError
+
+    def week_start(self, column):
+        """SQL for the Monday on or before a YYYY-MM-DD text column"""
+        raise NotImplementedError
+
+    def whole_amount(self, expression):
+        """SQL rounding an amount to a whole integer, halves away from zero;
+        must match the idx_transactions_duplicate expression"""
+        raise NotImplementedError
+
+    def make_read_only(self, cursor, table):
+        """Reject any later write to table (an archived partition)"""
+        raise NotImplementedError
+
+    def streaming_cursor(self, conn):
+        """A cursor for one long SELECT whose fetchmany reads rows from the
+        database as they are asked for, not all of them at execute"""
+        return conn.cursor()
+
+    def vacuum(self):
+        """Give the space of deleted rows back, where the engine does not do it by itself"""
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """One SQLite file at DATABASE: a single writer at a time"""
+
+    name = 'sqlite'
+
+    def connect(self):
+        # Times each statement for the per-request profile and the slow-query log
+        conn = sqlite3.connect(DATABASE, factory=ProfiledConnection)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def begin_write(self, cursor, lock):
+        # SQLite has one write lock for the whole file, which a transaction that
+        # has begun (they only begin on a write) already holds
+        if not cursor.connection.in_transaction:
+            cursor.execute('BEGIN IMMEDIATE')
+
+    def week_start(self, column):
+        return f"date({column}, '-6 days', 'weekday 1')"
+
+    def whole_amount(self, expression):
+        return f'CAST(ROUND({expression}) AS INTEGER)'
+
+    def make_read_only(self, cursor, table):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_read_only_{event.lower()}
+                BEFORE {event} ON {table} BEGIN
+                    SELECT RAISE(ABORT, 'archived partition {table} is read-only');
+                END''')
+
+    def vacuum(self):
+        conn = self.connect()
+        conn.execute('VACUUM')
+        conn.close()
+
+    def init_schema(self):
+        # DATABASE_PATH may point anywhere; its directory, not ./data, must exist
+        if os.path.dirname(DATABASE):
+            os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            receipt_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+
+        # Canonical merchants shared by all users, see utils/merchants.py
+        cursor.execute('''CREATE TABLE IF NOT EXISTS merchants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            normalized TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        # Each user's latest category for a merchant, used as a categorization hint
+        cursor.execute('''CREATE TABLE IF NOT EXISTS merchant_categories (
+            user_id INTEGER NOT NULL,
+            merchant_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            PRIMARY KEY (user_id, merchant_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (merchant_id) REFERENCES merchants (id)
+        )''')
+
+        # Columns added after the first release
+        columns = {row['name'] for row in cursor.execute('PRAGMA table_info(transactions)')}
+        if 'merchant_id' not in columns:
+            cursor.execute('ALTER TABLE transactions ADD COLUMN merchant_id INTEGER REFERENCES merchants (id)')
+        if 'import_hash' not in columns:
+            cursor.execute('ALTER TABLE transactions ADD COLUMN import_hash TEXT')
+        # Id of the transaction this one appears to duplicate; 0 once a user has said it is not one
+        if 'duplicate_of' not in columns:
+            cursor.execute('ALTER TABLE transactions ADD COLUMN duplicate_of INTEGER')
+
+        # Every per-user report filters on a date window, and duplicate checks look up
+        # (date, whole amount, merchant); the (user_id, date) prefix serves the reports
+        cursor.execute('DROP INDEX IF EXISTS idx_transactions_user_date')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_duplicate
+            ON transactions (user_id, date, CAST(ROUND(amount) AS INTEGER), merchant_id)''')
+        # (user_id, rowid): lets "user_id = ? AND id > ?" catch-up scans seek instead of reading every row
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_category ON transactions (user_id, category)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_merchant ON transactions (user_id, merchant_id)')
+        # Imported rows are identified by a hash so re-imports are skipped (NULLs don't collide)
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_import_hash ON transactions (user_id, import_hash)')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS budgets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            period TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, category, period)
+        )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            is_read INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS notification_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            budget_alerts_email INTEGER DEFAULT 1,
+            anomaly_alerts_email INTEGER DEFAULT 1,
+            daily_summary_email INTEGER DEFAULT 0,
+            weekly_summary_email INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+
+        # Track email alerts sent to prevent duplicates
+        cursor.execute('''CREATE TABLE IF NOT EXISTS email_alert_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            alert_type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            sent_date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, alert_type, category, sent_date)
+        )''')
+
+        # Scheduled transaction templates; next_date is the first occurrence not yet written (NULL once ended)
+        cursor.execute('''CREATE TABLE IF NOT EXISTS recurring_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            merchant_id INTEGER REFERENCES merchants (id),
+            schedule TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            next_date TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_recurring_rules_user ON recurring_rules (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_recurring_rules_due ON recurring_rules (next_date) WHERE active = 1')
+
+        # Recurring payments found by utils/subscriptions.py, with the watermark of each user's last scan
+        cursor.execute('''CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            merchant_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            period TEXT NOT NULL,
+            interval_days REAL NOT NULL,
+            occurrences INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            next_date TEXT NOT NULL,
+            confidence REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (merchant_id) REFERENCES merchants (id)
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_user_merchant ON subscriptions (user_id, merchant_id)')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS subscription_scans (
+            user_id INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+
+        # Merchants whose expenses were edited since the user's last subscription scan
+        cursor.execute('''CREATE TABLE IF NOT EXISTS subscription_changes (
+            user_id INTEGER NOT NULL,
+            merchant_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, merchant_id)
+        )''')
+
+        # Per-user data version, bumped by triggers on every write so readers can
+        # build cheap cache validators (ETags) without rescanning transactions
+        cursor.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+
+        # Archived months of transactions, see utils/partitions.py
+        cursor.execute('''CREATE TABLE IF NOT EXISTS transaction_partitions (
+            month TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            max_id INTEGER
+        )''')
+
+        # Receipts uploaded through the JSON API, read by OCR in the background
+        cursor.execute('''CREATE TABLE IF NOT EXISTS receipt_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            receipt_path TEXT NOT NULL,
+            transaction_id INTEGER,
+            duplicate_of INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_receipt_jobs_pending ON receipt_jobs (status) WHERE status IN ('queued', 'processing')")
+
+        for table in ('transactions', 'budgets'):
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS bump_version_{table}_{event.lower()}
+                    AFTER {event} ON {table} BEGIN
+                        INSERT INTO data_versions (user_id, version) VALUES ({row}.user_id, 1)
+                        ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+                    END''')
+
+        # New expenses are found by id; edits to old ones leave their merchants here
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS subscription_changes_update
+            AFTER UPDATE OF type, amount, date, merchant_id, duplicate_of ON transactions
+            WHEN (OLD.type = 'expense' OR NEW.type = 'expense')
+                AND (OLD.type IS NOT NEW.type OR OLD.amount IS NOT NEW.amount OR OLD.date IS NOT NEW.date
+                     OR OLD.merchant_id IS NOT NEW.merchant_id OR OLD.duplicate_of IS NOT NEW.duplicate_of)
+            BEGIN
+                INSERT INTO subscription_changes (user_id, merchant_id) SELECT OLD.user_id, OLD.merchant_id
+                    WHERE OLD.merchant_id IS NOT NULL ON CONFLICT DO NOTHING;
+                INSERT INTO subscription_changes (user_id, merchant_id) SELECT NEW.user_id, NEW.merchant_id
+                    WHERE NEW.merchant_id IS NOT NULL ON CONFLICT DO NOTHING;
+            END''')
+
+
+        conn.commit()
+        conn.close()
+
+
+_backend = None
+
+
+def get_backend():
+    """The backend DATABASE_URL selects: PostgreSQL for postgres:// or postgresql:// URLs
+    (models/postgres.py), otherwise SQLite at DATABASE"""
+    global _backend
+    url = os.environ.get('DATABASE_URL', '')
+    if not url.startswith(('postgres://', 'postgresql://')):
+        url = None
+    if _backend is None or getattr(_backend, 'url', None) != url:
+        if _backend is not None:
+            _backend.close()
+        if url:
+            from models.postgres import PostgresBackend
+            _backend = PostgresBackend(url)
+        else:
+            _backend = SQLiteBackend()
+    return _backend
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_backend().connect()
 
 def init_db():
-    Path('data').mkdir(exist_ok=True)
+    get_backend().init_schema()
+
+def begin_write(cursor, lock):
+    """Start a write transaction serialized with others taking the same lock"""
+    get_backend().begin_write(cursor, lock)
+
+def streaming_cursor(conn):
+    """A cursor on conn for one SELECT too large to fetch at once"""
+    return get_backend().streaming_cursor(conn)
+
+def get_data_version(user_id):
+    """Return the user's data version, which changes whenever their transactions or budgets do"""
     conn = get_db_connection()
     cursor = conn.cursor()
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        type TEXT NOT NULL,
-        amount REAL NOT NULL,
-        category TEXT NOT NULL,
-        description TEXT,
-        date TEXT NOT NULL,
-        receipt_path TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS budgets (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        category TEXT NOT NULL,
-        amount REAL NOT NULL,
-        period TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        UNIQUE(user_id, category, period)
-    )''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS alerts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        message TEXT NOT NULL,
-        alert_type TEXT NOT NULL,
-        is_read INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS notification_preferences (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL UNIQUE,
-        budget_alerts_email INTEGER DEFAULT 1,
-        anomaly_alerts_email INTEGER DEFAULT 1,
-        daily_summary_email INTEGER DEFAULT 0,
-        weekly_summary_email INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-
-    # Track email alerts sent to prevent duplicates
-    cursor.execute('''CREATE TABLE IF NOT EXISTS email_alert_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        alert_type TEXT NOT NULL,
-        category TEXT NOT NULL,
-        sent_date TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id),
-        UNIQUE(user_id, alert_type, category, sent_date)
-    )''')
-
-    conn.commit()
+    cursor.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,))
+    result = cursor.fetchone()
     conn.close()
+    return result['version'] if result else 0
@@ -0,0 +1,428 @@
+"""
+PostgreSQL storage backend, selected by a postgres:// or postgresql:// DATABASE_URL
+
+Connections come from a psycopg_pool pool (DATABASE_POOL_MIN to
+DATABASE_POOL_MAX per process) and are wrapped to look like the sqlite3
+connections the rest of the app was written against:
+- '?' placeholders are rewritten to '%s'
+- rows can be read by column name or index, or are plain tuples once row_factory is None
+- an INSERT into a table with an id column sets cursor.lastrowid
+- close() hands the connection back to the pool, rolling back anything uncommitted
+- streaming_cursor() is a named, server-side cursor, so fetchmany reads a
+  batch at a time instead of the whole result arriving with execute
+
+The schema mirrors SQLiteBackend.init_schema, including the row triggers that
+bump data_versions. Dates stay YYYY-MM-DD text so that the same range filters
+and the columnar store work unchanged.
+"""
+
+import itertools
+import os
+import re
+import time
+import zlib
+from functools import lru_cache
+
+from psycopg.pq import TransactionStatus
+from psycopg.types.numeric import FloatLoader
+from psycopg_pool import ConnectionPool
+
+from models.database import StorageBackend
+from utils.query_profiler import _record
+
+POOL_MIN = int(os.environ.get('DATABASE_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DATABASE_POOL_MAX', '10'))
+
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', '30'))
+
+# Tables keyed by something other than an id column, so INSERTs into them get no RETURNING id
+_WITHOUT_ID = frozenset({'subscription_scans', 'subscription_changes', 'data_versions', 'transaction_partitions',
+                         'merchant_categories'})
+
+_INSERT = re.compile(r'\s*INSERT\s+INTO\s+(\w+)[^;]*\bVALUES\b', re.IGNORECASE | re.DOTALL)
+
+_CREATED_AT = "TEXT DEFAULT to_char(timezone('UTC', now()), 'YYYY-MM-DD HH24:MI:SS')"
+
+SCHEMA = [
+    f'''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        username TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        created_at {_CREATED_AT}
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS merchants (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL,
+        normalized TEXT UNIQUE NOT NULL,
+        created_at {_CREATED_AT}
+    )''',
+    '''CREATE TABLE IF NOT EXISTS merchant_categories (
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        merchant_id INTEGER NOT NULL REFERENCES merchants (id),
+        category TEXT NOT NULL,
+        PRIMARY KEY (user_id, merchant_id)
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        type TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT,
+        date TEXT NOT NULL,
+        receipt_path TEXT,
+        created_at {_CREATED_AT},
+        merchant_id INTEGER REFERENCES merchants (id),
+        import_hash TEXT,
+        duplicate_of INTEGER
+    )''',
+    '''CREATE INDEX IF NOT EXISTS idx_transactions_duplicate
+        ON transactions (user_id, date, CAST(ROUND(CAST(amount AS NUMERIC)) AS INTEGER), merchant_id)''',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, id)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_user_category ON transactions (user_id, category)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_user_merchant ON transactions (user_id, merchant_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_import_hash ON transactions (user_id, import_hash)',
+    f'''CREATE TABLE IF NOT EXISTS budgets (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        category TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        period TEXT NOT NULL,
+        created_at {_CREATED_AT},
+        UNIQUE (user_id, category, period)
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        message TEXT NOT NULL,
+        alert_type TEXT NOT NULL,
+        is_read INTEGER DEFAULT 0,
+        created_at {_CREATED_AT}
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS notification_preferences (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL UNIQUE REFERENCES users (id),
+        budget_alerts_email INTEGER DEFAULT 1,
+        anomaly_alerts_email INTEGER DEFAULT 1,
+        daily_summary_email INTEGER DEFAULT 0,
+        weekly_summary_email INTEGER DEFAULT 0,
+        created_at {_CREATED_AT}
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS email_alert_history (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        alert_type TEXT NOT NULL,
+        category TEXT NOT NULL,
+        sent_date TEXT NOT NULL,
+        created_at {_CREATED_AT},
+        UNIQUE (user_id, alert_type, category, sent_date)
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS recurring_rules (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        type TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT,
+        merchant_id INTEGER REFERENCES merchants (id),
+        schedule TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT,
+        next_date TEXT,
+        active INTEGER NOT NULL DEFAULT 1,
+        created_at {_CREATED_AT}
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_recurring_rules_user ON recurring_rules (user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_recurring_rules_due ON recurring_rules (next_date) WHERE active = 1',
+    f'''CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        merchant_id INTEGER NOT NULL REFERENCES merchants (id),
+        amount DOUBLE PRECISION NOT NULL,
+        period TEXT NOT NULL,
+        interval_days DOUBLE PRECISION NOT NULL,
+        occurrences INTEGER NOT NULL,
+        first_date TEXT NOT NULL,
+        last_date TEXT NOT NULL,
+        next_date TEXT NOT NULL,
+        confidence DOUBLE PRECISION NOT NULL,
+        updated_at {_CREATED_AT}
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_subscriptions_user_merchant ON subscriptions (user_id, merchant_id)',
+    '''CREATE TABLE IF NOT EXISTS subscription_scans (
+        user_id INTEGER PRIMARY KEY REFERENCES users (id),
+        last_id INTEGER NOT NULL,
+        row_count INTEGER NOT NULL,
+        version INTEGER NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS subscription_changes (
+        user_id INTEGER NOT NULL,
+        merchant_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, merchant_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS data_versions (
+        user_id INTEGER PRIMARY KEY REFERENCES users (id),
+        version INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS transaction_partitions (
+        month TEXT PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        row_count INTEGER NOT NULL,
+        max_id INTEGER
+    )''',
+    f'''CREATE TABLE IF NOT EXISTS receipt_jobs (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        status TEXT NOT NULL DEFAULT 'queued',
+        receipt_path TEXT NOT NULL,
+        transaction_id INTEGER,
+        duplicate_of INTEGER,
+        error TEXT,
+        created_at {_CREATED_AT},
+        updated_at {_CREATED_AT}
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_receipt_jobs_pending ON receipt_jobs (status) WHERE status IN ('queued', 'processing')",
+    '''CREATE OR REPLACE FUNCTION reject_archived_write() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'archived partition % is read-only', TG_TABLE_NAME;
+    END
+    $$ LANGUAGE plpgsql''',
+    # One bump per changed row, as the SQLite triggers do
+    '''CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO data_versions (user_id, version)
+        VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.user_id ELSE NEW.user_id END, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = data_versions.version + 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql''',
+]
+for _table in ('transactions', 'budgets'):
+    SCHEMA += [f'DROP TRIGGER IF EXISTS bump_version_{_table} ON {_table}',
+               f'''CREATE TRIGGER bump_version_{_table} AFTER INSERT OR UPDATE OR DELETE ON {_table}
+                   FOR EACH ROW EXECUTE FUNCTION bump_data_version()''']
+
+# Merchants of edited expenses, for the next subscription scan
+SCHEMA += [
+    '''CREATE OR REPLACE FUNCTION record_subscription_change() RETURNS trigger AS $$
+    BEGIN
+        IF OLD.merchant_id IS NOT NULL THEN
+            INSERT INTO subscription_changes (user_id, merchant_id) VALUES (OLD.user_id, OLD.merchant_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+        IF NEW.merchant_id IS NOT NULL THEN
+            INSERT INTO subscription_changes (user_id, merchant_id) VALUES (NEW.user_id, NEW.merchant_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS subscription_changes_update ON transactions',
+    '''CREATE TRIGGER subscription_changes_update
+        AFTER UPDATE OF type, amount, date, merchant_id, duplicate_of ON transactions FOR EACH ROW
+        WHEN ((OLD.type = 'expense' OR NEW.type = 'expense')
+              AND (OLD.type, OLD.amount, OLD.date, OLD.merchant_id, OLD.duplicate_of)
+                  IS DISTINCT FROM (NEW.type, NEW.amount, NEW.date, NEW.merchant_id, NEW.duplicate_of))
+        EXECUTE FUNCTION record_subscription_change()''',
+]
+
+
+class Row(tuple):
+    """A result row readable by column name or index, like sqlite3.Row"""
+
+    __slots__ = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+@lru_cache(maxsize=256)
+def row_class(names):
+    """A Row subclass for one set of column names"""
+    return type('Row', (Row,), {'__slots__': (), '_index': {name: i for i, name in enumerate(names)}})
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrite sqlite3 '?' placeholders outside quoted text as '%s', and escape literal '%'"""
+    out = []
+    quote = None
+    for char in sql:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '?':
+            char = '%s'
+        if char == '%':
+            char = '%%'
+        out.append(char)
+    return ''.join(out)
+
+
+@lru_cache(maxsize=1024)
+def _returns_id(sql):
+    match = _INSERT.match(sql)
+    return bool(match) and match.group(1).lower() not in _WITHOUT_ID and 'RETURNING' not in sql.upper()
+
+
+# Numbers server-side cursors, whose names must be unique per connection
+_cursor_ids = itertools.count(1)
+
+
+class PostgresCursor:
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        # A named cursor is server-side: it runs one SELECT and fetches its rows on demand
+        self._cursor = connection.raw.cursor(name=name) if name else connection.raw.cursor()
+        self.row_factory = connection.row_factory
+        self.arraysize = 1
+        self.lastrowid = None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql, parameters=()):
+        query = translate(sql)
+        returning = _returns_id(sql)
+        if returning:
+            query += ' RETURNING id'
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(query, parameters)
+        finally:
+            _record(sql, started)
+        if returning:
+            row = self._cursor.fetchone()
+            self.lastrowid = row[0] if row else None
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(translate(sql), seq_of_parameters)
+        finally:
+            _record(sql, started, many=True)
+        return self
+
+    def _wrap(self, rows):
+        if self.row_factory is None or not rows:
+            return rows
+        cls = row_class(tuple(column.name for column in self._cursor.description))
+        return [cls(row) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None or self.row_factory is None:
+            return row
+        return row_class(tuple(column.name for column in self._cursor.description))(row)
+
+    def fetchmany(self, size=None):
+        return self._wrap(self._cursor.fetchmany(size or self.arraysize))
+
+    def fetchall(self):
+        return self._wrap(self._cursor.fetchall())
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """A pooled psycopg connection with the sqlite3 connection methods the app uses"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.raw = pool.getconn()
+        self.row_factory = Row
+
+    def cursor(self):
+        return PostgresCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self.raw.commit()
+        finally:
+            _record('COMMIT', started)
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if self.raw is not None:
+            # Reads open a transaction too; end it here rather than have the pool warn about it
+            if self.raw.info.transaction_status != TransactionStatus.IDLE:
+                self.raw.rollback()
+            self.pool.putconn(self.raw)
+            self.raw = None
+
+
+def _configure(conn):
+    # NUMERIC results (SUM and AVG of integers) as float, as SQLite returns them
+    conn.adapters.register_loader('numeric', FloatLoader)
+
+
+class PostgresBackend(StorageBackend):
+    """PostgreSQL through a per-process connection pool"""
+
+    name = 'postgresql'
+
+    def __init__(self, url):
+        self.url = url
+        self.pool = ConnectionPool(url, min_size=POOL_MIN, max_size=max(POOL_MIN, POOL_MAX), timeout=POOL_TIMEOUT,
+                                   configure=_configure, open=True)
+
+    def connect(self):
+        return PostgresConnection(self.pool)
+
+    def begin_write(self, cursor, lock):
+        # Transactions start implicitly; the advisory lock is held until commit or rollback
+        cursor.execute('SELECT pg_advisory_xact_lock(?)', (zlib.crc32(lock.encode()),))
+
+    def week_start(self, column):
+        return f"to_char(date_trunc('week', substr({column}, 1, 10)::date), 'YYYY-MM-DD')"
+
+    def whole_amount(self, expression):
+        # round() on double precision rounds halves to even; on numeric, away from zero like SQLite
+        return f'CAST(ROUND(CAST({expression} AS NUMERIC)) AS INTEGER)'
+
+    def streaming_cursor(self, conn):
+        return PostgresCursor(conn, f'stream_{next(_cursor_ids)}')
+
+    def make_read_only(self, cursor, table):
+        cursor.execute(f'''CREATE TRIGGER {table}_read_only BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION reject_archived_write()''')
+
+    def init_schema(self):
+        with self.pool.connection() as conn:
+            # Serializes workers that start at the same time
+            conn.execute('SELECT pg_advisory_xact_lock(%s)', (zlib.crc32(b'init_schema'),))
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def close(self):
+        self.pool.close()
@@ -6,4 +6,23 @@ document.addEventListener('DOMContentLoaded', function() {
             setTimeout(() => alert.remove(), 500);
         }, 5000);
     });
-});
\ No newline at end of file
+});
+// Poll a JSON endpoint that supports ETags. The browser revalidates with
+// If-None-Match, so unchanged data costs a 304 and onChange is not called.
+function pollJson(url, onChange, intervalMs) {
+    let lastEtag = null;
+    function tick() {
+        fetch(url, { cache: 'no-cache', credentials: 'same-origin' })
+            .then(response => {
+                const etag = response.headers.get('ETag');
+                if (!response.ok || (etag && etag === lastEtag)) {
+                    return null;
+                }
+                lastEtag = etag;
+                return response.json();
+            })
+            .then(data => { if (data) onChange(data); })
+            .catch(() => {});
+    }
+    setInterval(tick, intervalMs || 60000);
+}
@@ -0,0 +1,59 @@
+"""
+Tests for the compiled keyword categorizer
+"""
+
+import unittest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.ai_categorizer import categorize_expense, predict_category, get_matcher
+
+
+class TestKeywordCategorizer(unittest.TestCase):
+
+    def test_matches_at_word_start_only(self):
+        self.assertEqual(categorize_expense('Shopping at AMAZON'), 'Shopping')
+        self.assertEqual(categorize_expense('Gift for parent'), 'Other')
+        self.assertEqual(categorize_expense(''), 'Other')
+
+    def test_first_listed_category_wins_for_categorize(self):
+        # 'gas' is listed under both Transportation and Utilities
+        self.assertEqual(categorize_expense('gas bill'), 'Transportation')
+
+    def test_prefix_keywords_are_credited_with_longer_ones(self):
+        keywords = {'Bills': ['pay'], 'Shopping': ['paypal'], 'Other': []}
+        scores = dict(predict_category('PAYPAL *seller', return_all=True, category_keywords=keywords))
+        self.assertEqual(scores, {'Bills': 1, 'Shopping': 1})
+        self.assertEqual(categorize_expense('paypal', category_keywords=keywords), 'Bills')
+
+    def test_shared_keyword_credits_every_category(self):
+        scores = dict(predict_category('gas', return_all=True))
+        self.assertEqual(scores, {'Transportation': 1, 'Utilities': 1})
+
+    def test_return_all_is_sorted_by_score(self):
+        ranked = predict_category('pizza lunch via uber', return_all=True)
+        self.assertEqual(ranked[0], ('Food & Dining', 2))
+        self.assertEqual(predict_category('pizza lunch via uber'), 'Food & Dining')
+        self.assertEqual(predict_category('', return_all=True), [('Other', 0)])
+        self.assertEqual(predict_category('zzqx', return_all=True), [('Other', 0)])
+        self.assertEqual(predict_category('zzqx'), 'Other')
+
+    def test_custom_keywords_rebuild_when_changed(self):
+        keywords = {'Pets': ['vet'], 'Other': []}
+        self.assertEqual(categorize_expense('VET visit', category_keywords=keywords), 'Pets')
+        matcher = get_matcher(keywords)
+        self.assertIs(get_matcher(keywords), matcher)
+
+        keywords['Pets'].append('kibble')
+        self.assertIsNot(get_matcher(keywords), matcher)
+        self.assertEqual(predict_category('kibble', category_keywords=keywords), 'Pets')
+
+    def test_empty_keyword_set(self):
+        self.assertEqual(categorize_expense('anything', category_keywords={'Other': []}), 'Other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+"""
+Tests for spending analytics and the per-user data version used for ETags
+"""
+
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+from datetime import datetime
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import models.database as database
+from models.database import init_db, get_db_connection, get_data_version
+from utils import executors, merchants, ml_categorizer
+from utils.analytics import (generate_spending_report, get_category_breakdown, get_monthly_summary,
+                             get_spending_series, choose_bucket, MAX_SERIES_POINTS)
+
+
+class AnalyticsTestCase(unittest.TestCase):
+    """Base class that points the app at a throwaway SQLite database, or at an
+    emptied PostgreSQL schema when TEST_DATABASE_URL is set"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self._original_database = database.DATABASE
+        database.DATABASE = os.path.join(self.test_dir, 'expense_tracker.db')
+        self._original_url = os.environ.get('DATABASE_URL')
+        if os.environ.get('TEST_DATABASE_URL'):
+            os.environ['DATABASE_URL'] = os.environ['TEST_DATABASE_URL']
+            conn = get_db_connection()
+            conn.execute('DROP SCHEMA public CASCADE')
+            conn.execute('CREATE SCHEMA public')
+            conn.commit()
+            conn.close()
+        else:
+            os.environ.pop('DATABASE_URL', None)
+        init_db()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                       ('analytics', 'analytics@example.com', 'hashed'))
+        conn.commit()
+        self.user_id = cursor.lastrowid
+        conn.close()
+
+    def tearDown(self):
+        database.DATABASE = self._original_database
+        if self._original_url is None:
+            os.environ.pop('DATABASE_URL', None)
+        else:
+            os.environ['DATABASE_URL'] = self._original_url
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def add_transactions(self, rows):
+        conn = get_db_connection()
+        conn.executemany('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)''', [(self.user_id,) + tuple(row) for row in rows])
+        conn.commit()
+        conn.close()
+
+
+class ModelTestCase(AnalyticsTestCase):
+    """AnalyticsTestCase for code that writes transactions: categorizer models
+    are kept in the test directory, and the model and merchant caches start
+    empty and are cleared again once background learning has finished"""
+
+    def setUp(self):
+        super().setUp()
+        self._original_model_dir = ml_categorizer.MODEL_DIR
+        ml_categorizer.MODEL_DIR = os.path.join(self.test_dir, 'models')
+        ml_categorizer.reset_models()
+        merchants.reset_cache()
+
+    def tearDown(self):
+        executors.shutdown()
+        ml_categorizer.reset_models()
+        ml_categorizer.MODEL_DIR = self._original_model_dir
+        merchants.reset_cache()
+        super().tearDown()
+
+
+class TestDataVersion(AnalyticsTestCase):
+
+    def test_version_starts_at_zero(self):
+        self.assertEqual(get_data_version(self.user_id), 0)
+
+    def test_writes_bump_version(self):
+        self.add_transactions([('expense', 10.0, 'Other', 'a', '2025-01-01')])
+        after_insert = get_data_version(self.user_id)
+        self.assertGreater(after_insert, 0)
+
+        conn = get_db_connection()
+        conn.execute('UPDATE transactions SET amount = 20 WHERE user_id = ?', (self.user_id,))
+        conn.commit()
+        after_update = get_data_version(self.user_id)
+        conn.execute('DELETE FROM transactions WHERE user_id = ?', (self.user_id,))
+        conn.commit()
+        after_delete = get_data_version(self.user_id)
+        conn.execute('INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)',
+                     (self.user_id, 'Other', 100, 'monthly'))
+        conn.commit()
+        after_budget = get_data_version(self.user_id)
+        conn.close()
+
+        self.assertLess(after_insert, after_update)
+        self.assertLess(after_update, after_delete)
+        self.assertLess(after_delete, after_budget)
+
+    def test_versions_are_per_user(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                       ('other', 'other@example.com', 'hashed'))
+        other_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        self.add_transactions([('expense', 10.0, 'Other', 'a', '2025-01-01')])
+        self.assertEqual(get_data_version(other_id), 0)
+
+
+class TestSpendingReport(AnalyticsTestCase):
+
+    def test_report_totals_and_breakdown(self):
+        self.add_transactions([
+            ('income', 1000.0, 'Salary', 'pay', '2025-03-01'),
+            ('expense', 40.0, 'Food & Dining', 'lunch', '2025-03-02'),
+            ('expense', 60.0, 'Food & Dining', 'dinner', '2025-03-02'),
+            ('expense', 300.0, 'Housing', 'rent', '2025-03-05'),
+            ('expense', 999.0, 'Housing', 'old rent', '2025-02-01'),
+        ])
+        report = generate_spending_report(self.user_id, '2025-03-01')
+
+        self.assertEqual(report['summary']['total_income'], 1000.0)
+        self.assertEqual(report['summary']['total_expense'], 400.0)
+        self.assertEqual(report['summary']['net_savings'], 600.0)
+        self.assertEqual(report['summary']['transaction_count'], 4)
+        self.assertEqual(report['category_breakdown'][0], {'category': 'Housing', 'amount': 300.0})
+        self.assertEqual(report['daily_spending'][0], {'date': '2025-03-02', 'amount': 100.0})
+        self.assertEqual([t['amount'] for t in report['top_expenses']], [300.0, 60.0, 40.0])
+
+    def test_monthly_summary_and_breakdown(self):
+        month = datetime.now().strftime('%Y-%m')
+        self.add_transactions([
+            ('income', 500.0, 'Salary', 'pay', f'{month}-01'),
+            ('expense', 75.0, 'Transportation', 'uber', f'{month}-01'),
+        ])
+        self.assertEqual(get_monthly_summary(self.user_id, month),
+                         {'total_income': 500.0, 'total_expense': 75.0})
+        self.assertEqual(get_category_breakdown(self.user_id, month),
+                         [{'category': 'Transportation', 'amount': 75.0}])
+
+
+class TestSpendingSeries(AnalyticsTestCase):
+
+    def test_bucket_choice_scales_with_range(self):
+        self.assertEqual(choose_bucket('2025-03-01', '2025-03-31'), 'day')
+        self.assertEqual(choose_bucket('2025-01-01', '2025-12-31'), 'week')
+        self.assertEqual(choose_bucket('2016-01-01', '2025-12-31'), 'month')
+        self.assertEqual(choose_bucket('1990-01-01', '2025-12-31'), 'year')
+
+    def test_series_is_gap_filled(self):
+        self.add_transactions([
+            ('expense', 10.0, 'Other', 'a', '2025-03-01'),
+            ('expense', 5.0, 'Other', 'b', '2025-03-01'),
+            ('income', 50.0, 'Salary', 'c', '2025-03-04'),
+        ])
+        series = get_spending_series(self.user_id, '2025-03-01', '2025-03-05')
+
+        self.assertEqual(series['bucket'], 'day')
+        self.assertEqual([p['date'] for p in series['points']],
+                         ['2025-03-01', '2025-03-02', '2025-03-03', '2025-03-04', '2025-03-05'])
+        self.assertEqual([p['amount'] for p in series['points']], [15.0, 0, 0, 0.0, 0])
+        self.assertEqual(series['points'][3]['income'], 50.0)
+
+    def test_week_and_quarter_buckets_match_sql(self):
+        self.add_transactions([
+            ('expense', 10.0, 'Other', 'a', '2025-03-05'),  # Wednesday
+            ('expense', 20.0, 'Other', 'b', '2025-03-09'),  # Sunday, same week
+            ('expense', 30.0, 'Other', 'c', '2025-05-20'),
+        ])
+        weekly = get_spending_series(self.user_id, '2025-03-05', '2025-03-16', 'week')
+        self.assertEqual([(p['date'], p['amount']) for p in weekly['points']],
+                         [('2025-03-03', 30.0), ('2025-03-10', 0)])
+
+        quarterly = get_spending_series(self.user_id, '2025-02-01', '2025-08-01', 'quarter')
+        self.assertEqual([(p['date'], p['amount']) for p in quarterly['points']],
+                         [('2025-01-01', 30.0), ('2025-04-01', 30.0), ('2025-07-01', 0)])
+
+    def test_long_ranges_stay_bounded(self):
+        self.add_transactions([('expense', 1.0, 'Other', 'a', '2015-06-15')])
+        series = get_spending_series(self.user_id, '2015-01-01', '2025-12-31')
+        self.assertLessEqual(len(series['points']), MAX_SERIES_POINTS)
+
+        # An explicit bucket too fine for the range falls back to one that fits
+        series = get_spending_series(self.user_id, '2015-01-01', '2025-12-31', 'day')
+        self.assertEqual(series['bucket'], 'quarter')
+        report = generate_spending_report(self.user_id, '2015-01-01', '2025-12-31', 'day')
+        self.assertLessEqual(len(report['series']['points']), MAX_SERIES_POINTS)
+        self.assertEqual(sum(p['amount'] for p in series['points']), 1.0)
+
+    def test_report_respects_end_date(self):
+        self.add_transactions([
+            ('expense', 10.0, 'Other', 'a', '2025-03-01'),
+            ('expense', 99.0, 'Other', 'b', '2025-04-01'),
+        ])
+        report = generate_spending_report(self.user_id, '2025-03-01', '2025-03-31')
+        self.assertEqual(report['summary']['total_expense'], 10.0)
+        self.assertEqual(report['series']['points'][0]['amount'], 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+Tests for the ASGI entry point, the async views and the bounded executors
+"""
+
+import unittest
+import asyncio
+import io
+import os
+import sys
+import threading
+from unittest import mock
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import executors, receipt_store
+
+
+class ASGITestCase(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from app import app
+        from asgi import application
+        self.application = application
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = self.user_id
+        self.cookie = client.get_cookie('session').value
+        self._receipt_dir = receipt_store.RECEIPT_DIR
+        receipt_store.RECEIPT_DIR = os.path.join(self.test_dir, 'receipts')
+
+    def tearDown(self):
+        executors.shutdown()
+        receipt_store.RECEIPT_DIR = self._receipt_dir
+        super().tearDown()
+
+    async def call(self, method, path, body=b'', headers=(), chunks=None):
+        """(status, headers, body) of one request sent straight to the ASGI app.
+        chunks, if given, is a list the body is sent in and is left holding
+        the messages the app never received."""
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+                 'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+                 'headers': [(b'cookie', f'session={self.cookie}'.encode()), *headers]}
+        if chunks is None:
+            chunks = [body]
+        messages = chunks
+        messages[:] = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in chunks]
+        messages[-1]['more_body'] = False
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await self.application(scope, receive, send)
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+    def get(self, path, **kwargs):
+        return asyncio.run(self.call('GET', path, **kwargs))
+
+
+class TestASGI(ASGITestCase):
+
+    def test_async_and_sync_views(self):
+        status, headers, body = self.get('/api/dashboard')
+        self.assertEqual(status, 200)
+        self.assertIn(b'"summary"', body)
+        self.assertEqual(self.get('/api/dashboard', headers=[(b'if-none-match', headers[b'etag'])])[0], 304)
+        self.assertEqual(self.get('/budgets')[0], 200)
+        self.assertEqual(self.get('/missing')[0], 404)
+
+    def test_email_sends_run_side_by_side(self):
+        # Each send waits for all the others, so this only passes if they all run at once,
+        # with four times as many sends as request threads
+        sends = 4 * executors.THREADS['wsgi']
+        barrier = threading.Barrier(sends, timeout=5)
+        with mock.patch('app.send_daily_summary_email', side_effect=lambda user_id: barrier.wait() >= 0), \
+                mock.patch.dict(executors.THREADS, email=sends):
+            async def send_all():
+                return await asyncio.gather(*(self.call('GET', '/send_test_email') for _ in range(sends)))
+            statuses = [status for status, _, _ in asyncio.run(send_all())]
+        self.assertEqual(statuses, [302] * sends)
+        self.assertFalse(barrier.broken)
+
+    def test_full_pool_answers_503(self):
+        release = threading.Event()
+        with mock.patch.dict(executors.THREADS, default=1), mock.patch.object(executors, 'QUEUE_LIMIT', 0):
+            executors.shutdown()
+            executors.submit('default', release.wait, 5)
+            try:
+                status, headers, body = self.get('/api/dashboard')
+            finally:
+                release.set()
+        self.assertEqual((status, headers[b'retry-after']), (503, b'5'))
+        self.assertIn(b'"error"', body)
+
+    def test_oversized_body_is_refused(self):
+        # Refused on its Content-Length before any of it is received
+        chunks = [b'x' * (1024 * 1024)] * 17
+        status, _, _ = asyncio.run(self.call('POST', '/api/transactions/bulk', chunks=chunks, headers=[
+            (b'content-type', b'application/json'), (b'content-length', str(17 * 1024 * 1024).encode())]))
+        self.assertEqual((status, len(chunks)), (413, 17))
+
+        # Without one, once the limit is passed
+        chunks = [b'x' * (1024 * 1024)] * 20
+        status, _, _ = asyncio.run(self.call('POST', '/api/transactions/bulk', chunks=chunks,
+                                             headers=[(b'content-type', b'application/json')]))
+        self.assertEqual(status, 413)
+        self.assertGreater(len(chunks), 0)
+
+
+class TestReceiptJobs(ASGITestCase):
+
+    def test_upload_is_processed_in_the_background(self):
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'white').save(image, 'PNG')
+        boundary, body = encode_multipart({'receipt': FileStorage(io.BytesIO(image.getvalue()), 'receipt.png')})
+        content_type = f'multipart/form-data; boundary={boundary}'.encode()
+        extracted = {'amount': 12.5, 'date': '2024-03-01', 'description': 'Cafe', 'confidence': 0.9}
+
+        with mock.patch('utils.receipt_jobs.extract_receipt_data', return_value=extracted):
+            status, headers, _ = asyncio.run(self.call('POST', '/api/receipts', body=body,
+                                                       headers=[(b'content-type', content_type)]))
+            self.assertEqual(status, 202)
+            executors.shutdown()  # waits for the OCR job
+
+        status, _, body = self.get(headers[b'location'].decode())
+        self.assertEqual(status, 200)
+        self.assertIn(b'"status":"done"', body)
+        conn = get_db_connection()
+        row = conn.execute('SELECT amount, description FROM transactions WHERE user_id = ?', (self.user_id,)).fetchone()
+        conn.close()
+        self.assertEqual(tuple(row), (12.5, 'Cafe'))
+        self.assertEqual(self.get('/api/receipts/999')[0], 404)
+
+    def test_bad_upload_is_rejected(self):
+        boundary, body = encode_multipart({'receipt': FileStorage(io.BytesIO(b'MZ' + b'\0' * 4 * 1024 * 1024),
+                                                                  'receipt.png')})
+        chunks = [body[offset:offset + 256 * 1024] for offset in range(0, len(body), 256 * 1024)]
+        status, _, _ = asyncio.run(self.call('POST', '/api/receipts', chunks=chunks, headers=[
+            (b'content-type', f'multipart/form-data; boundary={boundary}'.encode())]))
+        self.assertEqual(status, 400)
+        # Refused from its first bytes, without waiting for the rest of the upload
+        self.assertGreater(len(chunks), 10)
+        conn = get_db_connection()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM receipt_jobs').fetchone()[0], 0)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
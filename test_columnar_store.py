@@ -0,0 +1,201 @@
+"""
+Tests for the columnar transaction cache: results must match the SQL paths
+"""
+
+import unittest
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import columnar_store
+from utils.columnar_store import ColumnarStore, UserColumns, set_columnar_store
+from utils.analytics import generate_spending_report, get_category_breakdown, get_monthly_summary, get_spending_series
+from utils.alerts import get_month_spending_by_category, find_unusual_expenses
+
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+class ColumnarTestCase(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = ColumnarStore()
+        set_columnar_store(None)
+
+    def tearDown(self):
+        set_columnar_store(None)
+        super().tearDown()
+
+    def both_paths(self, func, *args):
+        """Run func once against SQL and once against the columnar store"""
+        set_columnar_store(None)
+        from_sql = func(*args)
+        set_columnar_store(self.store)
+        from_columns = func(*args)
+        set_columnar_store(None)
+        return from_sql, from_columns
+
+    def seed(self):
+        self.add_transactions([
+            ('income', 2000.0, 'Salary', 'pay', days_ago(3)),
+            ('expense', 20.0, 'Food & Dining', 'lunch', days_ago(20)),
+            ('expense', 22.0, 'Food & Dining', 'lunch', days_ago(15)),
+            ('expense', 18.0, 'Food & Dining', 'lunch', days_ago(10)),
+            ('expense', 150.0, 'Food & Dining', 'party', days_ago(2)),
+            ('expense', 900.0, 'Housing', 'rent', days_ago(1)),
+            ('expense', 45.5, 'Transportation', 'uber', days_ago(0)),
+            ('expense', 300.0, 'Shopping', 'old', '2020-01-01'),
+        ])
+
+
+class TestColumnarParity(ColumnarTestCase):
+
+    def test_monthly_views_match(self):
+        self.seed()
+        month = datetime.now().strftime('%Y-%m')
+        sql, cols = self.both_paths(get_monthly_summary, self.user_id, month)
+        self.assertAlmostEqual(sql['total_income'], cols['total_income'])
+        self.assertAlmostEqual(sql['total_expense'], cols['total_expense'])
+
+        sql, cols = self.both_paths(get_category_breakdown, self.user_id, month)
+        self.assertEqual(sql, cols)
+        sql, cols = self.both_paths(get_month_spending_by_category, self.user_id, month)
+        self.assertEqual(sql, cols)
+
+    def test_report_and_series_match(self):
+        self.seed()
+        sql, cols = self.both_paths(generate_spending_report, self.user_id, days_ago(400))
+        self.assertEqual(sql['summary'], cols['summary'])
+        self.assertEqual(sql['category_breakdown'], cols['category_breakdown'])
+        self.assertEqual(sql['daily_spending'], cols['daily_spending'])
+        self.assertEqual(sql['top_expenses'], cols['top_expenses'])
+        self.assertEqual(sql['series'], cols['series'])
+
+        sql, cols = self.both_paths(get_spending_series, self.user_id, '2019-06-01', None, 'quarter')
+        self.assertEqual(sql, cols)
+
+    def test_unusual_expenses_match(self):
+        self.seed()
+        sql, cols = self.both_paths(find_unusual_expenses, self.user_id, days_ago(30), days_ago(7))
+        self.assertEqual(sql, cols)
+        self.assertIn(('Food & Dining', 150.0, days_ago(2)), cols)
+
+
+class TestColumnarStore(ColumnarTestCase):
+
+    def test_loads_once_until_data_changes(self):
+        self.seed()
+        first = self.store.get(self.user_id)
+        self.assertIs(self.store.get(self.user_id), first)
+        self.assertEqual(self.store.stats()['hits'], 1)
+
+        self.add_transactions([('expense', 1.0, 'Other', 'x', days_ago(0))])
+        reloaded = self.store.get(self.user_id)
+        self.assertIsNot(reloaded, first)
+        self.assertEqual(len(reloaded), len(first) + 1)
+
+    def test_record_insert_appends_in_place(self):
+        self.seed()
+        columns = self.store.get(self.user_id)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)''', (self.user_id, 'expense', 12.5, 'Pets', 'vet', days_ago(0)))
+        conn.commit()
+        conn.close()
+
+        self.store.record_insert(self.user_id, cursor.lastrowid, days_ago(0), 12.5, 'Pets', 'expense')
+        self.assertIs(self.store.get(self.user_id), columns)
+        self.assertIn('Pets', columns.category_totals(columns.is_expense))
+
+    def test_appends_grow_capacity_geometrically(self):
+        columns = UserColumns([1], ['2025-01-01'], [5.0], ['Food'], ['expense'], 1)
+        capacities = set()
+        for i in range(2, 1001):
+            columns.append(i, '2025-01-02', 1.0, 'Other' if i % 2 else 'Food', 'income' if i % 3 == 0 else 'expense')
+            capacities.add(len(columns._ids))
+        self.assertEqual(len(columns), 1000)
+        self.assertLessEqual(len(capacities), 8)
+        self.assertEqual(len(columns.amounts), 1000)
+        self.assertEqual(columns.ids[-1], 1000)
+        self.assertEqual(int(columns.is_income.sum()), 333)
+        self.assertEqual(columns.category_totals(columns.is_expense | columns.is_income),
+                         {'Food': 505.0, 'Other': 499.0})
+
+    def test_concurrent_misses_load_once(self):
+        self.seed()
+        load = self.store._load
+        loaded = []
+        started = threading.Barrier(4)
+
+        def slow_load(user_id, version):
+            loaded.append(user_id)
+            return load(user_id, version)
+
+        def get():
+            started.wait()
+            results.append(self.store.get(self.user_id))
+
+        results = []
+        with mock.patch.object(self.store, '_load', side_effect=slow_load):
+            threads = [threading.Thread(target=get) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(loaded), 1)
+        self.assertTrue(all(columns is results[0] for columns in results))
+
+    def test_failed_load_leaves_no_loading_lock(self):
+        self.seed()
+        with mock.patch.object(self.store, '_load', side_effect=RuntimeError('database gone')):
+            with self.assertRaises(RuntimeError):
+                self.store.get(self.user_id)
+        self.assertEqual(self.store._loading, {})
+        self.assertIs(self.store.get(self.user_id), self.store.get(self.user_id))
+        self.assertEqual(self.store._loading, {})
+
+    def test_record_insert_drops_stale_entry(self):
+        self.seed()
+        self.store.get(self.user_id)
+        self.add_transactions([('expense', 1.0, 'Other', 'a', days_ago(0)),
+                               ('expense', 2.0, 'Other', 'b', days_ago(0))])
+        self.store.record_insert(self.user_id, 999, days_ago(0), 2.0, 'Other', 'expense')
+        self.assertEqual(self.store.stats()['users'], 0)
+
+    def test_evicts_least_recently_used_over_budget(self):
+        self.seed()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                       ('second', 'second@example.com', 'hashed'))
+        other_id = cursor.lastrowid
+        cursor.execute('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, 'expense', 5, 'Other', 'x', ?)''', (other_id, days_ago(0)))
+        conn.commit()
+        conn.close()
+
+        store = ColumnarStore(max_bytes=1)
+        store.get(self.user_id)
+        store.get(other_id)
+        stats = store.stats()
+        self.assertEqual(stats['users'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_disabled_by_default(self):
+        columnar_store._store_configured = False
+        os.environ.pop('ENABLE_COLUMNAR_CACHE', None)
+        self.assertIsNone(columnar_store.get_columnar_store())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Tests for near-duplicate transaction detection
+"""
+
+import unittest
+import io
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import ModelTestCase
+from models.database import get_db_connection
+from utils import duplicates
+from utils.duplicates import find_duplicate, find_duplicates, sweep_duplicates
+from utils.merchants import assign_merchants, resolve_merchant_id
+from utils.importer import import_statement
+from utils.transaction_service import create_transactions
+
+
+class DuplicateTestCase(ModelTestCase):
+
+    def flags(self):
+        conn = get_db_connection()
+        rows = [tuple(row) for row in conn.execute('SELECT id, duplicate_of FROM transactions ORDER BY id')]
+        conn.close()
+        return rows
+
+    def lookup(self, *args, **kwargs):
+        conn = get_db_connection()
+        found = find_duplicate(conn.cursor(), self.user_id, *args, **kwargs)
+        conn.close()
+        return found
+
+
+class TestFindDuplicate(DuplicateTestCase):
+
+    def test_matches_date_whole_amount_merchant_and_type(self):
+        self.add_transactions([('expense', 4.50, 'Coffee', 'Starbucks', '2025-03-01')])
+        assign_merchants(self.user_id)
+        starbucks = resolve_merchant_id('STARBUCKS #1234')
+        self.assertEqual(self.lookup('2025-03-01', 4.7, starbucks), 1)
+        self.assertIsNone(self.lookup('2025-03-02', 4.5, starbucks))
+        self.assertIsNone(self.lookup('2025-03-01', 5.6, starbucks))
+        self.assertIsNone(self.lookup('2025-03-01', 4.5, starbucks, 'income'))
+        self.assertIsNone(self.lookup('2025-03-01', 4.5, resolve_merchant_id('Shell Oil')))
+        self.assertIsNone(self.lookup('2025-03-01', 4.5, None))
+        self.assertIsNone(self.lookup('2025-03-01', 4.5, starbucks, before_id=0))
+
+    def test_batch_lookup_matches_single_lookups(self):
+        self.add_transactions([('expense', 4.50, 'Coffee', 'Starbucks', '2025-03-01'),
+                               ('expense', 4.50, 'Coffee', 'Starbucks', '2025-03-01'),
+                               ('expense', 40.0, 'Transportation', 'Shell Oil', '2025-03-05'),
+                               ('income', 2.5, 'Refund', 'Shell Oil', '2025-03-05')])
+        assign_merchants(self.user_id)
+        starbucks, shell = resolve_merchant_id('Starbucks'), resolve_merchant_id('Shell Oil')
+        probes = [('2025-03-01', 4.7, starbucks, 'expense'), ('2025-03-02', 4.5, starbucks, 'expense'),
+                  ('2025-03-05', 39.5, shell, 'expense'), ('2025-03-05', 40.5, shell, 'expense'),
+                  ('2025-03-05', 2.5, shell, 'income'), ('2025-03-05', 40.0, shell, 'income'),
+                  ('2025-03-01', 4.5, None, 'expense')]
+        conn = get_db_connection()
+        original = duplicates._QUERY_CHUNK
+        duplicates._QUERY_CHUNK = 1
+        try:
+            found = find_duplicates(conn.cursor(), self.user_id, probes)
+            self.assertEqual(found, [1, None, 3, None, 4, None, None])
+            self.assertEqual(found, [self.lookup(day, amount, merchant_id, transaction_type)
+                                     for day, amount, merchant_id, transaction_type in probes])
+            self.assertEqual(find_duplicates(conn.cursor(), self.user_id, probes[:1], before_id=0), [None])
+        finally:
+            duplicates._QUERY_CHUNK = original
+            conn.close()
+
+
+class TestWritesAreFlagged(DuplicateTestCase):
+
+    def test_statement_rows_matching_manual_entries(self):
+        self.add_transactions([('expense', 250.0, 'Transportation', 'Uber', '2025-03-01')])
+        assign_merchants(self.user_id)
+        statement = ('Date,Description,Amount\n2025-03-01,UBER TRIP 8812,-250.00\n'
+                     '2025-03-01,STARBUCKS #1,-4.50\n2025-03-01,STARBUCKS #1,-4.50\n')
+        result = import_statement(self.user_id, io.BytesIO(statement.encode()), 'statement.csv')
+        self.assertEqual((result['inserted'], result['flagged']), (3, 1))
+        # Identical rows within one statement are each other's siblings, not duplicates
+        self.assertEqual(self.flags(), [(1, None), (2, 1), (3, None), (4, None)])
+
+    def test_statement_rows_in_later_chunks(self):
+        self.add_transactions([('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-01')])
+        assign_merchants(self.user_id)
+        statement = 'Date,Description,Amount\n' + '2025-03-01,STARBUCKS #1,-4.50\n' * 3
+        result = import_statement(self.user_id, io.BytesIO(statement.encode()), 'statement.csv', chunk_size=1)
+        # Each chunk is checked against what was there before the import, not the chunks before it
+        self.assertEqual((result['inserted'], result['flagged']), (3, 3))
+        self.assertEqual(self.flags(), [(1, None), (2, 1), (3, 1), (4, 1)])
+
+    def test_bulk_writes(self):
+        self.add_transactions([('expense', 250.0, 'Transportation', 'Uber', '2025-03-01')])
+        assign_merchants(self.user_id)
+        result = create_transactions(self.user_id, [{'amount': 250, 'date': '2025-03-01', 'description': 'Uber trip'},
+                                                    {'amount': 250, 'date': '2025-03-02', 'description': 'Uber trip'}])
+        self.assertEqual(result['flagged'], 1)
+
+
+class TestSweep(DuplicateTestCase):
+
+    def test_single_pass_flags_later_copies(self):
+        self.add_transactions([
+            ('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-01'),
+            ('expense', 40.0, 'Transportation', 'Shell Oil', '2025-03-01'),
+            ('income', 4.5, 'Refund', 'Starbucks', '2025-03-01'),
+            ('expense', 4.6, 'Coffee', 'STARBUCKS #12', '2025-03-01'),
+            ('expense', 4.5, 'Coffee', 'Starbucks Coffee', '2025-03-01'),
+            ('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-02'),
+            ('expense', 9.0, 'Other', '', '2025-03-01'),
+        ])
+        assign_merchants(self.user_id)
+        original = duplicates.SWEEP_CHUNK_SIZE
+        duplicates.SWEEP_CHUNK_SIZE = 2
+        try:
+            self.assertEqual(sweep_duplicates(self.user_id, dry_run=True), 2)
+            self.assertTrue(all(flag is None for _, flag in self.flags()))
+            self.assertEqual(sweep_duplicates(self.user_id), 2)
+        finally:
+            duplicates.SWEEP_CHUNK_SIZE = original
+        self.assertEqual(dict(self.flags()), {1: None, 2: None, 3: None, 4: 1, 5: 1, 6: None, 7: None})
+        self.assertEqual(sweep_duplicates(self.user_id), 0)
+
+    def test_kept_rows_stay_unflagged(self):
+        self.add_transactions([('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-01'),
+                               ('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-01')])
+        assign_merchants(self.user_id)
+        conn = get_db_connection()
+        conn.execute('UPDATE transactions SET duplicate_of = 0 WHERE id = 2')
+        conn.commit()
+        conn.close()
+        self.assertEqual(sweep_duplicates(), 0)
+        self.assertEqual(self.flags(), [(1, None), (2, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
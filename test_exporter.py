@@ -0,0 +1,90 @@
+"""
+Tests for streaming transaction export
+"""
+
+import unittest
+import csv
+import io
+import json
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from utils import merchants
+from utils.merchants import assign_merchants
+from utils.exporter import stream_export, EXPORT_COLUMNS
+
+ROWS = [
+    ('expense', 5.5, 'Food & Dining', 'STARBUCKS #1234', '2025-03-01'),
+    ('expense', 40.0, 'Transportation', 'Shell, "Oil" 5521', '2025-03-03'),
+    ('income', 1000.0, 'Salary', 'March salary', '2025-03-05'),
+    ('expense', 12.0, 'Food & Dining', 'Café Bleu', '2025-04-02'),
+    ('expense', 7.0, 'Other', '', '2025-04-10'),
+]
+
+
+class TestStreamExport(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        merchants.reset_cache()
+        self.add_transactions(ROWS)
+
+    def tearDown(self):
+        merchants.reset_cache()
+        super().tearDown()
+
+    def export_csv(self, **kwargs):
+        return list(csv.DictReader(io.StringIO(''.join(stream_export(self.user_id, 'csv', **kwargs)))))
+
+    def test_csv_round_trip_newest_first(self):
+        assign_merchants(self.user_id)
+        rows = self.export_csv(batch_size=2)
+        self.assertEqual([row['date'] for row in rows], sorted((r[4] for r in ROWS), reverse=True))
+        shell = next(row for row in rows if row['amount'] == '40.0')
+        self.assertEqual((shell['description'], shell['merchant']), ('Shell, "Oil" 5521', 'Shell Oil'))
+        self.assertEqual(rows[0]['merchant'], '')
+
+    def test_one_chunk_per_batch(self):
+        chunks = list(stream_export(self.user_id, 'csv', batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[0].startswith(','.join(EXPORT_COLUMNS)))
+
+    def test_csv_neutralizes_formulas(self):
+        self.add_transactions([
+            ('expense', 3.0, 'Other', '=HYPERLINK("http://x","y")', '2025-05-01'),
+            ('expense', 4.0, 'Other', '@SUM(A1)', '2025-05-02'),
+            ('expense', 5.0, 'Other', '\tcmd', '2025-05-03'),
+        ])
+        rows = self.export_csv(start_date='2025-05-01')
+        self.assertEqual([row['description'] for row in rows],
+                         ["'\tcmd", "'@SUM(A1)", "'=HYPERLINK(\"http://x\",\"y\")"])
+        self.assertEqual([row['amount'] for row in rows], ['5.0', '4.0', '3.0'])
+        ndjson = ''.join(stream_export(self.user_id, 'ndjson', start_date='2025-05-02', end_date='2025-05-02'))
+        self.assertEqual(json.loads(ndjson)['description'], '@SUM(A1)')
+
+    def test_filters(self):
+        expenses = self.export_csv(transaction_type='expense', start_date='2025-03-02', end_date='2025-04-05')
+        self.assertEqual([row['description'] for row in expenses], ['Café Bleu', 'Shell, "Oil" 5521'])
+        food = self.export_csv(category='Food & Dining')
+        self.assertEqual(len(food), 2)
+
+    def test_ndjson(self):
+        lines = ''.join(stream_export(self.user_id, 'ndjson', batch_size=3, transaction_type='income')).splitlines()
+        self.assertEqual([json.loads(line)['amount'] for line in lines], [1000.0])
+        self.assertEqual(list(json.loads(lines[0])), list(EXPORT_COLUMNS))
+
+    def test_empty_export_has_header_only(self):
+        self.assertEqual(''.join(stream_export(self.user_id, 'csv', category='Travel')).strip(), ','.join(EXPORT_COLUMNS))
+        self.assertEqual(''.join(stream_export(self.user_id, 'ndjson', category='Travel')), '')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            stream_export(self.user_id, 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
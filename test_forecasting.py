@@ -0,0 +1,127 @@
+"""
+Tests for spending forecasts and budget burn-rate projections
+"""
+
+import unittest
+import os
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import forecasting
+from utils.columnar_store import ColumnarStore, set_columnar_store, day_number
+from utils.forecasting import SmoothingState, forecast_month, project_budgets
+
+TODAY = date(2025, 3, 15)
+
+
+class ForecastTestCase(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        forecasting._states.clear()
+
+    def add_daily_spend(self, category, amount, days, end=TODAY):
+        rows = [('expense', amount, category, 'daily', (end - timedelta(days=offset)).isoformat())
+                for offset in range(days)]
+        self.add_transactions(rows)
+
+    def add_budget(self, category, amount):
+        conn = get_db_connection()
+        conn.execute("INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, 'monthly')",
+                     (self.user_id, category, amount))
+        conn.commit()
+        conn.close()
+
+
+class TestSmoothingState(unittest.TestCase):
+
+    def test_constant_series_forecasts_constant(self):
+        categories = ['A', 'B']
+        state = SmoothingState(categories, np.array([0.0, 0.0]), np.zeros(2), np.zeros((2, 7)), 6, 0)
+        history = np.vstack([np.full(200, 10.0), np.full(200, 3.0)])
+        state.advance(history, 7)
+        forecast = state.forecast(5)
+        self.assertEqual(forecast.shape, (2, 5))
+        np.testing.assert_allclose(forecast[0], 10.0, rtol=0.05)
+        np.testing.assert_allclose(forecast[1], 3.0, rtol=0.05)
+
+    def test_weekly_pattern_is_learned(self):
+        state = SmoothingState(['A'], np.zeros(1), np.zeros(1), np.zeros((1, 7)), 6, 0)
+        weekly = np.tile([0, 0, 0, 0, 0, 70, 0], 40).astype(float)
+        state.advance(weekly[None, :], 7)
+        forecast = state.forecast(7)[0]
+        self.assertEqual(int(np.argmax(forecast)), 5)
+
+
+class TestForecastMonth(ForecastTestCase):
+
+    def test_projects_steady_spending_to_month_end(self):
+        self.add_daily_spend('Food & Dining', 10.0, 90)
+        result = forecast_month(self.user_id, TODAY)
+        food = result['categories']['Food & Dining']
+        self.assertAlmostEqual(food['spent'], 150.0)
+        self.assertAlmostEqual(food['projected'], 310.0, delta=10.0)
+
+    def test_columnar_and_sql_paths_agree(self):
+        self.add_daily_spend('Food & Dining', 10.0, 90)
+        self.add_daily_spend('Housing', 5.0, 20)
+        from_sql = forecast_month(self.user_id, TODAY)['categories']
+        forecasting._states.clear()
+        set_columnar_store(ColumnarStore())
+        try:
+            from_columns = forecast_month(self.user_id, TODAY)['categories']
+        finally:
+            set_columnar_store(None)
+        for name in from_sql:
+            self.assertAlmostEqual(from_sql[name]['projected'], from_columns[name]['projected'])
+
+    def test_state_is_advanced_not_refit_when_data_unchanged(self):
+        self.add_daily_spend('Food & Dining', 10.0, 90)
+        forecast_month(self.user_id, TODAY)
+        cached = forecasting._states[self.user_id]
+        self.assertEqual(cached.through_day, day_number(TODAY.isoformat()) - 1)
+
+        forecast_month(self.user_id, TODAY + timedelta(days=2))
+        advanced = forecasting._states[self.user_id]
+        self.assertEqual(advanced.through_day, day_number(TODAY.isoformat()) + 1)
+        self.assertEqual(advanced.version, cached.version)
+        self.assertEqual(cached.through_day, day_number(TODAY.isoformat()) - 1)
+
+    def test_category_first_seen_today_is_included(self):
+        self.add_transactions([('expense', 42.0, 'Pets', 'vet', TODAY.isoformat())])
+        pets = forecast_month(self.user_id, TODAY)['categories']['Pets']
+        self.assertEqual(pets['spent'], 42.0)
+
+
+class TestProjectBudgets(ForecastTestCase):
+
+    def test_budget_exhaustion_date_and_status(self):
+        self.add_daily_spend('Food & Dining', 10.0, 90)
+        self.add_budget('Food & Dining', 200)
+        self.add_budget('Housing', 1000)
+        self.add_budget('Transportation', 100)
+        self.add_transactions([('expense', 150.0, 'Transportation', 'flight', TODAY.isoformat())])
+
+        projections = {p['category']: p for p in project_budgets(self.user_id, TODAY)}
+
+        food = projections['Food & Dining']
+        self.assertEqual(food['status'], 'at_risk')
+        self.assertEqual(food['exhaustion_date'], '2025-03-20')
+        self.assertEqual(projections['Housing']['status'], 'on_track')
+        self.assertIsNone(projections['Housing']['exhaustion_date'])
+        self.assertEqual(projections['Transportation']['status'], 'exceeded')
+
+    def test_no_budgets_means_no_projections(self):
+        self.add_daily_spend('Food & Dining', 10.0, 10)
+        self.assertEqual(project_budgets(self.user_id, TODAY), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for CSV and OFX statement import
+"""
+
+import unittest
+import io
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import ModelTestCase
+from models.database import get_db_connection
+from utils import importer
+from utils.importer import import_statement, parse_amount, parse_date, parse_ofx, StatementError
+
+CSV_STATEMENT = '''Txn Date,Narration,Withdrawal Amt.,Deposit Amt.,Chq./Ref.No.
+01/03/2025,UBER TRIP 8812,250.00,,
+01/03/2025,STARBUCKS #1234,180.00,,
+01/03/2025,STARBUCKS #1234,180.00,,
+02/03/2025,SALARY MARCH,,"85,000.00",
+not a date,BROKEN ROW,10.00,,
+03/03/2025,AMAZON PAY,1299.00,,
+'''
+
+OFX_STATEMENT = '''OFXHEADER:100
+DATA:OFXSGML
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20250305120000
+<TRNAMT>-42.50
+<FITID>2025030501
+<NAME>SHELL OIL 5521
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20250306<TRNAMT>1000.00<FITID>2025030602<NAME>REFUND</STMTTRN>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20250307
+<FITID>2025030703
+<NAME>NO AMOUNT
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+'''
+
+
+class ImportTestCase(ModelTestCase):
+
+    def run_import(self, text, filename, **kwargs):
+        return import_statement(self.user_id, io.BytesIO(text.encode('utf-8')), filename, **kwargs)
+
+    def stored(self):
+        conn = get_db_connection()
+        rows = [dict(row) for row in conn.execute(
+            'SELECT type, amount, category, description, date, merchant_id FROM transactions ORDER BY id')]
+        conn.close()
+        return rows
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_amounts(self):
+        self.assertEqual(parse_amount('1,234.50'), 1234.5)
+        self.assertEqual(parse_amount('(12.00)'), -12.0)
+        self.assertEqual(parse_amount('-₹45'), -45.0)
+        self.assertEqual(parse_amount('12.00 DR'), -12.0)
+        self.assertIsNone(parse_amount(''))
+        with self.assertRaises(ValueError):
+            parse_amount('n/a')
+
+    def test_dates(self):
+        self.assertEqual(parse_date('2025-03-01'), '2025-03-01')
+        self.assertEqual(parse_date('01/03/2025'), '2025-03-01')
+        self.assertEqual(parse_date('03/01/2025', '%m/%d/%Y'), '2025-03-01')
+        self.assertEqual(parse_date('5 Mar 2025'), '2025-03-05')
+
+    def test_ofx_tags_split_across_reads(self):
+        original = importer.OFX_READ_SIZE
+        importer.OFX_READ_SIZE = 7
+        try:
+            rows = list(parse_ofx(io.StringIO(OFX_STATEMENT)))
+        finally:
+            importer.OFX_READ_SIZE = original
+        self.assertEqual([row.get('description') for row in rows[:2]], ['SHELL OIL 5521', 'REFUND'])
+        self.assertEqual(rows[0]['amount'], 42.5)
+        self.assertEqual(rows[1]['date'], '2025-03-06')
+        self.assertIn('error', rows[2])
+
+
+class TestImportStatement(ImportTestCase):
+
+    def test_csv_import_and_reimport(self):
+        result = self.run_import(CSV_STATEMENT, 'hdfc.csv', chunk_size=2)
+        self.assertEqual(result['format'], 'csv')
+        self.assertEqual((result['rows'], result['inserted'], result['duplicates'], result['errors']), (6, 5, 0, 1))
+        self.assertIn('Line 6', result['error_messages'][0])
+
+        rows = self.stored()
+        self.assertEqual([row['description'] for row in rows].count('STARBUCKS #1234'), 2)
+        salary = next(row for row in rows if row['description'] == 'SALARY MARCH')
+        self.assertEqual((salary['type'], salary['amount'], salary['date']), ('income', 85000.0, '2025-03-02'))
+        uber = next(row for row in rows if row['description'] == 'UBER TRIP 8812')
+        self.assertEqual((uber['type'], uber['category']), ('expense', 'Transportation'))
+        self.assertTrue(all(row['merchant_id'] for row in rows))
+
+        again = self.run_import(CSV_STATEMENT, 'hdfc.csv')
+        self.assertEqual((again['inserted'], again['duplicates']), (0, 5))
+        self.assertEqual(len(self.stored()), 5)
+
+    def test_ofx_import_is_detected_from_content(self):
+        result = self.run_import(OFX_STATEMENT, 'statement.dat')
+        self.assertEqual(result['format'], 'ofx')
+        self.assertEqual((result['inserted'], result['errors']), (2, 1))
+        self.assertEqual(self.run_import(OFX_STATEMENT, 'statement.qfx')['duplicates'], 2)
+
+    def test_progress_is_reported_per_chunk(self):
+        seen = []
+        self.run_import(CSV_STATEMENT, 'hdfc.csv', chunk_size=4, progress=lambda t: seen.append(t['rows']))
+        self.assertEqual(seen, [4, 6])
+
+    def test_unusable_file(self):
+        with self.assertRaises(StatementError):
+            self.run_import('foo,bar\n1,2\n', 'x.csv')
+        with self.assertRaises(StatementError):
+            self.run_import('', 'x.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""
+Tests for merchant canonicalization and merchant analytics
+"""
+
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+import shutil
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+import models.database as database
+from models.database import init_db, get_db_connection
+from utils import merchants
+from utils.merchants import normalize_merchant, resolve_merchant, resolve_merchant_id, record_category, assign_merchants
+from utils.analytics import get_merchant_breakdown
+
+
+class MerchantTestCase(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        merchants.reset_cache()
+
+    def tearDown(self):
+        merchants.reset_cache()
+        super().tearDown()
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_strips_store_numbers_suffixes_and_noise(self):
+        self.assertEqual(normalize_merchant('STARBUCKS #1234'), 'starbucks')
+        self.assertEqual(normalize_merchant('Starbucks Corp.'), 'starbucks')
+        self.assertEqual(normalize_merchant('POS PURCHASE SQ *BLUE BOTTLE 0042'), 'blue bottle')
+        self.assertEqual(normalize_merchant('Receipt Purchase'), '')
+        self.assertEqual(normalize_merchant(None), '')
+
+
+class TestResolveMerchant(MerchantTestCase):
+
+    def test_variants_resolve_to_one_merchant(self):
+        merchant_id, name, hint = resolve_merchant('STARBUCKS #1234')
+        self.assertEqual(name, 'Starbucks')
+        self.assertIsNone(hint)
+        for raw in ('Starbucks Coffee', 'STARBUCKS CORP', 'STARBUGKS #88'):
+            self.assertEqual(resolve_merchant_id(raw), merchant_id, raw)
+        self.assertNotEqual(resolve_merchant_id('Shell Oil 5521'), merchant_id)
+        self.assertIsNone(resolve_merchant_id('#00123'))
+
+    def test_repeated_lookups_are_memoized(self):
+        resolve_merchant_id('Blue Bottle Oakland')
+        hits = resolve_merchant_id.cache_info().hits
+        resolve_merchant_id('Blue Bottle Oakland')
+        self.assertEqual(resolve_merchant_id.cache_info().hits, hits + 1)
+
+    def test_merchants_created_elsewhere_are_found(self):
+        resolve_merchant_id('Walmart Supercenter')
+        conn = get_db_connection()
+        conn.execute("INSERT INTO merchants (name, normalized) VALUES ('Trader Joes', 'trader joes')")
+        conn.commit()
+        created = conn.execute("SELECT id FROM merchants WHERE normalized = 'trader joes'").fetchone()[0]
+        conn.close()
+        self.assertEqual(resolve_merchant_id("TRADER JOE'S #552"), created)
+
+    def test_category_hint_is_per_user(self):
+        merchant_id = resolve_merchant_id('Chewy.com')
+        record_category(self.user_id, merchant_id, 'Pets')
+        record_category(self.user_id, merchant_id, 'Other')
+        self.assertEqual(resolve_merchant('CHEWY 1182', self.user_id)[2], 'Pets')
+        self.assertIsNone(resolve_merchant('CHEWY 1182')[2])
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO users (username, email, password) VALUES ('other', 'other@example.com', 'x')")
+        other_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        self.assertIsNone(resolve_merchant('CHEWY 1182', other_id)[2])
+        record_category(other_id, merchant_id, 'Gifts')
+        self.assertEqual(resolve_merchant('CHEWY 1182', other_id)[2], 'Gifts')
+        self.assertEqual(resolve_merchant('CHEWY 1182', self.user_id)[2], 'Pets')
+
+    def test_hint_changed_by_another_worker_is_seen(self):
+        merchant_id = resolve_merchant_id('Chewy.com')
+        record_category(self.user_id, merchant_id, 'Pets')
+        self.assertEqual(resolve_merchant('CHEWY 1182', self.user_id)[2], 'Pets')
+
+        def set_elsewhere(category):
+            conn = get_db_connection()
+            conn.execute('UPDATE merchant_categories SET category = ? WHERE user_id = ?', (category, self.user_id))
+            conn.commit()
+            conn.close()
+
+        set_elsewhere('Gifts')
+        # This process last saw 'Pets' but must still write it
+        record_category(self.user_id, merchant_id, 'Pets')
+        self.assertEqual(resolve_merchant('CHEWY 1182', self.user_id)[2], 'Pets')
+        set_elsewhere('Gifts')
+        self.assertEqual(resolve_merchant('CHEWY 1182', self.user_id)[2], 'Gifts')
+
+
+class TestMerchantAnalytics(MerchantTestCase):
+
+    def test_backfill_and_breakdown(self):
+        self.add_transactions([
+            ('expense', 5.0, 'Food & Dining', 'STARBUCKS #1234', '2025-03-01'),
+            ('expense', 6.0, 'Food & Dining', 'Starbucks Coffee', '2025-03-02'),
+            ('expense', 40.0, 'Transportation', 'Shell Oil 5521', '2025-03-03'),
+            ('expense', 9.0, 'Other', '', '2025-03-03'),
+            ('income', 100.0, 'Salary', 'Starbucks payroll', '2025-03-04'),
+        ])
+        self.assertEqual(assign_merchants(self.user_id, chunk_size=2), 4)
+        self.assertEqual(assign_merchants(self.user_id), 0)
+
+        breakdown = get_merchant_breakdown(self.user_id, '2025-03-01', '2025-03-31')
+        self.assertEqual([(m['merchant'], m['amount'], m['count']) for m in breakdown],
+                         [('Shell Oil', 40.0, 1), ('Starbucks', 11.0, 2)])
+
+
+class TestMigration(unittest.TestCase):
+
+    def test_merchant_column_added_to_existing_database(self):
+        test_dir = tempfile.mkdtemp()
+        original = database.DATABASE
+        database.DATABASE = os.path.join(test_dir, 'old.db')
+        try:
+            conn = sqlite3.connect(database.DATABASE)
+            conn.execute('''CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                type TEXT NOT NULL, amount REAL NOT NULL, category TEXT NOT NULL, description TEXT,
+                date TEXT NOT NULL, receipt_path TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            conn.commit()
+            conn.close()
+            init_db()
+            init_db()
+            conn = get_db_connection()
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(transactions)')]
+            conn.close()
+            self.assertIn('merchant_id', columns)
+        finally:
+            database.DATABASE = original
+            shutil.rmtree(test_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests for the Prometheus metrics and the /metrics endpoint
+"""
+
+import unittest
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_client import REGISTRY
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import metrics, merchants
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(AnalyticsTestCase):
+
+    def test_queue_depths(self):
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        conn = get_db_connection()
+        conn.executemany('''INSERT INTO recurring_rules
+            (user_id, type, amount, category, description, schedule, start_date, next_date, active)
+            VALUES (?, 'expense', 10, 'Housing', 'Rent', 'RRULE:FREQ=MONTHLY', ?, ?, ?)''',
+                         [(self.user_id, yesterday, yesterday, 1), (self.user_id, yesterday, yesterday, 0),
+                          (self.user_id, yesterday, '2999-01-01', 1)])
+        conn.commit()
+        conn.close()
+        self.add_transactions([('expense', 10.0, 'Food', 'Lunch', yesterday)])
+
+        text = metrics.render().decode()
+        self.assertIn('expense_tracker_recurring_rules_due 1.0', text)
+        self.assertIn('expense_tracker_subscription_scans_pending 1.0', text)
+
+    def test_email_and_cache_counts(self):
+        before = sample('expense_tracker_emails_total', service='basic', outcome='failed')
+        metrics.record_email('basic', time.perf_counter(), 'failed')
+        self.assertEqual(sample('expense_tracker_emails_total', service='basic', outcome='failed'), before + 1)
+
+        merchants.reset_cache()
+        merchants.normalize_merchant('Cafe Coffee Day')
+        merchants.resolve_merchant_id('Cafe Coffee Day')
+        merchants.resolve_merchant_id('Cafe Coffee Day')
+        metrics.refresh_caches(force=True)
+        self.assertEqual(sample('expense_tracker_cache_hits', cache='merchant_ids'), 1)
+        self.assertEqual(sample('expense_tracker_cache_misses', cache='merchant_ids'), 1)
+        merchants.reset_cache()
+
+
+class TestMetricsEndpoint(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from app import app
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+
+    def test_requests_are_recorded(self):
+        before = sample('expense_tracker_request_seconds_count', endpoint='budgets', method='GET')
+        statements = sample('expense_tracker_db_statements_total', endpoint='budgets')
+        self.client.get('/budgets')
+        self.client.get('/budgets')
+        self.assertEqual(sample('expense_tracker_request_seconds_count', endpoint='budgets', method='GET'), before + 2)
+        self.assertEqual(sample('expense_tracker_db_statements_total', endpoint='budgets'), statements + 2)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'expense_tracker_requests_total{endpoint="budgets",method="GET",status="200"}', response.data)
+
+    def test_token(self):
+        os.environ['METRICS_TOKEN'] = 'secret'
+        try:
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+        finally:
+            del os.environ['METRICS_TOKEN']
+
+
+if __name__ == '__main__':
+    unittest.main()
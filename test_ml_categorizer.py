@@ -0,0 +1,254 @@
+"""
+Tests for the learned categorizer: training, incremental updates and persistence
+"""
+
+import unittest
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import ModelTestCase
+from models.database import get_db_connection
+from utils import ml_categorizer
+from utils.ml_categorizer import (NaiveBayesModel, featurize, amount_bucket, fit_temperature, get_model,
+                                  predict, predict_batch, learn_transactions, correct_transaction, forget_transaction)
+from utils.ai_categorizer import predict_category, categorize_batch, recategorize_transactions
+
+HISTORY = [
+    ('expense', 4.5, 'Coffee', 'BLUE BOTTLE #1182'),
+    ('expense', 5.0, 'Coffee', 'Blue Bottle Oakland'),
+    ('expense', 3.8, 'Coffee', 'blue bottle sf'),
+    ('expense', 60.0, 'Pets', 'Chewy order 99812'),
+    ('expense', 45.0, 'Pets', 'CHEWY.COM'),
+    ('expense', 80.0, 'Pets', 'Banfield vet'),
+    ('expense', 1200.0, 'Housing', 'Oakwood apartments'),
+]
+
+
+class MLTestCase(ModelTestCase):
+
+    def add_history(self, repeat=1):
+        self.add_transactions([row + ('2025-03-01',) for row in HISTORY] * repeat)
+
+    def insert(self, category, description, amount=10.0):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''INSERT INTO transactions (user_id, type, amount, category, description, date)
+            VALUES (?, 'expense', ?, ?, ?, '2025-03-02')''', (self.user_id, amount, category, description))
+        conn.commit()
+        conn.close()
+        return cursor.lastrowid
+
+
+class TestFeatures(unittest.TestCase):
+
+    def test_shared_merchant_names_share_features(self):
+        a = set(featurize('STARBUCKS #1234', 5))
+        b = set(featurize('Starbucks Coffee', 5))
+        c = set(featurize('Shell gas station', 5))
+        self.assertGreater(len(a & b), len(a & c))
+
+    def test_amount_buckets_are_log_scale(self):
+        self.assertEqual(amount_bucket(0), 0)
+        self.assertEqual(amount_bucket(1), 1)
+        self.assertEqual(amount_bucket(3), 2)
+        self.assertEqual(amount_bucket(1100), amount_bucket(1500))
+        self.assertNotEqual(amount_bucket(10), amount_bucket(1000))
+        self.assertEqual(amount_bucket('n/a'), 0)
+
+    def test_temperature_softens_overconfident_scores(self):
+        # Right two times out of three but always certain: the fitted temperature should be above 1
+        scores = np.array([[50.0, 0.0], [50.0, 0.0], [50.0, 0.0]])
+        self.assertGreater(fit_temperature(scores, [0, 0, 1]), 1.0)
+
+
+class TestNaiveBayesModel(unittest.TestCase):
+
+    def test_learn_and_unlearn(self):
+        model = NaiveBayesModel()
+        model.learn(featurize('chewy'), 'Pets')
+        model.learn(featurize('blue bottle'), 'Coffee')
+        self.assertEqual(max(model.probabilities(featurize('chewy')).items(), key=lambda kv: kv[1])[0], 'Pets')
+        model.learn(featurize('chewy'), 'Pets', -1)
+        self.assertEqual(model.examples, 1)
+        self.assertEqual(model.counts.min(), 0)
+
+    def test_fit_matches_incremental_learning(self):
+        pairs = [(featurize(row[3], row[1]), row[2]) for row in HISTORY]
+        fitted = NaiveBayesModel()
+        fitted.fit([f for f, _ in pairs], [c for _, c in pairs])
+        incremental = NaiveBayesModel()
+        for features, category in pairs:
+            incremental.learn(features, category)
+        self.assertEqual(fitted.classes, incremental.classes)
+        np.testing.assert_array_equal(fitted.counts, incremental.counts)
+
+    def test_learn_batch_matches_incremental_learning(self):
+        pairs = [(featurize(row[3], row[1]), row[2]) for row in HISTORY]
+        batched = NaiveBayesModel()
+        batched.learn(*pairs[0])
+        batched.learn_batch([f for f, _ in pairs[1:]], [c for _, c in pairs[1:]])
+        incremental = NaiveBayesModel()
+        for features, category in pairs:
+            incremental.learn(features, category)
+        self.assertEqual(batched.classes, incremental.classes)
+        np.testing.assert_array_equal(batched.counts, incremental.counts)
+        np.testing.assert_array_equal(batched.class_counts, incremental.class_counts)
+        self.assertEqual((batched.examples, batched.pending), (len(HISTORY), len(HISTORY)))
+
+
+class TestLearnedPredictions(MLTestCase):
+
+    def test_learns_user_categories_and_falls_back_to_keywords(self):
+        self.add_history(repeat=3)
+        category, confidence = predict(self.user_id, 'BLUE BOTTLE COFFEE 2231', 4.0)
+        self.assertEqual(category, 'Coffee')
+        self.assertGreater(confidence, 0.5)
+        self.assertLessEqual(confidence, 1.0)
+        self.assertEqual(predict_category('chewy pet supplies', 50, user_id=self.user_id), 'Pets')
+        # Without a user the keyword rules apply as before
+        self.assertEqual(predict_category('chewy pet supplies', 50), 'Other')
+
+    def test_abstains_without_history(self):
+        self.assertEqual(predict(self.user_id, 'anything'), (None, 0.0))
+        self.assertEqual(predict_category('uber ride', user_id=self.user_id), 'Transportation')
+
+    def test_abstains_with_a_single_category(self):
+        self.add_transactions([row + ('2025-03-01',) for row in HISTORY[:3]] * 3)
+        self.assertEqual(predict(self.user_id, 'uber home'), (None, 0.0))
+        self.assertEqual(predict_category('uber home', user_id=self.user_id), 'Transportation')
+
+    def test_new_transactions_are_learned_incrementally(self):
+        self.add_history(repeat=2)
+        model = get_model(self.user_id)
+        before = model.examples
+        self.insert('Gym', 'Planet Fitness monthly')
+        learn_transactions(self.user_id)
+        self.assertIs(get_model(self.user_id), model)
+        self.assertEqual(model.examples, before + 1)
+        self.assertIn('Gym', model.classes)
+        learn_transactions(self.user_id)
+        self.assertEqual(model.examples, before + 1)
+
+    def test_correction_moves_evidence(self):
+        self.add_history(repeat=2)
+        transaction_id = self.insert('Coffee', 'Philz downtown')
+        learn_transactions(self.user_id)
+        model = get_model(self.user_id)
+        coffee = model.classes.index('Coffee')
+        coffee_examples = model.class_counts[coffee]
+
+        conn = get_db_connection()
+        conn.execute("UPDATE transactions SET category = 'Dining' WHERE id = ?", (transaction_id,))
+        conn.commit()
+        conn.close()
+        correct_transaction(self.user_id, transaction_id, 'Philz downtown', 10.0, 'Coffee', 'Dining')
+
+        self.assertEqual(model.class_counts[coffee], coffee_examples - 1)
+        self.assertEqual(model.class_counts[model.classes.index('Dining')], 1)
+
+        forget_transaction(self.user_id, transaction_id, 'Philz downtown', 10.0, 'Dining')
+        self.assertEqual(model.class_counts[model.classes.index('Dining')], 0)
+
+    def test_corrections_are_saved_once_later(self):
+        self.add_history(repeat=2)
+        ids = {self.insert('Coffee', f'Philz {i}'): f'Philz {i}' for i in range(3)}
+        learn_transactions(self.user_id)
+        path = ml_categorizer.model_path(self.user_id)
+        saved = os.path.getmtime(path)
+        os.utime(path, (saved - 60, saved - 60))
+
+        for transaction_id, description in ids.items():
+            correct_transaction(self.user_id, transaction_id, description, 10.0, 'Coffee', 'Dining')
+        model = get_model(self.user_id)
+        self.assertIsNotNone(model.save_timer)
+        self.assertEqual(os.path.getmtime(path), saved - 60)
+
+        ml_categorizer.reset_models()
+        self.assertGreater(os.path.getmtime(path), saved - 60)
+        reloaded = get_model(self.user_id)
+        self.assertEqual(reloaded.class_counts[reloaded.classes.index('Dining')],
+                         model.class_counts[model.classes.index('Dining')])
+
+    def test_saved_model_is_reloaded_and_caught_up(self):
+        self.add_history(repeat=2)
+        trained = get_model(self.user_id)
+        self.assertTrue(os.path.exists(ml_categorizer.model_path(self.user_id)))
+        self.insert('Gym', 'Planet Fitness monthly')
+
+        ml_categorizer.reset_models()
+        reloaded = get_model(self.user_id)
+        self.assertIsNot(reloaded, trained)
+        self.assertEqual(reloaded.examples, trained.examples + 1)
+        self.assertAlmostEqual(reloaded.temperature, trained.temperature)
+
+    def test_other_is_not_a_training_label(self):
+        self.add_history()
+        self.insert('Other', 'mystery charge')
+        self.assertNotIn('Other', get_model(self.user_id).classes)
+
+
+class TestBatchCategorization(MLTestCase):
+
+    SAMPLES = [('blue bottle latte', 4.0), ('CHEWY 22', 55.0), ('uber trip', 18.0), ('', 3.0),
+               ('blue bottle latte', 4.2), ('Oakwood apartments rent', 1200.0), ('zzz', 0)]
+
+    def test_batch_matches_single_predictions(self):
+        self.add_history(repeat=3)
+        descriptions = [d for d, _ in self.SAMPLES]
+        amounts = [a for _, a in self.SAMPLES]
+        categories, confidences = predict_batch(self.user_id, descriptions, amounts)
+        for (description, amount), category, confidence in zip(self.SAMPLES, categories, confidences):
+            expected = predict(self.user_id, description, amount)
+            self.assertEqual(category, expected[0])
+            self.assertAlmostEqual(confidence, expected[1])
+
+        self.assertEqual(categorize_batch(descriptions, amounts, self.user_id),
+                         [predict_category(d, a, user_id=self.user_id) for d, a in self.SAMPLES])
+        self.assertEqual(categorize_batch(descriptions, amounts),
+                         [predict_category(d, a) for d, a in self.SAMPLES])
+
+    def test_class_learned_during_a_batch_is_left_out(self):
+        self.add_history(repeat=3)
+        model = get_model(self.user_id)
+        original = model.batch_probabilities
+
+        def learn_then_score(*args):
+            # Background learning adds a category after predict_batch has mapped the model's classes
+            model.learn(featurize('lawn mower'), 'Garden')
+            return original(*args)
+
+        with mock.patch.object(model, 'batch_probabilities', learn_then_score):
+            categories, _ = predict_batch(self.user_id, ['blue bottle'], [4.0])
+        self.assertEqual(categories, ['Coffee'])
+
+    def test_recategorize_other_backlog_in_chunks(self):
+        self.add_history(repeat=3)
+        self.add_transactions([('expense', 4.0, 'Other', 'Blue Bottle #2', '2025-03-05'),
+                               ('expense', 50.0, 'Other', 'chewy autoship', '2025-03-05'),
+                               ('expense', 9.0, 'Other', 'qqq', '2025-03-05'),
+                               ('expense', 30.0, 'Other', 'pizza night', '2025-03-05')])
+
+        preview = recategorize_transactions(self.user_id, dry_run=True, chunk_size=2)
+        self.assertEqual(preview['scanned'], 4)
+        conn = get_db_connection()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM transactions WHERE category = 'Other'").fetchone()[0], 4)
+
+        seen = []
+        totals = recategorize_transactions(self.user_id, chunk_size=2, progress=lambda t: seen.append(t['scanned']))
+        self.assertEqual(seen, [2, 4])
+        self.assertEqual(totals['updated'], preview['updated'])
+        self.assertEqual(totals['categories'].get('Coffee'), 1)
+        self.assertEqual(totals['categories'].get('Pets'), 1)
+        remaining = [row[0] for row in conn.execute("SELECT description FROM transactions WHERE category = 'Other'")]
+        conn.close()
+        self.assertEqual(remaining, ['qqq'])
+
+
+if __name__ == '__main__':
+    unittest.main()
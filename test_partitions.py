@@ -0,0 +1,162 @@
+"""
+Tests for monthly transaction partitions: archiving, read-only cold months and
+date-range pruning
+"""
+
+import unittest
+import os
+import sys
+from datetime import date
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import ModelTestCase
+from models.database import get_db_connection, get_data_version
+from utils import partitions, query_profiler
+from utils.analytics import get_monthly_summary, get_spending_series, generate_spending_report
+from utils.exporter import iter_batches
+from utils.partitions import archive_transactions, source, hot_cutoff
+from utils.transaction_service import create_transactions
+
+TODAY = date.today().isoformat()
+
+
+class PartitionTestCase(ModelTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_transactions([
+            ('expense', 40.0, 'Food', 'Groceries', '2024-01-05'),
+            ('income', 1000.0, 'Salary', 'Pay', '2024-01-31'),
+            ('expense', 25.0, 'Transportation', 'Fuel', '2024-02-10'),
+            ('expense', 12.5, 'Food', 'Lunch', TODAY),
+        ])
+
+    def hot_dates(self):
+        conn = get_db_connection()
+        dates = [row['date'] for row in conn.execute('SELECT date FROM transactions ORDER BY date')]
+        conn.close()
+        return dates
+
+    def reports(self):
+        return (get_monthly_summary(self.user_id, '2024-01'),
+                get_spending_series(self.user_id, '2023-12-01', TODAY, bucket='month'),
+                generate_spending_report(self.user_id, '2024-01-01'),
+                [row for batch in iter_batches(self.user_id) for row in batch])
+
+
+class TestArchive(PartitionTestCase):
+
+    def test_reports_read_archived_months(self):
+        before = self.reports()
+        version = get_data_version(self.user_id)
+        self.assertEqual(archive_transactions(), {'months': 2, 'archived': 3, 'restored': 0})
+        self.assertEqual(self.hot_dates(), [TODAY])
+        self.assertGreater(get_data_version(self.user_id), version)
+        self.assertEqual(self.reports(), before)
+
+    def test_archived_months_are_read_only(self):
+        archive_transactions()
+        conn = get_db_connection()
+        with self.assertRaises(Exception) as raised:
+            conn.execute('UPDATE transactions_2024_01 SET amount = 1')
+        self.assertIn('read-only', str(raised.exception))
+        conn.close()
+
+    def test_pruning(self):
+        archive_transactions()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        with query_profiler.profile() as active:
+            self.assertEqual(source(cursor, hot_cutoff()), 'transactions')
+            self.assertEqual(source(cursor, TODAY), 'transactions')
+        # The catalog is read once per connection
+        self.assertEqual(active.count, 1)
+        february = source(cursor, '2024-02-01', '2024-02-29')
+        self.assertIn('transactions_2024_02', february)
+        self.assertNotIn('transactions_2024_01', february)
+        self.assertEqual(source(cursor, '2023-01-01', '2023-12-31', alias='t'), 'transactions t')
+        conn.close()
+
+    def test_backdated_rows_are_merged_and_not_imported_twice(self):
+        item = {'type': 'expense', 'amount': 9.0, 'date': '2024-01-20', 'description': 'Books',
+                'category': 'Shopping', 'idempotency_key': 'books-2024'}
+        self.assertEqual(create_transactions(self.user_id, [item])['inserted'], 1)
+        archive_transactions()
+        # Writing into an archived month first moves it back to the hot table
+        self.assertEqual(create_transactions(self.user_id, [item]),
+                         {'received': 1, 'inserted': 0, 'duplicates': 1, 'flagged': 0})
+        self.assertEqual(self.hot_dates(), ['2024-01-05', '2024-01-20', '2024-01-31', TODAY])
+
+        self.add_transactions([('expense', 5.0, 'Food', 'Snack', '2024-01-21')])
+        self.assertEqual(archive_transactions(), {'months': 1, 'archived': 4, 'restored': 0})
+        conn = get_db_connection()
+        rows = [tuple(row) for row in conn.execute('SELECT date, amount FROM transactions_2024_01')]
+        conn.close()
+        # Rewritten in (user_id, date) order
+        self.assertEqual(rows, [('2024-01-05', 40.0), ('2024-01-20', 9.0), ('2024-01-21', 5.0), ('2024-01-31', 1000.0)])
+
+    def test_reports_read_months_newer_than_the_hot_window(self):
+        today = date.today()
+        this_month = date(today.year, today.month, 1)
+        last_month = date(this_month.year - (this_month.month == 1), (this_month.month - 2) % 12 + 1, 1).isoformat()
+        self.add_transactions([('expense', 50.0, 'Shopping', 'Shoes', last_month)])
+        before = generate_spending_report(self.user_id, last_month)
+        self.assertEqual(before['summary']['total_expense'], 62.5)
+
+        # Archived with fewer hot months than HOT_MONTHS, then read with HOT_MONTHS raised
+        self.assertEqual(archive_transactions(hot_months=1)['archived'], 4)
+        self.assertEqual(self.hot_dates(), [TODAY])
+        self.assertEqual(generate_spending_report(self.user_id, last_month), before)
+        with mock.patch.object(partitions, 'HOT_MONTHS', 12):
+            conn = get_db_connection()
+            self.assertIn(partitions.partition_table(last_month[:7]), source(conn.cursor(), last_month))
+            conn.close()
+
+    def test_raising_hot_months_moves_months_back(self):
+        archive_transactions()
+        before = self.reports()
+        self.assertEqual(archive_transactions(hot_months=1000), {'months': 0, 'archived': 0, 'restored': 3})
+        self.assertEqual(len(self.hot_dates()), 4)
+        self.assertEqual(self.reports(), before)
+
+
+class TestArchivedEdits(PartitionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from app import app
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+        archive_transactions()
+
+    def transaction_id(self, description):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT id FROM {source(cursor)} WHERE description = ?', (description,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def test_category_of_an_archived_transaction_can_be_changed(self):
+        self.client.post(f"/update_category/{self.transaction_id('Fuel')}", data={'category': 'Travel'})
+        self.assertEqual(self.hot_dates(), ['2024-02-10', TODAY])
+        conn = get_db_connection()
+        self.assertEqual(conn.execute("SELECT category FROM transactions WHERE description = 'Fuel'").fetchone()[0],
+                         'Travel')
+        conn.close()
+        self.assertEqual(archive_transactions(), {'months': 1, 'archived': 1, 'restored': 0})
+
+    def test_archived_transaction_can_be_deleted(self):
+        self.client.get(f"/delete_transaction/{self.transaction_id('Groceries')}")
+        self.assertIsNone(self.transaction_id('Groceries'))
+        self.assertEqual(self.hot_dates(), ['2024-01-31', TODAY])
+        self.assertEqual(self.client.get('/delete_transaction/999999').status_code, 302)
+        self.assertEqual(self.hot_dates(), ['2024-01-31', TODAY])
+
+
+if __name__ == '__main__':
+    unittest.main()
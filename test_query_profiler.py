@@ -0,0 +1,142 @@
+"""
+Tests for the per-request query profiler, slow-query log and route query budgets
+"""
+
+import unittest
+import json
+import os
+import sys
+from datetime import date
+
+from flask import url_for
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import query_profiler
+from utils.query_profiler import profile, QueryBudgetExceeded
+
+
+class TestQueryProfile(AnalyticsTestCase):
+
+    def test_counts_statements_and_commits(self):
+        with profile('block') as active:
+            conn = get_db_connection()
+            conn.execute('SELECT * FROM users').fetchall()
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ?', (self.user_id,))
+            cursor.executemany('INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)',
+                               [(self.user_id, 'Food', 100, 'monthly'), (self.user_id, 'Travel', 50, 'monthly')])
+            conn.commit()
+            conn.close()
+        self.assertEqual(active.count, 4)
+        self.assertGreater(active.seconds, 0)
+        self.assertEqual(len(active.slowest), 4)
+        self.assertEqual(sorted(active.slowest, key=lambda query: -query['ms']), active.slowest)
+        self.assertIn('SELECT COUNT(*) FROM transactions WHERE user_id = ?', [query['sql'] for query in active.slowest])
+
+        # Rows still come back as sqlite3.Row, and nothing is recorded outside a profile
+        conn = get_db_connection()
+        self.assertEqual(conn.execute('SELECT email FROM users').fetchone()['email'], 'analytics@example.com')
+        conn.close()
+        self.assertIsNone(query_profiler.current_profile())
+        self.assertEqual(active.count, 4)
+
+    def test_nested_profiles_and_budget(self):
+        with profile('outer') as outer:
+            with self.assertRaises(QueryBudgetExceeded):
+                with profile('inner', max_queries=1):
+                    conn = get_db_connection()
+                    conn.execute('SELECT 1')
+                    conn.execute('SELECT 2')
+                    conn.close()
+            self.assertIs(query_profiler.current_profile(), outer)
+        self.assertEqual(outer.count, 0)
+
+    def test_slow_query_log(self):
+        threshold = query_profiler.SLOW_QUERY_MS
+        query_profiler.SLOW_QUERY_MS = 0
+        try:
+            with self.assertLogs('slow_queries', 'WARNING') as logs:
+                conn = get_db_connection()
+                conn.execute('''SELECT *
+                    FROM users''')
+                conn.close()
+        finally:
+            query_profiler.SLOW_QUERY_MS = threshold
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['event'], entry['sql'], entry['request']), ('slow_query', 'SELECT * FROM users', None))
+
+
+class TestRouteQueryBudgets(AnalyticsTestCase):
+    """Each main page stays within its QUERY_BUDGETS entry"""
+
+    def setUp(self):
+        super().setUp()
+        from app import app
+        self.app = app
+        self._testing = app.testing
+        app.testing = True
+        month = date.today().isoformat()
+        self.add_transactions([('expense', amount, category, f'Order {i}', month)
+                               for i, (amount, category) in enumerate([(900, 'Food'), (450, 'Travel'),
+                                                                        (60, 'Food'), (5000, 'Shopping')])])
+        conn = get_db_connection()
+        conn.executemany("INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, 'monthly')",
+                         [(self.user_id, 'Food', 1000), (self.user_id, 'Travel', 400), (self.user_id, 'Shopping', 9000)])
+        conn.commit()
+        conn.close()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+            session['username'] = 'analytics'
+
+    def tearDown(self):
+        self.app.testing = self._testing
+        super().tearDown()
+
+    def test_pages_within_budget(self):
+        from app import QUERY_BUDGET_MARGIN
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO receipt_jobs (user_id, status, receipt_path) VALUES (?, 'queued', 'receipt.png')",
+                       (self.user_id,))
+        job_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        budgets = self.app.config['QUERY_BUDGETS']
+        pages = {'dashboard': {}, 'api_dashboard': {}, 'transactions': {}, 'analytics': {}, 'api_analytics': {},
+                 'budgets': {}, 'recurring': {}, 'notifications': {}, 'add_transaction': {},
+                 'api_receipt_status': {'job_id': job_id}}
+        self.assertEqual(set(pages), set(budgets))
+        for endpoint, arguments in pages.items():
+            with self.subTest(endpoint=endpoint):
+                with self.app.test_request_context():
+                    path = url_for(endpoint, **arguments)
+                counts = []
+                # The dashboard's first view of the day does more than later ones
+                for _ in range(2):
+                    # QueryBudgetExceeded propagates out of the test client when over budget
+                    response = self.client.get(path)
+                    self.assertEqual(response.status_code, 200)
+                    counts.append(int(response.headers['X-Query-Count']))
+                self.assertLessEqual(max(counts), budgets[endpoint])
+                # A budget left well above the count would let a new per-row query through unnoticed
+                self.assertGreaterEqual(max(counts) + QUERY_BUDGET_MARGIN, budgets[endpoint])
+
+    def test_over_budget_fails(self):
+        budgets = self.app.config['QUERY_BUDGETS']
+        original = budgets['budgets']
+        budgets['budgets'] = 0
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/budgets')
+        finally:
+            budgets['budgets'] = original
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""
+Tests for content-addressed receipt storage and its garbage collector
+"""
+
+import unittest
+import hashlib
+import io
+import os
+import shutil
+import sys
+import time
+from datetime import date
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import receipt_store
+from utils.partitions import archive_transactions
+from utils.receipt_store import store_receipt, thumbnail_path, collect_garbage, ingest_upload, open_upload, UploadError
+
+
+class ReceiptStoreTestCase(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._settings = (receipt_store.RECEIPT_DIR, receipt_store.RECEIPT_FORMAT)
+        receipt_store.RECEIPT_DIR = os.path.join(self.test_dir, 'receipts')
+
+    def tearDown(self):
+        receipt_store.RECEIPT_DIR, receipt_store.RECEIPT_FORMAT = self._settings
+        super().tearDown()
+
+    def upload(self, name, color='white', size=(2400, 1600), file_format='PNG'):
+        """A noisy photo-sized image, written as an upload would be"""
+        image = Image.effect_noise(size, 40).convert('RGB')
+        image.paste(color, (0, 0, size[0] // 2, size[1] // 2))
+        path = os.path.join(self.test_dir, name)
+        image.save(path, file_format)
+        return path
+
+    def stored_files(self):
+        return sorted(name for _, _, names in os.walk(receipt_store.RECEIPT_DIR) for name in names)
+
+    def attach(self, receipt_path, transaction_date='2024-01-05'):
+        self.add_transactions([('expense', 10.0, 'Food', 'Cafe', transaction_date)])
+        conn = get_db_connection()
+        conn.execute('UPDATE transactions SET receipt_path = ? WHERE id = (SELECT MAX(id) FROM transactions)',
+                     (receipt_path,))
+        conn.commit()
+        conn.close()
+
+    def age(self, seconds=7200):
+        past = time.time() - seconds
+        for directory, _, names in os.walk(receipt_store.RECEIPT_DIR):
+            for name in names:
+                os.utime(os.path.join(directory, name), (past, past))
+
+
+class TestStoreReceipt(ReceiptStoreTestCase):
+
+    def test_compresses_and_writes_thumbnail(self):
+        stored = store_receipt(self.upload('photo.png'), '.png')
+        self.assertFalse(stored['deduplicated'])
+        self.assertEqual(stored['path'], os.path.join(receipt_store.RECEIPT_DIR, stored['sha256'][:2],
+                                                      stored['sha256'] + '.webp'))
+        self.assertLess(stored['stored_bytes'], stored['bytes'] / 2)
+        with Image.open(stored['path']) as image:
+            self.assertEqual((image.format, max(image.size)), ('WEBP', receipt_store.RECEIPT_MAX_SIDE))
+        with Image.open(thumbnail_path(stored['path'])) as thumbnail:
+            self.assertEqual(max(thumbnail.size), receipt_store.THUMBNAIL_SIZE)
+
+    def test_jpeg(self):
+        receipt_store.RECEIPT_FORMAT = 'jpeg'
+        stored = store_receipt(self.upload('photo.jpg', size=(800, 600), file_format='JPEG'), '.jpg')
+        self.assertTrue(stored['path'].endswith('.jpg'))
+        self.assertTrue(thumbnail_path(stored['path']).endswith('.thumb.jpg'))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = store_receipt(self.upload('a.png', size=(400, 300)), '.png')
+        copy = shutil.copy(os.path.join(self.test_dir, 'a.png'), os.path.join(self.test_dir, 'copy.png'))
+        second = store_receipt(copy, '.png')
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(second['path'], first['path'])
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_other_files_are_kept_as_uploaded(self):
+        path = os.path.join(self.test_dir, 'receipt.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4 receipt')
+        stored = store_receipt(path, '.PDF')
+        self.assertTrue(stored['path'].endswith('.pdf'))
+        with open(stored['path'], 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 receipt')
+        self.assertIsNone(thumbnail_path(stored['path']))
+
+
+class CountingStream(io.BytesIO):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class TestIngestUpload(ReceiptStoreTestCase):
+
+    def ingest(self, data, **kwargs):
+        self.stream = CountingStream(data)
+        return ingest_upload(self.stream, **kwargs)
+
+    def photo(self, size=(2400, 1600)):
+        with open(self.upload('photo.jpg', size=size, file_format='JPEG'), 'rb') as f:
+            return f.read()
+
+    def test_image_is_hashed_and_downscaled(self):
+        data = self.photo()
+        stored = self.ingest(data)
+        self.assertEqual((stored['kind'], stored['sha256'], stored['bytes']),
+                         ('jpeg', hashlib.sha256(data).hexdigest(), len(data)))
+        with Image.open(stored['path']) as image:
+            self.assertEqual(max(image.size), receipt_store.RECEIPT_MAX_SIDE)
+        self.assertTrue(self.ingest(data)['deduplicated'])
+        self.assertEqual(os.listdir(receipt_store.temp_dir()), [])
+
+    def test_pdf_is_moved_into_place(self):
+        stored = self.ingest(b'%PDF-1.4 receipt')
+        self.assertEqual((stored['kind'], stored['path'][-4:]), ('pdf', '.pdf'))
+        with open(stored['path'], 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 receipt')
+
+    def test_renamed_file_is_rejected_after_first_chunk(self):
+        with self.assertRaises(UploadError):
+            self.ingest(b'MZ' + b'\0' * (4 * 1024 * 1024))
+        self.assertEqual(self.stream.bytes_read, receipt_store._CHUNK)
+        self.assertEqual(os.listdir(receipt_store.temp_dir()), [])
+        with self.assertRaises(UploadError):
+            self.ingest(b'')
+
+    def test_oversized_uploads_are_rejected_early(self):
+        receipt_store.MAX_PIXELS, max_pixels = 1000 * 1000, receipt_store.MAX_PIXELS
+        try:
+            with self.assertRaises(UploadError) as raised:
+                self.ingest(self.photo())
+            self.assertIn('2400 x 1600', str(raised.exception))
+            self.assertEqual(self.stream.bytes_read, receipt_store._CHUNK)
+        finally:
+            receipt_store.MAX_PIXELS = max_pixels
+        with self.assertRaises(UploadError):
+            self.ingest(self.photo(), max_bytes=100 * 1024)
+        self.assertLessEqual(self.stream.bytes_read, 100 * 1024 + receipt_store._CHUNK)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_unreadable_image_is_rejected(self):
+        with self.assertRaises(UploadError):
+            self.ingest(b'\x89PNG\r\n\x1a\n' + b'\0' * 1000)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_upload_is_read_from_the_request_body(self):
+        data = self.photo()
+        boundary, body = encode_multipart({'note': 'lunch', 'receipt': FileStorage(io.BytesIO(data), 'photo.jpg')})
+        content_type = f'multipart/form-data; boundary={boundary}'
+        self.stream = CountingStream(body)
+        upload = open_upload(self.stream, content_type, 'receipt')
+        self.assertEqual(upload.filename, 'photo.jpg')
+        self.assertEqual(ingest_upload(upload)['sha256'], hashlib.sha256(data).hexdigest())
+
+        self.stream = CountingStream(body.replace(data, b'MZ' + b'\0' * (4 * 1024 * 1024)))
+        with self.assertRaises(UploadError):
+            ingest_upload(open_upload(self.stream, content_type, 'receipt'))
+        self.assertLessEqual(self.stream.bytes_read, 2 * receipt_store._CHUNK)
+
+        self.assertIsNone(open_upload(io.BytesIO(body), content_type, 'other'))
+        self.assertIsNone(open_upload(io.BytesIO(body), 'application/json', 'receipt'))
+        with self.assertRaises(UploadError):
+            open_upload(io.BytesIO(b'not multipart'), content_type, 'receipt')
+
+
+class TestCollectGarbage(ReceiptStoreTestCase):
+
+    def test_deletes_only_old_unreferenced_files(self):
+        kept = store_receipt(self.upload('kept.png', size=(400, 300)), '.png')
+        archived = store_receipt(self.upload('archived.png', 'red', size=(400, 300)), '.png')
+        store_receipt(self.upload('orphan.png', 'blue', size=(400, 300)), '.png')
+        self.attach(kept['path'], date.today().isoformat())
+        self.attach(archived['path'])
+        archive_transactions()
+        stray = os.path.join(receipt_store.temp_dir(), 'upload.png')
+        open(stray, 'wb').close()
+
+        self.assertEqual(collect_garbage()['files'], 0)
+        self.age()
+        self.assertEqual(collect_garbage(dry_run=True)['files'], 3)
+        self.assertEqual(len(self.stored_files()), 7)
+        self.assertEqual(collect_garbage()['files'], 3)
+        self.assertEqual(self.stored_files(), sorted(os.path.basename(p) for p in (
+            kept['path'], thumbnail_path(kept['path']), archived['path'], thumbnail_path(archived['path']))))
+
+    def test_reupload_of_orphan_is_protected(self):
+        path = self.upload('orphan.png', size=(400, 300))
+        store_receipt(path, '.png')
+        self.age()
+        self.assertTrue(store_receipt(path, '.png')['deduplicated'])
+        self.assertEqual(collect_garbage()['files'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests for scheduled recurring transactions
+"""
+
+import unittest
+import os
+import sys
+from datetime import date
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import merchants
+from utils.merchants import assign_merchants
+from utils.partitions import archive_transactions
+from utils.recurring import (build_schedule, describe_schedule, expand, create_rule, get_rules,
+                             set_rule_active, delete_rule, materialize_due)
+
+RENT = {'type': 'expense', 'amount': '25000', 'category': 'Housing', 'description': 'Rent',
+        'frequency': 'monthly', 'start_date': '2025-01-01'}
+SALARY = {'type': 'income', 'amount': 90000, 'category': 'Salary', 'description': 'Salary',
+          'frequency': 'monthly', 'start_date': '2025-01-31'}
+
+
+class TestSchedules(unittest.TestCase):
+
+    def test_month_end_falls_back_to_last_day(self):
+        schedule = build_schedule('monthly', 1, date(2025, 1, 31))
+        self.assertEqual(expand(schedule, '2025-01-31', '2025-01-01', '2025-04-30'),
+                         (['2025-01-31', '2025-02-28', '2025-03-31', '2025-04-30'], '2025-05-31'))
+        # Anchored at a later occurrence, as the materializer does
+        self.assertEqual(expand(schedule, '2025-02-28', '2025-02-28', '2025-03-31')[0], ['2025-02-28', '2025-03-31'])
+        schedule = build_schedule('yearly', 1, date(2024, 2, 29))
+        self.assertEqual(expand(schedule, '2024-02-29', '2024-01-01', '2026-12-31')[0],
+                         ['2024-02-29', '2025-02-28', '2026-02-28'])
+
+    def test_intervals_and_end_date(self):
+        schedule = build_schedule('weekly', 2, date(2025, 3, 3))
+        self.assertEqual(expand(schedule, '2025-03-17', '2025-03-01', '2025-04-30', end_date='2025-03-31'),
+                         (['2025-03-17', '2025-03-31'], None))
+        self.assertEqual(describe_schedule(schedule), 'every 2 weeks')
+        self.assertEqual(describe_schedule(build_schedule('monthly', 1, date(2025, 1, 30))), 'monthly')
+
+
+class TestMaterializer(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        merchants.reset_cache()
+
+    def tearDown(self):
+        merchants.reset_cache()
+        super().tearDown()
+
+    def generated(self):
+        conn = get_db_connection()
+        rows = [tuple(row) for row in conn.execute(
+            'SELECT type, amount, category, date FROM transactions ORDER BY date, type')]
+        conn.close()
+        return rows
+
+    def test_generates_due_occurrences_once(self):
+        create_rule(self.user_id, RENT)
+        create_rule(self.user_id, SALARY)
+        self.assertEqual(materialize_due(date(2025, 3, 15)), {'rules': 2, 'inserted': 5})
+        self.assertEqual(self.generated(), [
+            ('expense', 25000.0, 'Housing', '2025-01-01'), ('income', 90000.0, 'Salary', '2025-01-31'),
+            ('expense', 25000.0, 'Housing', '2025-02-01'), ('income', 90000.0, 'Salary', '2025-02-28'),
+            ('expense', 25000.0, 'Housing', '2025-03-01')])
+        self.assertEqual(materialize_due(date(2025, 3, 15)), {'rules': 0, 'inserted': 0})
+        self.assertEqual([rule['next_date'] for rule in get_rules(self.user_id)], ['2025-03-31', '2025-04-01'])
+        self.assertEqual(materialize_due(date(2025, 4, 1), batch_size=1), {'rules': 2, 'inserted': 2})
+
+    def test_rewound_watermark_does_not_duplicate(self):
+        create_rule(self.user_id, RENT)
+        materialize_due(date(2025, 2, 10))
+        conn = get_db_connection()
+        conn.execute("UPDATE recurring_rules SET next_date = '2025-01-01'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(materialize_due(date(2025, 2, 10)), {'rules': 1, 'inserted': 0})
+        self.assertEqual(len(self.generated()), 2)
+
+        # Also when the months written have been archived since
+        self.assertEqual(archive_transactions(today=date(2025, 6, 1))['archived'], 2)
+        conn = get_db_connection()
+        conn.execute("UPDATE recurring_rules SET next_date = '2025-01-01'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(materialize_due(date(2025, 2, 10)), {'rules': 1, 'inserted': 0})
+        self.assertEqual(len(self.generated()), 2)
+
+    def test_flags_occurrences_already_entered_by_hand(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO users (username, email, password) VALUES (?, ?, ?)',
+                       ('other', 'other@example.com', 'hashed'))
+        other_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        self.add_transactions([('expense', 25000, 'Housing', 'RENT', '2025-02-01')])
+        assign_merchants()
+        create_rule(self.user_id, RENT)
+        create_rule(other_id, RENT)
+        self.assertEqual(materialize_due(date(2025, 2, 10)), {'rules': 2, 'inserted': 4})
+        conn = get_db_connection()
+        flagged = [tuple(row) for row in conn.execute(
+            'SELECT user_id, date, duplicate_of FROM transactions WHERE duplicate_of > 0')]
+        conn.close()
+        # Only the user's own February rent: the other user's never matches it
+        self.assertEqual(flagged, [(self.user_id, '2025-02-01', 1)])
+
+    def test_end_date_pause_and_delete(self):
+        ending = create_rule(self.user_id, dict(RENT, end_date='2025-02-15'))
+        paused = create_rule(self.user_id, dict(RENT, description='Gym', category='Healthcare', amount=1500))
+        set_rule_active(self.user_id, paused, False)
+        materialize_due(date(2025, 3, 15))
+        self.assertEqual(len(self.generated()), 2)
+        self.assertEqual({rule['id']: rule['next_date'] for rule in get_rules(self.user_id)},
+                         {ending: None, paused: '2025-01-01'})
+
+        # Resuming picks up from today instead of back-filling the pause
+        set_rule_active(self.user_id, paused, True, today=date(2025, 3, 15))
+        self.assertEqual(materialize_due(date(2025, 4, 15)), {'rules': 1, 'inserted': 1})
+        self.assertTrue(delete_rule(self.user_id, paused))
+        self.assertFalse(delete_rule(self.user_id + 1, ending))
+        self.assertEqual(len(self.generated()), 3)
+
+    def test_invalid_rules(self):
+        for bad in (dict(RENT, frequency='hourly'), dict(RENT, interval='0'), dict(RENT, amount='-5'),
+                    dict(RENT, start_date='01/01/2025'), dict(RENT, end_date='2024-12-31')):
+            with self.assertRaises(ValueError):
+                create_rule(self.user_id, bad)
+        self.assertEqual(get_rules(self.user_id), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
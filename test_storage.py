@@ -0,0 +1,238 @@
+"""
+Tests for the storage backends: the SQL shared by SQLite and PostgreSQL, and
+the sqlite3-style wrapper around psycopg.
+
+Set TEST_DATABASE_URL to a PostgreSQL database to run these (and every test
+built on AnalyticsTestCase) against it; its public schema is emptied per test.
+"""
+
+import unittest
+import io
+import os
+import re
+import sys
+from datetime import date
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase, ModelTestCase
+import models.database as database
+from models.database import get_db_connection, get_data_version, begin_write, streaming_cursor
+from utils.analytics import get_spending_series, get_monthly_summary
+from utils import executors, query_profiler
+from utils.duplicates import find_duplicate, sweep_duplicates
+from utils.merchants import assign_merchants, resolve_merchant_id
+from utils.ml_categorizer import train_model
+from utils.partitions import archive_transactions
+from utils.recurring import materialize_due
+from utils.subscriptions import update_subscriptions
+
+try:
+    from models import postgres
+except ImportError:
+    postgres = None
+
+
+class TestPortableSql(AnalyticsTestCase):
+
+    def test_backend_selection(self):
+        self.assertEqual(database.get_backend().name,
+                         'postgresql' if os.environ.get('TEST_DATABASE_URL') else 'sqlite')
+
+    def test_upsert_keeps_one_row_and_bumps_version(self):
+        conn = get_db_connection()
+        for amount in (100.0, 150.0):
+            conn.execute('''INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, category, period) DO UPDATE SET amount = excluded.amount''',
+                         (self.user_id, 'Food', amount, 'monthly'))
+        conn.commit()
+        rows = [tuple(row) for row in conn.execute('SELECT category, amount FROM budgets')]
+        conn.close()
+        self.assertEqual(rows, [('Food', 150.0)])
+        self.assertEqual(get_data_version(self.user_id), 2)
+
+    def test_buckets(self):
+        self.add_transactions([
+            ('expense', 10.0, 'Food', 'a', '2025-03-30'),  # Sunday
+            ('expense', 20.0, 'Food', 'b', '2025-03-31'),  # Monday
+            ('income', 5.0, 'Salary', 'c', '2025-04-02'),
+        ])
+        weeks = get_spending_series(self.user_id, '2025-03-24', '2025-04-06', bucket='week')['points']
+        self.assertEqual([(p['date'], p['amount'], p['income']) for p in weeks],
+                         [('2025-03-24', 10.0, 0), ('2025-03-31', 20.0, 5.0)])
+        quarters = get_spending_series(self.user_id, '2025-01-01', '2025-06-30', bucket='quarter')['points']
+        self.assertEqual([(p['date'], p['amount'], p['income']) for p in quarters],
+                         [('2025-01-01', 30.0, 0), ('2025-04-01', 0, 5.0)])
+        self.assertEqual(get_monthly_summary(self.user_id, '2025-03'), {'total_income': 0, 'total_expense': 30.0})
+
+    def test_whole_amounts_round_halves_up(self):
+        self.add_transactions([('expense', 4.5, 'Coffee', 'Starbucks', '2025-03-01')])
+        conn = get_db_connection()
+        conn.execute('UPDATE transactions SET merchant_id = ?', (resolve_merchant_id('Starbucks'),))
+        conn.commit()
+        cursor = conn.cursor()
+        self.assertEqual(find_duplicate(cursor, self.user_id, '2025-03-01', 5.4, resolve_merchant_id('Starbucks')), 1)
+        self.assertIsNone(find_duplicate(cursor, self.user_id, '2025-03-01', 4.4, resolve_merchant_id('Starbucks')))
+        conn.close()
+
+    def test_insert_or_ignore_and_write_lock(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        begin_write(cursor, 'test')
+        cursor.executemany('''INSERT INTO transactions (user_id, type, amount, category, date, import_hash)
+            VALUES (?, 'expense', 1, 'Other', '2025-01-01', ?) ON CONFLICT DO NOTHING''',
+                           [(self.user_id, 'a'), (self.user_id, 'b'), (self.user_id, 'a')])
+        self.assertEqual(cursor.rowcount, 2)
+        conn.commit()
+        cursor.execute("INSERT INTO alerts (user_id, message, alert_type) VALUES (?, '50% used', 'budget')",
+                       (self.user_id,))
+        self.assertEqual(cursor.lastrowid, 1)
+        cursor.row_factory = None
+        cursor.execute("SELECT message FROM alerts WHERE message LIKE '%used'")
+        self.assertEqual(cursor.fetchall(), [('50% used',)])
+        conn.close()
+
+    @unittest.skipIf(os.environ.get('TEST_DATABASE_URL'), 'SQLite only')
+    def test_database_directory_is_created(self):
+        database.DATABASE = os.path.join(self.test_dir, 'elsewhere', 'expense_tracker.db')
+        database.init_db()
+        self.assertTrue(os.path.exists(database.DATABASE))
+
+    def test_streaming_cursor(self):
+        self.add_transactions([('expense', float(i), 'Food', f'row {i}', '2025-03-01') for i in range(5)])
+        conn = get_db_connection()
+        cursor = streaming_cursor(conn)
+        cursor.row_factory = None
+        cursor.execute('SELECT amount FROM transactions WHERE user_id = ? ORDER BY id', (self.user_id,))
+        if postgres is not None and isinstance(conn, postgres.PostgresConnection):
+            # Server-side: rows stay in the database until fetched
+            self.assertIsNotNone(cursor._cursor.name)
+        # Other queries can run on the connection between batches
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0], 5)
+        self.assertEqual(cursor.fetchmany(2), [(0.0,), (1.0,)])
+        self.assertEqual(cursor.fetchmany(5), [(2.0,), (3.0,), (4.0,)])
+        self.assertEqual(cursor.fetchmany(2), [])
+        conn.close()
+
+
+# SQLite syntax PostgreSQL does not accept; the SQLite backend's own statements are exempt
+_SQLITE_ONLY = re.compile(r"\bINSERT\s+OR\s+(IGNORE|REPLACE)\b|\bREPLACE\s+INTO\b|\bstrftime\s*\(|\bjulianday\s*\("
+                          r"|\bdatetime\s*\(|\bdate\s*\(\s*'now'|\bIFNULL\s*\(|\bGROUP_CONCAT\s*\(|\bPRAGMA\b"
+                          r"|\bAUTOINCREMENT\b|\bBEGIN\s+IMMEDIATE\b|\bLIMIT\s+\?\s*,", re.IGNORECASE)
+_SQLITE_BACKEND = re.compile(r'^BEGIN IMMEDIATE$|^VACUUM$|_read_only_(insert|update|delete)\b')
+
+
+def _outside_quotes(sql):
+    return re.sub(r"'[^']*'|\"[^\"]*\"", '', sql)
+
+
+@unittest.skipIf(postgres is None, 'psycopg is not installed')
+class TestEveryStatementTranslates(ModelTestCase):
+    """Drives the app's pages and jobs and checks every SQL statement they run
+    against the PostgreSQL translation"""
+
+    def setUp(self):
+        super().setUp()
+        from app import app
+        self.app = app
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+            session['username'] = 'analytics'
+
+    def get(self, path):
+        response = self.client.get(path)
+        body = b''.join(response.response)
+        self.assertLess(response.status_code, 500, path)
+        return body
+
+    def post(self, path, **kwargs):
+        response = self.client.post(path, **kwargs)
+        self.assertLess(response.status_code, 500, path)
+
+    def run_app(self):
+        today = date.today().isoformat()
+        self.post('/register', data={'username': 'other', 'email': 'other@example.com', 'password': 'secret'})
+        self.post('/login', data={'email': 'analytics@example.com', 'password': 'wrong'})
+        self.post('/budgets', data={'category': 'Food', 'amount': '100', 'period': 'monthly'})
+        self.post('/add_transaction', data={'type': 'expense', 'amount': '120', 'category': 'Food',
+                                            'description': 'Starbucks', 'date': today})
+        self.post('/add_transaction', data={'type': 'expense', 'amount': '120', 'category': 'auto',
+                                            'description': 'STARBUCKS #12', 'date': today})
+        self.post('/api/transactions/bulk', json={'transactions': [
+            {'type': 'expense', 'amount': 649, 'date': f'2024-0{month}-05', 'description': 'NETFLIX.COM'}
+            for month in range(1, 5)]}, headers={'Idempotency-Key': 'bulk'})
+        statement = 'Date,Description,Amount\n2024-01-10,UBER TRIP 8812,-250.00\n2024-01-11,SALARY,85000\n'
+        self.post('/import_statement', data={'statement': (io.BytesIO(statement.encode()), 'statement.csv')},
+                  content_type='multipart/form-data')
+        self.post('/recurring', data={'type': 'expense', 'amount': '500', 'category': 'Bills', 'description': 'Rent',
+                                      'frequency': 'monthly', 'start_date': '2024-01-01'})
+        self.post('/notifications', data={'budget_alerts_email': '1'})
+        materialize_due()
+
+        for path in ('/dashboard', '/api/dashboard', '/transactions', '/transactions?type=expense&category=Food',
+                     '/analytics', '/api/analytics', '/budgets', '/recurring', '/notifications', '/add_transaction',
+                     '/import_statement', '/export_transactions?format=csv',
+                     '/export_transactions?format=ndjson&start=2024-01-01&end=2024-12-31',
+                     '/api/receipts/1', '/receipt/1'):
+            self.get(path)
+        self.post('/update_category/1', data={'category': 'Coffee'})
+        self.post('/resolve_duplicate/2', data={'action': 'keep'})
+        self.post('/recurring/1/toggle', data={'active': '0'})
+        self.post('/recurring/1/delete')
+        self.get('/delete_transaction/1')
+
+        # Jobs run by the CLI and the background pools
+        assign_merchants()
+        sweep_duplicates()
+        update_subscriptions(self.user_id, rebuild=True)
+        train_model(self.user_id)
+        archive_transactions(hot_months=1, today=date.fromisoformat(today))
+        self.post('/update_category/3', data={'category': 'Entertainment'})
+        self.get('/delete_transaction/4')
+        for path in ('/dashboard', '/transactions', '/export_transactions?format=csv', '/api/analytics'):
+            self.get(path)
+        executors.shutdown()
+
+    def test_statements(self):
+        statements = set()
+        def record(sql, started, many=False):
+            statements.add(sql)
+        with mock.patch.object(query_profiler, '_record', record), mock.patch.object(postgres, '_record', record):
+            self.run_app()
+        self.assertGreater(len(statements), 100)
+
+        on_sqlite = database.get_backend().name == 'sqlite'
+        for sql in sorted(statements):
+            with self.subTest(sql=' '.join(sql.split())[:120]):
+                translated = postgres.translate(sql)
+                self.assertNotIn('?', _outside_quotes(translated))
+                self.assertEqual(_outside_quotes(translated).count('%s'), _outside_quotes(sql).count('?'))
+                self.assertNotRegex(translated.replace('%%', '').replace('%s', ''), '%')
+                if on_sqlite and not _SQLITE_BACKEND.search(sql.strip()):
+                    self.assertNotRegex(sql, _SQLITE_ONLY)
+
+
+@unittest.skipIf(postgres is None, 'psycopg is not installed')
+class TestPostgresWrapper(unittest.TestCase):
+
+    def test_translate(self):
+        self.assertEqual(postgres.translate("SELECT * FROM t WHERE a = ? AND b LIKE '%?' AND c = ?"),
+                         "SELECT * FROM t WHERE a = %s AND b LIKE '%%?' AND c = %s")
+
+    def test_returns_id(self):
+        self.assertTrue(postgres._returns_id('INSERT INTO transactions (user_id) VALUES (?)'))
+        self.assertFalse(postgres._returns_id('INSERT INTO data_versions (user_id) VALUES (?)'))
+        self.assertFalse(postgres._returns_id('UPDATE transactions SET amount = ?'))
+
+    def test_row(self):
+        row = postgres.row_class(('id', 'name'))((7, 'Rent'))
+        self.assertEqual((row['name'], row[0], tuple(row)), ('Rent', 7, (7, 'Rent')))
+        self.assertEqual(dict(row), {'id': 7, 'name': 'Rent'})
+        self.assertIs(type(row), postgres.row_class(('id', 'name')))
+
+
+if __name__ == '__main__':
+    unittest.main()
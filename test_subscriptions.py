@@ -0,0 +1,162 @@
+"""
+Tests for recurring payment and subscription detection
+"""
+
+import unittest
+import os
+import sys
+from datetime import date
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import AnalyticsTestCase
+from models.database import get_db_connection
+from utils import executors, merchants, subscriptions
+from utils.columnar_store import day_number
+from utils.merchants import assign_merchants
+from utils.subscriptions import detect_recurring, update_subscriptions, get_subscriptions, next_charge
+
+
+def series(merchant_id, amount, dates):
+    return [(merchant_id, amount, day_number(d)) for d in dates]
+
+
+def detect(rows):
+    merchant_ids, amounts, days = zip(*rows)
+    return {(found['merchant_id'], found['period']): found for found in detect_recurring(merchant_ids, amounts, days)}
+
+
+MONTHLY = ['2025-01-05', '2025-02-05', '2025-03-06', '2025-04-05', '2025-05-05', '2025-06-04']
+
+
+class TestDetectRecurring(unittest.TestCase):
+
+    def test_weekly_monthly_and_annual(self):
+        found = detect(series(1, 649.0, MONTHLY)
+                       + series(2, 300.0, ['2025-03-03', '2025-03-10', '2025-03-17', '2025-03-24', '2025-03-31'])
+                       + series(3, 1499.0, ['2023-08-14', '2024-08-13', '2025-08-14']))
+        self.assertEqual(set(found), {(1, 'monthly'), (2, 'weekly'), (3, 'annual')})
+        self.assertEqual(found[(1, 'monthly')]['occurrences'], 6)
+        self.assertEqual(found[(1, 'monthly')]['last_day'], day_number('2025-06-04'))
+        self.assertEqual(found[(2, 'weekly')]['interval_days'], 7.0)
+
+    def test_amount_bands_split_a_merchant(self):
+        # A monthly plan and irregular one-off purchases at the same merchant
+        rows = series(1, 1499.0, MONTHLY) + series(1, 220.0, ['2025-01-09', '2025-01-11', '2025-03-20', '2025-06-01'])
+        found = detect(rows)
+        self.assertEqual(list(found), [(1, 'monthly')])
+        self.assertEqual(found[(1, 'monthly')]['amount'], 1499.0)
+
+    def test_price_rise_stays_one_series(self):
+        rows = series(1, 499.0, MONTHLY[:3]) + series(1, 549.0, MONTHLY[3:])
+        found = detect(rows)[(1, 'monthly')]
+        self.assertEqual((found['occurrences'], found['amount']), (6, 549.0))
+
+    def test_irregular_and_short_series_are_ignored(self):
+        rows = (series(1, 180.0, ['2025-01-02', '2025-01-09', '2025-01-21', '2025-02-14', '2025-02-17'])
+                + series(2, 649.0, MONTHLY[:2]))
+        self.assertEqual(detect(rows), {})
+        self.assertEqual(detect_recurring([], [], []), [])
+
+    def test_next_charge(self):
+        self.assertEqual(next_charge('2025-01-31', 'monthly'), '2025-02-28')
+        self.assertEqual(next_charge('2025-03-03', 'weekly'), '2025-03-10')
+        self.assertEqual(next_charge('2024-02-29', 'annual'), '2025-02-28')
+
+
+class TestStoredSubscriptions(AnalyticsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        merchants.reset_cache()
+
+    def add_expenses(self, description, amount, dates):
+        self.add_transactions([('expense', amount, 'Entertainment', description, d) for d in dates])
+        assign_merchants(self.user_id)
+
+    def stored_ids(self):
+        conn = get_db_connection()
+        ids = {row['merchant']: row['id'] for row in conn.execute(
+            'SELECT s.id, m.name AS merchant FROM subscriptions s JOIN merchants m ON m.id = s.merchant_id')}
+        conn.close()
+        return ids
+
+    def tearDown(self):
+        executors.shutdown()
+        merchants.reset_cache()
+        super().tearDown()
+
+    def test_detects_and_reports_next_charge(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY)
+        update_subscriptions(self.user_id)
+        subscriptions = get_subscriptions(self.user_id, today=date(2025, 6, 20))
+        self.assertEqual(len(subscriptions), 1)
+        netflix = subscriptions[0]
+        self.assertEqual((netflix['merchant'], netflix['period'], netflix['next_date']), ('Netflix', 'monthly', '2025-07-04'))
+        self.assertEqual((netflix['status'], netflix['monthly_cost']), ('active', 649.0))
+        self.assertEqual(get_subscriptions(self.user_id, today=date(2025, 8, 1))[0]['status'], 'lapsed')
+
+    def test_updates_only_merchants_with_new_expenses(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY)
+        self.add_expenses('Spotify', 119.0, MONTHLY[:2])
+        self.assertEqual(update_subscriptions(self.user_id), 2)
+        self.assertEqual(update_subscriptions(self.user_id), 0)
+        netflix_row = self.stored_ids()['Netflix']
+
+        self.add_expenses('SPOTIFY P0123', 119.0, ['2025-03-05'])
+        self.assertEqual(update_subscriptions(self.user_id), 1)
+        self.assertEqual(self.stored_ids(), {'Netflix': netflix_row, 'Spotify': netflix_row + 1})
+
+    def test_deleted_history_triggers_rescan(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY[:3])
+        update_subscriptions(self.user_id)
+        conn = get_db_connection()
+        conn.execute('DELETE FROM transactions WHERE id = 2')
+        conn.commit()
+        conn.close()
+        self.assertEqual(update_subscriptions(self.user_id), 1)
+        self.assertEqual(get_subscriptions(self.user_id), [])
+
+    def test_edited_expenses_are_reanalyzed(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY)
+        self.add_expenses('Spotify', 119.0, MONTHLY)
+        self.assertEqual(update_subscriptions(self.user_id), 2)
+        conn = get_db_connection()
+        conn.execute("UPDATE transactions SET category = 'Other' WHERE user_id = ?", (self.user_id,))
+        conn.commit()
+        self.assertEqual(update_subscriptions(self.user_id), 0)
+
+        conn.execute("UPDATE transactions SET amount = 799.0 WHERE description = 'NETFLIX.COM'")
+        conn.commit()
+        self.assertEqual(update_subscriptions(self.user_id), 1)
+        self.assertEqual([s['amount'] for s in get_subscriptions(self.user_id) if s['merchant'] == 'Netflix'], [799.0])
+
+        conn.execute("UPDATE transactions SET type = 'income' WHERE description = 'Spotify'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(update_subscriptions(self.user_id), 1)
+        self.assertEqual([s['merchant'] for s in get_subscriptions(self.user_id)], ['Netflix'])
+
+    def test_reads_queue_the_update(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY)
+        self.assertEqual(get_subscriptions(self.user_id), [])
+        executors.shutdown()  # waits for the queued update
+        self.assertEqual([s['merchant'] for s in get_subscriptions(self.user_id)], ['Netflix'])
+        with mock.patch.object(subscriptions, 'update_in_background') as queue:
+            get_subscriptions(self.user_id)
+        queue.assert_not_called()
+
+    def test_flagged_duplicates_are_ignored(self):
+        self.add_expenses('NETFLIX.COM', 649.0, MONTHLY[:3] + MONTHLY[2:3])
+        conn = get_db_connection()
+        conn.execute('UPDATE transactions SET duplicate_of = 3 WHERE id = 4')
+        conn.commit()
+        conn.close()
+        update_subscriptions(self.user_id)
+        self.assertEqual(get_subscriptions(self.user_id, today=date(2025, 3, 10))[0]['occurrences'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests for tracing spans and the JSON-lines exporter
+"""
+
+import unittest
+import json
+import os
+import sys
+import shutil
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import tracing
+from utils.tracing import trace, traced, span
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self._settings = (tracing.SAMPLE_RATE, tracing.SLOW_MS, tracing.TRACE_FILE)
+        tracing.SAMPLE_RATE = 1.0
+        tracing.SLOW_MS = None
+        tracing.TRACE_FILE = os.path.join(self.test_dir, 'traces', 'traces.jsonl')
+
+    def tearDown(self):
+        tracing.SAMPLE_RATE, tracing.SLOW_MS, tracing.TRACE_FILE = self._settings
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def exported(self):
+        if not os.path.exists(tracing.TRACE_FILE):
+            return []
+        with open(tracing.TRACE_FILE) as f:
+            return [json.loads(line) for line in f]
+
+    def test_spans_nest_under_one_trace(self):
+        with trace('upload', user_id=7) as root:
+            with span('ocr') as ocr:
+                with span('readtext') as readtext:
+                    readtext.set(elements=3)
+            with span('db_insert'):
+                pass
+        spans = {s['name']: s for s in self.exported()}
+        self.assertEqual(list(spans), ['readtext', 'ocr', 'db_insert', 'upload'])
+        self.assertEqual({s['trace_id'] for s in spans.values()}, {root.trace_id})
+        self.assertIsNone(spans['upload']['parent_id'])
+        self.assertEqual(spans['readtext']['parent_id'], ocr.span_id)
+        self.assertEqual(spans['db_insert']['parent_id'], root.span_id)
+        self.assertEqual(spans['readtext']['attributes'], {'elements': 3})
+        self.assertEqual(spans['upload']['attributes'], {'user_id': 7, 'kept': 'sampled'})
+        self.assertGreaterEqual(spans['upload']['duration_ms'], spans['ocr']['duration_ms'])
+
+    def test_outside_a_trace_spans_do_nothing(self):
+        with span('orphan') as orphan:
+            orphan.set(ignored=True)
+        self.assertIsNone(tracing.current_trace_id())
+        self.assertEqual(self.exported(), [])
+
+    def test_sampling_keeps_slow_and_failed_traces(self):
+        tracing.SAMPLE_RATE = 0.0
+        with trace('fast'):
+            pass
+        self.assertEqual(self.exported(), [])
+
+        tracing.SLOW_MS = 0
+        with trace('slow'):
+            pass
+        tracing.SLOW_MS = 60000
+
+        @traced('failing')
+        def failing():
+            with span('parse'):
+                raise ValueError('bad date')
+
+        with self.assertRaises(ValueError):
+            failing()
+        spans = self.exported()
+        self.assertEqual([(s['name'], s['attributes'].get('kept')) for s in spans],
+                         [('slow', 'slow'), ('parse', None), ('failing', 'error')])
+        self.assertEqual((spans[1]['status'], spans[1]['error']), ('error', 'ValueError: bad date'))
+
+    def test_disabled(self):
+        tracing.SAMPLE_RATE = 0.0
+        with trace('upload') as root:
+            self.assertIs(root, tracing.NOOP_SPAN)
+            self.assertIsNone(tracing.current_trace_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
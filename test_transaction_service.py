@@ -0,0 +1,71 @@
+"""
+Tests for bulk, idempotent transaction writes
+"""
+
+import unittest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_analytics import ModelTestCase
+from models.database import get_db_connection
+from utils.transaction_service import create_transactions, ValidationError, MAX_BULK_TRANSACTIONS
+
+ITEMS = [
+    {'type': 'expense', 'amount': 250, 'date': '2025-03-01', 'description': 'UBER TRIP 8812'},
+    {'type': 'expense', 'amount': '4.50', 'date': '2025-03-01', 'description': 'STARBUCKS #12', 'category': 'Coffee'},
+    {'type': 'income', 'amount': 85000.0, 'date': '2025-03-02', 'description': 'Salary', 'category': 'Salary'},
+]
+
+
+class TestCreateTransactions(ModelTestCase):
+
+    def stored(self):
+        conn = get_db_connection()
+        rows = [dict(row) for row in conn.execute(
+            'SELECT type, amount, category, description, date, merchant_id FROM transactions ORDER BY id')]
+        conn.close()
+        return rows
+
+    def test_inserts_and_categorizes(self):
+        result = create_transactions(self.user_id, ITEMS)
+        self.assertEqual(result, {'received': 3, 'inserted': 3, 'duplicates': 0, 'flagged': 0})
+        rows = self.stored()
+        self.assertEqual([row['category'] for row in rows], ['Transportation', 'Coffee', 'Salary'])
+        self.assertEqual(rows[1]['amount'], 4.5)
+        self.assertTrue(all(row['merchant_id'] for row in rows))
+
+    def test_request_key_makes_retries_safe(self):
+        create_transactions(self.user_id, ITEMS, idempotency_key='batch-1')
+        again = create_transactions(self.user_id, ITEMS, idempotency_key='batch-1')
+        self.assertEqual((again['inserted'], again['duplicates']), (0, 3))
+        self.assertEqual(create_transactions(self.user_id, ITEMS, idempotency_key='batch-2')['inserted'], 3)
+        self.assertEqual(len(self.stored()), 6)
+
+    def test_item_keys_survive_partial_retries(self):
+        keyed = [dict(item, idempotency_key=f'tx-{i}') for i, item in enumerate(ITEMS)]
+        create_transactions(self.user_id, keyed[:2])
+        result = create_transactions(self.user_id, keyed)
+        self.assertEqual((result['inserted'], result['duplicates']), (1, 2))
+
+    def test_without_keys_every_call_inserts(self):
+        create_transactions(self.user_id, ITEMS)
+        self.assertEqual(create_transactions(self.user_id, ITEMS)['inserted'], 3)
+
+    def test_invalid_batch_writes_nothing(self):
+        bad = ITEMS + [{'amount': -5, 'date': '2025-03-01'}, {'amount': 5, 'date': '03/01/2025'},
+                       {'type': 'transfer', 'amount': 5, 'date': '2025-03-01'}, 'nope', {'amount': 5}]
+        with self.assertRaises(ValidationError) as caught:
+            create_transactions(self.user_id, bad)
+        self.assertEqual([error['index'] for error in caught.exception.errors], [3, 4, 5, 6, 7])
+        self.assertEqual(self.stored(), [])
+
+    def test_batch_size_limit(self):
+        with self.assertRaises(ValidationError):
+            create_transactions(self.user_id, ITEMS[:1] * (MAX_BULK_TRANSACTIONS + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
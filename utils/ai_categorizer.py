@@ -1,3 +1,10 @@
+import copy
+import re
+import threading
+
+from models.database import get_db_connection
+from .ml_categorizer import MIN_CONFIDENCE, predict as predict_learned, predict_batch
+
 CATEGORY_KEYWORDS = {
     'Food & Dining': ['restaurant', 'cafe', 'food', 'dining', 'pizza', 'burger', 'coffee', 'lunch', 'dinner', 'breakfast', 'grocery', 'supermarket'],
     'Transportation': ['uber', 'lyft', 'taxi', 'gas', 'fuel', 'parking', 'metro', 'bus', 'train', 'flight', 'airline'],
@@ -10,25 +17,200 @@ CATEGORY_KEYWORDS = {
     'Other': []
 }
 
-def categorize_expense(description, amount=0):
+# Compiled matchers kept per keyword set; small because keyword sets rarely change
+MATCHER_CACHE_SIZE = 16
+
+# Rows re-categorized per database transaction by recategorize_transactions
+RECATEGORIZE_CHUNK_SIZE = 5000
+
+class KeywordMatcher:
+    """Every category keyword compiled into a single regular expression.
+
+    A keyword matches at the start of a word, so 'shop' matches "Shopping" and
+    'coffee' matches "Coffeehouse", but 'rent' no longer matches "parent". One
+    scan of the description yields the set of matched keywords, and each one
+    credits every category that lists it.
+    """
+
+    def __init__(self, category_keywords):
+        self.categories = list(category_keywords)
+        self.keyword_categories = {}
+        for index, keywords in enumerate(category_keywords.values()):
+            for keyword in keywords:
+                owners = self.keyword_categories.setdefault(keyword.lower(), [])
+                if index not in owners:
+                    owners.append(index)
+
+        # The longest alternative wins at each position, so remember which
+        # shorter keywords are prefixes of a match and would have matched too
+        self.prefix_keywords = {
+            keyword: [keyword[:end] for end in range(1, len(keyword) + 1) if keyword[:end] in self.keyword_categories]
+            for keyword in self.keyword_categories
+        }
+
+        # First category (in listed order) credited by a match, for categorize_expense
+        self.first_category = {
+            keyword: min(index for prefix in prefixes for index in self.keyword_categories[prefix])
+            for keyword, prefixes in self.prefix_keywords.items()
+        }
+
+        self.pattern = None
+        if self.keyword_categories:
+            self.pattern = re.compile(r'\b' + _trie_pattern(self.keyword_categories))
+
+    def matched_keywords(self, description):
+        if not description or self.pattern is None:
+            return set()
+        matched = set()
+        for keyword in set(self.pattern.findall(description.lower())):
+            matched.update(self.prefix_keywords[keyword])
+        return matched
+
+    def first_match(self, description):
+        """The earliest listed category with any matching keyword, or None"""
+        if not description or self.pattern is None:
+            return None
+        found = self.pattern.findall(description.lower())
+        if not found:
+            return None
+        return self.categories[min(self.first_category[keyword] for keyword in found)]
+
+    def scores(self, description):
+        """{category: number of distinct matched keywords}, in CATEGORY_KEYWORDS order"""
+        counts = [0] * len(self.categories)
+        for keyword in self.matched_keywords(description):
+            for index in self.keyword_categories[keyword]:
+                counts[index] += 1
+        return {self.categories[i]: count for i, count in enumerate(counts) if count}
+
+def _trie_pattern(keywords):
+    """Regex for a set of keywords shaped as a trie, e.g. (?:ca(?:fe|ble)|...),
+    so each position is checked in time proportional to keyword length rather
+    than to the number of keywords. Greedy optional groups make the longest
+    keyword win."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        group = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return '(?:' + group + ')?'
+        return group
+
+    return build(trie)
+
+# id(keyword dict) -> (snapshot of its contents, compiled matcher)
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+def get_matcher(category_keywords=None):
+    """Compiled matcher for a keyword dict, rebuilt only when its contents change"""
+    category_keywords = CATEGORY_KEYWORDS if category_keywords is None else category_keywords
+    cached = _matchers.get(id(category_keywords))
+    # Comparing against the snapshot is a C-level walk, far cheaper than recompiling
+    if cached is not None and cached[0] == category_keywords:
+        return cached[1]
+
+    matcher = KeywordMatcher(category_keywords)
+    snapshot = copy.deepcopy(category_keywords)
+    with _matchers_lock:
+        if len(_matchers) >= MATCHER_CACHE_SIZE:
+            _matchers.pop(next(iter(_matchers)))
+        _matchers[id(category_keywords)] = (snapshot, matcher)
+    return matcher
+
+def categorize_expense(description, amount=0, category_keywords=None):
     if not description:
         return 'Other'
-    description_lower = description.lower()
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in description_lower:
-                return category
-    return 'Other'
-
-def predict_category(description, amount=0, return_all=False):
+    return get_matcher(category_keywords).first_match(description) or 'Other'
+
+def predict_category(description, amount=0, return_all=False, category_keywords=None, user_id=None, hint=None):
+    """Highest scoring category, or with return_all a list of keyword (category,
+    score) pairs from best to worst. Given a user_id, the learned model decides
+    when it is confident enough; then a hint (such as the category the user
+    last gave this merchant), and the keywords are the fallback. Empty or
+    unmatched descriptions are 'Other', or [('Other', 0)] with return_all."""
     if not description:
-        return 'Other'
-    description_lower = description.lower()
-    scores = {}
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        score = sum(1 for keyword in keywords if keyword in description_lower)
-        if score > 0:
-            scores[category] = score
+        return [('Other', 0)] if return_all else 'Other'
+    if user_id is not None and not return_all:
+        category, confidence = predict_learned(user_id, description, amount)
+        if category is not None and confidence >= MIN_CONFIDENCE:
+            return category
+    if hint and not return_all:
+        return hint
+    scores = get_matcher(category_keywords).scores(description)
     if not scores:
-        return 'Other'
+        return [('Other', 0)] if return_all else 'Other'
+    if return_all:
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
     return max(scores, key=scores.get)
+
+def categorize_batch(descriptions, amounts=None, user_id=None, category_keywords=None):
+    """predict_category for a list of descriptions, returning a list of categories.
+
+    The learned model scores every row in one vectorized pass, and keyword
+    matching runs once per distinct description it was not confident about.
+    """
+    amounts = amounts if amounts is not None else [0] * len(descriptions)
+    categories = [None] * len(descriptions)
+    if user_id is not None:
+        learned, confidences = predict_batch(user_id, descriptions, amounts)
+        for index, (category, confidence) in enumerate(zip(learned, confidences.tolist())):
+            if category is not None and confidence >= MIN_CONFIDENCE:
+                categories[index] = category
+
+    matcher = get_matcher(category_keywords)
+    by_keywords = {}
+    for index, description in enumerate(descriptions):
+        if categories[index] is None:
+            if description not in by_keywords:
+                scores = matcher.scores(description)
+                by_keywords[description] = max(scores, key=scores.get) if scores else 'Other'
+            categories[index] = by_keywords[description]
+    return categories
+
+def recategorize_transactions(user_id, category='Other', chunk_size=RECATEGORIZE_CHUNK_SIZE, dry_run=False, progress=None):
+    """Re-run categorization over a user's transactions in one category.
+
+    Works through the rows chunk_size at a time, committing each chunk, and
+    returns {'scanned', 'updated', 'categories': {new category: count}}.
+    progress, if given, is called with the running totals after each chunk.
+
+    Only the hot transactions table is scanned: archived months are read-only
+    and keep their categories. Predictions come from the keyword rules and the
+    learned models; merchant category hints are not applied.
+    """
+    totals = {'scanned': 0, 'updated': 0, 'categories': {}}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    last_id = 0
+    while True:
+        cursor.execute('''SELECT id, description, amount FROM transactions
+            WHERE user_id = ? AND category = ? AND id > ? ORDER BY id LIMIT ?''',
+            (user_id, category, last_id, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        predicted = categorize_batch([row['description'] for row in rows], [row['amount'] for row in rows], user_id)
+        changes = [(new, row['id']) for row, new in zip(rows, predicted) if new != category]
+        for new, _ in changes:
+            totals['categories'][new] = totals['categories'].get(new, 0) + 1
+        if changes and not dry_run:
+            cursor.executemany('UPDATE transactions SET category = ? WHERE id = ?', changes)
+            conn.commit()
+
+        totals['scanned'] += len(rows)
+        totals['updated'] += len(changes)
+        if progress:
+            progress(totals)
+    conn.close()
+    return totals
@@ -1,6 +1,10 @@
 from models.database import get_db_connection
 from datetime import datetime, timedelta
+import numpy as np
 from .email_service import send_budget_alert_email, send_anomaly_alert_email
+from .columnar_store import get_columnar_store, day_to_iso
+from .partitions import source
+from .forecasting import project_budgets
 
 def has_alert_been_sent_today(user_id, alert_type, category):
     """Check if an alert has already been sent for this category today"""
@@ -16,24 +20,90 @@ def has_alert_been_sent_today(user_id, alert_type, category):
     conn.close()
     return result is not None
 
+def alerts_sent_today(user_id):
+    """(alert_type, category) of every alert already sent to the user today, in one query"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    today = datetime.now().strftime('%Y-%m-%d')
+    cursor.execute('SELECT alert_type, category FROM email_alert_history WHERE user_id = ? AND sent_date = ?',
+                   (user_id, today))
+    sent = {(row['alert_type'], row['category']) for row in cursor.fetchall()}
+    conn.close()
+    return sent
+
 def record_alert_sent(user_id, alert_type, category):
     """Record that an alert email has been sent for this category"""
+    record_alerts_sent(user_id, [(alert_type, category)])
+
+def record_alerts_sent(user_id, sent):
+    """Record (alert_type, category) pairs sent today, in one statement"""
     conn = get_db_connection()
     cursor = conn.cursor()
     today = datetime.now().strftime('%Y-%m-%d')
     
     try:
-        cursor.execute('''INSERT OR IGNORE INTO email_alert_history 
+        cursor.executemany('''INSERT INTO email_alert_history 
             (user_id, alert_type, category, sent_date)
-            VALUES (?, ?, ?, ?)''',
-            (user_id, alert_type, category, today))
+            VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING''',
+            [(user_id, alert_type, category, today) for alert_type, category in sent])
         conn.commit()
     except Exception as e:
         print(f"Error recording alert: {e}")
     finally:
         conn.close()
 
-def check_budget_alerts(user_id):
+def get_month_spending_by_category(user_id, month):
+    """Expense totals per category for a YYYY-MM month, in one pass"""
+    first_day = datetime.strptime(month, '%Y-%m')
+    next_month = (first_day + timedelta(days=32)).replace(day=1)
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        window = columns.window(first_day.strftime('%Y-%m-%d'),
+                                (next_month - timedelta(days=1)).strftime('%Y-%m-%d'))
+        return columns.category_totals(window & columns.is_expense)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    first = first_day.strftime('%Y-%m-%d')
+    cursor.execute(f'''SELECT category, SUM(amount) as total FROM {source(cursor, first, first)}
+        WHERE user_id = ? AND type = 'expense' AND date >= ? AND date < ?
+        GROUP BY category''', (user_id, first, next_month.strftime('%Y-%m-%d')))
+    totals = {row['category']: row['total'] for row in cursor.fetchall()}
+    conn.close()
+    return totals
+
+def find_unusual_expenses(user_id, average_since, recent_since):
+    """Expenses since recent_since that exceed twice their category's average
+    since average_since, as (category, amount, date) ordered by category"""
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        baseline = columns.window(average_since) & columns.is_expense
+        sums = np.bincount(columns.category_codes[baseline], weights=columns.amounts[baseline],
+                           minlength=len(columns.categories))
+        counts = np.bincount(columns.category_codes[baseline], minlength=len(columns.categories))
+        averages = np.divide(sums, counts, out=np.full(len(sums), np.inf), where=counts > 0)
+        recent = columns.window(recent_since) & columns.is_expense
+        unusual = np.flatnonzero(recent & (columns.amounts > 2 * averages[columns.category_codes]))
+        names = [columns.categories[code] for code in columns.category_codes[unusual]]
+        order = sorted(range(len(unusual)), key=lambda i: (names[i], columns.ids[unusual[i]]))
+        return [(names[i], float(columns.amounts[unusual[i]]), day_to_iso(columns.days[unusual[i]]))
+                for i in order]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT t.category, t.amount, t.date FROM {source(cursor, recent_since, alias='t')}
+        JOIN (SELECT category, AVG(amount) as avg_amount FROM {source(cursor, average_since)} 
+              WHERE user_id = ? AND type = 'expense' AND date >= ? GROUP BY category) a
+        ON t.category = a.category
+        WHERE t.user_id = ? AND t.type = 'expense' AND t.date >= ? AND t.amount > a.avg_amount * 2
+        ORDER BY t.category, t.id''', (user_id, average_since, user_id, recent_since))
+    unusual = [(row['category'], row['amount'], row['date']) for row in cursor.fetchall()]
+    conn.close()
+    return unusual
+
+def check_budget_alerts(user_id, projections=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     alerts = []
@@ -42,14 +112,14 @@ def check_budget_alerts(user_id):
 
     cursor.execute('SELECT * FROM budgets WHERE user_id = ?', (user_id,))
     budgets = cursor.fetchall()
+    spending = get_month_spending_by_category(user_id, current_month) if budgets else {}
+
+    # One history lookup and one insert for all of today's alerts rather than one of each per alert
+    sent = alerts_sent_today(user_id) if budgets or projections else set()
+    to_record = []
 
     for budget in budgets:
-        cursor.execute('''SELECT SUM(amount) as total FROM transactions 
-            WHERE user_id = ? AND category = ? AND type = 'expense' 
-            AND strftime('%Y-%m', date) = ?''', 
-            (user_id, budget['category'], current_month))
-        result = cursor.fetchone()
-        spent = result['total'] or 0
+        spent = spending.get(budget['category']) or 0
         percentage = (spent / budget['amount']) * 100 if budget['amount'] > 0 else 0
 
         if percentage >= 100:
@@ -58,9 +128,10 @@ def check_budget_alerts(user_id):
             alerts.append(alert_msg)
             
             # Only send email if not already sent today
-            if not has_alert_been_sent_today(user_id, 'budget_danger', budget['category']):
+            if ('budget_danger', budget['category']) not in sent:
+                sent.add(('budget_danger', budget['category']))
                 alerts_to_send.append(alert_msg)
-                record_alert_sent(user_id, 'budget_danger', budget['category'])
+                to_record.append(('budget_danger', budget['category']))
                 
         elif percentage >= 80:
             alert_msg = {'type': 'warning', 'category': budget['category'],
@@ -68,9 +139,31 @@ def check_budget_alerts(user_id):
             alerts.append(alert_msg)
             
             # Only send email if not already sent today
-            if not has_alert_been_sent_today(user_id, 'budget_warning', budget['category']):
+            if ('budget_warning', budget['category']) not in sent:
+                sent.add(('budget_warning', budget['category']))
                 alerts_to_send.append(alert_msg)
-                record_alert_sent(user_id, 'budget_warning', budget['category'])
+                to_record.append(('budget_warning', budget['category']))
+
+    # Warn early about budgets that are still under 80% but on pace to run out
+    flagged = {alert['category'] for alert in alerts}
+    if projections is None:
+        projections = project_budgets(user_id) if budgets else []
+    for projection in projections:
+        if projection['status'] != 'at_risk' or projection['category'] in flagged:
+            continue
+        run_out = f" around {projection['exhaustion_date']}" if projection['exhaustion_date'] else ''
+        alert_msg = {'type': 'info', 'category': projection['category'],
+                     'message': f"At the current pace your {projection['category']} budget will run out{run_out}. "
+                                f"Projected: ${projection['projected']:.2f} / ${projection['budget']:.2f}"}
+        alerts.append(alert_msg)
+
+        if ('budget_forecast', projection['category']) not in sent:
+            sent.add(('budget_forecast', projection['category']))
+            alerts_to_send.append(alert_msg)
+            to_record.append(('budget_forecast', projection['category']))
+
+    if to_record:
+        record_alerts_sent(user_id, to_record)
     
     # Send email only for new alerts
     if alerts_to_send:
@@ -86,36 +179,26 @@ def check_budget_alerts(user_id):
     return alerts
 
 def detect_anomalies(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     anomalies = []
     anomalies_to_send = []
     last_30_days = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-
-    cursor.execute('''SELECT AVG(amount) as avg_amount, category FROM transactions 
-        WHERE user_id = ? AND type = 'expense' AND date >= ? GROUP BY category''', 
-        (user_id, last_30_days))
-    averages = cursor.fetchall()
-
     last_7_days = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
 
-    for avg_row in averages:
-        category = avg_row['category']
-        avg_amount = avg_row['avg_amount']
-        cursor.execute('''SELECT * FROM transactions WHERE user_id = ? AND category = ? 
-            AND type = 'expense' AND date >= ? AND amount > ?''', 
-            (user_id, category, last_7_days, avg_amount * 2))
-        unusual = cursor.fetchall()
-
-        for transaction in unusual:
-            anomaly_msg = {'type': 'info',
-                'message': f"Unusual {category} expense: ${transaction['amount']:.2f} on {transaction['date']}"}
-            anomalies.append(anomaly_msg)
-            
-            # Only send email if not already sent today for this category
-            if not has_alert_been_sent_today(user_id, 'anomaly', category):
-                anomalies_to_send.append(anomaly_msg)
-                record_alert_sent(user_id, 'anomaly', category)
+    unusual = find_unusual_expenses(user_id, last_30_days, last_7_days)
+    sent = alerts_sent_today(user_id) if unusual else set()
+    to_record = []
+    for category, amount, date in unusual:
+        anomaly_msg = {'type': 'info',
+            'message': f"Unusual {category} expense: ${amount:.2f} on {date}"}
+        anomalies.append(anomaly_msg)
+        
+        # Only send email if not already sent today for this category
+        if ('anomaly', category) not in sent:
+            sent.add(('anomaly', category))
+            anomalies_to_send.append(anomaly_msg)
+            to_record.append(('anomaly', category))
+    if to_record:
+        record_alerts_sent(user_id, to_record)
     
     # Send email only for new anomalies
     if anomalies_to_send:
@@ -128,5 +211,4 @@ def detect_anomalies(user_id):
         if anomalies:
             print("Anomaly alert already sent today for this category")
     
-    conn.close()
     return anomalies
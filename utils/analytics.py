@@ -1,50 +1,335 @@
-from models.database import get_db_connection
+from models.database import get_backend, get_db_connection, streaming_cursor
+from utils.columnar_store import get_columnar_store, day_to_iso
+from utils.partitions import source
+from datetime import datetime, date, timedelta
+import heapq
+import numpy as np
+
+# Upper bound on points in a trend series, whatever the date range
+MAX_SERIES_POINTS = 120
+
+# Rows pulled per fetch while streaming a report window
+REPORT_FETCH_SIZE = 2000
+
+# Number of largest expenses listed in a spending report
+TOP_EXPENSES_LIMIT = 5
+
+# Merchants listed on the analytics page
+TOP_MERCHANTS_LIMIT = 10
+
+# SQL expressions mapping a transaction date to the first day of its bucket,
+# finest bucket first; string functions every backend has, except for weeks
+# (None here, see StorageBackend.week_start)
+BUCKET_SQL = {
+    'day': "substr(date, 1, 10)",
+    'week': None,
+    'month': "substr(date, 1, 7) || '-01'",
+    'quarter': """substr(date, 1, 5) || CASE WHEN substr(date, 6, 2) <= '03' THEN '01'
+        WHEN substr(date, 6, 2) <= '06' THEN '04' WHEN substr(date, 6, 2) <= '09' THEN '07' ELSE '10' END || '-01'""",
+    'year': "substr(date, 1, 4) || '-01-01'"
+}
+
+def get_monthly_summary(user_id, month):
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        window = columns.window(*_month_range(month))
+        return {
+            'total_income': float(columns.amounts[window & columns.is_income].sum()),
+            'total_expense': float(columns.amounts[window & columns.is_expense].sum())
+        }
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    first, following = _month_bounds(month)
+    cursor.execute(f'''SELECT 
+        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
+        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense
+        FROM {source(cursor, first, first)} WHERE user_id = ? AND date >= ? AND date < ?''', (user_id, first, following))
+    summary = cursor.fetchone()
+    conn.close()
+    return {
+        'total_income': summary['total_income'] or 0,
+        'total_expense': summary['total_expense'] or 0
+    }
 
 def get_category_breakdown(user_id, month):
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        totals = columns.category_totals(columns.window(*_month_range(month)) & columns.is_expense)
+        return [{'category': category, 'amount': amount} for category, amount in totals.items()]
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''SELECT category, SUM(amount) as total FROM transactions 
-        WHERE user_id = ? AND type = 'expense' AND strftime('%Y-%m', date) = ? 
-        GROUP BY category ORDER BY total DESC''', (user_id, month))
+    first, following = _month_bounds(month)
+    cursor.execute(f'''SELECT category, SUM(amount) as total FROM {source(cursor, first, first)}
+        WHERE user_id = ? AND type = 'expense' AND date >= ? AND date < ?
+        GROUP BY category ORDER BY total DESC''', (user_id, first, following))
     categories = cursor.fetchall()
     conn.close()
     return [{'category': row['category'], 'amount': row['total']} for row in categories]
 
-def generate_spending_report(user_id, start_date):
+def get_merchant_breakdown(user_id, start_date, end_date=None, limit=TOP_MERCHANTS_LIMIT):
+    """Expense totals per canonical merchant in a date window, largest first"""
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute(f'''SELECT m.id, m.name, SUM(t.amount) as total, COUNT(*) as count
+        FROM {source(cursor, start_date, end_date, alias='t')} JOIN merchants m ON m.id = t.merchant_id
+        WHERE t.user_id = ? AND t.type = 'expense' AND t.date >= ? AND t.date <= ?
+        GROUP BY m.id, m.name ORDER BY total DESC LIMIT ?''', (user_id, start_date, end_date or '9999-12-31', limit))
+    merchants = cursor.fetchall()
+    conn.close()
+    return [{'merchant_id': row['id'], 'merchant': row['name'], 'amount': row['total'], 'count': row['count']}
+            for row in merchants]
 
-    cursor.execute('''SELECT 
-        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as total_income,
-        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as total_expense,
-        COUNT(*) as transaction_count
-        FROM transactions WHERE user_id = ? AND date >= ?''', (user_id, start_date))
-    summary = cursor.fetchone()
+def choose_bucket(start_date, end_date, max_points=MAX_SERIES_POINTS):
+    """Pick the finest bucket that keeps the range within max_points"""
+    start, end = _to_date(start_date), _to_date(end_date)
+    for bucket in BUCKET_SQL:
+        if bucket_count(start, end, bucket) <= max_points:
+            return bucket
+    return 'year'
+
+def resolve_bucket(start_date, end_date, bucket):
+    """bucket if it is valid and keeps the range within MAX_SERIES_POINTS,
+    otherwise the finest bucket that does"""
+    if bucket in BUCKET_SQL and bucket_count(_to_date(start_date), _to_date(end_date), bucket) <= MAX_SERIES_POINTS:
+        return bucket
+    return choose_bucket(start_date, end_date)
+
+def bucket_count(start_date, end_date, bucket):
+    """Number of buckets a gap-filled series over the range will have"""
+    first = bucket_start(start_date, bucket)
+    last = bucket_start(end_date, bucket)
+    if bucket == 'day':
+        return (last - first).days + 1
+    if bucket == 'week':
+        return (last - first).days // 7 + 1
+    months = (last.year - first.year) * 12 + last.month - first.month
+    return months // {'month': 1, 'quarter': 3, 'year': 12}[bucket] + 1
+
+def bucket_start(day, bucket):
+    """First day of the bucket containing day (mirrors BUCKET_SQL)"""
+    day = _to_date(day)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+def next_bucket(day, bucket):
+    if bucket == 'day':
+        return day + timedelta(days=1)
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[bucket]
+    month_index = day.month - 1 + months
+    return day.replace(year=day.year + month_index // 12, month=month_index % 12 + 1, day=1)
+
+def get_spending_series(user_id, start_date, end_date=None, bucket='auto'):
+    """Income and expense totals per bucket, gap-filled across the whole range.
+
+    Grouping happens in SQL, so the number of rows read back and the number of
+    points returned depend on the bucket count, not on the number of transactions.
+    """
+    end_date = end_date or date.today().isoformat()
+    bucket = resolve_bucket(start_date, end_date, bucket)
+
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        totals = _column_bucket_totals(columns, columns.window(start_date, end_date), bucket)
+        return {'bucket': bucket, 'points': _fill_series(totals, start_date, end_date, bucket)}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT {BUCKET_SQL[bucket] or get_backend().week_start('date')} as bucket,
+        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
+        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense
+        FROM {source(cursor, start_date, end_date)} WHERE user_id = ? AND date >= ? AND date <= ?
+        GROUP BY bucket''', (user_id, start_date, end_date))
+    totals = {row['bucket']: row for row in cursor.fetchall()}
+    conn.close()
+
+    return {'bucket': bucket, 'points': _fill_series(totals, start_date, end_date, bucket)}
+
+def _fill_series(totals, start_date, end_date, bucket):
+    points = []
+    current = bucket_start(start_date, bucket)
+    last = _to_date(end_date)
+    while current <= last:
+        row = totals.get(current.isoformat())
+        points.append({
+            'date': current.isoformat(),
+            'amount': row['expense'] if row else 0,
+            'income': row['income'] if row else 0
+        })
+        current = next_bucket(current, bucket)
+    return points
+
+def _month_range(month):
+    first = _to_date(f'{month}-01')
+    return first.isoformat(), (next_bucket(first, 'month') - timedelta(days=1)).isoformat()
+
+def _month_bounds(month):
+    """[first day, first day of the next month) of a YYYY-MM month, for SQL range filters"""
+    first = _to_date(f'{month}-01')
+    return first.isoformat(), next_bucket(first, 'month').isoformat()
+
+def _column_bucket_totals(columns, mask, bucket):
+    """Bucketed income/expense totals from columnar data: group by day in
+    NumPy, then fold the (few) distinct days into their buckets"""
+    totals = {}
+    for field, type_mask in (('income', columns.is_income), ('expense', columns.is_expense)):
+        days, sums = columns.day_totals(mask & type_mask)
+        for day, amount in zip(days.tolist(), sums.tolist()):
+            key = _bucket_key(day_to_iso(day), bucket)
+            if key is None:
+                continue
+            bucket_totals = totals.setdefault(key, {'income': 0, 'expense': 0})
+            bucket_totals[field] += amount
+    return totals
 
-    cursor.execute('''SELECT category, SUM(amount) as total FROM transactions 
-        WHERE user_id = ? AND type = 'expense' AND date >= ? 
-        GROUP BY category ORDER BY total DESC''', (user_id, start_date))
-    category_breakdown = cursor.fetchall()
+def _report_from_columns(user_id, columns, start_date, end_date, series_end, bucket):
+    window = columns.window(start_date, end_date)
+    expenses = window & columns.is_expense
+    total_income = float(columns.amounts[window & columns.is_income].sum())
+    total_expense = float(columns.amounts[expenses].sum())
+    days, day_sums = columns.day_totals(expenses)
+    series_totals = _column_bucket_totals(columns, window & columns.window(start_date, series_end), bucket)
 
-    cursor.execute('''SELECT date, SUM(amount) as daily_total FROM transactions 
-        WHERE user_id = ? AND type = 'expense' AND date >= ? 
-        GROUP BY date ORDER BY date''', (user_id, start_date))
-    daily_spending = cursor.fetchall()
+    return {
+        'summary': {
+            'total_income': total_income,
+            'total_expense': total_expense,
+            'net_savings': total_income - total_expense,
+            'transaction_count': int(window.sum())
+        },
+        'category_breakdown': [{'category': category, 'amount': amount}
+                               for category, amount in columns.category_totals(expenses).items()],
+        'daily_spending': [{'date': day_to_iso(day), 'amount': amount}
+                           for day, amount in zip(days.tolist(), day_sums.tolist())],
+        'top_expenses': _top_expense_rows(columns, expenses),
+        'series': {'bucket': bucket, 'points': _fill_series(series_totals, start_date, series_end, bucket)}
+    }
 
-    cursor.execute('''SELECT * FROM transactions WHERE user_id = ? 
-        AND type = 'expense' AND date >= ? ORDER BY amount DESC LIMIT 5''', (user_id, start_date))
-    top_expenses = cursor.fetchall()
+def _top_expense_rows(columns, mask):
+    candidates = np.flatnonzero(mask)
+    if len(candidates) > TOP_EXPENSES_LIMIT:
+        candidates = candidates[np.argpartition(-columns.amounts[candidates], TOP_EXPENSES_LIMIT)[:TOP_EXPENSES_LIMIT]]
+    candidates = candidates[np.argsort(-columns.amounts[candidates], kind='stable')]
+    ids = [int(i) for i in columns.ids[candidates]]
+    if not ids:
+        return []
 
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    days = columns.days[candidates]
+    table = source(cursor, day_to_iso(int(days.min())), day_to_iso(int(days.max())))
+    cursor.execute(f'''SELECT * FROM {table} WHERE id IN ({','.join('?' * len(ids))})''', ids)
+    rows = {row['id']: dict(row) for row in cursor.fetchall()}
     conn.close()
+    return [rows[i] for i in ids if i in rows]
+
+def _bucket_key(day, bucket):
+    try:
+        return bucket_start(day, bucket).isoformat()
+    except ValueError:
+        return None
+
+def _to_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def generate_spending_report(user_id, start_date, end_date=None, bucket='auto'):
+    """Summary, category breakdown, daily totals, top expenses and trend series
+    for a date window, all computed from one streaming scan of the window's rows.
+    """
+    series_end = end_date or date.today().isoformat()
+    bucket = resolve_bucket(start_date, series_end, bucket)
+
+    store = get_columnar_store()
+    if store is not None:
+        return _report_from_columns(user_id, store.get(user_id), start_date, end_date, series_end, bucket)
+
+    conn = get_db_connection()
+    table = source(conn.cursor(), start_date, end_date)
+    cursor = streaming_cursor(conn)
+    # Plain tuples are much cheaper to build than sqlite3.Row on a long scan
+    cursor.row_factory = None
+    cursor.arraysize = REPORT_FETCH_SIZE
+    cursor.execute(f'''SELECT * FROM {table} WHERE user_id = ? AND date >= ? AND date <= ?''',
+                   (user_id, start_date, end_date or '9999-12-31'))
+    columns = [column[0] for column in cursor.description]
+    type_index, amount_index, category_index, date_index = (
+        columns.index(name) for name in ('type', 'amount', 'category', 'date'))
+
+    total_income = 0
+    total_expense = 0
+    transaction_count = 0
+    category_totals = {}
+    daily_totals = {}
+    bucket_totals = {}
+    bucket_keys = {}
+    top_heap = []  # min-heap of (amount, sequence, row) holding the largest expenses
+
+    rows = cursor.fetchmany()
+    while rows:
+        for row in rows:
+            transaction_count += 1
+            amount = row[amount_index]
+            day = row[date_index]
+
+            totals = None
+            if day <= series_end:
+                key = bucket_keys.get(day)
+                if key is None:
+                    key = bucket_keys[day] = _bucket_key(day, bucket)
+                if key is not None:
+                    totals = bucket_totals.get(key)
+                    if totals is None:
+                        totals = bucket_totals[key] = {'income': 0, 'expense': 0}
+
+            transaction_type = row[type_index]
+            if transaction_type == 'income':
+                total_income += amount
+                if totals is not None:
+                    totals['income'] += amount
+            elif transaction_type == 'expense':
+                total_expense += amount
+                if totals is not None:
+                    totals['expense'] += amount
+                category = row[category_index]
+                category_totals[category] = category_totals.get(category, 0) + amount
+                daily_totals[day] = daily_totals.get(day, 0) + amount
+
+                entry = (amount, transaction_count, row)
+                if len(top_heap) < TOP_EXPENSES_LIMIT:
+                    heapq.heappush(top_heap, entry)
+                elif amount > top_heap[0][0]:
+                    heapq.heapreplace(top_heap, entry)
+        rows = cursor.fetchmany()
+
+    conn.close()
+
+    top_expenses = sorted(top_heap, key=lambda entry: (-entry[0], entry[1]))
 
     return {
         'summary': {
-            'total_income': summary['total_income'] or 0,
-            'total_expense': summary['total_expense'] or 0,
-            'net_savings': (summary['total_income'] or 0) - (summary['total_expense'] or 0),
-            'transaction_count': summary['transaction_count']
+            'total_income': total_income,
+            'total_expense': total_expense,
+            'net_savings': total_income - total_expense,
+            'transaction_count': transaction_count
         },
-        'category_breakdown': [{'category': r['category'], 'amount': r['total']} for r in category_breakdown],
-        'daily_spending': [{'date': r['date'], 'amount': r['daily_total']} for r in daily_spending],
-        'top_expenses': [dict(r) for r in top_expenses]
+        'category_breakdown': [{'category': category, 'amount': total} for category, total in
+                               sorted(category_totals.items(), key=lambda item: item[1], reverse=True)],
+        'daily_spending': [{'date': day, 'amount': daily_totals[day]} for day in sorted(daily_totals)],
+        'top_expenses': [dict(zip(columns, entry[2])) for entry in top_expenses],
+        'series': {'bucket': bucket, 'points': _fill_series(bucket_totals, start_date, series_end, bucket)}
     }
@@ -0,0 +1,278 @@
+"""
+Columnar in-memory cache of each user's transactions
+
+Analytics, alerts and forecasting all reduce the same per-user rows. Instead of
+pulling them through sqlite3.Row on every request, a user's history is loaded
+once into NumPy arrays (date as day numbers, amount as float64, category as
+small-int codes, type as a bool) so group-bys become bincount calls.
+
+The cache is optional: set ENABLE_COLUMNAR_CACHE=True to turn it on. Entries are
+validated against the per-user data version, extended in place when this
+process writes a row, and evicted when idle or when the memory budget is hit.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from models.database import get_db_connection, get_data_version
+from utils.partitions import source
+
+# Day number used for dates that cannot be parsed, so they never fall in a window
+INVALID_DAY = np.iinfo(np.int32).min
+
+
+def day_number(value):
+    """Days since 1970-01-01 for an ISO date string"""
+    return int(np.datetime64(value[:10], 'D').astype(np.int64))
+
+
+def day_to_iso(day):
+    return str(np.datetime64(int(day), 'D'))
+
+
+def parse_days(dates):
+    """Day numbers for ISO date strings, INVALID_DAY where a date cannot be parsed"""
+    try:
+        return np.array([d[:10] for d in dates], dtype='datetime64[D]').astype(np.int32)
+    except (ValueError, TypeError):
+        days = np.empty(len(dates), dtype=np.int32)
+        for i, value in enumerate(dates):
+            try:
+                days[i] = day_number(value)
+            except (ValueError, TypeError):
+                days[i] = INVALID_DAY
+        return days
+
+
+class UserColumns:
+    """One user's transactions as parallel NumPy arrays.
+
+    Rows live in buffers with spare capacity that doubles when full, so
+    appending a row is amortized O(1); the public arrays are views of the
+    first len(self) rows.
+    """
+
+    _COLUMNS = ('ids', 'days', 'amounts', 'category_codes', 'is_expense', 'is_income')
+
+    def __init__(self, ids, dates, amounts, categories, types, version):
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._days = parse_days(dates)
+        self._amounts = np.asarray(amounts, dtype=np.float64)
+        self.categories, codes = np.unique(np.asarray(categories, dtype=object), return_inverse=True)
+        self.categories = list(self.categories)
+        self._category_codes = codes.astype(np.int16).reshape(-1)
+        self._is_expense = np.asarray([t == 'expense' for t in types], dtype=bool)
+        self._is_income = np.asarray([t == 'income' for t in types], dtype=bool)
+        self._length = len(self._ids)
+        self.version = version
+        self.last_access = time.monotonic()
+
+    ids = property(lambda self: self._ids[:self._length])
+    days = property(lambda self: self._days[:self._length])
+    amounts = property(lambda self: self._amounts[:self._length])
+    category_codes = property(lambda self: self._category_codes[:self._length])
+    is_expense = property(lambda self: self._is_expense[:self._length])
+    is_income = property(lambda self: self._is_income[:self._length])
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def nbytes(self):
+        arrays = [getattr(self, '_' + name) for name in self._COLUMNS]
+        return sum(a.nbytes for a in arrays) + sum(len(c) + 49 for c in self.categories)
+
+    def append(self, transaction_id, date, amount, category, transaction_type):
+        if category not in self.categories:
+            self.categories.append(category)
+        if self._length == len(self._ids):
+            self._grow(max(2 * self._length, 16))
+        row = self._length
+        self._ids[row] = transaction_id
+        self._days[row] = parse_days([date])[0]
+        self._amounts[row] = float(amount)
+        self._category_codes[row] = self.categories.index(category)
+        self._is_expense[row] = transaction_type == 'expense'
+        self._is_income[row] = transaction_type == 'income'
+        self._length += 1
+
+    def _grow(self, capacity):
+        for name in self._COLUMNS:
+            current = getattr(self, '_' + name)
+            grown = np.empty(capacity, dtype=current.dtype)
+            grown[:self._length] = current[:self._length]
+            setattr(self, '_' + name, grown)
+
+    def window(self, start_date, end_date=None):
+        """Boolean mask of rows dated within [start_date, end_date]"""
+        mask = self.days >= day_number(start_date)
+        if end_date:
+            mask &= self.days <= day_number(end_date)
+        return mask
+
+    def category_totals(self, mask):
+        """{category: summed amount} for masked rows, largest first"""
+        sums = np.bincount(self.category_codes[mask], weights=self.amounts[mask],
+                           minlength=len(self.categories))
+        counts = np.bincount(self.category_codes[mask], minlength=len(self.categories))
+        totals = {self.categories[i]: float(sums[i]) for i in np.flatnonzero(counts)}
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def day_totals(self, mask):
+        """(sorted unique day numbers, summed amounts per day) for masked rows"""
+        days, inverse = np.unique(self.days[mask], return_inverse=True)
+        return days, np.bincount(inverse.reshape(-1), weights=self.amounts[mask], minlength=len(days))
+
+
+class ColumnarStore:
+    """Process-local cache of UserColumns with memory accounting and eviction"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, idle_seconds=1800):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # user_id -> lock held while that user's columns are being loaded
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Current columns for the user, reloading them if their data changed.
+        Concurrent misses for one user wait for a single load."""
+        version = get_data_version(user_id)
+        with self._lock:
+            columns = self._current(user_id, version)
+            if columns is not None:
+                self.hits += 1
+                return columns
+            self.misses += 1
+            loading = self._loading.setdefault(user_id, threading.Lock())
+
+        with loading:
+            with self._lock:
+                columns = self._current(user_id, version)
+            if columns is not None:
+                return columns
+            try:
+                columns = self._load(user_id, version)
+                with self._lock:
+                    self._users[user_id] = columns
+                    self._users.move_to_end(user_id)
+                    self._evict()
+            finally:
+                # Also when the load failed, or the lock would stay behind for good
+                with self._lock:
+                    if self._loading.get(user_id) is loading:
+                        del self._loading[user_id]
+        return columns
+
+    def _current(self, user_id, version):
+        # Called with the lock held
+        columns = self._users.get(user_id)
+        if columns is None or columns.version != version:
+            return None
+        columns.last_access = time.monotonic()
+        self._users.move_to_end(user_id)
+        return columns
+
+    def record_insert(self, user_id, transaction_id, date, amount, category, transaction_type):
+        """Extend a cached user in place after this process inserted one row.
+
+        If anything else changed the user's data since the cache was filled, the
+        entry is dropped instead and rebuilt on the next read.
+        """
+        version = get_data_version(user_id)
+        with self._lock:
+            columns = self._users.get(user_id)
+            if columns is None:
+                return
+            if columns.version != version - 1:
+                del self._users[user_id]
+                return
+            columns.append(transaction_id, date, amount, category, transaction_type)
+            columns.version = version
+            self._evict()
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self._users),
+                'bytes': sum(c.nbytes for c in self._users.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+    def _load(self, user_id, version):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(f'''SELECT id, date, amount, category, type FROM {source(cursor)}
+            WHERE user_id = ? ORDER BY date, id''', (user_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        if rows:
+            ids, dates, amounts, categories, types = zip(*rows)
+        else:
+            ids, dates, amounts, categories, types = (), (), (), (), ()
+        return UserColumns(ids, dates, amounts, categories, types, version)
+
+    def _evict(self):
+        # Called with the lock held; drop idle users, then least recently used
+        # ones until the cache fits its memory budget (always keeping one user)
+        now = time.monotonic()
+        for user_id in [u for u, c in self._users.items() if now - c.last_access > self.idle_seconds]:
+            del self._users[user_id]
+            self.evictions += 1
+        total = sum(c.nbytes for c in self._users.values())
+        while total > self.max_bytes and len(self._users) > 1:
+            _, columns = self._users.popitem(last=False)
+            total -= columns.nbytes
+            self.evictions += 1
+
+
+_store = None
+_store_configured = False
+
+
+def get_columnar_store():
+    """The shared ColumnarStore, or None when the cache is disabled"""
+    global _store, _store_configured
+    if not _store_configured:
+        if os.environ.get('ENABLE_COLUMNAR_CACHE', 'False').lower() in ('1', 'true', 'yes'):
+            _store = ColumnarStore(
+                max_bytes=int(os.environ.get('COLUMNAR_CACHE_MB', '64')) * 1024 * 1024,
+                idle_seconds=int(os.environ.get('COLUMNAR_CACHE_IDLE_SECONDS', '1800'))
+            )
+        _store_configured = True
+    return _store
+
+
+def set_columnar_store(store):
+    """Install a store explicitly (or None to disable), e.g. from tests"""
+    global _store, _store_configured
+    _store = store
+    _store_configured = True
+
+
+def record_insert(user_id, transaction_id, date, amount, category, transaction_type):
+    """Write-path hook: keep the cache in step with a newly inserted transaction"""
+    store = get_columnar_store()
+    if store is not None:
+        store.record_insert(user_id, transaction_id, date, amount, category, transaction_type)
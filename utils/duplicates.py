@@ -0,0 +1,144 @@
+"""
+Near-duplicate transaction detection
+
+Two transactions of the same type are taken to be the same purchase when they
+share a user, a date, a merchant and an amount rounded to whole units: the same
+receipt uploaded twice, or a statement row matching a manual entry. Writes look
+the new row up in the (user_id, date, whole amount, merchant_id) index, one
+B-tree search, and set duplicate_of to the earlier transaction's id rather
+than refusing the row, since two identical coffees on one day do happen.
+Batch writes look a whole batch up at once with find_duplicates: one range
+scan of the index per few hundred merchants instead of one search per row.
+
+duplicate_of is NULL for rows not flagged, the original's id for a suspected
+duplicate and 0 once the user has kept a flagged row, which is never flagged
+again. The sweep applies the same rule to existing rows by walking the index
+in order, so each group of duplicates is a run of consecutive rows.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from models.database import get_backend, get_db_connection
+from .partitions import source
+
+# Rows per fetch and per commit in the sweep
+SWEEP_CHUNK_SIZE = 5000
+
+# Merchant ids per find_duplicates IN (...) query
+_QUERY_CHUNK = 500
+
+
+def find_duplicate(cursor, user_id, date, amount, merchant_id, transaction_type='expense', before_id=None):
+    """Id of an existing transaction this one would duplicate, or None.
+
+    before_id limits the search to rows up to that id, so a batch write can
+    check against what existed before it started without matching itself.
+    """
+    if merchant_id is None:
+        return None
+    whole_amount = get_backend().whole_amount
+    query = f'''SELECT id FROM {source(cursor, date, date)}
+        WHERE user_id = ? AND date = ? AND {whole_amount('amount')} = {whole_amount('?')}
+        AND merchant_id = ? AND type = ? AND (duplicate_of IS NULL OR duplicate_of = 0)'''
+    params = [user_id, date, amount, merchant_id, transaction_type]
+    if before_id is not None:
+        query += ' AND id <= ?'
+        params.append(before_id)
+    cursor.execute(query + ' ORDER BY id LIMIT 1', params)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _whole(amount):
+    """amount rounded as the backend's whole_amount SQL rounds it, halves away from zero"""
+    return int(Decimal(str(amount)).to_integral_value(ROUND_HALF_UP))
+
+
+def find_duplicates(cursor, user_id, rows, before_id=None):
+    """find_duplicate for a batch: rows are (date, amount, merchant_id, type)
+    and the result lists, in order, the id each would duplicate or None.
+    Rows are matched only against existing transactions, not each other."""
+    wanted = {}
+    for date, amount, merchant_id, transaction_type in rows:
+        if merchant_id is not None:
+            wanted.setdefault(merchant_id, []).append(date)
+    found = {}
+    merchants = sorted(wanted)
+    sql_amount = get_backend().whole_amount('amount')
+    for offset in range(0, len(merchants), _QUERY_CHUNK):
+        chunk = merchants[offset:offset + _QUERY_CHUNK]
+        start = min(min(wanted[merchant_id]) for merchant_id in chunk)
+        end = max(max(wanted[merchant_id]) for merchant_id in chunk)
+        query = f'''SELECT date, {sql_amount}, merchant_id, type, MIN(id) FROM {source(cursor, start, end)}
+            WHERE user_id = ? AND date BETWEEN ? AND ? AND merchant_id IN ({','.join('?' * len(chunk))})
+            AND (duplicate_of IS NULL OR duplicate_of = 0)'''
+        params = [user_id, start, end, *chunk]
+        if before_id is not None:
+            query += ' AND id <= ?'
+            params.append(before_id)
+        cursor.execute(query + f' GROUP BY date, {sql_amount}, merchant_id, type', params)
+        found.update((tuple(row[:4]), row[4]) for row in cursor.fetchall())
+    return [found.get((date, _whole(amount), merchant_id, transaction_type)) if merchant_id is not None else None
+            for date, amount, merchant_id, transaction_type in rows]
+
+
+def last_transaction_id(cursor):
+    """Highest transaction id so far, archived ones included: the before_id for a batch about to be written"""
+    cursor.execute('''SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM transactions
+        UNION ALL SELECT MAX(max_id) FROM transaction_partitions) AS ids''')
+    return cursor.fetchone()[0] or 0
+
+
+def count_flagged(cursor, user_id, after_id):
+    """Flagged rows a batch write added: the user's flagged rows with ids above after_id"""
+    cursor.execute('SELECT COUNT(*) FROM transactions WHERE id > ? AND user_id = ? AND duplicate_of > 0',
+                   (after_id, user_id))
+    return cursor.fetchone()[0]
+
+
+def sweep_duplicates(user_id=None, dry_run=False, progress=None):
+    """Flag duplicates among existing transactions in one ordered pass.
+
+    Rows without a merchant are skipped (see assign_merchants). Returns the
+    number of rows flagged, or that would be with dry_run. progress, if given,
+    is called with (rows scanned, rows flagged) after each chunk.
+    """
+    conn = get_db_connection()
+    read = conn.cursor()
+    write = conn.cursor()
+    # The ORDER BY matches idx_transactions_duplicate, so no sort is needed
+    whole_amount = get_backend().whole_amount('amount')
+    query = f'''SELECT id, user_id, date, {whole_amount}, merchant_id, type, duplicate_of
+        FROM transactions WHERE merchant_id IS NOT NULL'''
+    params = []
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    read.execute(query + f' ORDER BY user_id, date, {whole_amount}, merchant_id, id', params)
+
+    scanned = flagged = 0
+    # Runs can interleave expense and income rows, so keep the first of each type
+    group, originals = None, {}
+    while True:
+        rows = read.fetchmany(SWEEP_CHUNK_SIZE)
+        if not rows:
+            break
+        updates = []
+        for transaction_id, owner, date, whole_amount, merchant_id, transaction_type, duplicate_of in rows:
+            key = (owner, date, whole_amount, merchant_id)
+            if key != group:
+                group, originals = key, {}
+            if duplicate_of:
+                continue
+            original = originals.setdefault(transaction_type, transaction_id)
+            if original != transaction_id and duplicate_of is None:
+                updates.append((original, transaction_id))
+        scanned += len(rows)
+        flagged += len(updates)
+        if updates and not dry_run:
+            write.executemany('UPDATE transactions SET duplicate_of = ? WHERE id = ?', updates)
+            conn.commit()
+        if progress:
+            progress(scanned, flagged)
+    conn.close()
+    return flagged
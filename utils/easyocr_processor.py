@@ -12,6 +12,8 @@ from datetime import datetime
 import os
 import logging
 from typing import Dict, Optional, Tuple, List
+from utils.metrics import OCR_STAGE_SECONDS, OCR_CONFIDENCE, OCR_RECEIPTS
+from utils.tracing import span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,7 +38,8 @@ def get_ocr_reader(languages=['en']):
     if _reader is None:
         logger.info(f"Initializing EasyOCR reader for languages: {languages}")
         try:
-            _reader = easyocr.Reader(languages, gpu=False)
+            with span('load_model', languages=languages), OCR_STAGE_SECONDS.labels('easyocr', 'load_model').time():
+                _reader = easyocr.Reader(languages, gpu=False)
             logger.info("EasyOCR reader initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize EasyOCR: {str(e)}")
@@ -61,32 +64,7 @@ def preprocess_image(image_path: str) -> np.ndarray:
         if img is None:
             raise ValueError(f"Could not read image: {image_path}")
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply denoising
-        denoised = cv2.fastNlMeansDenoising(gray, h=10)
-        
-        # Apply adaptive thresholding for better text contrast
-        thresh = cv2.adaptiveThreshold(
-            denoised,
-            255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            11,
-            2
-        )
-        
-        # Apply morphological operations to improve text
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-        morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        
-        # Upscale if image is small
-        height = morph.shape[0]
-        if height < 300:
-            scale_factor = 2
-            morph = cv2.resize(morph, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_CUBIC)
-        
+        morph = preprocess_array(img)
         logger.info(f"Image preprocessed successfully: {morph.shape}")
         return morph
         
@@ -95,6 +73,45 @@ def preprocess_image(image_path: str) -> np.ndarray:
         raise
 
 
+def preprocess_array(img: np.ndarray) -> np.ndarray:
+    """
+    Denoise, threshold and upscale an already loaded BGR or grayscale image
+    
+    Args:
+        img: Image as read by cv2.imread, or a 2-D grayscale array
+        
+    Returns:
+        np.ndarray: Preprocessed image
+    """
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    
+    # Apply denoising
+    denoised = cv2.fastNlMeansDenoising(gray, h=10)
+    
+    # Apply adaptive thresholding for better text contrast
+    thresh = cv2.adaptiveThreshold(
+        denoised,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        11,
+        2
+    )
+    
+    # Apply morphological operations to improve text
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+    morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    
+    # Upscale if image is small
+    height = morph.shape[0]
+    if height < 300:
+        scale_factor = 2
+        morph = cv2.resize(morph, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_CUBIC)
+    
+    return morph
+
+
 def extract_text_with_confidence(image_path: str, languages=['en']) -> Tuple[str, float]:
     """
     Extract text from image using EasyOCR with confidence scoring
@@ -110,10 +127,14 @@ def extract_text_with_confidence(image_path: str, languages=['en']) -> Tuple[str
         reader = get_ocr_reader(languages)
         
         # Preprocess the image
-        processed_img = preprocess_image(image_path)
+        with span('preprocess') as stage, OCR_STAGE_SECONDS.labels('easyocr', 'preprocess').time():
+            processed_img = preprocess_image(image_path)
+            stage.set(shape=list(processed_img.shape))
         
-        # Run OCR
-        results = reader.readtext(processed_img, detail=1)
+        # Run OCR (text detection and recognition)
+        with span('readtext') as stage, OCR_STAGE_SECONDS.labels('easyocr', 'recognize').time():
+            results = reader.readtext(processed_img, detail=1)
+            stage.set(elements=len(results))
         
         if not results:
             logger.warning("No text detected in image")
@@ -177,6 +198,7 @@ def extract_receipt_data(image_path: str) -> Dict:
         
         if not text or text.strip() == '':
             logger.warning("No text extracted from receipt")
+            OCR_RECEIPTS.labels('easyocr', 'empty').inc()
             return {
                 'amount': 0.0,
                 'date': datetime.now().strftime('%Y-%m-%d'),
@@ -188,9 +210,18 @@ def extract_receipt_data(image_path: str) -> Dict:
             }
         
         # Extract structured data
-        amount = extract_amount(text)
-        date = extract_date(text)
-        merchant = extract_merchant(text)
+        with OCR_STAGE_SECONDS.labels('easyocr', 'parse').time():
+            with span('parse_amount') as stage:
+                amount = extract_amount(text)
+                stage.set(amount=amount)
+            with span('parse_date') as stage:
+                date = extract_date(text)
+                stage.set(date=date)
+            with span('parse_merchant') as stage:
+                merchant = extract_merchant(text)
+                stage.set(merchant=merchant)
+        OCR_CONFIDENCE.labels('easyocr').observe(confidence)
+        OCR_RECEIPTS.labels('easyocr', 'ok').inc()
         
         logger.info(f"Extracted - Amount: {amount}, Date: {date}, Merchant: {merchant}")
         
@@ -205,6 +236,7 @@ def extract_receipt_data(image_path: str) -> Dict:
         
     except Exception as e:
         logger.error(f"Error processing receipt: {str(e)}")
+        OCR_RECEIPTS.labels('easyocr', 'error').inc()
         return {
             'amount': 0.0,
             'date': datetime.now().strftime('%Y-%m-%d'),
@@ -3,9 +3,12 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
+import time
+from utils.metrics import record_email
 
 def send_email(to_email, subject, html_content, text_content=None):
     """Send email using SMTP"""
+    started = time.perf_counter()
     try:
         # Email configuration (these should be set as environment variables)
         smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
@@ -16,6 +19,7 @@ def send_email(to_email, subject, html_content, text_content=None):
         
         if not smtp_username or not smtp_password:
             print("SMTP credentials not configured. Email not sent.")
+            record_email('basic', started, 'unconfigured')
             return False
         
         # Create message
@@ -41,10 +45,12 @@ def send_email(to_email, subject, html_content, text_content=None):
         server.quit()
         
         print(f"Email sent successfully to {to_email}")
+        record_email('basic', started, 'sent')
         return True
         
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
+        record_email('basic', started, 'failed')
         return False
 
 def get_user_email(user_id):
@@ -13,7 +13,9 @@ from email import encoders
 from dotenv import load_dotenv
 from typing import List, Optional, Dict, Any
 import json
+import time
 from datetime import datetime
+from utils.metrics import record_email
 
 # Load environment variables
 load_dotenv()
@@ -160,6 +162,7 @@ class EmailService:
     
     def _send_message(self, msg: MIMEMultipart, recipients: List[str]) -> Dict[str, Any]:
         """Send the email message"""
+        started = time.perf_counter()
         try:
             # Create SMTP session
             server = smtplib.SMTP(self.smtp_server, self.smtp_port)
@@ -172,6 +175,7 @@ class EmailService:
             server.quit()
             
             logger.info(f"Email sent successfully to {', '.join(recipients)}")
+            record_email('enhanced', started, 'sent')
             
             return {
                 'success': True,
@@ -183,16 +187,19 @@ class EmailService:
         except smtplib.SMTPAuthenticationError as e:
             error_msg = f"Authentication failed: {str(e)}"
             logger.error(error_msg)
+            record_email('enhanced', started, 'failed')
             return {'success': False, 'error': error_msg}
             
         except smtplib.SMTPConnectError as e:
             error_msg = f"Connection failed: {str(e)}"
             logger.error(error_msg)
+            record_email('enhanced', started, 'failed')
             return {'success': False, 'error': error_msg}
             
         except Exception as e:
             error_msg = f"Failed to send email: {str(e)}"
             logger.error(error_msg)
+            record_email('enhanced', started, 'failed')
             return {'success': False, 'error': error_msg}
     
     def send_template(self, template_name: str, recipients: List[str], 
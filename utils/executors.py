@@ -0,0 +1,114 @@
+"""
+Bounded thread pools for blocking work started by async views
+
+An async view must not block the event loop it runs on, so its SQL, SMTP
+and OCR calls go to one of these pools with 'await run(pool, fn, ...)'. Each
+pool has a fixed number of threads and a cap on waiting work:
+
+    default  SQL and file work for the JSON API   ASYNC_DEFAULT_THREADS (8)
+    email    SMTP sends                           ASYNC_EMAIL_THREADS (16)
+    ocr      receipt OCR, CPU and memory heavy    ASYNC_OCR_THREADS (1)
+    wsgi     sync views served by asgi.py         ASYNC_WSGI_THREADS (4)
+
+When a pool already has ASYNC_QUEUE_LIMIT calls waiting, submit raises Busy
+and the app answers 503 instead of piling up work it cannot finish. A slow
+SMTP server then only holds email threads, not the connections or the
+threads that serve everything else.
+
+Calls run in a copy of the caller's context, so the Flask request, the
+request's query profile and tracing spans are visible in the pool thread;
+spawn starts work that outlives the request without them. Pools are created
+on first use, after any fork of a server worker.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import metrics
+
+THREADS = {
+    'default': int(os.environ.get('ASYNC_DEFAULT_THREADS', '8')),
+    'email': int(os.environ.get('ASYNC_EMAIL_THREADS', '16')),
+    'ocr': int(os.environ.get('ASYNC_OCR_THREADS', '1')),
+    'wsgi': int(os.environ.get('ASYNC_WSGI_THREADS', '4')),
+}
+
+# Calls a pool holds beyond those running before it refuses more
+QUEUE_LIMIT = int(os.environ.get('ASYNC_QUEUE_LIMIT', '256'))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """A pool's queue is full; the request should be retried later"""
+
+    def __init__(self, pool):
+        super().__init__(f'The {pool} pool is busy')
+        self.pool = pool
+
+
+class BoundedExecutor:
+    """A thread pool that refuses work past threads + queue_limit calls"""
+
+    def __init__(self, name, threads, queue_limit):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max(threads, 1), thread_name_prefix=f'{name}-pool')
+        self._slots = threading.BoundedSemaphore(max(threads, 1) + queue_limit)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise Busy(self.name)
+        metrics.EXECUTOR_CALLS.labels(self.name).inc()
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        metrics.EXECUTOR_CALLS.labels(self.name).dec()
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+
+def executor(name):
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = BoundedExecutor(name, THREADS.get(name, THREADS['default']), QUEUE_LIMIT)
+    return pool
+
+
+def submit(name, fn, *args, **kwargs):
+    """Run fn on a pool without waiting for it; returns a concurrent.futures.Future"""
+    return executor(name).submit(fn, *args, **kwargs)
+
+
+def spawn(name, fn, *args, **kwargs):
+    """Like submit, for work that outlives the request: fn runs outside the
+    request's context, so it is neither profiled nor traced as part of it"""
+    return contextvars.Context().run(submit, name, fn, *args, **kwargs)
+
+
+async def run(name, fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) run on a pool"""
+    return await asyncio.wrap_future(executor(name).submit(fn, *args, **kwargs))
+
+
+def shutdown(wait=True):
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait)
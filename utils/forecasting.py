@@ -0,0 +1,226 @@
+"""
+Spending forecasts and budget burn-rate projections
+
+Daily expense totals for every category are smoothed together with additive
+Holt-Winters (level, damped trend and a weekly season) as NumPy vectors, one
+row per category. The smoothed state projects the rest of the month, which
+gives a projected month-end spend per category and the date each monthly
+budget is expected to run out.
+
+Smoothing state is cached per user and advanced only over days completed since
+the last run, so the dashboard does not pay for a full refit on every request.
+It is rebuilt from scratch when the user's data version changes.
+"""
+
+import threading
+from calendar import monthrange
+from datetime import date, timedelta
+
+import numpy as np
+
+from models.database import get_db_connection, get_data_version
+from .columnar_store import get_columnar_store, day_number, day_to_iso
+from .partitions import source
+
+# Smoothing parameters: level, trend, season, trend damping
+ALPHA = 0.3
+BETA = 0.05
+GAMMA = 0.2
+PHI = 0.9
+
+SEASON_LENGTH = 7
+
+# Days of history used to fit the model
+HISTORY_DAYS = 84
+
+# Projected share of a budget at which it is flagged as at risk
+AT_RISK_RATIO = 1.0
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+class SmoothingState:
+    """Holt-Winters state for a set of categories through a given day"""
+
+    def __init__(self, categories, level, trend, season, through_day, version):
+        self.categories = categories
+        self.level = level
+        self.trend = trend
+        self.season = season
+        self.through_day = through_day
+        self.version = version
+
+    def copy(self):
+        return SmoothingState(self.categories, self.level.copy(), self.trend.copy(),
+                              self.season.copy(), self.through_day, self.version)
+
+    def advance(self, observations, first_day):
+        """Fold in a (categories x days) block of daily totals starting at first_day"""
+        for offset in range(observations.shape[1]):
+            slot = (first_day + offset) % SEASON_LENGTH
+            y = observations[:, offset]
+            seasonal = self.season[:, slot]
+            level = ALPHA * (y - seasonal) + (1 - ALPHA) * (self.level + PHI * self.trend)
+            self.trend = BETA * (level - self.level) + (1 - BETA) * PHI * self.trend
+            self.season[:, slot] = GAMMA * (y - level) + (1 - GAMMA) * seasonal
+            self.level = level
+        self.through_day = first_day + observations.shape[1] - 1
+
+    def forecast(self, horizon):
+        """(categories x horizon) daily forecasts for the days after through_day"""
+        steps = np.arange(1, horizon + 1)
+        damped = np.cumsum(PHI ** steps)
+        slots = (self.through_day + steps) % SEASON_LENGTH
+        values = self.level[:, None] + self.trend[:, None] * damped[None, :] + self.season[:, slots]
+        return np.clip(values, 0, None)
+
+
+def daily_expense_matrix(user_id, first_day, last_day, categories=None):
+    """(categories, matrix) of expense totals per category per day, days given as day numbers"""
+    days = last_day - first_day + 1
+    store = get_columnar_store()
+    if store is not None:
+        columns = store.get(user_id)
+        mask = columns.is_expense & (columns.days >= first_day) & (columns.days <= last_day)
+        names = categories or sorted({columns.categories[c] for c in np.unique(columns.category_codes[mask])})
+        index = {name: i for i, name in enumerate(names)}
+        code_map = np.array([index.get(name, -1) for name in columns.categories] or [-1], dtype=np.int64)
+        rows = code_map[columns.category_codes[mask]]
+        keep = rows >= 0
+        matrix = np.zeros((len(names), days))
+        np.add.at(matrix, (rows[keep], columns.days[mask][keep] - first_day), columns.amounts[mask][keep])
+        return names, matrix
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    start, end = day_to_iso(first_day), day_to_iso(last_day)
+    cursor.execute(f'''SELECT category, date, SUM(amount) as total FROM {source(cursor, start, end)}
+        WHERE user_id = ? AND type = 'expense' AND date >= ? AND date <= ?
+        GROUP BY category, date''', (user_id, start, end))
+    totals = cursor.fetchall()
+    conn.close()
+
+    names = categories or sorted({row['category'] for row in totals})
+    index = {name: i for i, name in enumerate(names)}
+    matrix = np.zeros((len(names), days))
+    for row in totals:
+        if row['category'] in index:
+            matrix[index[row['category']], day_number(row['date']) - first_day] += row['total']
+    return names, matrix
+
+
+def fit_state(user_id, through_day, version):
+    first_day = through_day - HISTORY_DAYS + 1
+    categories, history = daily_expense_matrix(user_id, first_day, through_day)
+    warmup = history[:, :SEASON_LENGTH]
+    level = warmup.mean(axis=1)
+    season = np.zeros((len(categories), SEASON_LENGTH))
+    for offset in range(SEASON_LENGTH):
+        season[:, (first_day + offset) % SEASON_LENGTH] = warmup[:, offset] - level
+    state = SmoothingState(categories, level, np.zeros(len(categories)), season, first_day + SEASON_LENGTH - 1, version)
+    state.advance(history[:, SEASON_LENGTH:], first_day + SEASON_LENGTH)
+    return state
+
+
+def get_state(user_id, through_day):
+    """Smoothing state through through_day, reusing and advancing the cached one when possible"""
+    version = get_data_version(user_id)
+    with _states_lock:
+        state = _states.get(user_id)
+
+    if state is None or state.version != version or state.through_day > through_day:
+        state = fit_state(user_id, through_day, version)
+    elif state.through_day < through_day:
+        _, recent = daily_expense_matrix(user_id, state.through_day + 1, through_day, state.categories)
+        state = state.copy()
+        state.advance(recent, state.through_day + 1)
+
+    with _states_lock:
+        _states[user_id] = state
+    return state
+
+
+def forecast_month(user_id, today=None):
+    """Projected month-end expense per category.
+
+    Returns {'month', 'as_of', 'categories': {name: {...}}} where each category
+    has 'spent' (month to date), 'spent_before_today', 'projected' (month end)
+    and 'daily_forecast' covering today through the end of the month.
+    """
+    today = today or date.today()
+    today_day = day_number(today.isoformat())
+    month_start = day_number(today.replace(day=1).isoformat())
+    month_end = month_start + monthrange(today.year, today.month)[1] - 1
+
+    state = get_state(user_id, today_day - 1)
+    forecast = dict(zip(state.categories, state.forecast(month_end - today_day + 1)))
+    names, actual = daily_expense_matrix(user_id, month_start, today_day)
+    actual = dict(zip(names, actual))
+    no_spend = np.zeros(today_day - month_start + 1)
+    no_forecast = np.zeros(month_end - today_day + 1)
+
+    categories = {}
+    for name in sorted(set(forecast) | set(actual)):
+        spent = actual.get(name, no_spend)
+        # Today is still in progress: count whichever is larger, spend so far or forecast
+        remaining = forecast.get(name, no_forecast).copy()
+        remaining[0] = max(remaining[0], spent[-1])
+        spent_before_today = float(spent[:-1].sum())
+        categories[name] = {
+            'spent': spent_before_today + float(spent[-1]),
+            'spent_before_today': spent_before_today,
+            'projected': spent_before_today + float(remaining.sum()),
+            'daily_forecast': remaining
+        }
+    return {'month': today.strftime('%Y-%m'), 'as_of': today.isoformat(), 'categories': categories}
+
+
+def project_budgets(user_id, today=None):
+    """Burn-rate projection for each monthly budget, sorted by urgency.
+
+    Each entry has the budget, spend so far, projected month-end spend and the
+    date the budget is expected to be exhausted (None if it should last the
+    month or is already exceeded).
+    """
+    today = today or date.today()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT category, amount FROM budgets WHERE user_id = ? AND period = 'monthly'", (user_id,))
+    budgets = cursor.fetchall()
+    conn.close()
+    if not budgets:
+        return []
+
+    forecast = forecast_month(user_id, today)['categories']
+    projections = []
+    for budget in budgets:
+        category = forecast.get(budget['category'])
+        spent = category['spent'] if category else 0
+        projected = category['projected'] if category else 0
+        exhaustion_date = None
+
+        if budget['amount'] > 0 and spent >= budget['amount']:
+            status = 'exceeded'
+        else:
+            if category is not None and budget['amount'] > 0:
+                cumulative = category['spent_before_today'] + np.cumsum(category['daily_forecast'])
+                crossing = np.flatnonzero(cumulative >= budget['amount'])
+                if len(crossing):
+                    exhaustion_date = (today + timedelta(days=int(crossing[0]))).isoformat()
+            at_risk = budget['amount'] > 0 and projected >= budget['amount'] * AT_RISK_RATIO
+            status = 'at_risk' if at_risk else 'on_track'
+
+        projections.append({
+            'category': budget['category'],
+            'budget': budget['amount'],
+            'spent': round(spent, 2),
+            'projected': round(projected, 2),
+            'projected_percentage': round(projected / budget['amount'] * 100, 1) if budget['amount'] > 0 else 0,
+            'exhaustion_date': exhaustion_date,
+            'status': status
+        })
+
+    urgency = {'exceeded': 0, 'at_risk': 1, 'on_track': 2}
+    projections.sort(key=lambda p: (urgency[p['status']], p['exhaustion_date'] or '9999-12-31'))
+    return projections
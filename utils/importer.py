@@ -0,0 +1,289 @@
+"""
+Bank statement import (CSV and OFX/QFX)
+
+Statements are parsed as a stream of rows, never loaded whole, and handled in
+chunks: each chunk is categorized with one categorize_batch call, linked to
+merchants, checked for duplicates with one find_duplicates lookup and inserted
+with a single executemany inside one transaction.
+
+Every imported row carries an import_hash, unique per user. It is built from
+the bank's transaction id (OFX FITID) when there is one, otherwise from the
+date, amount and description plus a counter for identical rows within the
+file, so importing an overlapping or repeated statement skips the rows that
+are already there while two identical coffees on one day both import.
+"""
+
+import csv
+import hashlib
+import io
+import re
+from datetime import datetime
+from functools import lru_cache
+
+from models.database import get_db_connection
+from .ai_categorizer import categorize_batch
+from .merchants import resolve_merchant_id
+from .duplicates import find_duplicates, last_transaction_id, count_flagged
+from .partitions import restore_archived
+
+IMPORT_CHUNK_SIZE = 5000
+
+# Bad rows reported back in full; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+# Characters read from an OFX file at a time
+OFX_READ_SIZE = 64 * 1024
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d',
+                '%d %b %Y', '%d-%b-%Y', '%d-%b-%y', '%b %d, %Y', '%d/%m/%y', '%Y%m%d']
+
+CSV_COLUMNS = {
+    'date': ['date', 'transaction date', 'txn date', 'posting date', 'posted date', 'value date'],
+    'description': ['description', 'payee', 'merchant', 'narration', 'details', 'particulars',
+                    'transaction details', 'name', 'memo', 'remarks'],
+    'amount': ['amount', 'transaction amount', 'amount (inr)'],
+    'debit': ['debit', 'debit amount', 'withdrawal', 'withdrawals', 'withdrawal amt.', 'withdrawal amount'],
+    'credit': ['credit', 'credit amount', 'deposit', 'deposits', 'deposit amt.', 'deposit amount'],
+    'type': ['type', 'transaction type', 'dr/cr', 'cr/dr'],
+    'category': ['category'],
+    'reference': ['reference', 'ref no', 'ref no.', 'chq./ref.no.', 'transaction id', 'id']
+}
+
+EXPENSE_TYPES = {'debit', 'dr', 'd', 'withdrawal', 'expense', 'payment', 'pos', 'atm', 'fee', 'check', 'cheque'}
+
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class StatementError(ValueError):
+    """The file cannot be read as a statement at all"""
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text, date_format=None):
+    """ISO date for a statement date string; statements repeat dates, so memoized"""
+    text = (text or '').strip()
+    if date_format:
+        return datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+    for candidate in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, candidate).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f'Unrecognized date: {text!r}')
+
+
+def parse_amount(text):
+    """Signed float from strings like '1,234.50', '(12.00)', '-₹45' or '12.00 DR'"""
+    text = (text or '').strip()
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')') or text.startswith('-') or text.upper().endswith('DR')
+    digits = re.sub(r'[^\d.]', '', text)
+    if not digits:
+        raise ValueError(f'Unrecognized amount: {text!r}')
+    amount = float(digits)
+    return -amount if negative else amount
+
+
+def _find_columns(header):
+    normalized = [name.strip().lower() for name in header]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in normalized:
+                columns[field] = normalized.index(name)
+                break
+    if 'date' not in columns or not ('amount' in columns or 'debit' in columns or 'credit' in columns):
+        raise StatementError('CSV needs a date column and an amount (or debit/credit) column')
+    return columns
+
+
+def parse_csv(stream, date_format=None):
+    """Yield statement rows from a CSV text stream.
+
+    Each row is a dict with date, description, amount (positive), type,
+    category (if the file has one) and reference, or an 'error' key for a row
+    that could not be read.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        raise StatementError('The file is empty')
+    columns = _find_columns(header)
+
+    def cell(values, field):
+        index = columns.get(field)
+        return values[index].strip() if index is not None and index < len(values) else ''
+
+    for line, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        try:
+            if 'amount' in columns and cell(values, 'amount'):
+                amount = parse_amount(cell(values, 'amount'))
+                kind = cell(values, 'type').lower()
+                if kind:
+                    amount = -abs(amount) if kind in EXPENSE_TYPES else abs(amount)
+            else:
+                debit = parse_amount(cell(values, 'debit'))
+                credit = parse_amount(cell(values, 'credit'))
+                amount = -abs(debit) if debit else abs(credit or 0)
+            yield {
+                'date': parse_date(cell(values, 'date'), date_format),
+                'description': cell(values, 'description'),
+                'amount': abs(amount),
+                'type': 'expense' if amount < 0 else 'income',
+                'category': cell(values, 'category'),
+                'reference': cell(values, 'reference')
+            }
+        except (ValueError, TypeError) as e:
+            yield {'error': f'Line {line}: {e}'}
+
+
+def _ofx_tags(stream):
+    """Yield (closing, tag, value) for each OFX tag, reading the stream in blocks"""
+    buffer = ''
+    while True:
+        block = stream.read(OFX_READ_SIZE)
+        buffer += block
+        # Keep an unfinished tag for the next block
+        cut = buffer.rfind('<') if block else len(buffer)
+        if cut < 0:
+            cut = len(buffer)
+        for match in _OFX_TAG.finditer(buffer, 0, cut):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        buffer = buffer[cut:]
+        if not block:
+            return
+
+
+def parse_ofx(stream):
+    """Yield statement rows (as parse_csv) from an OFX or QFX text stream, SGML or XML"""
+    current = None
+    for closing, tag, value in _ofx_tags(stream):
+        if tag == 'STMTTRN':
+            if not closing:
+                current = {}
+                continue
+            if current is not None:
+                yield _ofx_row(current)
+            current = None
+        elif current is not None and not closing:
+            current[tag] = value
+
+
+def _ofx_row(fields):
+    try:
+        amount = parse_amount(fields.get('TRNAMT'))
+        if amount is None:
+            raise ValueError('missing TRNAMT')
+        return {
+            'date': parse_date(fields.get('DTPOSTED', '')[:8], '%Y%m%d'),
+            'description': fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO', ''),
+            'amount': abs(amount),
+            'type': 'expense' if amount < 0 else 'income',
+            'category': '',
+            'reference': fields.get('FITID', '')
+        }
+    except ValueError as e:
+        return {'error': f"Transaction {fields.get('FITID', '?')}: {e}"}
+
+
+def detect_format(filename, head):
+    """'ofx' or 'csv' from the file name, falling back to the first bytes"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in ('ofx', 'qfx'):
+        return 'ofx'
+    if extension == 'csv':
+        return 'csv'
+    return 'ofx' if b'OFX' in head[:512].upper() else 'csv'
+
+
+def import_hash(row, occurrence):
+    if row['reference']:
+        key = f"ref|{row['date']}|{row['amount']:.2f}|{row['reference']}"
+    else:
+        key = f"{row['date']}|{row['amount']:.2f}|{row['type']}|{' '.join(row['description'].lower().split())}|{occurrence}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_statement(user_id, binary_stream, filename='', date_format=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Import a CSV or OFX statement for a user.
+
+    binary_stream is any readable binary file object. Returns
+    {'rows', 'inserted', 'duplicates', 'flagged', 'errors', 'error_messages'}:
+    duplicates are rows skipped as already imported, flagged rows imported but
+    marked as looking like an existing transaction (duplicate_of). progress,
+    if given, is called with the running totals after each chunk.
+    """
+    if hasattr(binary_stream, 'peek'):
+        head = binary_stream.peek(512)
+    elif binary_stream.seekable():
+        head = binary_stream.read(512)
+        binary_stream.seek(0)
+    else:
+        binary_stream = io.BufferedReader(binary_stream)
+        head = binary_stream.peek(512)
+    file_format = detect_format(filename, head)
+    text = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', errors='replace', newline='')
+    rows = parse_ofx(text) if file_format == 'ofx' else parse_csv(text, date_format)
+
+    totals = {'format': file_format, 'rows': 0, 'inserted': 0, 'duplicates': 0, 'flagged': 0, 'errors': 0,
+              'error_messages': []}
+    occurrences = {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Rows are flagged against what was there before the import, not each other
+    before_id = last_transaction_id(cursor)
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            good = []
+            for row in chunk:
+                if 'error' in row:
+                    totals['errors'] += 1
+                    if len(totals['error_messages']) < MAX_REPORTED_ERRORS:
+                        totals['error_messages'].append(row['error'])
+                else:
+                    good.append(row)
+
+            predicted = categorize_batch([row['description'] for row in good], [row['amount'] for row in good], user_id)
+            merchant_ids = [resolve_merchant_id(row['description']) for row in good]
+            duplicates = find_duplicates(cursor, user_id, [(row['date'], row['amount'], merchant_id, row['type'])
+                                                           for row, merchant_id in zip(good, merchant_ids)], before_id)
+            values = []
+            for row, category, merchant_id, duplicate_of in zip(good, predicted, merchant_ids, duplicates):
+                # Hashed so memory grows by a small int per distinct row, not by the row itself
+                key = hash((row['date'], row['amount'], row['type'], row['description']))
+                occurrences[key] = occurrences.get(key, 0) + 1
+                values.append((user_id, row['type'], row['amount'], row['category'] or category, row['description'],
+                               row['date'], merchant_id, import_hash(row, occurrences[key]), duplicate_of))
+
+            restore_archived(cursor, (row['date'] for row in good))
+            cursor.executemany('''INSERT INTO transactions
+                (user_id, type, amount, category, description, date, merchant_id, import_hash, duplicate_of)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING''', values)
+            # rowcount, unlike total_changes, leaves out the version trigger's writes
+            inserted = max(cursor.rowcount, 0)
+            conn.commit()
+
+            totals['rows'] += len(chunk)
+            totals['inserted'] += inserted
+            totals['duplicates'] += len(values) - inserted
+            if progress:
+                progress(totals)
+        totals['flagged'] = count_flagged(cursor, user_id, before_id)
+    finally:
+        conn.close()
+        text.detach()
+    return totals
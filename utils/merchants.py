@@ -0,0 +1,253 @@
+"""
+Merchant canonicalization
+
+Receipt OCR and bank descriptions spell the same merchant many ways:
+"STARBUCKS #1234", "Starbucks Coffee" and "STARBUCKS CORP". Each raw string is
+normalized to a token key (lowercase words without store numbers, corporate
+suffixes or payment noise) and matched against known merchants through a token
+index, using token containment and difflib similarity for OCR misreads. New
+keys become new merchants.
+
+The merchants table is shared by all users. Category hints are not: each
+user's latest category for a merchant is kept in merchant_categories, so one
+user's custom categories and mistakes never reach anyone else.
+Transactions store the merchant id so analytics can group by merchant without
+touching descriptions. Raw strings are memoized in an LRU cache, so repeated
+descriptions cost a dictionary lookup.
+"""
+
+import re
+import threading
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+from models.database import get_db_connection
+
+# Raw descriptions remembered by resolve_merchant
+MERCHANT_CACHE_SIZE = 16384
+
+# difflib ratio at which two keys are taken to be the same merchant
+FUZZY_THRESHOLD = 0.85
+
+# Candidates scored per lookup, most shared tokens first
+MAX_CANDIDATES = 50
+
+NOISE_WORDS = {
+    # Corporate suffixes
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited', 'llc',
+    'llp', 'plc', 'pvt', 'private', 'the',
+    # Payment and statement noise
+    'pos', 'purchase', 'payment', 'debit', 'credit', 'card', 'txn', 'upi', 'ref', 'sq', 'tst',
+    'receipt', 'store', 'stores', 'www', 'com'
+}
+
+_WORD = re.compile(r'[a-z]+')
+
+# 'Other' is a fallback, never a useful hint
+IGNORED_CATEGORIES = ('Other', '')
+
+
+def normalize_merchant(raw):
+    """Token key for a raw merchant string, '' if nothing identifying is left"""
+    tokens = [token for token in _WORD.findall((raw or '').lower())
+              if len(token) > 1 and token not in NOISE_WORDS]
+    # Keep the leading words: trailing ones are usually locations and branches
+    return ' '.join(tokens[:4])
+
+
+def display_name(key):
+    return key.title()
+
+
+class MerchantIndex:
+    """In-memory token index over the merchants table"""
+
+    def __init__(self):
+        self.keys = {}        # merchant id -> key
+        self.by_key = {}      # key -> merchant id
+        self.by_token = {}    # token -> set of merchant ids
+        self.by_prefix = {}   # first three letters of a token -> set of merchant ids
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, merchant_id, key):
+        self.keys[merchant_id] = key
+        self.by_key[key] = merchant_id
+        for token in key.split():
+            self.by_token.setdefault(token, set()).add(merchant_id)
+            self.by_prefix.setdefault(token[:3], set()).add(merchant_id)
+        self.last_id = max(self.last_id, merchant_id)
+
+    def refresh(self, cursor):
+        """Pick up merchants created since the index last looked, e.g. by another process"""
+        cursor.execute('SELECT id, normalized FROM merchants WHERE id > ? ORDER BY id', (self.last_id,))
+        for row in cursor.fetchall():
+            self.add(row['id'], row['normalized'])
+
+    def match(self, key):
+        """Id of the known merchant key most likely refers to, or None"""
+        if key in self.by_key:
+            return self.by_key[key]
+
+        tokens = key.split()
+        shared = {}
+        for token in tokens:
+            for merchant_id in self.by_token.get(token, ()):
+                shared[merchant_id] = shared.get(merchant_id, 0) + 2
+            for merchant_id in self.by_prefix.get(token[:3], ()):
+                shared[merchant_id] = shared.get(merchant_id, 0) + 1
+        candidates = sorted(shared, key=shared.get, reverse=True)[:MAX_CANDIDATES]
+
+        token_set = set(tokens)
+        # key is seq2, so difflib indexes it once rather than once per candidate
+        matcher = SequenceMatcher(None, '', key, autojunk=False)
+        best, best_score = None, 0.0
+        for merchant_id in candidates:
+            candidate = self.keys[merchant_id]
+            candidate_tokens = candidate.split()
+            # "starbucks" and "starbucks coffee": one is the other plus extra words
+            if candidate_tokens[0] == tokens[0] and (set(candidate_tokens) <= token_set or token_set <= set(candidate_tokens)):
+                score = 1.0 + len(candidate_tokens) / 100
+            else:
+                matcher.set_seq1(candidate)
+                # Cheap upper bounds first; most candidates fail them
+                floor = max(best_score, FUZZY_THRESHOLD)
+                if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+                    continue
+                score = matcher.ratio()
+            if score > best_score:
+                best, best_score = merchant_id, score
+        return best if best_score >= FUZZY_THRESHOLD else None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = MerchantIndex()
+            conn = get_db_connection()
+            index.refresh(conn.cursor())
+            conn.close()
+            _index = index
+        return _index
+
+
+@lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def _resolve_key(key):
+    index = get_index()
+    with index.lock:
+        merchant_id = index.match(key)
+        if merchant_id is None:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            index.refresh(cursor)
+            merchant_id = index.match(key)
+            if merchant_id is None:
+                cursor.execute('INSERT INTO merchants (name, normalized) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                               (display_name(key), key))
+                conn.commit()
+                index.refresh(cursor)
+                merchant_id = index.by_key[key]
+            conn.close()
+    return merchant_id
+
+
+@lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def resolve_merchant_id(raw):
+    """Canonical merchant id for a raw description, creating the merchant if new; None if unidentifiable"""
+    key = normalize_merchant(raw)
+    return _resolve_key(key) if key else None
+
+
+def get_merchant(merchant_id):
+    """{'id', 'name'} for a merchant id, or None"""
+    if merchant_id is None:
+        return None
+    return _merchant_row(merchant_id)
+
+
+@lru_cache(maxsize=MERCHANT_CACHE_SIZE)
+def _merchant_row(merchant_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name FROM merchants WHERE id = ?', (merchant_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def resolve_merchant(raw, user_id=None):
+    """(merchant id, canonical name, the user's category hint) for a raw description;
+    (None, None, None) if unidentifiable. Without a user_id the hint is None."""
+    merchant = get_merchant(resolve_merchant_id(raw))
+    if merchant is None:
+        return None, None, None
+    return merchant['id'], merchant['name'], category_hint(user_id, merchant['id'])
+
+
+def category_hint(user_id, merchant_id):
+    """The category the user last gave one of the merchant's transactions, or None"""
+    if user_id is None or merchant_id is None:
+        return None
+    # Read every time: another worker may have changed it
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT category FROM merchant_categories WHERE user_id = ? AND merchant_id = ?',
+                   (user_id, merchant_id))
+    row = cursor.fetchone()
+    conn.close()
+    return row['category'] if row else None
+
+
+def record_category(user_id, merchant_id, category):
+    """Remember the category the user gave a merchant's transaction as their hint"""
+    if merchant_id is None or category in IGNORED_CATEGORIES:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''INSERT INTO merchant_categories (user_id, merchant_id, category) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, merchant_id) DO UPDATE SET category = excluded.category''',
+                   (user_id, merchant_id, category))
+    conn.commit()
+    conn.close()
+
+
+def assign_merchants(user_id=None, chunk_size=5000, progress=None):
+    """Set merchant_id on transactions that have none; returns the number assigned"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    assigned = 0
+    last_id = 0
+    query = '''SELECT id, description FROM transactions
+        WHERE merchant_id IS NULL AND id > ?''' + (' AND user_id = ?' if user_id is not None else '') + ' ORDER BY id LIMIT ?'
+    while True:
+        params = [last_id] + ([user_id] if user_id is not None else []) + [chunk_size]
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        updates = [(merchant_id, row['id']) for row in rows
+                   for merchant_id in [resolve_merchant_id(row['description'])] if merchant_id is not None]
+        if updates:
+            cursor.executemany('UPDATE transactions SET merchant_id = ? WHERE id = ?', updates)
+            conn.commit()
+        assigned += len(updates)
+        if progress:
+            progress(last_id, assigned)
+    conn.close()
+    return assigned
+
+
+def reset_cache():
+    """Forget memoized lookups and the in-memory index (e.g. after switching databases)"""
+    global _index
+    resolve_merchant_id.cache_clear()
+    _resolve_key.cache_clear()
+    _merchant_row.cache_clear()
+    with _index_lock:
+        _index = None
@@ -0,0 +1,161 @@
+"""
+Prometheus metrics for the app, served at /metrics
+
+Requests, SQL per request (from utils.query_profiler), OCR stages and emails
+are recorded as they happen. Cache hit counters are copied from the caches
+at most every CACHE_REFRESH_SECONDS per process. Queue depths are read from
+the database when /metrics is scraped.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory before
+the workers start; gunicorn.conf.py does this. Each worker then writes its
+samples to memory-mapped files there, and /metrics adds them up whichever
+worker serves it.
+"""
+
+import os
+import time
+from datetime import date
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+from models.database import get_db_connection
+from utils import query_profiler
+
+# prometheus_client switches to its file-backed values when this is set at import
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+CACHE_REFRESH_SECONDS = 10
+
+REQUEST_SECONDS = Histogram(
+    'expense_tracker_request_seconds', 'Request latency by route', ['endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+REQUESTS = Counter('expense_tracker_requests_total', 'Requests by route and status', ['endpoint', 'method', 'status'])
+
+DB_STATEMENTS = Counter('expense_tracker_db_statements_total', 'SQL statements and commits run by requests', ['endpoint'])
+DB_SECONDS = Counter('expense_tracker_db_seconds_total', 'Time in SQL statements and commits run by requests', ['endpoint'])
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    'expense_tracker_db_statements_per_request', 'SQL statements and commits per request', ['endpoint'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+OCR_STAGE_SECONDS = Histogram(
+    'expense_tracker_ocr_stage_seconds', 'Receipt OCR time per stage', ['backend', 'stage'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+OCR_CONFIDENCE = Histogram(
+    'expense_tracker_ocr_confidence', 'Mean recognition confidence per receipt', ['backend'],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+OCR_RECEIPTS = Counter('expense_tracker_ocr_receipts_total', 'Receipts processed by outcome', ['backend', 'outcome'])
+
+EMAIL_SEND_SECONDS = Histogram(
+    'expense_tracker_email_send_seconds', 'Time to hand an email to the SMTP server', ['service'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+EMAILS = Counter('expense_tracker_emails_total', 'Emails by outcome (sent, failed, unconfigured)', ['service', 'outcome'])
+
+# Calls running or queued on each utils/executors.py pool
+EXECUTOR_CALLS = Gauge('expense_tracker_executor_calls', 'Calls running or waiting per thread pool', ['pool'],
+                       multiprocess_mode='livesum')
+
+# Cumulative counts copied from each process's caches; hit ratio is hits / (hits + misses)
+CACHE_HITS = Gauge('expense_tracker_cache_hits', 'Cache hits', ['cache'], multiprocess_mode='sum')
+CACHE_MISSES = Gauge('expense_tracker_cache_misses', 'Cache misses', ['cache'], multiprocess_mode='sum')
+
+_caches_refreshed = 0.0
+
+
+def _cache_counts():
+    """cache name -> (hits, misses) for this process"""
+    from utils import importer, merchants, ml_categorizer, recurring
+    from utils.columnar_store import get_columnar_store
+
+    counts = {}
+    for name, cached in (('merchant_keys', merchants._resolve_key), ('merchant_ids', merchants.resolve_merchant_id),
+                         ('merchant_rows', merchants._merchant_row),
+                         ('token_features', ml_categorizer._token_features),
+                         ('description_features', ml_categorizer._description_features),
+                         ('statement_dates', importer.parse_date), ('recurring_schedules', recurring._parse)):
+        info = cached.cache_info()
+        counts[name] = (info.hits, info.misses)
+    store = get_columnar_store()
+    if store is not None:
+        counts['columnar'] = (store.hits, store.misses)
+    return counts
+
+
+def refresh_caches(force=False):
+    global _caches_refreshed
+    now = time.monotonic()
+    if not force and now - _caches_refreshed < CACHE_REFRESH_SECONDS:
+        return
+    _caches_refreshed = now
+    for name, (hits, misses) in _cache_counts().items():
+        CACHE_HITS.labels(name).set(hits)
+        CACHE_MISSES.labels(name).set(misses)
+
+
+class QueueCollector:
+    """Work waiting in the database, read at scrape time"""
+
+    def collect(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM recurring_rules WHERE active = 1 AND next_date <= ?',
+                       (date.today().isoformat(),))
+        due = cursor.fetchone()[0]
+        cursor.execute('''SELECT COUNT(*) FROM data_versions d
+            LEFT JOIN subscription_scans s ON s.user_id = d.user_id
+            WHERE s.version IS NULL OR d.version > s.version''')
+        stale = cursor.fetchone()[0]
+        conn.close()
+        yield GaugeMetricFamily('expense_tracker_recurring_rules_due',
+                                'Active recurring rules with an occurrence waiting to be materialized', value=due)
+        yield GaugeMetricFamily('expense_tracker_subscription_scans_pending',
+                                'Users whose transactions changed since their last subscription scan', value=stale)
+
+
+_queues = CollectorRegistry()
+_queues.register(QueueCollector())
+
+
+def render():
+    """The /metrics payload, summed over all workers in multiprocess mode"""
+    refresh_caches(force=True)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(_queues)
+
+
+def record_email(service, started, outcome):
+    if outcome != 'unconfigured':
+        EMAIL_SEND_SECONDS.labels(service).observe(time.perf_counter() - started)
+    EMAILS.labels(service, outcome).inc()
+
+
+def init_app(app):
+    """Time every request and record its SQL statements"""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        active = query_profiler.current_profile()
+        if active is not None:
+            DB_STATEMENTS.labels(endpoint).inc(active.count)
+            DB_SECONDS.labels(endpoint).inc(active.seconds)
+            DB_STATEMENTS_PER_REQUEST.labels(endpoint).observe(active.count)
+        refresh_caches()
+        return response
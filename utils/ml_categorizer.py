@@ -0,0 +1,566 @@
+"""
+Learned expense categorizer
+
+A multinomial naive Bayes model over hashed features of each transaction:
+word tokens, character 3- and 4-grams of each word (so "STARBUCKS#1234" and
+"Starbucks Coffee" share evidence) and a log-scale amount bucket. One model is
+trained per user from their own transactions and one globally from everyone's,
+and predictions blend the two, leaning on the user's model as their history
+grows.
+
+Models are count matrices, so adding or correcting a transaction is a row
+update rather than a retrain. Each model remembers the highest transaction id
+it has learned from and is saved as a compressed .npz file; newer transactions
+are folded in when it is loaded and whenever transactions are added.
+Corrections and deletions are saved a few seconds later, in one write for all
+the edits made in between.
+
+Confidence is the softmax of the class scores divided by a temperature fitted
+on held-out transactions, since raw naive Bayes probabilities are far too
+close to 0 or 1.
+"""
+
+import math
+import os
+import re
+import threading
+import zlib
+from functools import lru_cache
+from itertools import chain
+
+import numpy as np
+
+from models.database import get_db_connection
+from .partitions import source
+from . import executors
+
+MODEL_DIR = os.path.join('data', 'models')
+MODEL_FORMAT = 1
+
+# Hashed feature space; 2**14 keeps a 12-category model at under 1 MB in memory
+N_FEATURES = 2 ** 14
+
+# Additive smoothing for feature counts
+SMOOTHING = 0.1
+
+# Examples a user needs before their own model gets half the weight
+USER_PRIOR_EXAMPLES = 20
+
+# Fewer examples than this (user and global together) and the model abstains
+MIN_EXAMPLES = 5
+
+# Below this the keyword rules are preferred
+MIN_CONFIDENCE = 0.5
+
+# Every nth transaction is held out when fitting the temperature
+HOLDOUT_EVERY = 5
+MIN_HOLDOUT = 10
+TEMPERATURES = np.geomspace(0.25, 64, 41)
+
+# Models saved after this many incremental updates; anything newer is replayed on load
+SAVE_EVERY = 25
+
+# Corrections and deletions can't be replayed, so a model they changed is saved
+# this many seconds later, once for all the edits made in the meantime
+SAVE_DELAY = 5
+
+# Per-user models kept in memory
+MODEL_CACHE_SIZE = 256
+
+# 'Other' is the keyword fallback, not a label anyone chose
+IGNORED_CATEGORIES = ('Other', '')
+
+TRAINING_FETCH_SIZE = 2000
+
+# Rows scored together by predict_batch; bounds the (features x classes) gather
+BATCH_SIZE = 4096
+
+_TOKEN = re.compile(r'[a-z]+|\d+')
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _hash(feature):
+    return zlib.crc32(feature.encode('utf-8')) % N_FEATURES
+
+
+@lru_cache(maxsize=65536)
+def _token_features(token):
+    """Features for one lowercased token; merchant words repeat endlessly, so memoized"""
+    if token.isdigit():
+        # Store numbers and references carry little meaning beyond their length
+        return (_hash(f'n:{len(token)}'),)
+    features = [_hash('w:' + token)]
+    padded = f' {token} '
+    for n in (3, 4):
+        for start in range(len(padded) - n + 1):
+            features.append(_hash(f'c{n}:' + padded[start:start + n]))
+    return tuple(features)
+
+
+def amount_bucket(amount):
+    """Log-scale bucket: 0 for nothing, then one bucket per doubling"""
+    try:
+        amount = abs(float(amount or 0))
+    except (TypeError, ValueError):
+        return 0
+    return 0 if amount < 1 else int(math.log2(amount)) + 1
+
+
+def text_features(description):
+    features = []
+    for token in _TOKEN.findall((description or '').lower()):
+        features.extend(_token_features(token))
+    return features
+
+
+@lru_cache(maxsize=65536)
+def _description_features(description):
+    """text_features as a tuple, memoized for batches where merchants recur"""
+    return tuple(text_features(description))
+
+
+def feature_list(description, amount=0):
+    return [_hash(f'a:{amount_bucket(amount)}'), *_description_features((description or '').lower())]
+
+
+def featurize(description, amount=0):
+    """Hashed feature indices for a transaction, with repeats for repeated features"""
+    return np.array(feature_list(description, amount), dtype=np.int64)
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes over hashed features, updatable one example at a time"""
+
+    def __init__(self, classes=None, counts=None, class_counts=None, temperature=1.0, last_id=0):
+        self.classes = list(classes or [])
+        self.counts = counts if counts is not None else np.zeros((len(self.classes), N_FEATURES), dtype=np.float32)
+        self.class_counts = class_counts if class_counts is not None else np.zeros(len(self.classes))
+        self.temperature = float(temperature)
+        self.last_id = int(last_id)
+        self.examples = int(self.class_counts.sum())
+        self.pending = 0
+        self.lock = threading.Lock()
+        # Held while replaying new transactions so two requests don't learn them twice
+        self.sync_lock = threading.Lock()
+        # Pending delayed save, see _save_soon
+        self.save_timer = None
+        self._log_likelihood = None
+        self._log_prior = None
+
+    def _class_index(self, category):
+        try:
+            return self.classes.index(category)
+        except ValueError:
+            self.classes.append(category)
+            self.counts = np.vstack([self.counts, np.zeros((1, N_FEATURES), dtype=np.float32)])
+            self.class_counts = np.append(self.class_counts, 0.0)
+            self._log_likelihood = None
+            self._log_prior = None
+            return len(self.classes) - 1
+
+    def learn(self, features, category, weight=1):
+        """Add (or with weight=-1 remove) one labelled example"""
+        with self.lock:
+            row = self._class_index(category)
+            np.add.at(self.counts[row], features, weight)
+            np.maximum(self.counts[row], 0, out=self.counts[row])
+            self.class_counts[row] = max(self.class_counts[row] + weight, 0)
+            self.examples = int(self.class_counts.sum())
+            self._log_likelihood = None
+            self._log_prior = None
+            self.pending += 1
+
+    def learn_batch(self, feature_lists, labels):
+        """learn() for many examples at once, with one count update"""
+        if not labels:
+            return
+        with self.lock:
+            rows = np.array([self._class_index(label) for label in labels], dtype=np.int64)
+            lengths = np.array([len(features) for features in feature_lists], dtype=np.int64)
+            self.class_counts += np.bincount(rows, minlength=len(self.classes))
+            self.examples = int(self.class_counts.sum())
+            if lengths.sum():
+                flat = np.repeat(rows, lengths) * N_FEATURES + np.concatenate(feature_lists)
+                self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+            self._log_likelihood = None
+            self._log_prior = None
+            self.pending += len(labels)
+
+    def fit(self, feature_lists, labels):
+        """Rebuild all counts from scratch in one pass"""
+        with self.lock:
+            rows = np.array([self._class_index(label) for label in labels], dtype=np.int64)
+            lengths = np.array([len(features) for features in feature_lists], dtype=np.int64)
+            self.counts[:] = 0
+            self.class_counts[:] = np.bincount(rows, minlength=len(self.classes)) if len(rows) else 0
+            self.examples = len(rows)
+            if lengths.sum():
+                flat = np.repeat(rows, lengths) * N_FEATURES + np.concatenate(feature_lists)
+                self.counts[:] = np.bincount(flat, minlength=len(self.classes) * N_FEATURES).reshape(len(self.classes), N_FEATURES)
+            self._log_likelihood = None
+            self._log_prior = None
+
+    def _tables(self):
+        """(log likelihood, log prior), rebuilt if an update invalidated them; call under lock"""
+        if self._log_likelihood is None:
+            # Feature-major, so scoring gathers a few contiguous rows
+            counts = self.counts.astype(np.float64) + SMOOTHING
+            self._log_likelihood = np.ascontiguousarray((np.log(counts) - np.log(counts.sum(axis=1, keepdims=True))).T)
+            # Features no class has seen would only favour the smallest classes
+            self._log_likelihood[~self.counts.any(axis=0)] = 0
+        if self._log_prior is None:
+            self._log_prior = np.log(self.class_counts + 1) - np.log(self.class_counts.sum() + len(self.classes))
+        return self._log_likelihood, self._log_prior
+
+    def log_scores(self, features):
+        """Unnormalized log posterior for each class"""
+        with self.lock:
+            log_likelihood, log_prior = self._tables()
+            return log_prior + log_likelihood[features].sum(axis=0)
+
+    def batch_probabilities(self, text_features, text_offsets, text_empty, row_texts, row_amounts):
+        """(rows x classes) calibrated probabilities. Text features for each
+        distinct description are concatenated in text_features, each starting at
+        its offset (descriptions without any hold one placeholder, flagged in
+        text_empty); row_texts picks a description per row and row_amounts holds
+        each row's amount feature."""
+        with self.lock:
+            log_likelihood, log_prior = self._tables()
+            text_scores = np.add.reduceat(log_likelihood[text_features], text_offsets, axis=0)
+            text_scores[text_empty] = 0
+            scores = text_scores[row_texts] + log_likelihood[row_amounts] + log_prior
+        scores = (scores - scores.max(axis=1, keepdims=True)) / self.temperature
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def probabilities(self, features):
+        """{category: calibrated probability}"""
+        if not self.classes or not self.examples:
+            return {}
+        # A dozen classes: plain floats beat NumPy's per-call overhead here
+        scores = self.log_scores(features).tolist()
+        top = max(scores)
+        weights = [math.exp((score - top) / self.temperature) for score in scores]
+        total = sum(weights)
+        return {category: weight / total for category, weight in zip(self.classes, weights)}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            # Write beside the target and rename so a reader never sees half a file
+            temp_path = path + '.tmp.npz'
+            np.savez_compressed(temp_path, format=MODEL_FORMAT, n_features=N_FEATURES,
+                                classes=np.array(self.classes, dtype=str), counts=self.counts,
+                                class_counts=self.class_counts, temperature=self.temperature,
+                                last_id=self.last_id)
+            os.replace(temp_path, path)
+            self.pending = 0
+
+    @classmethod
+    def load(cls, path):
+        """The saved model, or None if missing or from an incompatible format"""
+        try:
+            with np.load(path) as data:
+                if int(data['format']) != MODEL_FORMAT or int(data['n_features']) != N_FEATURES:
+                    return None
+                return cls(data['classes'].tolist(), data['counts'].astype(np.float32), data['class_counts'],
+                           float(data['temperature']), int(data['last_id']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def fit_temperature(score_rows, label_rows):
+    """Temperature minimizing the negative log likelihood of the true labels"""
+    scores = np.asarray(score_rows)
+    labels = np.asarray(label_rows)
+    best, best_loss = 1.0, np.inf
+    for temperature in TEMPERATURES:
+        scaled = scores / temperature
+        scaled = scaled - scaled.max(axis=1, keepdims=True)
+        log_norm = np.log(np.exp(scaled).sum(axis=1))
+        loss = (log_norm - scaled[np.arange(len(labels)), labels]).mean()
+        if loss < best_loss:
+            best, best_loss = temperature, loss
+    return float(best)
+
+
+def model_path(user_id=None):
+    name = 'global.npz' if user_id is None else f'user_{int(user_id)}.npz'
+    return os.path.join(MODEL_DIR, name)
+
+
+def _labelled_rows(user_id=None, after_id=0):
+    """Yield (id, description, amount, category) for usable training rows"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    query = f'''SELECT id, description, amount, category FROM {source(cursor)}
+        WHERE id > ? AND description IS NOT NULL AND description != ''
+        AND category NOT IN (?, ?)'''
+    params = [after_id, *IGNORED_CATEGORIES]
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    cursor.execute(query + ' ORDER BY id', params)
+    while True:
+        rows = cursor.fetchmany(TRAINING_FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
+    conn.close()
+
+
+def train_model(user_id=None, save=True):
+    """Train the user's model (or the global one) from the transactions table"""
+    ids, feature_lists, labels = [], [], []
+    for transaction_id, description, amount, category in _labelled_rows(user_id):
+        ids.append(transaction_id)
+        feature_lists.append(featurize(description, amount))
+        labels.append(category)
+
+    model = NaiveBayesModel()
+    holdout = [i for i in range(len(labels)) if i % HOLDOUT_EVERY == HOLDOUT_EVERY - 1]
+    if len(holdout) >= MIN_HOLDOUT:
+        held = set(holdout)
+        training = [i for i in range(len(labels)) if i not in held]
+        model.fit([feature_lists[i] for i in training], [labels[i] for i in training])
+        known = [i for i in holdout if labels[i] in model.classes]
+        if len(known) >= MIN_HOLDOUT:
+            model.temperature = fit_temperature([model.log_scores(feature_lists[i]) for i in known],
+                                                [model.classes.index(labels[i]) for i in known])
+
+    model.fit(feature_lists, labels)
+    model.last_id = ids[-1] if ids else 0
+    if save:
+        model.save(model_path(user_id))
+    with _models_lock:
+        _cache_model(user_id, model)
+    return model
+
+
+def _cache_model(user_id, model):
+    if user_id is not None and user_id not in _models and len(_models) >= MODEL_CACHE_SIZE + 1:
+        evict = next(key for key in _models if key is not None)
+        _models.pop(evict)
+    _models[user_id] = model
+
+
+def _catch_up(model, user_id):
+    """Fold in transactions added since the model last saw one"""
+    with model.sync_lock:
+        feature_lists, labels = [], []
+        for transaction_id, description, amount, category in _labelled_rows(user_id, model.last_id):
+            feature_lists.append(feature_list(description, amount))
+            labels.append(category)
+            if len(labels) >= BATCH_SIZE:
+                model.learn_batch(feature_lists, labels)
+                model.last_id = transaction_id
+                feature_lists, labels = [], []
+        if labels:
+            model.learn_batch(feature_lists, labels)
+            model.last_id = transaction_id
+        if model.pending >= SAVE_EVERY:
+            model.save(model_path(user_id))
+
+
+def get_model(user_id=None):
+    """The user's model (or the global one), loaded or trained on first use"""
+    with _models_lock:
+        model = _models.get(user_id)
+    if model is not None:
+        return model
+
+    model = NaiveBayesModel.load(model_path(user_id))
+    if model is None:
+        return train_model(user_id)
+    _catch_up(model, user_id)
+    with _models_lock:
+        _cache_model(user_id, model)
+    return model
+
+
+def predict(user_id, description, amount=0):
+    """(category, confidence) blending the user's and the global model, or (None, 0.0)"""
+    if not description:
+        return None, 0.0
+    features = featurize(description, amount)
+    user_model = get_model(user_id)
+    global_model = get_model()
+    if user_model.examples + global_model.examples < MIN_EXAMPLES:
+        return None, 0.0
+
+    weight = user_model.examples / (user_model.examples + USER_PRIOR_EXAMPLES)
+    blended = {}
+    for model, share in ((user_model, weight), (global_model, 1 - weight)):
+        for category, probability in model.probabilities(features).items():
+            blended[category] = blended.get(category, 0.0) + share * probability
+    # With a single category every prediction would look certain
+    if len(blended) < 2:
+        return None, 0.0
+
+    # A model with no examples contributes nothing, so renormalize
+    total = sum(blended.values())
+    category = max(blended, key=blended.get)
+    return category, blended[category] / total
+
+
+def amount_buckets(amounts):
+    """amount_bucket for a sequence of amounts"""
+    try:
+        values = np.abs(np.asarray(amounts, dtype=np.float64))
+    except (TypeError, ValueError):
+        return np.array([amount_bucket(amount) for amount in amounts], dtype=np.int64)
+    values = np.nan_to_num(values)
+    buckets = np.zeros(len(values), dtype=np.int64)
+    spent = values >= 1
+    buckets[spent] = np.floor(np.log2(values[spent])).astype(np.int64) + 1
+    return buckets
+
+
+def predict_batch(user_id, descriptions, amounts):
+    """predict() for many transactions at once: (categories, confidences), with
+    None and 0.0 where the models abstain.
+
+    Each distinct description is featurized and scored once, and rows are
+    scored BATCH_SIZE at a time.
+    """
+    count = len(descriptions)
+    categories = [None] * count
+    confidences = np.zeros(count)
+    user_model = get_model(user_id)
+    global_model = get_model()
+    if user_model.examples + global_model.examples < MIN_EXAMPLES:
+        return categories, confidences
+
+    weight = user_model.examples / (user_model.examples + USER_PRIOR_EXAMPLES)
+    shares = [(model, share) for model, share in ((user_model, weight), (global_model, 1 - weight))
+              if model.examples]
+    classes = list(dict.fromkeys(c for model, _ in shares for c in model.classes))
+    if len(classes) < 2:
+        return categories, confidences
+    columns = [np.array([classes.index(c) for c in model.classes], dtype=np.int64) for model, _ in shares]
+    buckets = amount_buckets(amounts)
+
+    for start in range(0, count, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, count)
+        texts = {}
+        row_texts = np.fromiter((texts.setdefault((descriptions[i] or '').lower(), len(texts)) for i in range(start, stop)),
+                                dtype=np.int64, count=stop - start)
+        lists = [_description_features(text) for text in texts]
+        empty = np.array([not features for features in lists])
+        lists = [features or (0,) for features in lists]
+        lengths = np.fromiter((len(features) for features in lists), dtype=np.int64, count=len(lists))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        flat = np.fromiter(chain.from_iterable(lists), dtype=np.int64, count=int(lengths.sum()))
+        used, positions = np.unique(buckets[start:stop], return_inverse=True)
+        row_amounts = np.array([_hash(f'a:{bucket}') for bucket in used.tolist()], dtype=np.int64)[positions]
+
+        blended = np.zeros((stop - start, len(classes)))
+        for (model, share), model_columns in zip(shares, columns):
+            probabilities = model.batch_probabilities(flat, offsets, empty, row_texts, row_amounts)
+            # Classes only get appended; one learned in the background since columns were mapped is left out
+            blended[:, model_columns] += share * probabilities[:, :len(model_columns)]
+        blended /= blended.sum(axis=1, keepdims=True)
+
+        best = blended.argmax(axis=1)
+        confidences[start:stop] = blended[np.arange(stop - start), best]
+        for offset, index in enumerate(best.tolist()):
+            if descriptions[start + offset]:
+                categories[start + offset] = classes[index]
+            else:
+                confidences[start + offset] = 0.0
+    return categories, confidences
+
+
+def _synced_models(user_id):
+    """The user's and the global model with every saved transaction folded in"""
+    models = []
+    for owner in (user_id, None):
+        model = get_model(owner)
+        _catch_up(model, owner)
+        models.append((owner, model))
+    return models
+
+
+def learn_transactions(user_id):
+    """Learn from transactions saved since the user's model was last updated"""
+    _synced_models(user_id)
+
+
+def learn_in_background(user_id):
+    """learn_transactions on the default pool, so a batch write returns without
+    waiting for it. Skipped when the pool is busy: the next write catches up."""
+    try:
+        executors.spawn('default', learn_transactions, user_id)
+    except executors.Busy:
+        pass
+
+
+def correct_transaction(user_id, transaction_id, description, amount, old_category, new_category):
+    """Move a re-categorized transaction's evidence to its new category; call after saving it"""
+    if not description or old_category == new_category:
+        return
+    features = featurize(description, amount)
+    for owner in (user_id, None):
+        model = get_model(owner)
+        # A transaction the model has not seen yet is picked up with its new category
+        seen = transaction_id <= model.last_id
+        _catch_up(model, owner)
+        if not seen:
+            continue
+        if old_category not in IGNORED_CATEGORIES:
+            model.learn(features, old_category, -1)
+        if new_category not in IGNORED_CATEGORIES:
+            model.learn(features, new_category)
+        _save_soon(owner, model)
+
+
+def forget_transaction(user_id, transaction_id, description, amount, category):
+    """Remove a deleted transaction's evidence"""
+    if not description or category in IGNORED_CATEGORIES:
+        return
+    features = featurize(description, amount)
+    for owner in (user_id, None):
+        model = get_model(owner)
+        if transaction_id <= model.last_id:
+            model.learn(features, category, -1)
+            _save_soon(owner, model)
+
+
+def _save_soon(owner, model):
+    """Save the model SAVE_DELAY seconds from now unless a save is already due"""
+    with _models_lock:
+        if model.save_timer is not None:
+            return
+        # The path is fixed now, in case MODEL_DIR changes before the timer fires
+        model.save_timer = threading.Timer(SAVE_DELAY, _save_due, (model, model_path(owner)))
+        timer = model.save_timer
+    timer.start()
+
+
+def _save_due(model, path):
+    with _models_lock:
+        model.save_timer = None
+    model.save(path)
+
+
+def flush_models():
+    """Save every model with edits waiting for a delayed save"""
+    with _models_lock:
+        due = [model for model in _models.values() if model.save_timer is not None]
+    for model in due:
+        with _models_lock:
+            timer, model.save_timer = model.save_timer, None
+        if timer is not None:
+            timer.cancel()
+            model.save(timer.args[1])
+
+
+def reset_models():
+    """Drop every in-memory model (they are reloaded from disk on next use)"""
+    flush_models()
+    with _models_lock:
+        _models.clear()
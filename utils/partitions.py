@@ -0,0 +1,191 @@
+"""
+Monthly partitions of transaction history, in a hot and a cold tier
+
+The transactions table is the hot tier: the last HOT_MONTHS months (counting
+the current one) plus anything written since the last archive run, such as a
+back-dated import. The archive job moves each older month into its own table,
+transactions_YYYY_MM, listed in transaction_partitions. A partition is written
+in (user_id, date) order so each user's month sits on adjacent pages, is
+analyzed, and is then read-only: triggers reject any write to it. Run the job
+from cron with 'flask --app app archive-transactions'.
+
+Reads that take a date range get their FROM item from source(). Only the
+partitions whose month overlaps the range are added, as a UNION ALL with the
+hot table; which months are archived comes from the catalog, read once per
+connection, not from HOT_MONTHS, so a run with another --hot-months or a
+later change to HOT_MONTHS cannot hide rows. Dashboard queries for the
+current month therefore only touch the small hot table, which stays in the
+page cache, while years of cold rows stay on disk until a report asks for them.
+
+Writes only ever touch the hot table. A write dated in an archived month, or
+an edit or delete of an archived transaction, first moves that month back to
+the hot table with restore_months(), so the unique import hash index sees
+every row of it; the next run of the job archives it again. Raising
+HOT_MONTHS leaves months archived until the next run, which moves them back.
+"""
+
+import os
+import re
+from datetime import date
+
+from models.database import begin_write, get_backend, get_db_connection
+
+# Months, counting the current one, whose transactions stay in the hot table
+HOT_MONTHS = max(int(os.environ.get('HOT_MONTHS', '3')), 1)
+
+# Columns of transactions in table order; partitions have the same ones
+COLUMNS = ('id', 'user_id', 'type', 'amount', 'category', 'description', 'date', 'receipt_path', 'created_at',
+           'merchant_id', 'import_hash', 'duplicate_of')
+
+_MONTH = re.compile(r'\d{4}-\d{2}')
+
+
+def hot_cutoff(today=None, hot_months=None):
+    """First day of the oldest hot month, as YYYY-MM-DD"""
+    today = today or date.today()
+    months = today.year * 12 + today.month - max(HOT_MONTHS if hot_months is None else hot_months, 1)
+    return f'{months // 12:04d}-{months % 12 + 1:02d}-01'
+
+
+def partition_table(month):
+    return 'transactions_' + month.replace('-', '_')
+
+
+def archived_months(cursor):
+    """Months in the cold tier, oldest first; read once per connection"""
+    conn = cursor.connection
+    months = getattr(conn, 'archived_months', None)
+    if months is None:
+        cursor.execute('SELECT month FROM transaction_partitions ORDER BY month')
+        months = conn.archived_months = [row[0] for row in cursor.fetchall()]
+    return months
+
+
+def source(cursor, start_date=None, end_date=None, alias=None):
+    """FROM item for a user's transactions dated in [start_date, end_date]: the
+    hot table alone, or a UNION ALL of it and the archived months in the range"""
+    months = [month for month in archived_months(cursor)
+              if (not start_date or month >= start_date[:7]) and (not end_date or month <= end_date[:7])]
+    if not months:
+        return f'transactions {alias}' if alias else 'transactions'
+    columns = ', '.join(COLUMNS)
+    arms = ' UNION ALL '.join(f'SELECT {columns} FROM {table}'
+                              for table in ('transactions', *map(partition_table, months)))
+    return f'({arms}) AS {alias or "transactions"}'
+
+
+def restore_months(cursor, months):
+    """Move archived months back to the hot table so their rows can be written.
+    Takes the partition write lock and leaves the transaction open for the
+    caller's write to commit. Returns the rows moved back."""
+    begin_write(cursor, 'transaction_partitions')
+    months = sorted(months)
+    cursor.execute(f"SELECT month FROM transaction_partitions WHERE month IN ({','.join('?' * len(months))})", months)
+    restored = sum(_restore(cursor, row[0]) for row in cursor.fetchall())
+    cursor.connection.archived_months = None
+    return restored
+
+
+def restore_archived(cursor, dates):
+    """restore_months() for the archived months among dates, the dates of rows
+    about to be inserted"""
+    archived = archived_months(cursor)
+    months = {day[:7] for day in dates if day} & set(archived) if archived else set()
+    return restore_months(cursor, months) if months else 0
+
+
+def restore_transaction(cursor, user_id, transaction_id):
+    """restore_months() for the archived month holding a user's transaction,
+    before it is edited or deleted; False if no archived month has it"""
+    months = archived_months(cursor)
+    if not months:
+        return False
+    cursor.execute(' UNION ALL '.join(f"SELECT '{month}' FROM {partition_table(month)} WHERE id = ? AND user_id = ?"
+                                      for month in months), [transaction_id, user_id] * len(months))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    restore_months(cursor, [row[0]])
+    return True
+
+
+def archive_transactions(hot_months=None, today=None, vacuum=False, progress=None):
+    """Move months before the hot window into read-only partitions, one
+    transaction per month, merging rows that arrived since a month was archived.
+    Months back inside the window are first moved back to the hot table.
+
+    Returns {'months': partitions written, 'archived': rows moved out of the hot
+    table, 'restored': rows moved back}. progress, if given, is called with the
+    running totals after each month.
+    """
+    cutoff = hot_cutoff(today, hot_months)
+    backend = get_backend()
+    columns = ', '.join(COLUMNS)
+    totals = {'months': 0, 'archived': 0, 'restored': 0}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        begin_write(cursor, 'transaction_partitions')
+        cursor.execute('SELECT month FROM transaction_partitions WHERE month >= ? ORDER BY month', (cutoff[:7],))
+        for month in [row[0] for row in cursor.fetchall()]:
+            totals['restored'] += _restore(cursor, month)
+        conn.commit()
+
+        cursor.execute('SELECT DISTINCT substr(date, 1, 7) FROM transactions WHERE date < ? ORDER BY 1', (cutoff,))
+        # Malformed dates stay in the hot table rather than naming a table
+        months = [row[0] for row in cursor.fetchall() if _MONTH.fullmatch(row[0] or '')]
+        for month in months:
+            table, staging = partition_table(month), partition_table(month) + '_new'
+            bounds = (f'{month}-01', _next_month(month))
+            begin_write(cursor, 'transaction_partitions')
+            cursor.execute('SELECT 1 FROM transaction_partitions WHERE month = ?', (month,))
+            merge = cursor.fetchone() is not None
+            rows = f'SELECT {columns} FROM transactions WHERE date >= ? AND date < ?'
+            if merge:
+                rows += f' UNION ALL SELECT {columns} FROM {table}'
+
+            cursor.execute(f'CREATE TABLE {staging} AS SELECT {columns} FROM transactions WHERE 1 = 0')
+            cursor.execute(f'''INSERT INTO {staging} ({columns})
+                SELECT {columns} FROM ({rows}) AS moved ORDER BY user_id, date, id''', bounds)
+            if merge:
+                cursor.execute(f'DROP TABLE {table}')
+            cursor.execute(f'ALTER TABLE {staging} RENAME TO {table}')
+            cursor.execute(f'''CREATE INDEX idx_{table}_duplicate
+                ON {table} (user_id, date, {backend.whole_amount('amount')}, merchant_id)''')
+            cursor.execute(f'CREATE INDEX idx_{table}_id ON {table} (id)')
+            cursor.execute(f'CREATE UNIQUE INDEX idx_{table}_import_hash ON {table} (user_id, import_hash)')
+            backend.make_read_only(cursor, table)
+
+            cursor.execute('DELETE FROM transactions WHERE date >= ? AND date < ?', bounds)
+            totals['archived'] += cursor.rowcount
+            cursor.execute(f'SELECT COUNT(*), MAX(id) FROM {table}')
+            row_count, max_id = cursor.fetchone()
+            cursor.execute('''INSERT INTO transaction_partitions (month, table_name, row_count, max_id)
+                VALUES (?, ?, ?, ?) ON CONFLICT (month) DO UPDATE SET row_count = excluded.row_count,
+                max_id = excluded.max_id''', (month, table, row_count, max_id))
+            cursor.execute(f'ANALYZE {table}')
+            conn.commit()
+            totals['months'] += 1
+            if progress:
+                progress(totals)
+    finally:
+        conn.close()
+
+    if vacuum and (totals['archived'] or totals['restored']):
+        backend.vacuum()
+    return totals
+
+
+def _restore(cursor, month):
+    table = partition_table(month)
+    columns = ', '.join(COLUMNS)
+    cursor.execute(f'INSERT INTO transactions ({columns}) SELECT {columns} FROM {table}')
+    restored = cursor.rowcount
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute('DELETE FROM transaction_partitions WHERE month = ?', (month,))
+    return restored
+
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f'{year + number // 12:04d}-{number % 12 + 1:02d}-01'
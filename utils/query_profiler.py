@@ -0,0 +1,188 @@
+"""
+Per-request SQL profiling and the slow-query log
+
+get_db_connection() returns a ProfiledConnection, which times every statement
+and commit. While a profile is active (init_app opens one around each request,
+and tests can open one with profile()), it counts the statements, adds up
+their time and keeps the slowest. Any statement slower than SLOW_QUERY_MS is
+logged to the 'slow_queries' logger as one JSON object per line. This happens
+in requests, CLI commands and background jobs alike.
+
+Times cover executing a statement up to its first row. Rows fetched later
+are not included.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger('slow_queries')
+
+# init_app sets this from app.config['SLOW_QUERY_MS']
+SLOW_QUERY_MS = 100.0
+
+# Slowest statements kept per profile
+KEEP_SLOWEST = 5
+
+# Longest SQL text kept in logs and headers
+MAX_SQL_LENGTH = 200
+
+_current = ContextVar('query_profile', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """More statements ran than a profile or route allows"""
+
+
+class QueryProfile:
+    """Statements run while this profile is active"""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self._slowest = []  # min-heap of (seconds, sequence, sql)
+        self._sequence = itertools.count()
+
+    def record(self, sql, seconds):
+        self.count += 1
+        self.seconds += seconds
+        entry = (seconds, next(self._sequence), sql)
+        if len(self._slowest) < KEEP_SLOWEST:
+            heapq.heappush(self._slowest, entry)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        return [{'sql': compact(sql), 'ms': round(seconds * 1000, 2)}
+                for seconds, _, sql in sorted(self._slowest, reverse=True)]
+
+    def summary(self):
+        return {'queries': self.count, 'ms': round(self.seconds * 1000, 2), 'slowest': self.slowest}
+
+
+def compact(sql):
+    """SQL on one line, truncated for logs and headers"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return sql if len(sql) <= MAX_SQL_LENGTH else sql[:MAX_SQL_LENGTH - 3] + '...'
+
+
+def current_profile():
+    return _current.get()
+
+
+def _record(sql, started, many=False):
+    seconds = time.perf_counter() - started
+    active = _current.get()
+    if active is not None:
+        active.record(sql, seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning(json.dumps({'event': 'slow_query', 'ms': round(seconds * 1000, 2), 'sql': compact(sql),
+                                   'executemany': many, 'request': active.label if active else None}))
+
+
+class ProfiledCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(sql, started, many=True)
+
+
+class ProfiledConnection(sqlite3.Connection):
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _record('COMMIT', started)
+
+
+@contextmanager
+def profile(label=None, max_queries=None):
+    """Profile the statements run inside the block; raises QueryBudgetExceeded past max_queries"""
+    active = QueryProfile(label)
+    token = _current.set(active)
+    try:
+        yield active
+    finally:
+        _current.reset(token)
+    if max_queries is not None and active.count > max_queries:
+        raise QueryBudgetExceeded(f'{label or "block"} ran {active.count} statements; the budget is {max_queries}')
+
+
+def init_app(app):
+    """Profile every request and report on it in headers and the slow-query log"""
+    from flask import g, request
+
+    global SLOW_QUERY_MS
+    SLOW_QUERY_MS = app.config.setdefault('SLOW_QUERY_MS', SLOW_QUERY_MS)
+    # A request at or past either threshold is logged with its slowest statements
+    app.config.setdefault('SLOW_REQUEST_MS', 500.0)
+    app.config.setdefault('SLOW_REQUEST_QUERIES', 100)
+    # endpoint -> most statements it may run; exceeding it fails under app.testing
+    app.config.setdefault('QUERY_BUDGETS', {})
+    # Debug and test responses always carry the headers
+    app.config.setdefault('QUERY_PROFILER_HEADERS', False)
+
+    @app.before_request
+    def start_query_profile():
+        g.query_profile_token = _current.set(QueryProfile(request.endpoint))
+
+    @app.after_request
+    def report_query_profile(response):
+        active = _current.get()
+        if active is None:
+            return response
+        milliseconds = active.seconds * 1000
+        if app.debug or app.testing or app.config['QUERY_PROFILER_HEADERS']:
+            response.headers['X-Query-Count'] = str(active.count)
+            response.headers['X-Query-Time-Ms'] = f'{milliseconds:.2f}'
+            response.headers['Server-Timing'] = f'db;dur={milliseconds:.2f};desc="{active.count} queries"'
+            if active.count:
+                response.headers['X-Query-Slowest'] = ' | '.join(
+                    f"{query['ms']}ms {query['sql'][:120]}" for query in active.slowest[:3])
+
+        budget = app.config['QUERY_BUDGETS'].get(request.endpoint)
+        over_budget = budget is not None and active.count > budget
+        if over_budget or active.count >= app.config['SLOW_REQUEST_QUERIES'] or milliseconds >= app.config['SLOW_REQUEST_MS']:
+            logger.warning(json.dumps({'event': 'slow_request', 'endpoint': request.endpoint, 'method': request.method,
+                                       'path': request.path, 'status': response.status_code, 'budget': budget,
+                                       **active.summary()}))
+        if over_budget and app.testing:
+            raise QueryBudgetExceeded(f'{request.endpoint} ran {active.count} statements; the budget is {budget}')
+        return response
+
+    @app.teardown_request
+    def end_query_profile(exc):
+        token = g.pop('query_profile_token', None)
+        if token is not None:
+            _current.reset(token)
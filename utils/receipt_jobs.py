@@ -0,0 +1,132 @@
+"""
+Receipt OCR, inline or as a background job
+
+process_receipt turns a stored receipt (utils/receipt_store.py) into an
+expense. It runs OCR, resolves the canonical merchant, picks a category,
+checks for a duplicate, and does one INSERT. The upload_receipt page runs it
+inline.
+
+The JSON API queues it instead. create_job records the upload in
+receipt_jobs and hands it to the OCR pool (utils/executors.py). The request
+then returns at once, and clients poll get_job until the status is 'done' or
+'failed'. A job whose process exits before it finishes stays 'queued' or
+'processing'; upload the receipt again to retry it.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from models.database import get_db_connection
+from .ai_categorizer import predict_category
+from .columnar_store import record_insert
+from .duplicates import find_duplicate
+from .easyocr_processor import extract_receipt_data
+from .merchants import resolve_merchant
+from .ml_categorizer import learn_transactions
+from .tracing import span, trace
+from . import executors
+
+logger = logging.getLogger(__name__)
+
+JOB_FIELDS = ('id', 'status', 'transaction_id', 'duplicate_of', 'error', 'created_at', 'updated_at')
+
+
+def process_receipt(user_id, receipt_path):
+    """OCR a stored receipt and add it as an expense. Returns {'transaction_id',
+    'duplicate_of', 'amount', 'date', 'description', 'category'}, or None when
+    OCR returned nothing."""
+    with span('ocr') as stage:
+        extracted_data = extract_receipt_data(receipt_path)
+        stage.set(confidence=extracted_data.get('confidence'), error=extracted_data.get('error'))
+    if not extracted_data:
+        return None
+
+    amount = extracted_data.get('amount', 0)
+    # OCR spells merchants many ways; store the canonical name when there is one
+    with span('categorize') as stage:
+        merchant_id, merchant_name, category_hint = resolve_merchant(extracted_data.get('description', ''), user_id)
+        description = merchant_name or extracted_data.get('description', '')
+        category = predict_category(description, amount, user_id=user_id, hint=category_hint)
+        stage.set(merchant_id=merchant_id, category=category)
+    with span('db_insert') as stage:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        date = extracted_data.get('date', datetime.now().strftime('%Y-%m-%d'))
+        duplicate_of = find_duplicate(cursor, user_id, date, amount, merchant_id)
+        cursor.execute('INSERT INTO transactions (user_id, type, amount, category, description, date, receipt_path, merchant_id, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (user_id, 'expense', amount, category, description, date, receipt_path, merchant_id, duplicate_of))
+        conn.commit()
+        conn.close()
+        stage.set(transaction_id=cursor.lastrowid, duplicate_of=duplicate_of)
+    record_insert(user_id, cursor.lastrowid, date, amount, category, 'expense')
+    with span('learn'):
+        learn_transactions(user_id)
+    return {'transaction_id': cursor.lastrowid, 'duplicate_of': duplicate_of, 'amount': amount, 'date': date,
+            'description': description, 'category': category}
+
+
+def create_job(user_id, receipt_path):
+    """Queue a stored receipt for OCR; returns the job id. Raises executors.Busy,
+    without recording the job, when the OCR pool's queue is full."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO receipt_jobs (user_id, receipt_path) VALUES (?, ?)', (user_id, receipt_path))
+    job_id = cursor.lastrowid
+    conn.commit()
+    try:
+        executors.spawn('ocr', run_job, job_id)
+    except executors.Busy:
+        cursor.execute('DELETE FROM receipt_jobs WHERE id = ?', (job_id,))
+        conn.commit()
+        raise
+    finally:
+        conn.close()
+    return job_id
+
+
+def run_job(job_id):
+    """Process a queued job, recording the transaction it added or why it failed"""
+    with trace('receipt_job', job_id=job_id) as root:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, receipt_path FROM receipt_jobs WHERE id = ? AND status = ?', (job_id, 'queued'))
+        job = cursor.fetchone()
+        if job:
+            _update(cursor, job_id, status='processing')
+            conn.commit()
+        conn.close()
+        if not job:
+            return
+        root.set(user_id=job['user_id'])
+
+        try:
+            result = process_receipt(job['user_id'], job['receipt_path'])
+        except Exception as e:
+            logger.exception('Receipt job %s failed', job_id)
+            fields = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+        else:
+            if result is None:
+                fields = {'status': 'failed', 'error': 'Could not extract data from receipt.'}
+            else:
+                fields = {'status': 'done', 'transaction_id': result['transaction_id'],
+                          'duplicate_of': result['duplicate_of']}
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        _update(cursor, job_id, **fields)
+        conn.commit()
+        conn.close()
+
+
+def get_job(user_id, job_id):
+    """A user's job as a dict of JOB_FIELDS, or None"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM receipt_jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+    job = cursor.fetchone()
+    conn.close()
+    return dict(zip(JOB_FIELDS, job)) if job else None
+
+
+def _update(cursor, job_id, **fields):
+    fields['updated_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    cursor.execute(f'UPDATE receipt_jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
@@ -0,0 +1,385 @@
+"""
+Content-addressed storage for receipt images
+
+An upload is stored once, under the SHA-256 of its bytes:
+RECEIPT_DIR/ab/abcdef....webp. Uploading the same image again, or the same
+receipt from two transactions, reuses the stored file. Images are stored in
+two tiers. The full image is scaled down to RECEIPT_MAX_SIDE pixels and
+re-encoded as WebP or JPEG at RECEIPT_QUALITY; phone photos shrink from
+megabytes to a few hundred kilobytes. A thumbnail of RECEIPT_THUMBNAIL_SIZE
+pixels at a lower quality is written next to it, abcdef....thumb.webp, for list
+views. Files Pillow cannot decode, such as PDFs, are kept as uploaded without
+a thumbnail.
+
+Uploads come in through ingest_upload, which reads the file in chunks
+straight from the request body through open_upload, rather than from a copy
+the form parser has spooled. The first chunk's magic bytes decide whether it is an accepted
+image or a PDF, whatever its name, and an image's dimensions are checked as
+soon as its header has arrived. Rejected uploads are never written out in
+full. The hash is computed while the file is written, and JPEGs are decoded
+straight at a reduced scale, so a 16 MB photo is never held in memory at full
+resolution. OCR then reads the stored, downscaled copy.
+
+Transactions point at the full image through receipt_path. Deleting or
+merging a transaction leaves the file behind; collect_garbage removes stored
+receipts that no transaction, hot or archived, refers to any more. Files
+younger than RECEIPT_GC_GRACE_SECONDS are never removed, so an upload whose
+transaction is not yet committed is safe. Run it from cron with
+'flask --app app collect-receipts', or in-process with start_collector.
+"""
+
+import glob
+import hashlib
+import io
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+from models.database import get_db_connection
+from .partitions import source
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_DIR = os.environ.get('RECEIPT_DIR', os.path.join('data', 'receipts'))
+
+# 'webp' or 'jpeg'
+RECEIPT_FORMAT = os.environ.get('RECEIPT_FORMAT', 'webp').lower()
+RECEIPT_QUALITY = int(os.environ.get('RECEIPT_QUALITY', '80'))
+RECEIPT_MAX_SIDE = int(os.environ.get('RECEIPT_MAX_SIDE', '2000'))
+THUMBNAIL_SIZE = int(os.environ.get('RECEIPT_THUMBNAIL_SIZE', '240'))
+THUMBNAIL_QUALITY = int(os.environ.get('RECEIPT_THUMBNAIL_QUALITY', '60'))
+
+# Largest upload ingest_upload accepts, and the most pixels an image may have
+MAX_UPLOAD_BYTES = int(os.environ.get('RECEIPT_MAX_BYTES', str(16 * 1024 * 1024)))
+MAX_PIXELS = int(os.environ.get('RECEIPT_MAX_PIXELS', '50000000'))
+
+# Unreferenced files younger than this are left alone by collect_garbage
+GC_GRACE_SECONDS = int(os.environ.get('RECEIPT_GC_GRACE_SECONDS', '3600'))
+
+FORMATS = {'webp': ('WEBP', '.webp'), 'jpeg': ('JPEG', '.jpg')}
+
+# Leading bytes of the accepted uploads; WebP is checked separately
+SIGNATURES = ((b'\xff\xd8\xff', 'jpeg'), (b'\x89PNG\r\n\x1a\n', 'png'), (b'GIF87a', 'gif'),
+              (b'GIF89a', 'gif'), (b'%PDF-', 'pdf'))
+
+# Bytes read from an upload stream at a time, and the most kept to find an image header in
+_CHUNK = 64 * 1024
+_HEADER_BYTES = 1024 * 1024
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+class UploadError(ValueError):
+    """An upload that is not a receipt that can be stored"""
+
+
+def temp_dir():
+    """Where uploads are written before they are stored; same filesystem as the store"""
+    path = os.path.join(RECEIPT_DIR, 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_digest(path):
+    """SHA-256 hex digest and size of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest(), os.path.getsize(path)
+
+
+def find_receipt(digest):
+    """Stored full image for a digest, or None"""
+    for path in glob.glob(os.path.join(RECEIPT_DIR, digest[:2], digest + '.*')):
+        if '.thumb.' not in os.path.basename(path):
+            return path
+    return None
+
+
+def thumbnail_path(receipt_path):
+    """Thumbnail stored next to a receipt, or None (PDFs, uploads from before the store)"""
+    base = os.path.splitext(receipt_path)[0]
+    for _, extension in FORMATS.values():
+        if os.path.exists(base + '.thumb' + extension):
+            return base + '.thumb' + extension
+    return None
+
+
+def ingest_upload(stream, max_bytes=None):
+    """Store an upload straight from its stream. The first chunk must start like
+    a JPEG, PNG, GIF, WebP or PDF file and an image's header must give at most
+    RECEIPT_MAX_PIXELS pixels, otherwise UploadError is raised before the rest
+    is read. The file is hashed as it is written to the temp directory; the
+    copy is deleted once stored, or moved into place if it is not an image.
+
+    Returns the same dict as store_receipt, plus 'kind' ('jpeg', 'png', 'gif',
+    'webp' or 'pdf').
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    digest = hashlib.sha256()
+    kind, head, size = None, b'', 0
+    handle, temp_path = tempfile.mkstemp(dir=temp_dir())
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in iter(lambda: stream.read(_CHUNK), b''):
+                if kind is None:
+                    kind = sniff(chunk)
+                    if kind is None:
+                        raise UploadError('Upload a JPEG, PNG, GIF or WebP image, or a PDF.')
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f'Receipts can be at most {max_bytes // (1024 * 1024)} MB.')
+                if kind != 'pdf' and head is not None:
+                    head = _check_header(head + chunk)
+                digest.update(chunk)
+                f.write(chunk)
+        if kind is None:
+            raise UploadError('The file is empty.')
+
+        digest = digest.hexdigest()
+        stored = _reuse(digest, size)
+        if stored is None:
+            image = None
+            if kind != 'pdf':
+                image = _decode(temp_path)
+                if image is None:
+                    raise UploadError('The image could not be read.')
+            stored = _store(temp_path, digest, size, image, '.' + kind, move=True)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return dict(stored, kind=kind)
+
+
+def open_upload(stream, content_type, field):
+    """The file sent in a multipart/form-data field, read from the request
+    body stream only as it is read itself. Has a filename attribute; None if
+    the body is not multipart or has no file in that field."""
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        return None
+    upload = MultipartUpload(stream, options['boundary'], field)
+    return upload if upload.filename is not None else None
+
+
+class MultipartUpload(io.RawIOBase):
+    """One file field of a multipart body; fields before it are skipped and
+    the rest of the body is never read"""
+
+    def __init__(self, stream, boundary, field):
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._field = field
+        self._data = b''
+        self._reading = False
+        self._ended = False
+        self.filename = None
+        while self.filename is None and not self._ended:
+            self._next()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._reading and len(self._data) < len(buffer):
+            self._next()
+        size = min(len(buffer), len(self._data))
+        buffer[:size] = self._data[:size]
+        self._data = self._data[size:]
+        return size
+
+    def _next(self):
+        try:
+            event = self._decoder.next_event()
+            if isinstance(event, NeedData):
+                self._decoder.receive_data(self._stream.read(_CHUNK) or None)
+        except ValueError as e:
+            raise UploadError('The upload is not valid multipart/form-data.') from e
+        if isinstance(event, File) and event.name == self._field and self.filename is None:
+            self.filename = event.filename
+            self._reading = True
+        elif isinstance(event, Data) and self._reading:
+            self._data += event.data
+            self._reading = event.more_data
+        elif isinstance(event, Epilogue):
+            self._ended = True
+
+
+def sniff(head):
+    """Accepted file type that head (the first bytes of a file) starts like, or None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, kind in SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def store_receipt(upload_path, extension=''):
+    """Store the file at upload_path, which is left in place, unless the same
+    bytes are already stored. extension (e.g. '.pdf') is kept for files that
+    are not images.
+
+    Returns {'path': value for receipt_path, 'sha256', 'bytes': upload size,
+    'stored_bytes': size on disk, 'deduplicated': whether it was stored already}.
+    """
+    digest, size = file_digest(upload_path)
+    return _reuse(digest, size) or _store(upload_path, digest, size, _decode(upload_path), extension)
+
+
+def collect_garbage(grace_seconds=None, dry_run=False):
+    """Delete stored receipts and thumbnails that no transaction refers to, and
+    uploads left in the temp directory, once older than grace_seconds.
+    Returns {'files': files deleted, 'bytes': bytes freed}."""
+    cutoff = time.time() - (GC_GRACE_SECONDS if grace_seconds is None else grace_seconds)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'SELECT DISTINCT receipt_path FROM {source(cursor)} WHERE receipt_path IS NOT NULL')
+        referenced = {os.path.basename(row[0]).split('.')[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+    totals = {'files': 0, 'bytes': 0}
+    for directory, _, names in os.walk(RECEIPT_DIR):
+        in_temp = os.path.basename(directory) == 'tmp'
+        for name in names:
+            if not in_temp and name.split('.')[0] in referenced:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime >= cutoff:
+                    continue
+                if not dry_run:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            totals['files'] += 1
+            totals['bytes'] += stat.st_size
+    return totals
+
+
+def start_collector(interval_seconds):
+    """Run collect_garbage every interval_seconds on a daemon thread (once per process)"""
+    global _collector
+    with _collector_lock:
+        if _collector is not None:
+            return _collector
+
+        def run():
+            wake = threading.Event()
+            while True:
+                try:
+                    collect_garbage()
+                except Exception:
+                    logger.exception('Receipt garbage collection failed')
+                wake.wait(interval_seconds)
+
+        _collector = threading.Thread(target=run, name='receipt-collector', daemon=True)
+        _collector.start()
+        return _collector
+
+
+def _reuse(digest, size):
+    """Result for bytes that are stored already, or None"""
+    path = find_receipt(digest)
+    if path is None:
+        return None
+    # Counts as new for the collector until the caller's row is committed
+    for stored in (path, thumbnail_path(path)):
+        if stored:
+            os.utime(stored)
+    return {'path': path, 'sha256': digest, 'bytes': size,
+            'stored_bytes': os.path.getsize(path), 'deduplicated': True}
+
+
+def _store(upload_path, digest, size, image, extension, move=False):
+    """Write image, or the upload itself when image is None, under digest"""
+    os.makedirs(os.path.join(RECEIPT_DIR, digest[:2]), exist_ok=True)
+    base = os.path.join(RECEIPT_DIR, digest[:2], digest)
+    if image is None:
+        path = base + extension.lower()
+        if move:
+            os.replace(upload_path, path)
+        else:
+            def copy(f):
+                with open(upload_path, 'rb') as upload:
+                    shutil.copyfileobj(upload, f)
+            _replace(path, copy)
+    else:
+        file_format, suffix = FORMATS.get(RECEIPT_FORMAT, FORMATS['webp'])
+        path = base + suffix
+        image.thumbnail((RECEIPT_MAX_SIDE, RECEIPT_MAX_SIDE), Image.LANCZOS)
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+        # The thumbnail goes first: a stored full image always has one
+        _replace(base + '.thumb' + suffix, lambda f: _encode(thumbnail, f, file_format, THUMBNAIL_QUALITY))
+        _replace(path, lambda f: _encode(image, f, file_format, RECEIPT_QUALITY))
+    return {'path': path, 'sha256': digest, 'bytes': size,
+            'stored_bytes': os.path.getsize(path), 'deduplicated': False}
+
+
+def _check_header(head):
+    """Raise UploadError if an image header in head is too large; returns the
+    bytes to keep for the next call, None once the header has been read"""
+    try:
+        with Image.open(io.BytesIO(head)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise UploadError('The image is too large.')
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        # Not enough of the header yet, unless it is past any reasonable header size
+        return head if len(head) < _HEADER_BYTES else None
+    if width * height > MAX_PIXELS:
+        raise UploadError(f'The image is too large ({width} x {height} pixels).')
+    return None
+
+
+def _decode(path):
+    """The upload as an upright RGB or greyscale image, or None if it is not one"""
+    try:
+        with Image.open(path) as opened:
+            # Lets libjpeg decode large photos at 1/2, 1/4 or 1/8 scale, no smaller than stored
+            ratio = RECEIPT_MAX_SIDE / max(opened.size)
+            if ratio < 1:
+                opened.draft('RGB', (math.ceil(opened.width * ratio), math.ceil(opened.height * ratio)))
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+        return None
+    if image.mode in ('RGB', 'L'):
+        return image
+    image = image.convert('RGBA')
+    flattened = Image.new('RGB', image.size, 'white')
+    flattened.paste(image, mask=image.getchannel('A'))
+    return flattened
+
+
+def _encode(image, f, file_format, quality):
+    if file_format == 'JPEG':
+        image.save(f, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(f, 'WEBP', quality=quality, method=4)
+
+
+def _replace(path, write):
+    """Write a file through a temp file, so readers never see half of one"""
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir())
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,273 @@
+"""
+Scheduled recurring transactions
+
+A rule is a transaction template (type, amount, category, description) with a
+schedule, stored as an iCalendar RRULE such as 'FREQ=MONTHLY;INTERVAL=1'
+and expanded with dateutil from the rule's start date. Each rule keeps
+next_date, the first occurrence not yet generated, which is the watermark
+the materializer works from.
+
+materialize_due is one batched job for all users: it reads due rules through
+a partial index on next_date, writes every occurrence up to today with one
+executemany per batch of rules, checked for duplicates with one find_duplicates
+lookup per user in the batch, and moves each rule's next_date past today in
+the same SQLite transaction. Generated rows carry a hash of (rule, date) in the
+import_hash column, unique per user, so an occurrence is never written twice
+even if two processes run the job at once. Run it from cron with
+'flask --app app materialize-recurring', or in-process with start_materializer.
+"""
+
+import hashlib
+import logging
+import threading
+from datetime import date, datetime, time as day_start
+from functools import lru_cache
+
+from dateutil.rrule import rrulestr
+
+from models.database import begin_write, get_db_connection
+from .ai_categorizer import categorize_batch
+from .merchants import resolve_merchant_id
+from .duplicates import find_duplicates, last_transaction_id
+from .partitions import restore_archived
+from .transaction_service import validate_transaction
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = {'daily': 'DAILY', 'weekly': 'WEEKLY', 'monthly': 'MONTHLY', 'yearly': 'YEARLY'}
+
+MAX_INTERVAL = 365
+
+# Rules per transaction in materialize_due
+MATERIALIZE_BATCH_SIZE = 500
+
+_materializer = None
+_materializer_lock = threading.Lock()
+
+
+def build_schedule(frequency, interval, start):
+    """RRULE text for every interval-th day/week/month/year from start.
+
+    Monthly and yearly rules starting after the 28th fall back to the last day
+    of shorter months instead of skipping them.
+    """
+    parts = [f'FREQ={FREQUENCIES[frequency]}', f'INTERVAL={interval}']
+    if frequency in ('monthly', 'yearly') and start.day > 28:
+        if frequency == 'yearly':
+            parts.append(f'BYMONTH={start.month}')
+        parts.append('BYMONTHDAY=' + ','.join(str(day) for day in range(28, start.day + 1)))
+        parts.append('BYSETPOS=-1')
+    return ';'.join(parts)
+
+
+def describe_schedule(schedule):
+    """'monthly', 'every 2 weeks' and so on, for display"""
+    fields = dict(part.split('=', 1) for part in schedule.split(';'))
+    frequency = {value: name for name, value in FREQUENCIES.items()}.get(fields.get('FREQ'), schedule)
+    interval = int(fields.get('INTERVAL', 1))
+    if interval == 1:
+        return frequency
+    unit = {'daily': 'days', 'weekly': 'weeks', 'monthly': 'months', 'yearly': 'years'}.get(frequency, frequency)
+    return f'every {interval} {unit}'
+
+
+@lru_cache(maxsize=1024)
+def _parse(schedule):
+    return rrulestr(schedule, dtstart=datetime(2000, 1, 1))
+
+
+def _midnight(day):
+    return datetime.combine(date.fromisoformat(day), day_start())
+
+
+def expand(schedule, anchor, first, last, end_date=None):
+    """(ISO dates from first to last inclusive, first date after last) for a schedule.
+
+    anchor is a date the schedule falls on: its start date or any later
+    occurrence, such as a rule's next_date. Expanding from the watermark
+    rather than the start keeps the cost proportional to the dates returned.
+    Nothing is returned past end_date; the second item is None once it ends.
+    """
+    rule = _parse(schedule).replace(dtstart=_midnight(anchor))
+    dates, following = [], None
+    # One pass over the rule: what falls in [first, last], then the next date after it
+    for when in rule.xafter(_midnight(first), inc=True):
+        day = when.date().isoformat()
+        if day > last or (end_date and day > end_date):
+            following = day if not end_date or day <= end_date else None
+            break
+        dates.append(day)
+    return dates, following
+
+
+def occurrence_hash(rule_id, day):
+    return hashlib.sha1(f'recurring|{rule_id}|{day}'.encode('utf-8')).hexdigest()
+
+
+def create_rule(user_id, item):
+    """Save a recurring rule from a dict like a bulk API item plus schedule fields.
+
+    item has type, amount, description, category ('auto' or missing to
+    predict), start_date, frequency, optionally interval and end_date.
+    Raises ValueError for bad input. Occurrences already due are written the
+    next time the materializer runs. Returns the rule id.
+    """
+    transaction_type, amount, category, description, start_date, _ = validate_transaction(
+        dict(item, date=item.get('start_date'), idempotency_key=None))
+
+    frequency = item.get('frequency')
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    try:
+        interval = int(item.get('interval') or 1)
+    except (TypeError, ValueError):
+        raise ValueError('interval must be a whole number')
+    if not 1 <= interval <= MAX_INTERVAL:
+        raise ValueError(f'interval must be between 1 and {MAX_INTERVAL}')
+
+    end_date = item.get('end_date') or None
+    if end_date is not None:
+        try:
+            end_date = date.fromisoformat(end_date).isoformat()
+        except (TypeError, ValueError):
+            raise ValueError('end_date must be formatted as YYYY-MM-DD')
+        if end_date < start_date:
+            raise ValueError('end_date must not be before start_date')
+
+    if category is None:
+        category = categorize_batch([description], [amount], user_id)[0]
+
+    schedule = build_schedule(frequency, interval, date.fromisoformat(start_date))
+    # Resolved now: the materializer holds the write lock and cannot add merchants
+    merchant_id = resolve_merchant_id(description)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''INSERT INTO recurring_rules
+        (user_id, type, amount, category, description, merchant_id, schedule, start_date, end_date, next_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (user_id, transaction_type, amount, category, description, merchant_id, schedule,
+                    start_date, end_date, start_date))
+    conn.commit()
+    rule_id = cursor.lastrowid
+    conn.close()
+    return rule_id
+
+
+def get_rules(user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM recurring_rules WHERE user_id = ? ORDER BY active DESC, next_date IS NULL, next_date',
+                   (user_id,))
+    rules = [dict(row, frequency=describe_schedule(row['schedule'])) for row in cursor.fetchall()]
+    conn.close()
+    return rules
+
+
+def set_rule_active(user_id, rule_id, active, today=None):
+    """Pause or resume a rule; a resumed rule continues from today rather than filling the pause"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM recurring_rules WHERE id = ? AND user_id = ?', (rule_id, user_id))
+    rule = cursor.fetchone()
+    if rule is None:
+        conn.close()
+        return False
+    next_date = rule['next_date']
+    if active and not rule['active'] and next_date:
+        today = (today or date.today()).isoformat()
+        if next_date < today:
+            due_today, following = expand(rule['schedule'], next_date, today, today, rule['end_date'])
+            next_date = due_today[0] if due_today else following
+    cursor.execute('UPDATE recurring_rules SET active = ?, next_date = ? WHERE id = ?', (1 if active else 0, next_date, rule_id))
+    conn.commit()
+    conn.close()
+    return True
+
+
+def delete_rule(user_id, rule_id):
+    """Delete a rule; transactions it already generated are kept"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM recurring_rules WHERE id = ? AND user_id = ?', (rule_id, user_id))
+    conn.commit()
+    deleted = cursor.rowcount > 0
+    conn.close()
+    return deleted
+
+
+def materialize_due(today=None, batch_size=MATERIALIZE_BATCH_SIZE, progress=None):
+    """Write every occurrence due up to today for all users' active rules.
+
+    Returns {'rules': rules processed, 'inserted': transactions written}.
+    progress, if given, is called with the running totals after each batch.
+    """
+    today = (today or date.today()).isoformat()
+    totals = {'rules': 0, 'inserted': 0}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        while True:
+            # The write lock covers reading the watermarks, so concurrent runs take turns
+            begin_write(cursor, 'recurring_materialize')
+            cursor.execute('''SELECT * FROM recurring_rules WHERE active = 1 AND next_date <= ?
+                ORDER BY next_date LIMIT ?''', (today, batch_size))
+            rules = cursor.fetchall()
+            if not rules:
+                conn.rollback()
+                break
+
+            occurrences, watermarks = [], []
+            for rule in rules:
+                days, following = expand(rule['schedule'], rule['next_date'], rule['next_date'], today, rule['end_date'])
+                occurrences.extend((rule, day) for day in days)
+                watermarks.append((following, rule['id']))
+
+            # find_duplicates looks up one user's rows at a time
+            by_user = {}
+            for position, (rule, day) in enumerate(occurrences):
+                by_user.setdefault(rule['user_id'], []).append(position)
+            before_id = last_transaction_id(cursor)
+            duplicates = [None] * len(occurrences)
+            for user_id, positions in by_user.items():
+                found = find_duplicates(cursor, user_id, [(day, rule['amount'], rule['merchant_id'], rule['type'])
+                                                          for rule, day in (occurrences[p] for p in positions)], before_id)
+                for position, duplicate_of in zip(positions, found):
+                    duplicates[position] = duplicate_of
+            values = [(rule['user_id'], rule['type'], rule['amount'], rule['category'], rule['description'],
+                       day, rule['merchant_id'], occurrence_hash(rule['id'], day), duplicate_of)
+                      for (rule, day), duplicate_of in zip(occurrences, duplicates)]
+
+            restore_archived(cursor, (value[5] for value in values))
+            cursor.executemany('''INSERT INTO transactions
+                (user_id, type, amount, category, description, date, merchant_id, import_hash, duplicate_of)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING''', values)
+            totals['inserted'] += max(cursor.rowcount, 0)
+            cursor.executemany('UPDATE recurring_rules SET next_date = ? WHERE id = ?', watermarks)
+            conn.commit()
+            totals['rules'] += len(rules)
+            if progress:
+                progress(totals)
+    finally:
+        conn.close()
+    return totals
+
+
+def start_materializer(interval_seconds):
+    """Run materialize_due every interval_seconds on a daemon thread (once per process)"""
+    global _materializer
+    with _materializer_lock:
+        if _materializer is not None:
+            return _materializer
+
+        def run():
+            wake = threading.Event()
+            while True:
+                try:
+                    materialize_due()
+                except Exception:
+                    logger.exception('Recurring transaction materializer failed')
+                wake.wait(interval_seconds)
+
+        _materializer = threading.Thread(target=run, name='recurring-materializer', daemon=True)
+        _materializer.start()
+        return _materializer
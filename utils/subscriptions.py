@@ -0,0 +1,269 @@
+"""
+Recurring payment and subscription detection
+
+A user's expenses are grouped by canonical merchant and amount band: sorted by
+amount within a merchant, a new band starts wherever an amount is more than
+AMOUNT_TOLERANCE above the one before, so 499 and 549 after a price rise stay
+one series while a 40 coffee and a 1,200 order do not. Each band is then put
+in date order and its intervals are scored against each period in PERIODS,
+all bands at once with bincount. A band is a subscription when enough of its
+intervals land on one period.
+
+Results are stored per user with the next expected charge. Updates are
+incremental: only merchants with expenses newer than the last scan, or whose
+expenses were edited since (recorded in subscription_changes by a trigger on
+transactions), are re-analyzed, from their own history via the
+(user_id, merchant_id) index. A full rescan happens only when rows seen by the
+last scan have been deleted.
+
+Reads never scan: get_subscriptions returns what is stored and, when the
+user's data has changed since, queues an update on the default executor pool,
+so a page view does not wait on the scan's write lock.
+"""
+
+import threading
+from datetime import date
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from models.database import begin_write, get_db_connection
+from .columnar_store import parse_days, day_to_iso, INVALID_DAY
+from .partitions import source
+from . import executors
+
+# Relative step between consecutive amounts that starts a new band
+AMOUNT_TOLERANCE = 0.15
+
+# (name, length in days, tolerance in days, minimum charges)
+PERIODS = (
+    ('weekly', 7.0, 1.5, 4),
+    ('monthly', 30.44, 4.0, 3),
+    ('annual', 365.25, 10.0, 2),
+)
+
+# Share of a band's intervals that must match its period
+REGULARITY = 0.75
+
+_NEXT_CHARGE = {
+    'weekly': relativedelta(weeks=1),
+    'monthly': relativedelta(months=1),
+    'annual': relativedelta(years=1),
+}
+
+# Merchant ids per IN (...) query
+_QUERY_CHUNK = 500
+
+# Users with a background update queued or running
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def detect_recurring(merchant_ids, amounts, days):
+    """Find periodic series among one user's expenses.
+
+    Takes parallel arrays of merchant id, amount and day number and returns a
+    dict per detected series: merchant_id, amount (the latest charge), period,
+    interval_days, occurrences, first_day, last_day and confidence.
+    """
+    merchant_ids = np.asarray(merchant_ids, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    days = np.asarray(days, dtype=np.int64)
+    if len(days) < 2:
+        return []
+
+    # Amount bands: consecutive amounts of a merchant within the tolerance
+    order = np.lexsort((amounts, merchant_ids))
+    log_amounts = np.log(np.maximum(amounts[order], 0.01))
+    starts_band = np.ones(len(order), dtype=bool)
+    starts_band[1:] = ((merchant_ids[order][1:] != merchant_ids[order][:-1])
+                       | (np.diff(log_amounts) > np.log1p(AMOUNT_TOLERANCE)))
+    bands = np.empty(len(order), dtype=np.int64)
+    bands[order] = np.cumsum(starts_band) - 1
+    band_count = int(bands.max()) + 1
+
+    # Each band in date order; interval i runs from row i to row i + 1 of the same band
+    order = np.lexsort((days, bands))
+    sorted_bands, sorted_days = bands[order], days[order]
+    same_band = sorted_bands[1:] == sorted_bands[:-1]
+    intervals = np.diff(sorted_days)[same_band].astype(np.float64)
+    interval_bands = sorted_bands[:-1][same_band]
+    sizes = np.bincount(sorted_bands, minlength=band_count)
+    interval_counts = np.maximum(sizes - 1, 1)
+
+    best_share = np.zeros(band_count)
+    best_period = np.full(band_count, -1)
+    best_interval = np.zeros(band_count)
+    for index, (_, length, tolerance, minimum) in enumerate(PERIODS):
+        hits = np.abs(intervals - length) <= tolerance
+        hit_counts = np.bincount(interval_bands, weights=hits, minlength=band_count)
+        share = hit_counts / interval_counts
+        better = (sizes >= minimum) & (share >= REGULARITY) & (share > best_share)
+        best_share[better] = share[better]
+        best_period[better] = index
+        hit_days = np.bincount(interval_bands, weights=intervals * hits, minlength=band_count)
+        best_interval[better] = hit_days[better] / hit_counts[better]
+
+    detected = np.flatnonzero(best_period >= 0)
+    first = np.searchsorted(sorted_bands, detected)
+    last = first + sizes[detected] - 1
+    return [{
+        'merchant_id': int(merchant_ids[order[l]]),
+        'amount': float(amounts[order[l]]),
+        'period': PERIODS[best_period[band]][0],
+        'interval_days': round(float(best_interval[band]), 1),
+        'occurrences': int(sizes[band]),
+        'first_day': int(sorted_days[f]),
+        'last_day': int(sorted_days[l]),
+        'confidence': round(float(best_share[band]), 2),
+    } for band, f, l in zip(detected, first, last)]
+
+
+def next_charge(last_date, period):
+    """ISO date one period after last_date"""
+    return (date.fromisoformat(last_date) + _NEXT_CHARGE[period]).isoformat()
+
+
+def _load_expenses(cursor, user_id, merchant_ids=None):
+    """(merchant ids, amounts, days) of a user's expenses, optionally for some merchants only"""
+    query = f'''SELECT merchant_id, amount, date FROM {source(cursor)}
+        WHERE user_id = ? AND type = 'expense' AND merchant_id IS NOT NULL
+        AND (duplicate_of IS NULL OR duplicate_of = 0)'''
+    if merchant_ids is None:
+        cursor.execute(query, (user_id,))
+        rows = cursor.fetchall()
+    else:
+        rows = []
+        for offset in range(0, len(merchant_ids), _QUERY_CHUNK):
+            chunk = merchant_ids[offset:offset + _QUERY_CHUNK]
+            cursor.execute(query + f" AND merchant_id IN ({','.join('?' * len(chunk))})", [user_id, *chunk])
+            rows.extend(cursor.fetchall())
+    if not rows:
+        return [], [], []
+    merchants, amounts, dates = zip(*rows)
+    days = parse_days(dates)
+    valid = days != INVALID_DAY
+    return np.array(merchants)[valid], np.array(amounts)[valid], days[valid]
+
+
+def update_subscriptions(user_id, rebuild=False):
+    """Bring a user's stored subscriptions up to date; returns the number of merchants re-analyzed"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    version = row[0] if row else 0
+    cursor.execute('SELECT version FROM subscription_scans WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    if not rebuild and row and row[0] == version:
+        conn.close()
+        return 0
+
+    # Take the write lock before reading the watermark so concurrent updates run one at a time
+    begin_write(cursor, 'subscription_scan')
+    cursor.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    version = row[0] if row else 0
+    cursor.execute('SELECT last_id, row_count FROM subscription_scans WHERE user_id = ?', (user_id,))
+    state = cursor.fetchone()
+    last_id = state['last_id'] if state else 0
+    cursor.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ? AND id <= ?', (user_id, last_id))
+    seen = cursor.fetchone()[0]
+    cursor.execute('SELECT MAX(id), COUNT(*) FROM transactions WHERE user_id = ? AND id > ?', (user_id, last_id))
+    latest, added = cursor.fetchone()
+
+    # Taken before the expenses are read, so an edit committed later is kept for the next update
+    cursor.execute('DELETE FROM subscription_changes WHERE user_id = ? RETURNING merchant_id', (user_id,))
+    changed = {row[0] for row in cursor.fetchall()}
+
+    if rebuild or not state or seen != state['row_count']:
+        cursor.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+        analyzed = _store(cursor, user_id, _load_expenses(cursor, user_id))
+    else:
+        cursor.execute('''SELECT DISTINCT merchant_id FROM transactions
+            WHERE user_id = ? AND id > ? AND type = 'expense' AND merchant_id IS NOT NULL''', (user_id, last_id))
+        merchant_ids = sorted(changed.union(row[0] for row in cursor.fetchall()))
+        for offset in range(0, len(merchant_ids), _QUERY_CHUNK):
+            chunk = merchant_ids[offset:offset + _QUERY_CHUNK]
+            cursor.execute(f"DELETE FROM subscriptions WHERE user_id = ? AND merchant_id IN ({','.join('?' * len(chunk))})",
+                           [user_id, *chunk])
+        if merchant_ids:
+            _store(cursor, user_id, _load_expenses(cursor, user_id, merchant_ids))
+        analyzed = len(merchant_ids)
+
+    cursor.execute('''INSERT INTO subscription_scans (user_id, last_id, row_count, version) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET last_id = excluded.last_id, row_count = excluded.row_count,
+            version = excluded.version''', (user_id, latest or last_id, seen + added, version))
+    conn.commit()
+    conn.close()
+    return analyzed
+
+
+def update_in_background(user_id):
+    """Queue update_subscriptions for a user on the default pool, unless one is
+    already queued. Skipped when the pool is busy; the next read queues it again."""
+    with _queued_lock:
+        if user_id in _queued:
+            return
+        _queued.add(user_id)
+    try:
+        executors.spawn('default', _update_queued, user_id)
+    except executors.Busy:
+        with _queued_lock:
+            _queued.discard(user_id)
+
+
+def _update_queued(user_id):
+    try:
+        update_subscriptions(user_id)
+    finally:
+        with _queued_lock:
+            _queued.discard(user_id)
+
+
+def _store(cursor, user_id, expenses):
+    """Insert the series detected in expenses; returns the number of merchants they cover"""
+    merchant_ids, amounts, days = expenses
+    found = detect_recurring(merchant_ids, amounts, days)
+    rows = []
+    for series in found:
+        last_date = day_to_iso(series['last_day'])
+        rows.append((user_id, series['merchant_id'], series['amount'], series['period'], series['interval_days'],
+                     series['occurrences'], day_to_iso(series['first_day']), last_date,
+                     next_charge(last_date, series['period']), series['confidence']))
+    cursor.executemany('''INSERT INTO subscriptions (user_id, merchant_id, amount, period, interval_days,
+        occurrences, first_date, last_date, next_date, confidence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    return len(set(merchant_ids.tolist())) if len(merchant_ids) else 0
+
+
+def get_subscriptions(user_id, today=None):
+    """A user's stored subscriptions by next charge date. If their data has
+    changed since the last scan an update is queued, and shows on a later read.
+
+    Each has a status: 'active', or 'lapsed' once its next charge is overdue by
+    more than the period's tolerance. monthly_cost spreads the amount over a month.
+    """
+    today = today or date.today()
+    tolerances = {name: tolerance for name, _, tolerance, _ in PERIODS}
+    lengths = {name: length for name, length, _, _ in PERIODS}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT d.version, s.version FROM data_versions d
+        LEFT JOIN subscription_scans s ON s.user_id = d.user_id WHERE d.user_id = ?''', (user_id,))
+    row = cursor.fetchone()
+    if row and row[0] != row[1]:
+        update_in_background(user_id)
+    cursor.execute('''SELECT s.merchant_id, m.name AS merchant, s.amount, s.period, s.interval_days, s.occurrences,
+               s.first_date, s.last_date, s.next_date, s.confidence
+        FROM subscriptions s JOIN merchants m ON m.id = s.merchant_id
+        WHERE s.user_id = ? ORDER BY s.next_date, m.name''', (user_id,))
+    subscriptions = []
+    for row in cursor.fetchall():
+        subscription = dict(row)
+        overdue = (today - date.fromisoformat(subscription['next_date'])).days
+        subscription['status'] = 'lapsed' if overdue > tolerances[subscription['period']] else 'active'
+        subscription['monthly_cost'] = round(subscription['amount'] * lengths['monthly'] / lengths[subscription['period']], 2)
+        subscriptions.append(subscription)
+    conn.close()
+    return subscriptions
@@ -0,0 +1,152 @@
+"""
+Lightweight tracing spans, exported as JSON lines
+
+trace() (or the @traced decorator) opens a root span with a new trace id.
+span() opens a child of whatever span is current, and does nothing outside a
+trace. Spans are kept in memory until the root span ends. The trace is then
+written to TRACE_FILE, one span per line, if any of these holds:
+- it took at least TRACE_SLOW_MS
+- it failed
+- it was picked at random with probability TRACE_SAMPLE_RATE
+
+Slow uploads can therefore be looked into after the fact, e.g.
+    jq 'select(.trace_id == "...")' data/traces.jsonl
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Share of traces kept regardless of duration (0 to 1)
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+
+# Traces at least this long are always kept; empty disables
+SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '5000')) if os.environ.get('TRACE_SLOW_MS', '5000') else None
+
+TRACE_FILE = os.environ.get('TRACE_FILE', 'data/traces.jsonl')
+
+_current = ContextVar('trace_span', default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'started', 'duration', 'attributes', 'error', 'spans')
+
+    def __init__(self, name, trace_id, parent_id, attributes, spans):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.started = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        # Every span of the trace, in the order they ended; shared with the root
+        self.spans = spans
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id, 'name': self.name,
+                'start': round(self.started, 6), 'duration_ms': round(self.duration * 1000, 3),
+                'status': 'error' if self.error else 'ok', 'error': self.error, 'attributes': self.attributes}
+
+
+class _NoopSpan:
+    """Stands in for a span outside a trace, so callers can always call set()"""
+
+    trace_id = None
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled():
+    return SAMPLE_RATE > 0 or SLOW_MS is not None
+
+
+def current_trace_id():
+    active = _current.get()
+    return active.trace_id if active else None
+
+
+@contextmanager
+def _run(active):
+    token = _current.set(active)
+    started = time.perf_counter()
+    try:
+        yield active
+    except BaseException as e:
+        active.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        active.duration = time.perf_counter() - started
+        _current.reset(token)
+        active.spans.append(active)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child span of the current one; a no-op outside a trace"""
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    with _run(Span(name, parent.trace_id, parent.span_id, attributes, parent.spans)) as active:
+        yield active
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Root span of a new trace, exported when it ends if slow, failed or sampled"""
+    if _current.get() is not None:
+        with span(name, **attributes) as active:
+            yield active
+        return
+    if not enabled():
+        yield NOOP_SPAN
+        return
+
+    root = Span(name, f'{random.getrandbits(128):032x}', None, attributes, [])
+    try:
+        with _run(root):
+            yield root
+    finally:
+        if root.error:
+            _export(root, 'error')
+        elif SLOW_MS is not None and root.duration * 1000 >= SLOW_MS:
+            _export(root, 'slow')
+        elif random.random() < SAMPLE_RATE:
+            _export(root, 'sampled')
+
+
+def traced(name):
+    """Run the decorated function as the root of a trace"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with trace(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _export(root, reason):
+    root.attributes['kept'] = reason
+    lines = ''.join(json.dumps(s.to_dict(), default=str) + '\n' for s in root.spans)
+    directory = os.path.dirname(TRACE_FILE)
+    with _export_lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One append per trace, so traces from several workers do not interleave
+        with open(TRACE_FILE, 'a') as f:
+            f.write(lines)
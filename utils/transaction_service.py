@@ -0,0 +1,143 @@
+"""
+Bulk transaction writes
+
+create_transactions validates a whole batch, fills in missing categories with
+one categorize_batch call, links merchants, looks the whole batch up for
+duplicates with find_duplicates and inserts every row with a single
+executemany in one SQLite transaction, so a batch costs one commit instead of
+one per row. The categorizer learns from the new rows in the background.
+
+Retries are made safe with idempotency keys. Each item may carry its own
+'idempotency_key'; otherwise, when the request has a key, item i gets
+'<request key>:<i>'. Keys are stored hashed in the import_hash column, which
+is unique per user, so a repeated key is skipped rather than inserted twice.
+Items without any key are always inserted.
+"""
+
+import hashlib
+from datetime import date
+
+from models.database import get_db_connection
+from .ai_categorizer import categorize_batch
+from .merchants import resolve_merchant_id
+from .duplicates import find_duplicates, last_transaction_id, count_flagged
+from .partitions import restore_archived
+from .ml_categorizer import learn_in_background
+
+MAX_BULK_TRANSACTIONS = 10000
+
+TRANSACTION_TYPES = ('expense', 'income')
+
+MAX_DESCRIPTION_LENGTH = 500
+
+
+class ValidationError(ValueError):
+    """A batch was rejected; errors is a list of {'index', 'error'}"""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid transaction(s)')
+        self.errors = errors
+
+
+def idempotency_hash(key):
+    return hashlib.sha1(f'client|{key}'.encode('utf-8')).hexdigest()
+
+
+def validate_transaction(item):
+    """(type, amount, category or None, description, ISO date, key or None) for one item; raises ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('must be an object')
+
+    transaction_type = item.get('type', 'expense')
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError("type must be 'expense' or 'income'")
+
+    amount = item.get('amount')
+    if isinstance(amount, str):
+        try:
+            amount = float(amount)
+        except ValueError:
+            raise ValueError('amount must be a number')
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not 0 < amount < float('inf'):
+        raise ValueError('amount must be a positive number')
+
+    try:
+        day = date.fromisoformat(item['date']).isoformat()
+    except KeyError:
+        raise ValueError('date is required')
+    except (TypeError, ValueError):
+        raise ValueError('date must be formatted as YYYY-MM-DD')
+
+    description = item.get('description') or ''
+    if not isinstance(description, str) or len(description) > MAX_DESCRIPTION_LENGTH:
+        raise ValueError(f'description must be a string of at most {MAX_DESCRIPTION_LENGTH} characters')
+
+    category = item.get('category')
+    if category in (None, '', 'auto'):
+        category = None
+    elif not isinstance(category, str):
+        raise ValueError('category must be a string')
+
+    key = item.get('idempotency_key')
+    if key is not None and not isinstance(key, str):
+        raise ValueError('idempotency_key must be a string')
+
+    return transaction_type, float(amount), category, description, day, key
+
+
+def create_transactions(user_id, items, idempotency_key=None):
+    """Validate and insert a batch of transactions for a user, all or nothing.
+
+    items are dicts with type, amount, date and optionally category ('auto'
+    or missing to predict), description and idempotency_key. Raises
+    ValidationError listing every bad item, in which case nothing is written.
+    Returns {'received', 'inserted', 'duplicates', 'flagged'}: duplicates
+    are items skipped for a repeated idempotency key, flagged those inserted
+    but marked as looking like an existing transaction (duplicate_of).
+    """
+    if len(items) > MAX_BULK_TRANSACTIONS:
+        raise ValidationError([{'index': None, 'error': f'at most {MAX_BULK_TRANSACTIONS} transactions per request'}])
+
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate_transaction(item))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise ValidationError(errors)
+
+    missing = [index for index, row in enumerate(rows) if row[2] is None]
+    if missing:
+        predicted = categorize_batch([rows[i][3] for i in missing], [rows[i][1] for i in missing], user_id)
+        for index, category in zip(missing, predicted):
+            rows[index] = rows[index][:2] + (category,) + rows[index][3:]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        before_id = last_transaction_id(cursor)
+        merchant_ids = [resolve_merchant_id(row[3]) for row in rows]
+        duplicates = find_duplicates(cursor, user_id, [(row[4], row[1], merchant_id, row[0])
+                                                       for row, merchant_id in zip(rows, merchant_ids)], before_id)
+        values = []
+        for index, (transaction_type, amount, category, description, day, key) in enumerate(rows):
+            if key is None and idempotency_key:
+                key = f'{idempotency_key}:{index}'
+            values.append((user_id, transaction_type, amount, category, description, day, merchant_ids[index],
+                           idempotency_hash(key) if key is not None else None, duplicates[index]))
+
+        restore_archived(cursor, (row[4] for row in rows))
+        cursor.executemany('''INSERT INTO transactions
+            (user_id, type, amount, category, description, date, merchant_id, import_hash, duplicate_of)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING''', values)
+        inserted = max(cursor.rowcount, 0)
+        conn.commit()
+        flagged = count_flagged(cursor, user_id, before_id) if inserted else 0
+    finally:
+        conn.close()
+
+    if inserted:
+        learn_in_background(user_id)
+    return {'received': len(values), 'inserted': inserted, 'duplicates': len(values) - inserted, 'flagged': flagged}